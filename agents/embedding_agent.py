@@ -6,6 +6,8 @@ from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
 from vectorstore.chroma_db import chroma_manager
 from utils.language_utils import language_handler
+from utils.llm_backend import llm_backend
+from services.llm_cache import llm_decision_cache
 
 # Import message journey logger for detailed logging
 try:
@@ -15,6 +17,9 @@ except ImportError:
     LOGGING_AVAILABLE = False
     print("⚠️ Message journey logger not available - detailed embedding logging disabled")
 
+# Bump when the evaluation prompts change - cached evaluations of the old prompt stop matching
+EVALUATION_PROMPT_VERSION = "1"
+
 class EmbeddingAgent:
     def __init__(self):
         # Keep AsyncOpenAI for fallback if needed
@@ -29,12 +34,17 @@ class EmbeddingAgent:
         )
         self.similarity_threshold = 0.50  # Higher cosine similarity means better match
         
-    async def process_message(self, user_message: str, conversation_history: list = None, user_language: str = 'ar', journey_id: str = None) -> Dict[str, Any]:
+    async def process_message(self, user_message: str, conversation_history: list = None, user_language: str = 'ar', journey_id: str = None, evaluate: bool = True) -> Dict[str, Any]:
         """
         Process incoming message by comparing to knowledge base using embeddings
         
+        Args:
+            evaluate: When False, a usable match is returned as 'needs_evaluation' (with
+                      matched_answer) instead of asking ChatGPT - the caller decides, e.g.
+                      in the triage call, and finishes with evaluate_match()
+        
         Returns:
-        - action: 'reply', 'skip', or 'continue_to_classification'
+        - action: 'reply', 'skip', 'continue_to_classification' or 'needs_evaluation'
         - response: the response text if action is 'reply'
         - confidence: confidence score
         - matched_question: the matched question from database
@@ -174,32 +184,56 @@ class EmbeddingAgent:
         
        
         
-        # Ask ChatGPT to evaluate if the response is appropriate
-        evaluation_result = await self._evaluate_response_with_chatgpt(
-            user_message, matched_question_text or matched_document, final_answer, detected_user_language, conversation_history, journey_id
-        )
+        match = {
+            'action': 'needs_evaluation',
+            'response': None,
+            'confidence': similarity_score,
+            'matched_question': matched_question_text or matched_document,
+            'matched_answer': final_answer
+        }
+        if not evaluate:
+            return match
+        
+        return await self.evaluate_match(user_message, match, conversation_history, journey_id)
+    
+    async def evaluate_match(self, user_message: str, match: Dict[str, Any], conversation_history: list = None,
+                             journey_id: str = None, action: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Turn a 'needs_evaluation' match into the final embedding result
+        
+        Args:
+            match: Result of process_message(evaluate=False)
+            action: 'reply', 'skip' or 'continue' already decided upstream (triage) - skips the ChatGPT evaluation
+        """
+        if action is None:
+            # Ask ChatGPT to evaluate if the response is appropriate
+            evaluation_result = await self._evaluate_response_with_chatgpt(
+                user_message, match['matched_question'], match['matched_answer'],
+                language_handler.detect_language(user_message), conversation_history, journey_id
+            )
+            action = evaluation_result['action']
         
-        if evaluation_result['action'] == 'reply':
-            print(f"🤖 EmbeddingAgent Reply: {evaluation_result.get('response', final_answer)[:100]}...")
+        if action == 'reply':
+            print(f"🤖 EmbeddingAgent Reply: {match['matched_answer'][:100]}...")
             return {
                 'action': 'reply',
-                'response': evaluation_result.get('response', final_answer),
-                'confidence': similarity_score,
-                'matched_question': matched_question_text or matched_document
+                'response': match['matched_answer'],
+                'confidence': match['confidence'],
+                'matched_question': match['matched_question']
             }
-        elif evaluation_result['action'] == 'skip':
+        elif action == 'skip':
             return {
                 'action': 'skip',
                 'response': None,
-                'confidence': similarity_score,
-                'matched_question': matched_question_text or matched_document
+                'confidence': match['confidence'],
+                'matched_question': match['matched_question']
             }
         else:
             return {
                 'action': 'continue_to_classification',
                 'response': None,
-                'confidence': similarity_score,
-                'matched_question': matched_question_text or matched_document
+                'confidence': match['confidence'],
+                'matched_question': match['matched_question']
             }
     
     async def _evaluate_response_with_chatgpt(self, user_message: str, matched_question: str, 
@@ -431,10 +465,29 @@ Return only one of: `reply`, `skip`, or `continue`.
             
             # Use LangChain with specific parameters
             temp_llm = self.llm.bind(max_tokens=20, temperature=0.1)
-            response = await temp_llm.ainvoke(langchain_messages)
+            
+            async def _evaluate():
+                response = await llm_backend.chat_text(
+                    lambda: temp_llm.ainvoke(langchain_messages),
+                    langchain_messages,
+                    model=self.llm.model_name,
+                    max_tokens=20,
+                    temperature=0.1
+                )
+                return response.content
+            
+            # Same message + KB match + recent history always evaluates the same - memoized
+            raw_response = await llm_decision_cache.get_or_compute(
+                "kb_answer_evaluation",
+                EVALUATION_PROMPT_VERSION,
+                user_message,
+                _evaluate,
+                history=(conversation_history or [])[-5:],
+                extra=[language, matched_question, matched_answer]
+            )
             
             llm_duration = int((time.time() - llm_start_time) * 1000)
-            evaluation = response.content.strip().lower()
+            evaluation = (raw_response or "").strip().lower()
             
             # Log the complete response from LLM
             if LOGGING_AVAILABLE and journey_id:
@@ -454,7 +507,7 @@ Return only one of: `reply`, `skip`, or `continue`.
                     description=f"ChatGPT evaluation completed: {evaluation}",
                     data={
                         "evaluation_result": evaluation,
-                        "raw_response": response.content,
+                        "raw_response": raw_response,
                         "duration_ms": llm_duration,
                         "tokens_used": None,  # LangChain response doesn't include token usage directly
                         "user_message": user_message,
@@ -0,0 +1,320 @@
+import os
+import re
+import time
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional, Tuple
+from database.db_utils import SessionLocal
+from database.district_utils import DistrictLookup
+from services.data_api import data_api
+from services.gazetteer import entity_gazetteer
+from utils.language_utils import language_handler
+
+logger = logging.getLogger(__name__)
+
+# Import message journey logger for detailed logging
+try:
+    from utils.message_logger import message_journey_logger
+    LOGGING_AVAILABLE = True
+except ImportError:
+    LOGGING_AVAILABLE = False
+
+# Intent keywords (already normalized with DistrictLookup.normalize_city_name)
+INTENT_KEYWORDS = {
+    "brands_in_city": {
+        "ماركات", "الماركات", "ماركه", "الماركه", "شركات", "الشركات", "علامات", "العلامات",
+        "انواع", "الانواع", "brands", "brand"
+    },
+    "brand_prices_in_city": {
+        "اسعار", "الاسعار", "سعر", "السعر", "بكم", "كم", "price", "prices", "cost"
+    },
+    "delivery_to_city": {
+        "توصيل", "التوصيل", "توصلون", "توصلو", "توصلوا", "يوصل", "توصل", "تخدمون", "متوفر",
+        "متوفرين", "delivery", "deliver"
+    }
+}
+
+# Words that carry no meaning for these templates - they count as "explained"
+FILLER_WORDS = {
+    "وش", "ايش", "شو", "ما", "ماهي", "هي", "في", "فيه", "فى", "عندكم", "لديكم", "لو", "سمحت",
+    "ابي", "ابغى", "ابغا", "اريد", "مياه", "مويه", "ميه", "مياة", "الى", "هل", "حق", "عن", "من",
+    "المتوفره", "المتاحه", "متاحه", "لمدينه", "مدينه", "يا", "اخوي", "طيب", "الله", "يعطيك", "العافيه",
+    "what", "are", "the", "in", "is", "there", "to", "do", "you", "of", "for", "water", "please",
+    "available", "which", "have", "any", "how", "much"
+}
+
+# One-letter prefixes glued to a name: "بالرياض", "للدمام", "وجدة"
+ATTACHED_PREFIXES = ("و", "ب", "ل")
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class FastPathRouter:
+    """
+    Deterministic router for template inquiries - "وش الماركات في جدة", "اسعار نستله الرياض",
+    "فيه توصيل الدمام".
+
+    The message is matched against the shared entity gazetteer (city/brand catalog) plus intent
+    keywords. Confidence is the share of words explained by an entity, an intent keyword or a
+    filler word; only unambiguous matches at or above FAST_PATH_MIN_CONFIDENCE are answered
+    here (DataAPIService + reply templates). Everything else returns None and goes through the
+    normal embedding/classification/query agent path.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("FAST_PATH_ENABLED", "true").lower() == "true"
+        self.min_confidence = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.85"))
+        self.max_words = int(os.getenv("FAST_PATH_MAX_WORDS", "8"))
+
+        self.stats = {"attempts": 0, "hits": 0, "intents": {}, "fallbacks": {}}
+
+    @staticmethod
+    def _mentions(tokens: List[str]) -> Dict[int, Dict[int, List[Tuple[str, str]]]]:
+        """
+        City/brand mentions from the entity gazetteer's automaton, aligned to whole tokens:
+        first token -> last token -> list of (kind, display name). A mention may also start
+        after a one-letter prefix glued to its first token ("بالرياض", "للرياض").
+        """
+        variants = [tokens]
+        # "للرياض" -> "لالرياض": the prefix is dropped below, leaving "الرياض"
+        rewritten = [
+            token[0] + "ا" + token[1:]
+            if len(token) > 2 and token[0] in ATTACHED_PREFIXES and token[1] == "ل" and not token[1:].startswith("ال")
+            else token
+            for token in tokens
+        ]
+        if rewritten != tokens:
+            variants.append(rewritten)
+
+        exact: Dict[Tuple[int, int], List[Tuple[str, str]]] = {}
+        prefixed: Dict[Tuple[int, int], List[Tuple[str, str]]] = {}
+        for variant in variants:
+            starts, ends, offset = {}, {}, 0
+            for index, token in enumerate(variant):
+                starts[offset] = index
+                ends[offset + len(token)] = index
+                offset += len(token) + 1
+            for match in entity_gazetteer.find(" ".join(variant), ("city", "brand")):
+                last = ends.get(match["end"])
+                if last is None:
+                    continue
+                if match["start"] in starts:
+                    spans = exact
+                    first = starts[match["start"]]
+                elif match["start"] - 1 in starts and variant[starts[match["start"] - 1]][0] in ATTACHED_PREFIXES:
+                    spans = prefixed
+                    first = starts[match["start"] - 1]
+                else:
+                    continue
+                if first > last:
+                    continue
+                display = match["item"]["name"] if match["kind"] == "city" else match["item"]["title"]
+                entities = spans.setdefault((first, last), [])
+                if (match["kind"], display) not in entities:
+                    entities.append((match["kind"], display))
+
+        # A whole-token match wins over the same span read with its prefix stripped
+        mentions: Dict[int, Dict[int, List[Tuple[str, str]]]] = {}
+        for (first, last), entities in list(prefixed.items()) + list(exact.items()):
+            mentions.setdefault(first, {})[last] = entities
+        return mentions
+
+    def _analyze(self, message: str) -> Dict[str, Any]:
+        """Entities, intents and confidence of a message"""
+        tokens = TOKEN_PATTERN.findall(DistrictLookup.normalize_city_name(message))
+        mentions = self._mentions(tokens)
+        cities, brands, intents = [], [], []
+        explained = 0
+        ambiguous = False
+
+        index = 0
+        while index < len(tokens):
+            # Longest mention first ("صفا مكه" before "مكه")
+            spans = mentions.get(index)
+            if spans:
+                last = max(spans)
+                entities = spans[last]
+                if len({kind for kind, _ in entities}) > 1:
+                    ambiguous = True  # e.g. a brand named after a city
+                for kind, display in entities:
+                    target = cities if kind == "city" else brands
+                    if display not in target:
+                        target.append(display)
+                explained += last - index + 1
+                index = last + 1
+            else:
+                token = tokens[index]
+                matched_intents = [intent for intent, keywords in INTENT_KEYWORDS.items() if token in keywords]
+                if matched_intents:
+                    intents.extend(intent for intent in matched_intents if intent not in intents)
+                    explained += 1
+                elif token in FILLER_WORDS:
+                    explained += 1
+                index += 1
+
+        return {
+            "tokens": len(tokens),
+            "cities": cities,
+            "brands": brands,
+            "intents": intents,
+            "ambiguous": ambiguous,
+            "confidence": explained / len(tokens) if tokens else 0.0
+        }
+
+    def _fallback(self, reason: str) -> None:
+        self.stats["fallbacks"][reason] = self.stats["fallbacks"].get(reason, 0) + 1
+        return None
+
+    async def route(self, message: str, journey_id: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Answer a template inquiry without the LLM
+
+        Returns:
+            Dict with intent, response, language, confidence, city and brand - or None when the
+            message should take the normal LLM path
+        """
+        if not self.enabled or not message or not message.strip():
+            return None
+
+        start_time = time.time()
+        # Gazetteer build and catalog lookups are blocking DB work
+        result = await asyncio.to_thread(self._route, message)
+        if result is None:
+            return None
+
+        print(f"⚡ Fast path: {result['intent']} (city={result['city']}, brand={result['brand']}, confidence={result['confidence']})")
+        if LOGGING_AVAILABLE and journey_id:
+            message_journey_logger.add_step(
+                journey_id=journey_id,
+                step_type="fast_path",
+                description=f"Answered by fast path router: {result['intent']}",
+                data={key: value for key, value in result.items() if key != "response"},
+                duration_ms=int((time.time() - start_time) * 1000)
+            )
+        return result
+
+    def _route(self, message: str) -> Optional[Dict[str, Any]]:
+        self.stats["attempts"] += 1
+        try:
+            analysis = self._analyze(message)
+        except Exception as e:
+            logger.error(f"Fast path analysis failed: {str(e)}")
+            return self._fallback("error")
+
+        if analysis["tokens"] == 0 or analysis["tokens"] > self.max_words:
+            return self._fallback("length")
+        if analysis["ambiguous"]:
+            return self._fallback("ambiguous_entity")
+        if analysis["confidence"] < self.min_confidence:
+            return self._fallback("low_confidence")
+
+        cities, brands, intents = analysis["cities"], analysis["brands"], analysis["intents"]
+        if len(cities) != 1 or len(brands) > 1:
+            return self._fallback("entities")
+
+        # Prices need a brand; brands/delivery questions must not name one
+        if "brand_prices_in_city" in intents and len(brands) == 1:
+            intent = "brand_prices_in_city"
+        elif brands:
+            return self._fallback("no_intent")
+        elif "brands_in_city" in intents:
+            intent = "brands_in_city"
+        elif "delivery_to_city" in intents:
+            intent = "delivery_to_city"
+        else:
+            return self._fallback("no_intent")
+
+        language = language_handler.detect_language(message)
+        city = cities[0]
+        brand = brands[0] if brands else None
+
+        db = SessionLocal()
+        try:
+            if intent == "brand_prices_in_city":
+                products = data_api.get_products_by_brand_and_city_name(db, brand, city, language)
+                response = self._render_prices(products, language)
+            else:
+                city_brands = data_api.get_brands_by_city_name(db, city, language)
+                if intent == "brands_in_city":
+                    response = self._render_brands(city, city_brands, language)
+                else:
+                    response = self._render_delivery(city, city_brands, language)
+        except Exception as e:
+            logger.error(f"Fast path data lookup failed: {str(e)}")
+            return self._fallback("error")
+        finally:
+            db.close()
+
+        if not response:
+            return self._fallback("no_data")
+
+        self.stats["hits"] += 1
+        self.stats["intents"][intent] = self.stats["intents"].get(intent, 0) + 1
+        return {
+            "intent": intent,
+            "response": response,
+            "language": language,
+            "confidence": round(analysis["confidence"], 3),
+            "city": city,
+            "brand": brand
+        }
+
+    @staticmethod
+    def _render_brands(city: str, city_brands: List[Dict[str, Any]], language: str) -> str:
+        if not city_brands:
+            if language == 'ar':
+                return f"عذراً، لا نقدم خدمة التوصيل لمدينة {city} حالياً"
+            return f"Sorry, we currently do not provide delivery service to {city}"
+
+        city_name = city_brands[0]["city_name"]
+        titles = sorted({brand["title"] for brand in city_brands if brand.get("title")})
+        lines = "\n".join(f"• {title}" for title in titles)
+        if language == 'ar':
+            return f"هذه هي العلامات التجارية المتاحة في {city_name}:\n{lines}\n\nأي علامة تجارية تفضل؟"
+        return f"These are the brands available in {city_name}:\n{lines}\n\nWhich brand would you like?"
+
+    @staticmethod
+    def _render_delivery(city: str, city_brands: List[Dict[str, Any]], language: str) -> str:
+        if not city_brands:
+            return FastPathRouter._render_brands(city, city_brands, language)
+
+        city_name = city_brands[0]["city_name"]
+        titles = sorted({brand["title"] for brand in city_brands if brand.get("title")})
+        if language == 'ar':
+            return f"نعم، نوصل إلى {city_name} 🚚\nالعلامات التجارية المتاحة: {'، '.join(titles)}\n\nأي علامة تجارية تفضل؟"
+        return f"Yes, we deliver to {city_name} 🚚\nAvailable brands: {', '.join(titles)}\n\nWhich brand would you like?"
+
+    @staticmethod
+    def _render_prices(products: List[Dict[str, Any]], language: str) -> Optional[str]:
+        priced = [product for product in products if product.get("product_contract_price") is not None]
+        if not priced:
+            # Let the query agent explain missing products/prices
+            return None
+
+        brand_name = priced[0]["brand_title"]
+        city_name = priced[0]["city_name"]
+        lines = []
+        for product in priced:
+            packing = f" ({product['product_packing']})" if product.get("product_packing") else ""
+            if language == 'ar':
+                lines.append(f"• {product['product_title']}{packing} - {product['product_contract_price']} ريال")
+            else:
+                lines.append(f"• {product['product_title']}{packing} - {product['product_contract_price']} SAR")
+        lines = "\n".join(lines)
+        if language == 'ar':
+            return f"أسعار {brand_name} في {city_name}:\n{lines}"
+        return f"{brand_name} prices in {city_name}:\n{lines}"
+
+    def get_stats(self) -> Dict[str, Any]:
+        attempts = self.stats["attempts"]
+        return {
+            "enabled": self.enabled,
+            "min_confidence": self.min_confidence,
+            "gazetteer_version": entity_gazetteer.version,
+            "hit_rate": round(self.stats["hits"] / attempts, 3) if attempts else 0.0,
+            **self.stats
+        }
+
+
+# Singleton instance
+fast_path_router = FastPathRouter()
@@ -9,11 +9,15 @@ import base64
 from utils.language_utils import language_handler
 from typing import Tuple
 import re
+from services.llm_cache import llm_decision_cache
 
 # Configure APIs
 genai.configure(api_key=os.getenv("GEMINI_API_KEY"))  # Only for audio
 openai_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))  # Changed to AsyncOpenAI
 
+# Bump when the classification prompts change - cached classifications of the old prompt stop matching
+CLASSIFICATION_PROMPT_VERSION = "1"
+
 class MessageClassifier:
     def __init__(self):
         self.audio_model = genai.GenerativeModel('gemini-1.5-flash-002')  # Only for audio
@@ -99,6 +103,9 @@ class MessageClassifier:
         اكتب فقط اسم الفئة بدون أي إضافات.
         """
 
+        # History window the prompt sees (also part of the classification cache key)
+        history_window = []
+
         # Build the complete message with context - ENHANCED HISTORY HANDLING
         if conversation_history and len(conversation_history) > 0:
             # Get last 5 messages for better context (increased from 3 to 5)
@@ -121,6 +128,7 @@ class MessageClassifier:
                     context_lines.append(f"bot: {content}")
                 else:
                     context_lines.append(f"user: {content}")
+                history_window.append({"role": role, "content": content})
             
             # Add current message
             current_message_formatted = f"user: {text}"
@@ -183,9 +191,15 @@ class MessageClassifier:
 - الكلمات المفردة قد تكون استفسارات إذا كانت أسماء مدن أو علامات تجارية
 
 صنف الرسالة:"""
-        classification = await language_handler.process_with_openai(
-            classification_prompt,
-            system_prompt
+        classification = await llm_decision_cache.get_or_compute(
+            "message_classification",
+            CLASSIFICATION_PROMPT_VERSION,
+            text,
+            lambda: language_handler.process_with_openai(
+                classification_prompt,
+                system_prompt
+            ),
+            history=history_window
         )
 
         # Check if classification is None or empty
@@ -215,32 +229,37 @@ class MessageClassifier:
                 return None, language
 
             print(f"🏷️ Classification: '{text[:50]}...' → {message_type.name}")
-            user_message.message_type = message_type
-
-            # Handle special cases
-            if message_type == MessageType.COMPLAINT:
-                complaint = Complaint(
-                    user_id=user_message.user_id,
-                    message_id=user_message.id,
-                    content=text
-                )
-                db.add(complaint)
-            
-            elif message_type == MessageType.SUGGESTION:
-                suggestion = Suggestion(
-                    user_id=user_message.user_id,
-                    message_id=user_message.id,
-                    content=text
-                )
-                db.add(suggestion)
-
-            db.commit()
-            return message_type, language
+            return self.record_classification(text, db, user_message, message_type, language)
 
         except (ValueError, AttributeError) as e:
             user_message.message_type = None
             return None, language
 
+    def record_classification(self, text: str, db: Session, user_message: UserMessage, message_type: MessageType, language: str) -> Tuple[MessageType, str]:
+        """Store a message type decided here or upstream (triage) and file complaints/suggestions."""
+        user_message.language = language
+        user_message.message_type = message_type
+
+        # Handle special cases
+        if message_type == MessageType.COMPLAINT:
+            complaint = Complaint(
+                user_id=user_message.user_id,
+                message_id=user_message.id,
+                content=text
+            )
+            db.add(complaint)
+        
+        elif message_type == MessageType.SUGGESTION:
+            suggestion = Suggestion(
+                user_id=user_message.user_id,
+                message_id=user_message.id,
+                content=text
+            )
+            db.add(suggestion)
+
+        db.commit()
+        return message_type, language
+
     def get_default_response(self, message_type: MessageType, language: str) -> str:
         """Get default response based on message type and language."""
         responses = language_handler.get_default_responses(language)
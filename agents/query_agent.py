@@ -2,9 +2,11 @@
 
 import requests
 import json
+import re
 import logging
 import asyncio
 import time
+from contextvars import ContextVar
 from typing import Dict, List, Any, Optional
 from openai import AsyncOpenAI
 from langchain_openai import ChatOpenAI
@@ -17,6 +19,15 @@ from utils.language_utils import language_handler
 from services.data_api import data_api
 from database.db_utils import get_db
 from database.district_utils import district_lookup
+from utils.llm_backend import llm_backend
+from utils.llm_scheduler import llm_scheduler
+from utils.metrics import chatbot_metrics
+from services.llm_cache import llm_decision_cache
+from services.gazetteer import entity_gazetteer
+from utils.arabic_normalizer import normalize_brand
+from utils.validation_policy import validation_policy
+from utils.prompt_builder import PromptBuilder
+from utils.tool_result_serializer import tool_result_serializer
 import random
 
 # Load environment variables
@@ -34,6 +45,18 @@ except ImportError:
     LOGGING_AVAILABLE = False
     logger.warning("Message journey logger not available - LLM logging disabled")
 
+# Bump a version whenever its prompt changes - cached decisions of the old prompt stop matching
+DECISION_PROMPT_VERSIONS = {
+    "relevance": "1",
+    "city_verification": "1",
+    "brand_verification": "1",
+    "batch_verification": "1"
+}
+
+# Candidate verifications left for the message being processed - one budget shared by the
+# city and brand extraction tasks (set in _extract_contexts_and_check_relevance)
+verification_budget: ContextVar[Optional[Dict[str, int]]] = ContextVar("verification_budget", default=None)
+
 class QueryAgent:
     """
     Enhanced Query Agent with function calling capabilities for answering user queries 
@@ -60,11 +83,31 @@ class QueryAgent:
             tags=["query-agent", "abar-chatbot"]
         )
         
-        # Rate limiting settings (configurable via environment variables)
-        self.last_request_time = 0
-        self.min_request_interval = float(os.getenv("OPENAI_MIN_REQUEST_INTERVAL", "0.5"))  # Default 500ms between requests
+        # Retries of transient errors (configurable via environment variables) - request pacing and
+        # 429 handling are done by utils.llm_scheduler
         self.max_retries = int(os.getenv("OPENAI_MAX_RETRIES", "3"))  # Default 3 retries
-        self.base_delay = float(os.getenv("OPENAI_BASE_DELAY", "1"))  # Default 1 second base delay
+        
+        # How context extraction and relevance classification are scheduled: sequential, concurrent or speculative
+        self.extraction_mode = os.getenv("QUERY_AGENT_EXTRACTION_MODE", "concurrent").lower()
+        if self.extraction_mode not in ("sequential", "concurrent", "speculative"):
+            logger.warning(f"Unknown QUERY_AGENT_EXTRACTION_MODE '{self.extraction_mode}' - using concurrent")
+            self.extraction_mode = "concurrent"
+        
+        # City/brand candidate verification: "batched" (one LLM call for all candidates) or "individual"
+        self.verification_mode = os.getenv("QUERY_AGENT_VERIFICATION_MODE", "batched").lower()
+        # Per message, city and brand together: max candidates sent to the batched verifier / max individual verification calls
+        self.max_verification_candidates = int(os.getenv("QUERY_AGENT_MAX_VERIFICATION_CANDIDATES", "6"))
+        
+        # LLM round-trips per inquiry - each one may request several tools, executed concurrently
+        self.max_tool_round_trips = int(os.getenv("QUERY_AGENT_MAX_TOOL_ROUND_TRIPS", "5"))
+        
+        # Prompt size limits (tokens) - history is trimmed first, then the largest tool results
+        self.prompt_token_budget = int(os.getenv("QUERY_AGENT_PROMPT_TOKEN_BUDGET", "16000"))
+        self.max_tool_result_tokens = int(os.getenv("QUERY_AGENT_MAX_TOOL_RESULT_TOKENS", "4000"))
+        
+        # Resolved city/brand kept in UserSession.context - reused (not re-verified) until it expires
+        self.entity_memory_ttl_seconds = int(os.getenv("QUERY_AGENT_ENTITY_MEMORY_TTL_SECONDS", str(6 * 3600)))
+        self.entity_memory_min_confidence = float(os.getenv("QUERY_AGENT_ENTITY_MEMORY_MIN_CONFIDENCE", "0.7"))
         
         # Define available functions for the LLM
         self.available_functions = {
@@ -384,41 +427,33 @@ class QueryAgent:
                 }
             }
         ]
-    
-    async def _rate_limit_delay(self):
-        """Ensure minimum time between API requests"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.min_request_interval:
-            delay = self.min_request_interval - time_since_last
-            await asyncio.sleep(delay)
-        self.last_request_time = time.time()
+        
+        # Same functions in the `tools` format (allows several tool calls per response)
+        self.tool_definitions = [
+            {"type": "function", "function": definition} for definition in self.function_definitions
+        ]
     
     async def _call_openai_with_retry(self, **kwargs):
-        """Make OpenAI API call with exponential backoff retry logic"""
+        """Make OpenAI API call, retrying transient errors
+
+        Rate limits (429) are not retried here - utils.llm_scheduler already paused the model
+        and retried them with Retry-After, so a 429 reaching this point is final.
+        """
         for attempt in range(self.max_retries + 1):
             try:
-                # Apply rate limiting
-                await self._rate_limit_delay()
-                
-                # Make the API call
-                response = await self.openai_client.chat.completions.create(**kwargs)
+                # Make the API call (live, or record/replay through the LLM backend)
+                response = await llm_backend.chat_completion(
+                    lambda: self.openai_client.chat.completions.create(**kwargs),
+                    **kwargs
+                )
                 return response
                 
             except Exception as e:
                 error_str = str(e)
                 
-                # Handle 429 rate limit errors specifically
-                if "429" in error_str or "rate limit" in error_str.lower():
-                    if attempt < self.max_retries:
-                        # Exponential backoff with jitter
-                        delay = (self.base_delay * (2 ** attempt)) + random.uniform(0, 1)
-                        logger.warning(f"Rate limit hit, attempt {attempt + 1}/{self.max_retries + 1}. Retrying in {delay:.2f}s...")
-                        await asyncio.sleep(delay)
-                        continue
-                    else:
-                        logger.error("Max retries reached for rate limit error")
-                        raise Exception("OpenAI rate limit exceeded. Please try again in a few minutes.")
+                if llm_scheduler.is_rate_limit(e):
+                    logger.error("OpenAI rate limit persisted through the scheduler's retries")
+                    raise Exception("OpenAI rate limit exceeded. Please try again in a few minutes.")
                 
                 # Handle other errors
                 elif attempt < self.max_retries:
@@ -436,9 +471,6 @@ class QueryAgent:
     async def _call_langchain_llm(self, messages: List, max_tokens: int = 1500, temperature: float = 0.3):
         """Make LangChain LLM call for better tracing in LangSmith"""
         try:
-            # Apply rate limiting (same as before)
-            await self._rate_limit_delay()
-            
             # Convert dict messages to LangChain message objects if needed
             langchain_messages = []
             for msg in messages:
@@ -457,7 +489,13 @@ class QueryAgent:
             temp_llm = self.llm.bind(max_tokens=max_tokens, temperature=temperature)
             
             # Make the call (this will be traced in LangSmith)
-            response = await temp_llm.ainvoke(langchain_messages)
+            response = await llm_backend.chat_text(
+                lambda: temp_llm.ainvoke(langchain_messages),
+                langchain_messages,
+                model=self.llm.model_name,
+                max_tokens=max_tokens,
+                temperature=temperature
+            )
             
             # Return in format similar to OpenAI response for compatibility
             return {"content": response.content}
@@ -476,33 +514,9 @@ class QueryAgent:
         Removes: مياه, موية, مياة before brand names
         Applies Arabic text normalization for better matching
         Example: 'مياه وي' -> 'وي', 'موية نقي' -> 'نقي'
+        Same cleaning ("brand" profile of utils.arabic_normalizer) as the gazetteer's brand patterns
         """
-        from database.district_utils import DistrictLookup
-        
-        # Water prefixes to remove (case insensitive)
-        water_prefixes = ["مياه", "موية", "مياة", "ميه", "water"]
-        
-        # Clean the brand text
-        cleaned_text = brand_text.strip()
-        
-        # Remove water prefixes from the beginning
-        for prefix in water_prefixes:
-            # Check if text starts with the prefix followed by space
-            if cleaned_text.lower().startswith(prefix.lower() + " "):
-                cleaned_text = cleaned_text[len(prefix):].strip()
-                break
-            # Check if text starts with the prefix without space (for concatenated cases)
-            elif cleaned_text.lower().startswith(prefix.lower()) and len(cleaned_text) > len(prefix):
-                cleaned_text = cleaned_text[len(prefix):].strip()
-                break
-        
-        # Apply brand-specific replacements
-        cleaned_text = cleaned_text.replace("ايڤال", "ايفال")
-        
-        # Apply normalization for better brand matching
-        normalized_text = DistrictLookup.normalize_city_name(cleaned_text)
-        
-        return normalized_text
+        return normalize_brand(brand_text)
     
     async def _verify_city_extraction(self, user_message: str, conversation_history: List[Dict] = None, extracted_city: str = None, extraction_source: str = "message") -> bool:
         """Use ChatGPT to verify if the extracted city/district is correct based on the user's message and FULL conversation history"""
@@ -558,14 +572,21 @@ class QueryAgent:
 
             print(f"🔍 [CITY VERIFICATION] Sending prompt to LLM for verification")
             
-            # Call LangChain for verification
-            response = await self._call_langchain_llm(
-                messages=[
-                    {"role": "system", "content": "أنت خبير في فهم النصوص واستخراج المعلومات الجغرافية. كن دقيقاً جداً في التحقق. مهم جداً: فرق بين علامة 'صفا مكة' التجارية ومدينة 'مكة المكرمة' - لا تستخرج مدينة مكة إذا كانت جزء من اسم علامة تجارية."},
-                    {"role": "user", "content": verification_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=20
+            # Call LangChain for verification (memoized per message + history window)
+            response = await llm_decision_cache.get_or_compute(
+                "city_verification",
+                DECISION_PROMPT_VERSIONS["city_verification"],
+                user_message,
+                lambda: self._call_langchain_llm(
+                    messages=[
+                        {"role": "system", "content": "أنت خبير في فهم النصوص واستخراج المعلومات الجغرافية. كن دقيقاً جداً في التحقق. مهم جداً: فرق بين علامة 'صفا مكة' التجارية ومدينة 'مكة المكرمة' - لا تستخرج مدينة مكة إذا كانت جزء من اسم علامة تجارية."},
+                        {"role": "user", "content": verification_prompt}
+                    ],
+                    temperature=0.1,
+                    max_tokens=20
+                ),
+                history=(conversation_history or [])[-7:],
+                extra=[extracted_city, extraction_source]
             )
             
             verification_result = response["content"].strip().lower()
@@ -602,226 +623,410 @@ class QueryAgent:
             "found_in": found_in
         }
 
-    async def _extract_city_from_context(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar') -> Optional[Dict[str, Any]]:
+    async def _select_verified_candidate(self, kind: str, candidates: List[Dict[str, Any]], user_message: str, conversation_history: List[Dict] = None, confirmed_mentions: Optional[List[str]] = None) -> Optional[Dict[str, Any]]:
+        """Return the candidate the LLM confirms with the highest confidence (candidates are in priority order)
+        
+        Batched verdicts are ranked by their confidence, ties going to the higher-priority candidate.
+        
+        Args:
+            kind: "city" or "brand"
+            candidates: Dicts with item, name, source (for the prompt) and found_in
+            confirmed_mentions: Names the triage call already saw the customer mention - when
+                                given, candidates are matched against them instead of verified again
+        """
+        # The same entity can match in several history messages - verify it once, at its best priority
+        unique_candidates = []
+        seen = set()
+        for candidate in candidates:
+            key = (candidate["name"], candidate["found_in"])
+            if key not in seen:
+                seen.add(key)
+                unique_candidates.append(candidate)
+        
+        if not unique_candidates:
+            return None
+        
+        if confirmed_mentions is not None:
+            return self._match_confirmed_mentions(kind, unique_candidates, confirmed_mentions)
+        
+        budget = verification_budget.get()
+        if budget is None:
+            budget = {"remaining": self.max_verification_candidates}
+        if len(unique_candidates) > budget["remaining"]:
+            print(f"⚠️ [{kind.upper()} VERIFICATION] {len(unique_candidates)} candidates - verifying only the first {budget['remaining']} (per-message limit)")
+            unique_candidates = unique_candidates[:budget["remaining"]]
+            if not unique_candidates:
+                return None
+        
+        if self.verification_mode != "batched" or len(unique_candidates) == 1:
+            verify = self._verify_city_extraction if kind == "city" else self._verify_brand_extraction
+            for candidate in unique_candidates:
+                # Charged per call - the other kind may have spent the budget meanwhile
+                if budget["remaining"] <= 0:
+                    break
+                budget["remaining"] -= 1
+                if await verify(user_message, conversation_history, candidate["name"], candidate["source"]):
+                    return candidate
+            return None
+        
+        budget["remaining"] -= len(unique_candidates)
+        confidences = await self._verify_candidates_batch(kind, unique_candidates, user_message, conversation_history)
+        accepted = [index for index, confidence in enumerate(confidences) if confidence > 0]
+        if not accepted:
+            return None
+        # sorted() is stable - equal confidences keep the priority order
+        best = sorted(accepted, key=lambda index: -confidences[index])[0]
+        return unique_candidates[best]
+    
+    def _match_confirmed_mentions(self, kind: str, candidates: List[Dict[str, Any]], confirmed_mentions: List[str]) -> Optional[Dict[str, Any]]:
+        """First candidate whose name matches a mention confirmed by triage (no LLM call)"""
+        from database.district_utils import DistrictLookup
+        
+        mentions = [DistrictLookup.normalize_city_name(mention) for mention in confirmed_mentions if mention]
+        for candidate in candidates:
+            name = DistrictLookup.normalize_city_name(candidate["name"])
+            if name and any(name in mention or mention in name for mention in mentions if mention):
+                print(f"✅ [{kind.upper()} VERIFICATION] '{candidate['name']}' confirmed by triage")
+                return candidate
+        print(f"❌ [{kind.upper()} VERIFICATION] No candidate matches triage mentions {confirmed_mentions}")
+        return None
+    
+    def _entity_memory(self, session_context: Optional[Dict[str, Any]], kind: str) -> Optional[Dict[str, Any]]:
+        """Unexpired city/brand memory of this conversation (session_context["entities"][kind]), if any"""
+        if session_context is None:
+            return None
+        memory = (session_context.get("entities") or {}).get(kind)
+        if not memory or memory.get("expires_at", 0) < time.time():
+            return None
+        return memory
+    
+    @staticmethod
+    def _history_to_scan(conversation_history: List[Dict], memory: Optional[Dict[str, Any]]) -> List[Dict]:
+        """History messages not scanned for this entity kind on an earlier turn (last 7 at most)"""
+        recent_messages = (conversation_history or [])[-7:]
+        scanned_through = memory.get("scanned_through") if memory else None
+        if not scanned_through:
+            return recent_messages
+        # Same-second timestamps are scanned again rather than missed
+        return [msg for msg in recent_messages if not msg.get("timestamp") or msg["timestamp"] >= scanned_through]
+    
+    async def _resolve_with_memory(self, kind: str, candidates: List[Dict[str, Any]], user_message: str,
+                                   conversation_history: List[Dict] = None, confirmed_mentions: Optional[List[str]] = None,
+                                   session_context: Optional[Dict[str, Any]] = None, memory: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Pick the city/brand candidate, reusing the settled one from session context
+        
+        Only candidates ranked above a mention of the settled entity are verified - a settled
+        entity is never verified again. The choice is written back to session_context with its
+        confidence, a fresh expiry and the scan cursor.
+        """
+        settled = None
+        if memory and memory.get("item") and memory.get("confidence", 0) >= self.entity_memory_min_confidence:
+            settled = memory
+        
+        ahead = []
+        settled_match = None
+        for candidate in candidates:
+            if settled and candidate["item"]["id"] == settled["item"]["id"]:
+                settled_match = candidate
+                break
+            ahead.append(candidate)
+        
+        chosen = None
+        if ahead:
+            chosen = await self._select_verified_candidate(kind, ahead, user_message, conversation_history, confirmed_mentions)
+        
+        if chosen:
+            confidence = 0.95 if chosen["found_in"].startswith("current_message") else 0.85
+            if confirmed_mentions is not None:
+                confidence -= 0.05
+            entry = {
+                "item": {key: chosen["item"].get(key) for key in (("id", "name", "name_en") if kind == "city" else ("id", "title", "title_en"))},
+                "found_in": chosen["found_in"],
+                "district_name": chosen.get("district_name"),
+                "confidence": confidence
+            }
+            print(f"🧠 [{kind.upper()} MEMORY] Settled '{chosen['name']}' (confidence {confidence:.2f})")
+        elif settled:
+            entry = dict(settled)
+            if settled_match:
+                # Mentioned again - the customer is still talking about it
+                entry["found_in"] = settled_match["found_in"]
+                entry["confidence"] = min(1.0, settled["confidence"] + 0.05)
+            name = settled["item"].get("name") or settled["item"].get("title")
+            print(f"🧠 [{kind.upper()} MEMORY] Reusing settled '{name}' without verification")
+        else:
+            entry = {"item": None, "confidence": 0.0}
+        
+        if session_context is not None:
+            entry["expires_at"] = time.time() + self.entity_memory_ttl_seconds
+            # Advance the cursor only over history this turn actually scanned
+            scanned = [msg["timestamp"] for msg in self._history_to_scan(conversation_history, memory) if msg.get("timestamp")]
+            previous = memory.get("scanned_through") if memory else None
+            entry["scanned_through"] = max(scanned + ([previous] if previous else []), default=None)
+            session_context.setdefault("entities", {})[kind] = entry
+        
+        if not entry["item"]:
+            return None
+        found_in = entry["found_in"] if chosen or settled_match else "session_context"
+        return {"item": entry["item"], "found_in": found_in, "district_name": entry.get("district_name")}
+    
+    async def _verify_candidates_batch(self, kind: str, candidates: List[Dict[str, Any]], user_message: str, conversation_history: List[Dict] = None) -> List[float]:
+        """Verify all city/brand candidates of a message in one structured LLM call
+        
+        Returns one confidence per candidate (same order), 0.0 for rejected ones. Rejects
+        everything on errors, like the single verifiers.
+        """
+        try:
+            print(f"🔍 [{kind.upper()} VERIFICATION] Batch verifying {len(candidates)} candidates: {[candidate['name'] for candidate in candidates]}")
+            
+            context = ""
+            if conversation_history:
+                context_lines = []
+                for msg in conversation_history[-7:]:
+                    role = msg.get('role', 'unknown')
+                    content = msg.get('content', '')
+                    if role == 'user':
+                        context_lines.append(f"العميل: {content}")
+                    elif role == 'assistant':
+                        context_lines.append(f"المساعد: {content}")
+                    else:
+                        context_lines.append(f"{role}: {content}")
+                context = "تاريخ المحادثة الحديث:\n" + "\n".join(context_lines) + "\n"
+            
+            candidate_lines = "\n".join(
+                f'{index}. "{candidate["name"]}" (من {candidate["source"]})'
+                for index, candidate in enumerate(candidates, 1)
+            )
+            
+            if kind == "city":
+                entity = "مدينة"
+                rules = """- يجب أن يكون العميل ذكر المدينة بوضوح كموقع جغرافي في رسالته أو أكد عليها
+- إذا ذكر المساعد عدة مدن وقال العميل "نعم" أو "موافق" بدون تحديد مدينة معينة - خطأ
+- "صفا مكة" أو "صفا مكه" علامة تجارية للمياه وليست مدينة مكة المكرمة - لا تقبل "مكة" إذا كانت جزء منها"""
+                system_prompt = "أنت خبير في فهم النصوص واستخراج المعلومات الجغرافية. كن دقيقاً جداً في التحقق. مهم جداً: فرق بين علامة 'صفا مكة' التجارية ومدينة 'مكة المكرمة'."
+            else:
+                entity = "علامة تجارية"
+                rules = """- يجب أن يكون العميل ذكر العلامة التجارية بوضوح أو أكد عليها تحديداً (اسم العلامة منفرداً في رسالة يعتبر ذكراً صريحاً)
+- لا تقبل العلامات التي ذكرها المساعد فقط في قائمة الخيارات، ولا الردود الغامضة مثل "نعم" أو "أي واحدة"
+- تنويعات الكتابة (الهاء والتاء المربوطة، "نستله"/"نستلة"/"Nestle"، الأخطاء الإملائية البسيطة) مقبولة
+- المطابقة التامة مع رسالة العميل تكاد تكون صحيحة دائماً"""
+                system_prompt = "أنت خبير في فهم النصوص واستخراج أسماء العلامات التجارية. كن مرناً مع تنويعات كتابة أسماء العلامات التجارية ولكن دقيقاً في التحقق من ذكر العميل لها."
+            
+            verification_prompt = f"""{context}
+الرسالة الحالية للعميل: "{user_message}"
+
+استخرجنا المرشحين التاليين ({entity}) من رسائل العميل:
+{candidate_lines}
+
+🚨 قواعد التحقق:
+{rules}
+
+لكل مرشح، هل استخراجه صحيح ومبرر من رسائل العميل فقط؟
+أجب بصيغة JSON فقط بدون أي نص آخر:
+{{"verdicts": [{{"index": 1, "correct": true, "confidence": 0.9}}]}}"""
+            
+            response = await llm_decision_cache.get_or_compute(
+                "batch_verification",
+                DECISION_PROMPT_VERSIONS["batch_verification"],
+                user_message,
+                lambda: self._call_langchain_llm(
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": verification_prompt}
+                    ],
+                    temperature=0.1,
+                    max_tokens=30 + 25 * len(candidates)
+                ),
+                history=(conversation_history or [])[-7:],
+                extra=[kind] + [[candidate["name"], candidate["source"]] for candidate in candidates]
+            )
+            
+            content = response["content"].strip()
+            json_match = re.search(r'\{.*\}', content, re.DOTALL)
+            parsed = json.loads(json_match.group(0) if json_match else content)
+            
+            confidences = [0.0] * len(candidates)
+            for verdict in parsed.get("verdicts", []):
+                index = int(verdict.get("index", 0)) - 1
+                if 0 <= index < len(candidates) and verdict.get("correct"):
+                    # A verdict without a confidence still counts as accepted
+                    confidence = verdict.get("confidence")
+                    confidences[index] = min(1.0, max(0.01, float(confidence))) if confidence is not None else 1.0
+            
+            print(f"🔍 [{kind.upper()} VERIFICATION] Batch verdicts: " + ", ".join(
+                f"{candidate['name']} -> {f'✅ {confidence:.2f}' if confidence else '❌'}" for candidate, confidence in zip(candidates, confidences)
+            ))
+            return confidences
+            
+        except Exception as e:
+            logger.error(f"Error in batched {kind} verification: {str(e)}")
+            print(f"🚨 [{kind.upper()} VERIFICATION] Batch verification failed - rejecting all candidates for safety")
+            return [0.0] * len(candidates)
+    
+    async def _extract_city_from_context(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar', confirmed_mentions: Optional[List[str]] = None, session_context: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """Extract city information from current message and conversation history with AI verification
-        Priority: 1) City in last message, 2) District in last message, 3) City in history (last 5 messages), 4) District in history (last 5 messages)"""
+        Priority: 1) City in last message, 2) District in last message, 3) City in history (last 5 messages), 4) District in history (last 5 messages)
+        With session_context, only history messages newer than the last scan are searched and a settled city is reused"""
         try:
-            db = self._get_db_session()
-            try:
-                all_cities = data_api.get_all_cities(db)
+            memory = self._entity_memory(session_context, "city")
+            # Substring matches in priority order - verified together at the end
+            candidates = []
+            
+            # PRIORITY 1: Check for city in last message (current user message)
+            if user_message:
+                # Normalize user message for better matching
+                normalized_user_message = district_lookup.normalize_city_name(user_message)
+                
+                # One gazetteer pass finds every Arabic/English city name in the message
+                for city, fields in entity_gazetteer.entities_in(normalized_user_message, "city"):
+                    # LANGUAGE-AWARE PRIORITY: Check language-appropriate city name first
+                    if user_language == 'en':
+                        # For English conversations, prioritize English city names
+                        if "en" in fields:
+                            print(f"🏙️ QueryAgent: Found English city '{city.get('name_en', city['name'])}' in last message")
+                            
+                            candidates.append({"item": city, "name": city.get('name_en', city['name']), "source": "current message", "found_in": "current_message_city"})
+                        # Fallback: Check normalized Arabic city name for English conversations (e.g., "Kharj" -> "الخرج")
+                        else:
+                            print(f"🏙️ QueryAgent: Found normalized Arabic city '{city['name']}' matching English input")
+                            print(f"   User message normalized: '{normalized_user_message}'")
+                            
+                            candidates.append({"item": city, "name": city['name'], "source": "current message", "found_in": "current_message_city"})
+                    else:
+                        # For Arabic conversations, prioritize Arabic city names
+                        if "ar" in fields:
+                            print(f"🏙️ QueryAgent: Found normalized city '{city['name']}' in last message")
+                            print(f"   User message normalized: '{normalized_user_message}'")
+                            
+                            candidates.append({"item": city, "name": city['name'], "source": "الرسالة الحالية", "found_in": "current_message_city"})
+                        # Fallback: Check English city name for Arabic conversations
+                        else:
+                            print(f"🏙️ QueryAgent: Found direct city '{city['name']}' (English) in last message")
+                            
+                            candidates.append({"item": city, "name": city['name'], "source": "الرسالة الحالية", "found_in": "current_message_city"})
                 
-                # PRIORITY 1: Check for city in last message (current user message)
-                if user_message:
-                    # Normalize user message for better matching
-                    normalized_user_message = district_lookup.normalize_city_name(user_message)
-                    current_content = normalized_user_message.lower()
+                # No exact mention: try misspelled city names ("الرياظ", "jedda") - verified like the others
+                if not candidates:
+                    for match in entity_gazetteer.fuzzy_mentions("city", normalized_user_message):
+                        city = match["item"]
+                        print(f"🏙️ QueryAgent: Fuzzy city match '{city['name']}' for '{match['phrase']}' (score {match['score']})")
+                        if user_language == 'en':
+                            candidates.append({"item": city, "name": city.get('name_en') or city['name'], "source": "current message (approximate match)", "found_in": "current_message_city"})
+                        else:
+                            candidates.append({"item": city, "name": city['name'], "source": "الرسالة الحالية (مطابقة تقريبية)", "found_in": "current_message_city"})
+            
+            # PRIORITY 2: Check for district in last message (current user message) - COMMENTED OUT
+            # if user_message:
+            #     district_match = district_lookup.find_district_in_message(user_message, db)
+            #     print(f"🏘️ QueryAgent: District match: {district_match}")
+            #     if district_match:
+            #         district_name = district_match['district']
+            #         city_name = district_match['city']
+            #         
+            #         print(f"🏘️ QueryAgent: Found district '{district_name}' -> city '{city_name}' in last message")
+            #         
+            #         # Verify district extraction with ChatGPT
+            #         is_verified = await self._verify_city_extraction(
+            #             user_message, conversation_history, 
+            #             district_name, "الرسالة الحالية (حي)"
+            #         )
+            #         
+            #         if is_verified:
+            #             # Find the city details in our cities list (normalize for comparison)
+            #             normalized_district_city = district_lookup.normalize_city_name(city_name)
+            #             for city in all_cities:
+            #                 system_city_name = city.get("name", "").strip()
+            #                 normalized_system_city = district_lookup.normalize_city_name(system_city_name)
+            #                 
+            #                 if normalized_system_city == normalized_district_city:
+            #                     print(f"🎯 QueryAgent: District-to-City mapping from last message:")
+            #                     print(f"   📍 District: '{district_name}' (user is from this district)")
+            #                     print(f"   🏙️ Business City: '{city['name']}' (ID: {city['id']}) - THIS will be used for brands/products")
+            #                     return {
+            #                         "city_id": city["id"],
+            #                         "city_name": city["name"],  # ← CITY name (e.g., "الأحساء") - used for business logic
+            #                         "city_name_en": city["name_en"],
+            #                         "found_in": "current_message_district",
+            #                         "district_name": district_name  # ← DISTRICT name (e.g., "الحمراء الأول") - context only
+            #                     }
+            
+            # PRIORITY 3: Check for city in conversation history
+            if conversation_history:
+                for message in reversed(self._history_to_scan(conversation_history, memory)):  # Check last 7 (unscanned) messages
+                    content = message.get("content", "")
+                    # Normalize conversation history content for better matching
+                    normalized_content = district_lookup.normalize_city_name(content)
                     
-                    for city in all_cities:
-                        # Normalize both Arabic and English city names
-                        city_name_ar = district_lookup.normalize_city_name(city.get("name", "")).lower()
-                        city_name_en = city.get("name_en", "").lower().strip()
-                        
-                        # LANGUAGE-AWARE PRIORITY: Check language-appropriate city name first
+                    # Check if any city name appears in the message (language-aware priority)
+                    for city, fields in entity_gazetteer.entities_in(normalized_content, "city"):
+                        # LANGUAGE-AWARE PRIORITY for conversation history
                         if user_language == 'en':
                             # For English conversations, prioritize English city names
-                            if city_name_en and city_name_en in user_message.lower():
-                                print(f"🏙️ QueryAgent: Found English city '{city.get('name_en', city['name'])}' in last message")
+                            if "en" in fields:
+                                print(f"🏙️ QueryAgent: Found English city in history '{city.get('name_en', city['name'])}'")
                                 
-                                # Verify extraction with ChatGPT
-                                is_verified = await self._verify_city_extraction(
-                                    user_message, conversation_history, 
-                                    city.get('name_en', city['name']), "current message"
-                                )
-                                
-                                if is_verified:
-                                    return self._create_city_result(city, "current_message_city", user_language)
-                            # Fallback: Check normalized Arabic city name for English conversations (e.g., "Kharj" -> "الخرج")
-                            elif city_name_ar and city_name_ar in current_content:
-                                print(f"🏙️ QueryAgent: Found normalized Arabic city '{city['name']}' matching English input")
-                                print(f"   Original: '{city.get('name', '')}' -> Normalized: '{city_name_ar}'")
-                                print(f"   User message normalized: '{normalized_user_message}'")
-                                
-                                # Verify extraction with ChatGPT
-                                is_verified = await self._verify_city_extraction(
-                                    user_message, conversation_history, 
-                                    city['name'], "current message"
-                                )
+                                candidates.append({"item": city, "name": city.get('name_en', city['name']), "source": "conversation history", "found_in": "conversation_history_city"})
+                            # Fallback: Check normalized Arabic city name
+                            else:
+                                print(f"🏙️ QueryAgent: Found normalized Arabic city in history matching English context '{city['name']}'")
                                 
-                                if is_verified:
-                                    return self._create_city_result(city, "current_message_city", user_language)
+                                candidates.append({"item": city, "name": city['name'], "source": "conversation history", "found_in": "conversation_history_city"})
                         else:
                             # For Arabic conversations, prioritize Arabic city names
-                            if city_name_ar and city_name_ar in current_content:
-                                print(f"🏙️ QueryAgent: Found normalized city '{city['name']}' in last message")
-                                print(f"   Original: '{city.get('name', '')}' -> Normalized: '{city_name_ar}'")
-                                print(f"   User message normalized: '{normalized_user_message}'")
-                                
-                                # Verify extraction with ChatGPT
-                                is_verified = await self._verify_city_extraction(
-                                    user_message, conversation_history, 
-                                    city['name'], "الرسالة الحالية"
-                                )
-                                
-                                if is_verified:
-                                    return self._create_city_result(city, "current_message_city", user_language)
-                            # Fallback: Check English city name for Arabic conversations
-                            elif city_name_en and city_name_en in user_message.lower():
-                                print(f"🏙️ QueryAgent: Found direct city '{city['name']}' (English) in last message")
-                                
-                                # Verify extraction with ChatGPT
-                                is_verified = await self._verify_city_extraction(
-                                    user_message, conversation_history, 
-                                    city['name'], "الرسالة الحالية"
-                                )
+                            if "ar" in fields:
+                                print(f"🏙️ QueryAgent: Found normalized city in history '{city['name']}'")
                                 
-                                if is_verified:
-                                    return self._create_city_result(city, "current_message_city", user_language)
-                
-                # PRIORITY 2: Check for district in last message (current user message) - COMMENTED OUT
-                # if user_message:
-                #     district_match = district_lookup.find_district_in_message(user_message, db)
-                #     print(f"🏘️ QueryAgent: District match: {district_match}")
-                #     if district_match:
-                #         district_name = district_match['district']
-                #         city_name = district_match['city']
-                #         
-                #         print(f"🏘️ QueryAgent: Found district '{district_name}' -> city '{city_name}' in last message")
-                #         
-                #         # Verify district extraction with ChatGPT
-                #         is_verified = await self._verify_city_extraction(
-                #             user_message, conversation_history, 
-                #             district_name, "الرسالة الحالية (حي)"
-                #         )
-                #         
-                #         if is_verified:
-                #             # Find the city details in our cities list (normalize for comparison)
-                #             normalized_district_city = district_lookup.normalize_city_name(city_name)
-                #             for city in all_cities:
-                #                 system_city_name = city.get("name", "").strip()
-                #                 normalized_system_city = district_lookup.normalize_city_name(system_city_name)
-                #                 
-                #                 if normalized_system_city == normalized_district_city:
-                #                     print(f"🎯 QueryAgent: District-to-City mapping from last message:")
-                #                     print(f"   📍 District: '{district_name}' (user is from this district)")
-                #                     print(f"   🏙️ Business City: '{city['name']}' (ID: {city['id']}) - THIS will be used for brands/products")
-                #                     return {
-                #                         "city_id": city["id"],
-                #                         "city_name": city["name"],  # ← CITY name (e.g., "الأحساء") - used for business logic
-                #                         "city_name_en": city["name_en"],
-                #                         "found_in": "current_message_district",
-                #                         "district_name": district_name  # ← DISTRICT name (e.g., "الحمراء الأول") - context only
-                #                     }
-                
-                # PRIORITY 3: Check for city in conversation history
-                if conversation_history:
-                    for message in reversed(conversation_history[-7:]):  # Check last 7 messages
-                        content = message.get("content", "")
-                        # Normalize conversation history content for better matching
-                        normalized_content = district_lookup.normalize_city_name(content)
-                        content_lower = normalized_content.lower()
-                        
-                        # Check if any city name appears in the message (language-aware priority)
-                        for city in all_cities:
-                            # Normalize city names from database
-                            city_name_ar = district_lookup.normalize_city_name(city.get("name", "")).lower()
-                            city_name_en = city.get("name_en", "").lower().strip()
-                            
-                            # LANGUAGE-AWARE PRIORITY for conversation history
-                            if user_language == 'en':
-                                # For English conversations, prioritize English city names
-                                if city_name_en and city_name_en in content.lower():
-                                    print(f"🏙️ QueryAgent: Found English city in history '{city.get('name_en', city['name'])}'")
-                                    
-                                    # Verify extraction with ChatGPT
-                                    is_verified = await self._verify_city_extraction(
-                                        user_message, conversation_history, 
-                                        city.get('name_en', city['name']), "conversation history"
-                                    )
-                                    
-                                    if is_verified:
-                                        return self._create_city_result(city, "conversation_history_city", user_language)
-                                # Fallback: Check normalized Arabic city name
-                                elif city_name_ar and city_name_ar in content_lower:
-                                    print(f"🏙️ QueryAgent: Found normalized Arabic city in history matching English context '{city['name']}'")
-                                    print(f"   Original: '{city.get('name', '')}' -> Normalized: '{city_name_ar}'")
-                                    print(f"   History content normalized: '{normalized_content}'")
-                                    
-                                    # Verify extraction with ChatGPT
-                                    is_verified = await self._verify_city_extraction(
-                                        user_message, conversation_history, 
-                                        city['name'], "conversation history"
-                                    )
-                                    
-                                    if is_verified:
-                                        return self._create_city_result(city, "conversation_history_city", user_language)
+                                candidates.append({"item": city, "name": city['name'], "source": "تاريخ المحادثة", "found_in": "conversation_history_city"})
+                            # Fallback: Check English city name
                             else:
-                                # For Arabic conversations, prioritize Arabic city names
-                                if city_name_ar and city_name_ar in content_lower:
-                                    print(f"🏙️ QueryAgent: Found normalized city in history '{city['name']}'")
-                                    print(f"   Original: '{city.get('name', '')}' -> Normalized: '{city_name_ar}'")
-                                    print(f"   History content normalized: '{normalized_content}'")
-                                    
-                                    # Verify extraction with ChatGPT
-                                    is_verified = await self._verify_city_extraction(
-                                        user_message, conversation_history, 
-                                        city['name'], "تاريخ المحادثة"
-                                    )
-                                    
-                                    if is_verified:
-                                        return self._create_city_result(city, "conversation_history_city", user_language)
-                                # Fallback: Check English city name
-                                elif city_name_en and city_name_en in content.lower():
-                                    print(f"🏙️ QueryAgent: Found English city in history '{city['name']}'")
-                                    
-                                    # Verify extraction with ChatGPT
-                                    is_verified = await self._verify_city_extraction(
-                                        user_message, conversation_history, 
-                                        city['name'], "تاريخ المحادثة"
-                                    )
-                                    
-                                    if is_verified:
-                                        return self._create_city_result(city, "conversation_history_city", user_language)
-                
-                # PRIORITY 4: Check for district in conversation history - COMMENTED OUT
-                # if conversation_history:
-                #     for message in reversed(conversation_history[-5:]):  # Check last 5 messages
-                #         content = message.get("content", "")
-                #         
-                #         district_match = district_lookup.find_district_in_message(content, db)
-                #         if district_match:
-                #             district_name = district_match['district']
-                #             city_name = district_match['city']
-                #             
-                #             print(f"🏘️ QueryAgent: Found district in history '{district_name}' -> city '{city_name}'")
-                #             
-                #             # Verify district extraction with ChatGPT
-                #             is_verified = await self._verify_city_extraction(
-                #                 user_message, conversation_history, 
-                #                 district_name, "تاريخ المحادثة (حي)"
-                #             )
-                #             
-                #             if is_verified:
-                #                 # Find the city details in our cities list (normalize for comparison)
-                #                 normalized_district_city = district_lookup.normalize_city_name(city_name)
-                #                 for city in all_cities:
-                #                     system_city_name = city.get("name", "").strip()
-                #                     normalized_system_city = district_lookup.normalize_city_name(system_city_name)
-                #                     
-                #                     if normalized_system_city == normalized_district_city:
-                #                         print(f"🎯 QueryAgent: District-to-City mapping from history:")
-                #                         print(f"   📍 District: '{district_name}' (user is from this district)")
-                #                         print(f"   🏙️ Business City: '{city['name']}' (ID: {city['id']}) - THIS will be used for brands/products")
-                #                         return {
-                #                             "city_id": city["id"],
-                #                             "city_name": city["name"],  # ← CITY name - used for business logic
-                #                             "city_name_en": city["name_en"],
-                #                             "found_in": "conversation_history_district",
-                #                             "district_name": district_name  # ← DISTRICT name - context only
-                #                         }
-
-                return None
-            finally:
-                db.close()
+                                print(f"🏙️ QueryAgent: Found English city in history '{city['name']}'")
+                                
+                                candidates.append({"item": city, "name": city['name'], "source": "تاريخ المحادثة", "found_in": "conversation_history_city"})
+            
+            # PRIORITY 4: Check for district in conversation history - COMMENTED OUT
+            # if conversation_history:
+            #     for message in reversed(conversation_history[-5:]):  # Check last 5 messages
+            #         content = message.get("content", "")
+            #         
+            #         district_match = district_lookup.find_district_in_message(content, db)
+            #         if district_match:
+            #             district_name = district_match['district']
+            #             city_name = district_match['city']
+            #             
+            #             print(f"🏘️ QueryAgent: Found district in history '{district_name}' -> city '{city_name}'")
+            #             
+            #             # Verify district extraction with ChatGPT
+            #             is_verified = await self._verify_city_extraction(
+            #                 user_message, conversation_history, 
+            #                 district_name, "تاريخ المحادثة (حي)"
+            #             )
+            #             
+            #             if is_verified:
+            #                 # Find the city details in our cities list (normalize for comparison)
+            #                 normalized_district_city = district_lookup.normalize_city_name(city_name)
+            #                 for city in all_cities:
+            #                     system_city_name = city.get("name", "").strip()
+            #                     normalized_system_city = district_lookup.normalize_city_name(system_city_name)
+            #                     
+            #                     if normalized_system_city == normalized_district_city:
+            #                         print(f"🎯 QueryAgent: District-to-City mapping from history:")
+            #                         print(f"   📍 District: '{district_name}' (user is from this district)")
+            #                         print(f"   🏙️ Business City: '{city['name']}' (ID: {city['id']}) - THIS will be used for brands/products")
+            #                         return {
+            #                             "city_id": city["id"],
+            #                             "city_name": city["name"],  # ← CITY name - used for business logic
+            #                             "city_name_en": city["name_en"],
+            #                             "found_in": "conversation_history_district",
+            #                             "district_name": district_name  # ← DISTRICT name - context only
+            #                         }
+
+            chosen = await self._resolve_with_memory("city", candidates, user_message, conversation_history, confirmed_mentions, session_context, memory)
+            if chosen:
+                result = self._create_city_result(chosen["item"], chosen["found_in"], user_language)
+                if chosen.get("district_name"):
+                    result["district_name"] = chosen["district_name"]
+                return result
+            return None
         except Exception as e:
             logger.error(f"Error extracting city from context: {str(e)}")
             return None
@@ -898,14 +1103,21 @@ class QueryAgent:
             if "مطابقة تامة" in extraction_source or "exact match" in extraction_source.lower():
                 system_prompt += " ملحوظة خاصة: هذا استخراج بمطابقة تامة، لذا كن أكثر مرونة في قبول الذكر الصريح للعلامة."
             
-            # Call LangChain for verification
-            response = await self._call_langchain_llm(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": verification_prompt}
-                ],
-                temperature=0.1,
-                max_tokens=20
+            # Call LangChain for verification (memoized per message + history window)
+            response = await llm_decision_cache.get_or_compute(
+                "brand_verification",
+                DECISION_PROMPT_VERSIONS["brand_verification"],
+                user_message,
+                lambda: self._call_langchain_llm(
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": verification_prompt}
+                    ],
+                    temperature=0.1,
+                    max_tokens=20
+                ),
+                history=(conversation_history or [])[-7:],
+                extra=[extracted_brand, extraction_source]
             )
             
             verification_result = response["content"].strip().lower()
@@ -941,7 +1153,7 @@ class QueryAgent:
             "found_in": found_in
         }
 
-    async def _extract_brand_from_context(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar') -> Optional[Dict[str, Any]]:
+    async def _extract_brand_from_context(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar', confirmed_mentions: Optional[List[str]] = None, session_context: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """Extract brand information from current message and conversation history with AI verification and improved matching
         
         🔍 GENERAL EXTRACTION: Always extracts brands from ALL brands database (not city-specific)
@@ -951,6 +1163,7 @@ class QueryAgent:
         IMPORTANT: Removes water prefixes like مياه, موية, مياة before brand names
         ENHANCED: Searches for identical brand after normalizing, then partial matching
         Priority: 1) Brand in current message (exact → partial), 2) Brand in conversation history (last 5 messages)
+        With session_context, only history messages newer than the last scan are searched and a settled brand is reused
         
         Returns: Brand info with needs_city_check=True (LLM must always verify city availability)
         """
@@ -964,120 +1177,90 @@ class QueryAgent:
             return None
             
         try:
-            db = self._get_db_session()
-            try:
-                # Always get all brands - let LLM verify city availability later
-                brands = data_api.get_all_brands(db)
-                needs_city_check = True   # LLM must always verify brand availability in target city
-                
-                # PRIORITY 1: Check current user message first - EXACT MATCH
-                if user_message:
-                    # Track already verified brands to avoid duplicate verification
-                    current_msg_verified_brands = set()
+            # Brand titles come from the gazetteer (all brands) - let LLM verify city availability later
+            memory = self._entity_memory(session_context, "brand")
+            needs_city_check = True   # LLM must always verify brand availability in target city
+            # Substring matches in priority order - verified together at the end
+            candidates = []
+            
+            # PRIORITY 1: Check current user message first - EXACT MATCH
+            if user_message:
+                # Track already verified brands to avoid duplicate verification
+                current_msg_verified_brands = set()
+                
+                # Clean the user message by removing water prefixes
+                current_content = self._clean_brand_name(user_message)
+                
+                # First try exact matching after normalization
+                for brand in entity_gazetteer.brands_titled(current_content):
+                    print(f"🎯 Brand exact match found:")
+                    print(f"   Original brand: '{brand.get('title', '')}'")
+                    print(f"   User message cleaned: '{current_content}'")
+                    print(f"   City verification needed: YES (always required)")
                     
-                    # Clean the user message by removing water prefixes
-                    cleaned_message = self._clean_brand_name(user_message)
-                    current_content = cleaned_message.lower()
+                    # Add to verified set to avoid duplicate verification
+                    current_msg_verified_brands.add(brand["title"])
                     
-                    # First try exact matching after normalization
-                    for brand in brands:
-                        # Normalize brand title for better matching
-                        brand_title_normalized = self._clean_brand_name(brand.get("title", "")).lower().strip()
-                        
-                        if brand_title_normalized and brand_title_normalized == current_content:
-                            print(f"🎯 Brand exact match found:")
-                            print(f"   Original brand: '{brand.get('title', '')}'")
-                            print(f"   Normalized brand: '{brand_title_normalized}'")
-                            print(f"   User message cleaned: '{current_content}'")
-                            print(f"   City verification needed: YES (always required)")
-                            
-                            # Add to verified set to avoid duplicate verification
-                            current_msg_verified_brands.add(brand["title"])
-                            
-                            # Verify extraction with ChatGPT
-                            is_verified = await self._verify_brand_extraction(
-                                user_message, conversation_history,
-                                brand["title"], "الرسالة الحالية (مطابقة تامة)"
-                            )
-                            
-                            if is_verified:
-                                result = self._create_brand_result(brand, "current_message", user_language)
-                                result["needs_city_check"] = needs_city_check
-                                return result
+                    candidates.append({"item": brand, "name": brand["title"], "source": "الرسالة الحالية (مطابقة تامة)", "found_in": "current_message"})
+                
+                # If no exact match, try partial matching: brand title inside the message
+                # (gazetteer pass), or the message inside a brand title (e.g. "نق")
+                for brand in entity_gazetteer.brands_partial(current_content):
+                    # Skip if we already verified this brand in exact match
+                    if brand["title"] in current_msg_verified_brands:
+                        continue
                     
-                    # If no exact match, try partial matching
-                    for brand in brands:
-                        # Skip if we already verified this brand in exact match
+                    print(f"🔍 Brand partial match found:")
+                    print(f"   Original brand: '{brand.get('title', '')}'")
+                    print(f"   User message cleaned: '{current_content}'")
+                    print(f"   City verification needed: YES (always required)")
+                    
+                    # Add to verified set to avoid duplicate verification
+                    current_msg_verified_brands.add(brand["title"])
+                    
+                    candidates.append({"item": brand, "name": brand["title"], "source": "الرسالة الحالية (مطابقة جزئية)", "found_in": "current_message"})
+                
+                # No exact or partial match: try misspelled brand names ("نستلي") - verified like the others
+                if not candidates:
+                    for match in entity_gazetteer.fuzzy_mentions("brand", current_content):
+                        brand = match["item"]
                         if brand["title"] in current_msg_verified_brands:
                             continue
-                            
-                        # Normalize brand title for better matching
-                        brand_title_normalized = self._clean_brand_name(brand.get("title", "")).lower()
-                        
-                        if brand_title_normalized and (brand_title_normalized in current_content or current_content in brand_title_normalized):
-                            print(f"🔍 Brand partial match found:")
-                            print(f"   Original brand: '{brand.get('title', '')}'")
-                            print(f"   Normalized brand: '{brand_title_normalized}'")
-                            print(f"   User message cleaned: '{current_content}'")
-                            print(f"   City verification needed: YES (always required)")
-                            
-                            # Add to verified set to avoid duplicate verification
-                            current_msg_verified_brands.add(brand["title"])
-                            
-                            # Verify extraction with ChatGPT
-                            is_verified = await self._verify_brand_extraction(
-                                user_message, conversation_history,
-                                brand["title"], "الرسالة الحالية (مطابقة جزئية)"
-                            )
-                            
-                            if is_verified:
-                                result = self._create_brand_result(brand, "current_message", user_language)
-                                result["needs_city_check"] = needs_city_check
-                                return result
-                
-                # PRIORITY 2: Check conversation history if no brand in current message
-                if conversation_history:
-                    # Track already verified brands to avoid duplicate verification
-                    verified_brands = set()
+                        print(f"🔍 Brand fuzzy match '{brand['title']}' for '{match['phrase']}' (score {match['score']})")
+                        current_msg_verified_brands.add(brand["title"])
+                        candidates.append({"item": brand, "name": brand["title"], "source": "الرسالة الحالية (مطابقة تقريبية)", "found_in": "current_message"})
+            
+            # PRIORITY 2: Check conversation history if no brand in current message
+            if conversation_history:
+                # Track already verified brands to avoid duplicate verification
+                verified_brands = set()
+                
+                for message in reversed(self._history_to_scan(conversation_history, memory)):  # Check last 7 (unscanned) messages
+                    content = message.get("content", "")
+                    # Normalize conversation history content for better brand matching
+                    normalized_content = self._clean_brand_name(content)
                     
-                    for message in reversed(conversation_history[-7:]):  # Check last 7 messages
-                        content = message.get("content", "")
-                        # Normalize conversation history content for better brand matching
-                        normalized_content = self._clean_brand_name(content).lower()
+                    for brand, _ in entity_gazetteer.entities_in(normalized_content, "brand"):
+                        # Skip if we already verified this brand
+                        if brand["title"] in verified_brands:
+                            continue
                         
-                        # First try exact matching with normalized content
-                        for brand in brands:
-                            # Normalize brand title for better matching
-                            brand_title_normalized = self._clean_brand_name(brand.get("title", "")).lower().strip()
-                            
-                            # Skip if we already verified this brand
-                            if brand["title"] in verified_brands:
-                                continue
-                            
-                            if brand_title_normalized and brand_title_normalized in normalized_content:
-                                print(f"🔍 Brand found in conversation history:")
-                                print(f"   Original brand: '{brand.get('title', '')}'")
-                                print(f"   Normalized brand: '{brand_title_normalized}'")
-                                print(f"   History content normalized: '{normalized_content}'")
-                                print(f"   City verification needed: YES (always required)")
-                                
-                                # Add to verified set to avoid duplicate verification
-                                verified_brands.add(brand["title"])
-                                
-                                # Verify extraction with ChatGPT
-                                is_verified = await self._verify_brand_extraction(
-                                    user_message, conversation_history,
-                                    brand["title"], "تاريخ المحادثة"
-                                )
-                                
-                                if is_verified:
-                                    result = self._create_brand_result(brand, "conversation_history", user_language)
-                                    result["needs_city_check"] = needs_city_check
-                                    return result
-                
-                return None
-            finally:
-                db.close()
+                        print(f"🔍 Brand found in conversation history:")
+                        print(f"   Original brand: '{brand.get('title', '')}'")
+                        print(f"   History content normalized: '{normalized_content}'")
+                        print(f"   City verification needed: YES (always required)")
+                        
+                        # Add to verified set to avoid duplicate verification
+                        verified_brands.add(brand["title"])
+                        
+                        candidates.append({"item": brand, "name": brand["title"], "source": "تاريخ المحادثة", "found_in": "conversation_history"})
+            
+            chosen = await self._resolve_with_memory("brand", candidates, user_message, conversation_history, confirmed_mentions, session_context, memory)
+            if chosen:
+                result = self._create_brand_result(chosen["item"], chosen["found_in"], user_language)
+                result["needs_city_check"] = needs_city_check
+                return result
+            return None
         except Exception as e:
             logger.error(f"Error extracting brand from context: {str(e)}")
             return None
@@ -1515,14 +1698,22 @@ Current message to classify: "{user_message}"
                 print(f"🏷️ Brand context: {brand_context.get('brand_title') if brand_context else 'None'}")
                 print(f"📝 Context enhancement preview: {context_enhancement[:100]}...")
             
-            # Call LangChain for classification (will be traced in LangSmith)
-            response = await self._call_langchain_llm(
-                messages=[
-                    {"role": "system", "content": enhanced_classification_prompt},
-                    {"role": "user", "content": full_user_message}
-                ],
-                temperature=0.1,  # Low temperature for consistent classification
-                max_tokens=10  # Short response expected
+            # Call LangChain for classification (will be traced in LangSmith) - memoized,
+            # since the same message in the same conversation state always classifies the same
+            response = await llm_decision_cache.get_or_compute(
+                "relevance",
+                DECISION_PROMPT_VERSIONS["relevance"],
+                user_message,
+                lambda: self._call_langchain_llm(
+                    messages=[
+                        {"role": "system", "content": enhanced_classification_prompt},
+                        {"role": "user", "content": full_user_message}
+                    ],
+                    temperature=0.1,  # Low temperature for consistent classification
+                    max_tokens=10  # Short response expected
+                ),
+                history=(conversation_history or [])[-7:],
+                extra=[user_language, context_enhancement]
             )
             
             classification_result = response["content"].strip().lower()
@@ -2133,10 +2324,15 @@ Output in JSON format only:
             # Default to appropriate on error to avoid blocking responses
             return {"is_appropriate": True, "reason": f"Validation error: {str(e)}", "confidence": 0.5}
 
-    async def process_query(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar', journey_id: str = None) -> str:
+    async def process_query(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar', journey_id: str = None, triage: Optional[Dict[str, Any]] = None, session_context: Optional[Dict[str, Any]] = None) -> str:
         """
         Process user query using OpenAI with function calling capabilities with response validation and retry logic
         Enhanced with 2-attempt response validation to ensure appropriate responses
+        
+        Args:
+            triage: Result of triage_agent.triage() - reuses its relevance verdict and city/brand mentions
+            session_context: The decoded UserSession.context dict - the resolved city/brand are read from
+                             and written back to its "entities" key (the caller saves it)
         """
         print(f"Processing query: {user_message} (Language: {user_language})")
         
@@ -2147,8 +2343,9 @@ Output in JSON format only:
 
             
             try:
-                # Generate response using internal method
-                response_result = await self._generate_response_internal(user_message, conversation_history, user_language, journey_id)
+                # Generate response using internal method - reply_info says how the reply was produced
+                reply_info = {}
+                response_result = await self._generate_response_internal(user_message, conversation_history, user_language, journey_id, triage, session_context, reply_info)
                 if isinstance(response_result, tuple):
                     response, city_context, brand_context = response_result
                 else:
@@ -2165,8 +2362,33 @@ Output in JSON format only:
                         # This ensures no response is sent to customer and human agent can handle
                         return ""
                 
+                # Validation policy: replies rendered from catalog tool results skip the validation call
+                policy_decision = validation_policy.decide(
+                    reply_info.get("source", "error"),
+                    reply_info.get("relevance_confidence", 0.0),
+                    reply_info.get("tools"),
+                    reply_info.get("tool_failures", 0)
+                )
+                if LOGGING_AVAILABLE and journey_id:
+                    message_journey_logger.add_step(
+                        journey_id=journey_id,
+                        step_type="validation_policy",
+                        description=f"Validation {'required' if policy_decision['validate'] else 'skipped'}: {policy_decision['reason']}",
+                        data={
+                            **policy_decision,
+                            "reply_source": reply_info.get("source", "error"),
+                            "relevance_confidence": reply_info.get("relevance_confidence", 0.0),
+                            "tools": reply_info.get("tools", []),
+                            "estimated_saved_ms": 0 if policy_decision['validate'] else validation_policy.average_validation_ms()
+                        },
+                        status="completed" if policy_decision['validate'] else "skipped"
+                    )
+                if not policy_decision['validate']:
+                    print(f"⏭️ Validation skipped ({policy_decision['reason']}) → {response[:100]}...")
+                    return response
+                
                 # Validate response appropriateness
-
+                validation_start_time = time.time()
                 validation_result = await self._validate_response_appropriateness(
                     user_message=user_message,
                     generated_response=response,
@@ -2175,6 +2397,11 @@ Output in JSON format only:
                     city_context=city_context,
                     brand_context=brand_context
                 )
+                validation_policy.record_validation(
+                    policy_decision,
+                    int((time.time() - validation_start_time) * 1000),
+                    validation_result['is_appropriate']
+                )
                 
                 # Log validation result to message journey
                 if LOGGING_AVAILABLE and journey_id:
@@ -2187,6 +2414,7 @@ Output in JSON format only:
                             "reason": validation_result['reason'],
                             "confidence": validation_result['confidence'],
                             "attempt_number": attempt,
+                            "policy_reason": policy_decision['reason'],
                             "user_message_length": len(user_message),
                             "response_length": len(response),
                             "agent_reply": response,
@@ -2223,37 +2451,190 @@ Output in JSON format only:
                     error_msg = "عذراً، حدث خطأ في معالجة الاستعلام. الرجاء المحاولة مرة أخرى." if user_language == 'ar' else "Sorry, there was an error processing the query. Please try again."
                     return error_msg
 
-    async def _generate_response_internal(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar', journey_id: str = None) -> tuple:
+    async def _execute_tool_call(self, tool_call_id: str, function_name: str, function_args: Dict[str, Any],
+                                 turn_tool_results: Dict[tuple, tuple], journey_id: str = None) -> str:
+        """Run one requested tool off the event loop and return the tool message content
+        
+        Tools are blocking DB lookups, so each runs in a worker thread and the calls of one
+        response overlap. A call repeating one already made this turn (same function and
+        arguments) waits for the first result and only points back at it.
         """
-        Internal method for generating response (separated for retry logic)
-        Returns tuple of (response, city_context, brand_context)
+        key = (function_name, json.dumps(function_args, sort_keys=True, ensure_ascii=False))
+        previous = turn_tool_results.get(key)
+        if previous is not None:
+            first_call_id, task = previous
+            await asyncio.wait([task])
+            chatbot_metrics.observe_tool_call(function_name, "deduplicated")
+            print(f"♻️ Tool call {function_name}({function_args}) repeats {first_call_id} - reusing its result")
+            return json.dumps({"same_result_as_tool_call": first_call_id}, ensure_ascii=False)
+        
+        task = asyncio.ensure_future(asyncio.to_thread(self.available_functions[function_name], **function_args))
+        turn_tool_results[key] = (tool_call_id, task)
+        
+        # Record function call start time for duration measurement
+        func_start_time = time.time()
+        try:
+            function_result = await task
+        except Exception as func_error:
+            func_duration = int((time.time() - func_start_time) * 1000)
+            logger.error(f"Function {function_name} failed: {str(func_error)}")
+            chatbot_metrics.observe_tool_call(function_name, "failed")
+            
+            # Log the function error in detail
+            if LOGGING_AVAILABLE and journey_id:
+                message_journey_logger.log_function_call(
+                    journey_id=journey_id,
+                    function_name=function_name,
+                    function_args=function_args,
+                    function_result=None,
+                    duration_ms=func_duration,
+                    status="failed",
+                    error=str(func_error)
+                )
+            return tool_result_serializer.serialize(function_name, {"error": f"Function failed: {str(func_error)}"})
+        
+        func_duration = int((time.time() - func_start_time) * 1000)
+        chatbot_metrics.observe_tool_call(function_name, "completed")
+        
+        # Log the function call and response in detail
+        if LOGGING_AVAILABLE and journey_id:
+            message_journey_logger.log_function_call(
+                journey_id=journey_id,
+                function_name=function_name,
+                function_args=function_args,
+                function_result=function_result,
+                duration_ms=func_duration,
+                status="completed"
+            )
+        
+        logger.info(f"Function {function_name} completed successfully")
+        print(f"✅ Function Response: {function_name} → {type(function_result).__name__} (success: {function_result.get('success', 'N/A') if isinstance(function_result, dict) else 'N/A'})")
+        # Only the fields the model needs, as compact text (see utils.tool_result_serializer)
+        return tool_result_serializer.serialize(function_name, function_result)
+    
+    def _log_prompt_tokens(self, prompt: PromptBuilder, messages: List[Dict], stage: str, journey_id: str = None):
+        """Record prompt tokens of one LLM call stage (metrics, console and message journey)"""
+        try:
+            report = prompt.observe(stage, messages)
+        except Exception as e:
+            logger.error(f"Prompt token accounting failed: {str(e)}")
+            return
+        print(f"🧮 Prompt [{stage}]: {report['total_tokens']} tokens (static {report['static_tokens']}, "
+              f"history {report['sections']['history']}, tools {report['sections']['tool_results']}, budget {report['budget_tokens']})")
+        if LOGGING_AVAILABLE and journey_id:
+            message_journey_logger.add_step(
+                journey_id=journey_id,
+                step_type="prompt_assembly",
+                description=f"{stage} prompt: {report['total_tokens']} tokens",
+                data={"stage": stage, **report}
+            )
+    
+    def _relevance_confidence(self, triage: Optional[Dict[str, Any]], city_context: Dict = None, brand_context: Dict = None) -> float:
+        """Confidence behind a "relevant" verdict - an extracted city or brand backs it up"""
+        # The speculative relevance check runs without the extracted city/brand hints
+        confidence = 0.6 if triage is None and self.extraction_mode == "speculative" else 0.7
+        if city_context:
+            confidence += 0.15
+        if brand_context:
+            confidence += 0.15
+        return round(min(confidence, 1.0), 2)
+    
+    @staticmethod
+    def _tool_messages_as_text(messages: List[Dict]) -> List[Dict]:
+        """Fold tool calls/results into plain assistant text for the LangChain final-answer call"""
+        tool_names = {}
+        text_messages = []
+        for msg in messages:
+            if msg.get("tool_calls"):
+                for tool_call in msg["tool_calls"]:
+                    tool_names[tool_call["id"]] = tool_call["function"]["name"]
+                if msg.get("content"):
+                    text_messages.append({"role": "assistant", "content": msg["content"]})
+            elif msg.get("role") == "tool":
+                name = tool_names.get(msg.get("tool_call_id"), "tool")
+                text_messages.append({"role": "assistant", "content": f"[{name} result] {msg['content']}"})
+            else:
+                text_messages.append(msg)
+        return text_messages
+    
+    async def _extract_contexts_and_check_relevance(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar', triage: Optional[Dict[str, Any]] = None, session_context: Optional[Dict[str, Any]] = None) -> tuple:
+        """
+        Extract city/brand contexts and classify relevance.
+        Returns tuple of (is_relevant, city_context, brand_context)
+        
+        With a triage result, its relevance verdict and city/brand mentions replace the
+        relevance and verification calls - only the database matching runs here.
+        
+        Modes (QUERY_AGENT_EXTRACTION_MODE):
+        - sequential:  city, then brand, then context-aware relevance
+        - concurrent:  city and brand together, then context-aware relevance (same results as sequential)
+        - speculative: city, brand and a context-free relevance check all at once; a "not relevant"
+                       verdict cancels the extraction. Saves the relevance round-trip, but the
+                       classifier no longer sees the extracted city/brand hints
         """
-        # STEP 0: Extract city and brand contexts first for enhanced relevance classification
+        # Both extraction tasks copy this context and share the dict
+        verification_budget.set({"remaining": self.max_verification_candidates})
+        
+        if triage is not None:
+            if not triage["is_relevant"]:
+                print("🧭 Triage: not relevant - skipping context extraction")
+                return False, None, None
+            contexts = await asyncio.gather(
+                self._extract_city_from_context(user_message, conversation_history, user_language, triage["city_mentions"], session_context),
+                self._extract_brand_from_context(user_message, conversation_history, user_language, triage["brand_mentions"], session_context),
+                return_exceptions=True
+            )
+            for context in contexts:
+                if isinstance(context, Exception):
+                    print(f"⚠️ Error extracting context: {str(context)}")
+            city_context, brand_context = [None if isinstance(context, Exception) else context for context in contexts]
+            return True, city_context, brand_context
+        
         print("🔍 Extracting context information...")
         
+        city_task = asyncio.create_task(self._extract_city_from_context(user_message, conversation_history, user_language, session_context=session_context))
+        extraction_tasks = [city_task]
         try:
-            # Check if we already have city information from current message or conversation history
-            city_context = await self._extract_city_from_context(user_message, conversation_history, user_language)
-            
-            # Check if we have brand information
-            brand_context = await self._extract_brand_from_context(
-                user_message, 
-                conversation_history, 
-                user_language  # ← Pass language parameter
-            )
+            if self.extraction_mode == "sequential":
+                await asyncio.wait([city_task])
+            brand_task = asyncio.create_task(self._extract_brand_from_context(user_message, conversation_history, user_language, session_context=session_context))
+            extraction_tasks.append(brand_task)
             
-            # Log extracted contexts
-            if city_context:
-                print(f"🏙️ City context extracted: {city_context.get('city_name')} from {city_context.get('found_in')}")
-            if brand_context:
-                print(f"🏷️ Brand context extracted: {brand_context.get('brand_title')} from {brand_context.get('found_in')}")
-                
-        except Exception as e:
-            print(f"⚠️ Error extracting contexts: {str(e)}")
-            city_context = None
-            brand_context = None
+            if self.extraction_mode == "speculative":
+                print("🔍 Checking message relevance speculatively...")
+                # Extraction keeps running while we wait - it is only thrown away on "not relevant"
+                if not await self._classify_message_relevance(user_message, conversation_history, user_language):
+                    print("⚡ Speculative relevance: not relevant - cancelled context extraction")
+                    return False, None, None
+            
+            await asyncio.gather(*extraction_tasks, return_exceptions=True)
+        finally:
+            # Early "not relevant" or the caller timed out (process_query retries) - stop pending LLM calls
+            for task in extraction_tasks:
+                if not task.done():
+                    task.cancel()
         
-        # STEP 1: Check if message is relevant to water delivery services (enhanced with context)
+        city_context = None
+        brand_context = None
+        if city_task.exception():
+            print(f"⚠️ Error extracting city context: {str(city_task.exception())}")
+        else:
+            city_context = city_task.result()
+        if brand_task.exception():
+            print(f"⚠️ Error extracting brand context: {str(brand_task.exception())}")
+        else:
+            brand_context = brand_task.result()
+        
+        # Log extracted contexts
+        if city_context:
+            print(f"🏙️ City context extracted: {city_context.get('city_name')} from {city_context.get('found_in')}")
+        if brand_context:
+            print(f"🏷️ Brand context extracted: {brand_context.get('brand_title')} from {brand_context.get('found_in')}")
+        
+        if self.extraction_mode == "speculative":
+            return True, city_context, brand_context
+        
+        # Check if message is relevant to water delivery services (enhanced with context)
         print("🔍 Checking message relevance with context...")
         is_relevant = await self._classify_message_relevance(
             user_message, 
@@ -2262,48 +2643,12 @@ Output in JSON format only:
             city_context, 
             brand_context
         )
-        
-        if not is_relevant:
-            print(f"❌ Message not relevant to water delivery services: {user_message}...")
-            # Return None or empty string to indicate the agent should not reply
-            return ("", None, None)
-        
-        print("✅ Message is relevant to water delivery services")
-
-        # STEP 2: Check if this is a "yes" response to a previous product question
-        if self._check_for_yes_response(user_message, conversation_history):
-            print("✅ Detected 'yes' response - handling product confirmation")
-        
-        max_function_calls = 5
-        function_call_count = 0
-        
-        try:
-            
-            # Prepare conversation history
-            messages = []
-            
-            # System message with instructions based on user language
-            city_info = ""
-            brand_info = ""
-            
-            if city_context:
-                if 'district' in city_context.get('found_in', ''):
-                    found_where = "current message district" if 'current_message_district' in city_context['found_in'] else "conversation history district"
-                    district_name = city_context.get('district_name', 'unknown district')
-                    city_info = f"\n\nIMPORTANT CONTEXT: The customer mentioned {district_name} district which maps to {city_context['city_name_en']} ({city_context['city_name']}) - detected from {found_where}. Use the CITY name ({city_context['city_name']}) for all brand/product searches, but you can acknowledge their district for context. 🚨 MANDATORY: Since you know the city, immediately call get_brands_by_city_name('{city_context['city_name']}') to show available brands."
-                else:
-                    found_where = "current message" if city_context['found_in'] == "current_message" else "conversation history"
-                    city_info = f"\n\nIMPORTANT CONTEXT: The customer is from {city_context['city_name_en']} ({city_context['city_name']}) - detected from {found_where}. You already know their city, so you can show products and brands for this city without asking again. 🚨 MANDATORY: Since you know the city, immediately call get_brands_by_city_name('{city_context['city_name']}') to show available brands."
-            
-            if brand_context:
-                found_where = "current message" if brand_context['found_in'] == "current_message" else "conversation history"
-                
-                brand_info = f"\n\nBRAND CONTEXT: The customer mentioned '{brand_context['brand_title']}' - detected from {found_where}. 🔍 EXTRACTION TYPE: GENERAL (from ALL brands database - NOT city-specific). ⚠️ MANDATORY VERIFICATION: This brand may or may not be available in the target city. You MUST first call get_brands_by_city_name('city_name') to verify if '{brand_context['brand_title']}' exists in that city's brand list, then show products only if confirmed available."
-            
-            if user_language == 'en':
-                system_message = {
-                    "role": "system",
-                    "content": f"""You are a friendly customer service employee at Abar Water Delivery Company in Saudi Arabia.{city_info}{brand_info}
+        return is_relevant, city_context, brand_context
+    
+    def _static_system_prompt(self, user_language: str) -> str:
+        """Inquiry instructions - identical for every call in a language, so providers can cache the prompt prefix"""
+        if user_language == 'en':
+            return """You are a friendly customer service employee at Abar Water Delivery Company in Saudi Arabia.
 
                     📋 Important terminology for understanding Arabic customers (for understanding only - don't mention to customers):
                     - "قوارير المياه" = "الجوالين" (same product - water gallons)
@@ -2625,44 +2970,8 @@ Output in JSON format only:
                     - Ensure you display product name, size, and price for each product
 
                     Be helpful, understanding, and respond exactly like a friendly human employee would."""
-                                    }
-
-                    
-                # Check user message and conversation history for size-related keywords (English)
-                all_conversation_text = user_message
-                if conversation_history:
-                    for msg in conversation_history[-7:]:  # Check last 7 messages
-                        all_conversation_text += " " + msg.get("content", "")
-                
-                if "quarter" in all_conversation_text or "half" in all_conversation_text or "riyal" in all_conversation_text:
-                    system_message["content"] += "\n\nAdditional info: Quarter size = 200ml or 250ml, Half size = 330ml or 300ml, Riyal size = 600ml or 550ml, Two Riyal size = 1.5L"
-                if "groundwater" in all_conversation_text or "artesian" in all_conversation_text:
-                    system_message["content"] += (
-                        "\n\nAdditional info: Groundwater/artesian water brands include: "
-                        "Nova, Naqi, Berrin, Mawared, B, Vio, Miles, Aquaya, Aqua 8, Mana, Tania, Abar Hail, Oska, Nestle, Ava, Hena, Saqya Al Madina, Deman, Hani, Sahtak, Halwa, Athb, Aus, Qataf, Rest, Eval, We."
-                    )
-
-            else:
-                city_info_ar = ""
-                brand_info_ar = ""
-                
-                if city_context:
-                    if 'district' in city_context.get('found_in', ''):
-                        found_where_ar = "الرسالة الحالية (حي)" if 'current_message_district' in city_context['found_in'] else "تاريخ المحادثة (حي)"
-                        district_name = city_context.get('district_name', 'حي غير معروف')
-                        city_info_ar = f"\n\nسياق مهم: العميل ذكر حي {district_name} والذي يربط بمدينة {city_context['city_name']} ({city_context['city_name_en']}) - تم اكتشافه من {found_where_ar}. استخدم اسم المدينة ({city_context['city_name']}) لجميع عمليات البحث عن العلامات التجارية/المنتجات، ولكن يمكنك الاعتراف بحيهم للسياق. 🚨 إجباري: بما أنك تعرف المدينة، استدعي فوراً get_brands_by_city_name('{city_context['city_name']}') لعرض العلامات التجارية المتاحة."
-                    else:
-                        found_where_ar = "الرسالة الحالية" if city_context['found_in'] == "current_message" else "تاريخ المحادثة"
-                        city_info_ar = f"\n\nسياق مهم: العميل من {city_context['city_name']} ({city_context['city_name_en']}) - تم اكتشافها من {found_where_ar}. أنت تعرف مدينتهم بالفعل، لذا يمكنك عرض المنتجات والعلامات التجارية لهذه المدينة بدون السؤال مرة أخرى. 🚨 إجباري: بما أنك تعرف المدينة، استدعي فوراً get_brands_by_city_name('{city_context['city_name']}') لعرض العلامات التجارية المتاحة."
-                
-                if brand_context:
-                    found_where_ar = "الرسالة الحالية" if brand_context['found_in'] == "current_message" else "تاريخ المحادثة"
-                    
-                    brand_info_ar = f"\n\nسياق العلامة التجارية: العميل ذكر '{brand_context['brand_title']}' - تم اكتشافها من {found_where_ar}. 🔍 نوع الاستخراج: عام (من قاعدة بيانات جميع العلامات التجارية - ليس خاص بمدينة). ⚠️ تحقق إجباري: هذه العلامة التجارية قد تكون متوفرة أو غير متوفرة في المدينة المستهدفة. يجب أولاً استدعاء get_brands_by_city_name('اسم_المدينة') للتحقق من وجود '{brand_context['brand_title']}' في قائمة علامات تلك المدينة، ثم عرض المنتجات فقط إذا تم تأكيد التوفر."
-                
-                system_message = {
-                    "role": "system",
-                    "content": f"""أنت موظف خدمة عملاء ودود في شركة أبار لتوصيل المياه في السعودية.{city_info_ar}{brand_info_ar}
+        
+        return """أنت موظف خدمة عملاء ودود في شركة أبار لتوصيل المياه في السعودية.
 
                     📋 معلومات مهمة لفهم المصطلحات (للفهم فقط - لا تذكرها للعميل):
 - قوارير المياه = الجوالين (نفس المنتج)
@@ -3064,201 +3373,239 @@ Output in JSON format only:
                     - "حلوة أو حلوه" و "هنا" هما علامات تجارية للمياه وليست كلمات عادية
                     - عند رؤية "حلوة" أو "هنا" اعتبرهما أسماء علامات تجارية
 """
-                }
+    
+    async def _generate_response_internal(self, user_message: str, conversation_history: List[Dict] = None, user_language: str = 'ar', journey_id: str = None, triage: Optional[Dict[str, Any]] = None, session_context: Optional[Dict[str, Any]] = None, reply_info: Optional[Dict[str, Any]] = None) -> tuple:
+        """
+        Internal method for generating response (separated for retry logic)
+        Returns tuple of (response, city_context, brand_context)
+        
+        reply_info (if given) is filled with the reply source (tool_grounded, llm_freeform,
+        max_round_trips - unset for error messages), the tools called, failed tool calls and
+        the relevance confidence, for the validation policy
+        """
+        if reply_info is None:
+            reply_info = {}
+        # STEP 0 + STEP 1: Extract city/brand contexts and check relevance (see QUERY_AGENT_EXTRACTION_MODE)
+        is_relevant, city_context, brand_context = await self._extract_contexts_and_check_relevance(
+            user_message, conversation_history, user_language, triage, session_context
+        )
+        
+        if not is_relevant:
+            print(f"❌ Message not relevant to water delivery services: {user_message}...")
+            # Return None or empty string to indicate the agent should not reply
+            return ("", None, None)
+        
+        print("✅ Message is relevant to water delivery services")
+        reply_info["relevance_confidence"] = self._relevance_confidence(triage, city_context, brand_context)
+
+        # STEP 2: Check if this is a "yes" response to a previous product question
+        if self._check_for_yes_response(user_message, conversation_history):
+            print("✅ Detected 'yes' response - handling product confirmation")
+        
+        round_trips = 0
+        function_call_count = 0
+        # (function name, arguments) -> first tool_call_id and its result task, for this turn only
+        turn_tool_results: Dict[tuple, tuple] = {}
+        
+        try:
+            
+            # Prompt layout: static instructions (cacheable prefix) -> history -> per-conversation context -> message
+            prompt = PromptBuilder(self.prompt_token_budget, model="gpt-4o-mini", max_tool_result_tokens=self.max_tool_result_tokens)
+            prompt.add_static("instructions", self._static_system_prompt(user_language))
+            
             # Check user message and conversation history for size-related keywords
             all_conversation_text = user_message
             if conversation_history:
                 for msg in conversation_history[-7:]:  # Check last 7 messages
                     all_conversation_text += " " + msg.get("content", "")
             
+            if user_language == 'en':
+                if "quarter" in all_conversation_text or "half" in all_conversation_text or "riyal" in all_conversation_text:
+                    prompt.add_static("size_terms", "Additional info: Quarter size = 200ml or 250ml, Half size = 330ml or 300ml, Riyal size = 600ml or 550ml, Two Riyal size = 1.5L")
+                if "groundwater" in all_conversation_text or "artesian" in all_conversation_text:
+                    prompt.add_static("groundwater_brands", (
+                        "Additional info: Groundwater/artesian water brands include: "
+                        "Nova, Naqi, Berrin, Mawared, B, Vio, Miles, Aquaya, Aqua 8, Mana, Tania, Abar Hail, Oska, Nestle, Ava, Hena, Saqya Al Madina, Deman, Hani, Sahtak, Halwa, Athb, Aus, Qataf, Rest, Eval, We."
+                    ))
+            
             # if "ربع" in all_conversation_text or "نص" in all_conversation_text or "ريال" in all_conversation_text or "ريالين" in all_conversation_text:
-            #     system_message["content"] = system_message["content"] + "\n\nمعلومات اضافية: ابو ربع هي المياه بحجم ٢٠٠ مل او ٢٥٠ مل ابو نص هي المياه بحجم  ٣٣٠ او ٣٠٠ مل ابو ريال  هي المياه بحجم  ٦٠٠ مل  او ٥٥٠ مل ابو ريالين هي المياه بحجم  ١.٥ لتر"
+            #     prompt.add_static("size_terms", "معلومات اضافية: ابو ربع هي المياه بحجم ٢٠٠ مل او ٢٥٠ مل ابو نص هي المياه بحجم  ٣٣٠ او ٣٠٠ مل ابو ريال  هي المياه بحجم  ٦٠٠ مل  او ٥٥٠ مل ابو ريالين هي المياه بحجم  ١.٥ لتر")
             
             if "ابار" in all_conversation_text or "جوفية" in all_conversation_text:
-                system_message["content"] += (
-                    "\n\nمعلومات إضافية: الآبار الجوفية هي المياه الجوفية المعدنية التي تُستخرج من الأرض وتحتوي على معادن ومواد طبيعية مختلفة."
+                prompt.add_static("groundwater_brands_ar", (
+                    "معلومات إضافية: الآبار الجوفية هي المياه الجوفية المعدنية التي تُستخرج من الأرض وتحتوي على معادن ومواد طبيعية مختلفة."
                     "\n\nوهذه هي العلامات التجارية التي تُعد من منتجات الآبار الجوفية:\n"
                     "نوفا، نقي، بيرين، موارد، بي، فيو، مايلز، أكويا، أكوا 8، مانا، تانيا، آبار حائل، أوسكا، نستله، آفا، هنا، سقيا المدينة، ديمان، هني، صحتك، حلوة، عذب، أوس، قطاف، رست، إيفال، وي."
-                )
-
-            messages.append(system_message)
+                ))
             
-            # Add conversation history if provided (use last 7 messages to keep context manageable)
-            if conversation_history:
-                # Filter and add recent conversation history
-                recent_history = conversation_history[-7:]  # Last 7 messages for better context
-                for msg in recent_history:
-                    # Create a clean message without problematic fields
-                    clean_msg = {
-                        "role": msg.get("role", "user"),
-                        "content": msg.get("content", "")
-                    }
-                    # Skip empty messages
-                    if clean_msg["content"].strip():
-                        messages.append(clean_msg)
+            # Extracted city/brand go after the history so they don't break the cached prefix
+            city_info = ""
+            brand_info = ""
+            
+            if user_language == 'en':
+                if city_context:
+                    if 'district' in city_context.get('found_in', ''):
+                        found_where = "current message district" if 'current_message_district' in city_context['found_in'] else "conversation history district"
+                        district_name = city_context.get('district_name', 'unknown district')
+                        city_info = f"IMPORTANT CONTEXT: The customer mentioned {district_name} district which maps to {city_context['city_name_en']} ({city_context['city_name']}) - detected from {found_where}. Use the CITY name ({city_context['city_name']}) for all brand/product searches, but you can acknowledge their district for context. 🚨 MANDATORY: Since you know the city, immediately call get_brands_by_city_name('{city_context['city_name']}') to show available brands."
+                    else:
+                        found_where = "current message" if city_context['found_in'] == "current_message" else "conversation history"
+                        city_info = f"IMPORTANT CONTEXT: The customer is from {city_context['city_name_en']} ({city_context['city_name']}) - detected from {found_where}. You already know their city, so you can show products and brands for this city without asking again. 🚨 MANDATORY: Since you know the city, immediately call get_brands_by_city_name('{city_context['city_name']}') to show available brands."
                 
-                print(f"📚 Added {len([m for m in recent_history if m.get('content', '').strip()])} messages from conversation history")
+                if brand_context:
+                    found_where = "current message" if brand_context['found_in'] == "current_message" else "conversation history"
+                    
+                    brand_info = f"BRAND CONTEXT: The customer mentioned '{brand_context['brand_title']}' - detected from {found_where}. 🔍 EXTRACTION TYPE: GENERAL (from ALL brands database - NOT city-specific). ⚠️ MANDATORY VERIFICATION: This brand may or may not be available in the target city. You MUST first call get_brands_by_city_name('city_name') to verify if '{brand_context['brand_title']}' exists in that city's brand list, then show products only if confirmed available."
+            else:
+                if city_context:
+                    if 'district' in city_context.get('found_in', ''):
+                        found_where_ar = "الرسالة الحالية (حي)" if 'current_message_district' in city_context['found_in'] else "تاريخ المحادثة (حي)"
+                        district_name = city_context.get('district_name', 'حي غير معروف')
+                        city_info = f"سياق مهم: العميل ذكر حي {district_name} والذي يربط بمدينة {city_context['city_name']} ({city_context['city_name_en']}) - تم اكتشافه من {found_where_ar}. استخدم اسم المدينة ({city_context['city_name']}) لجميع عمليات البحث عن العلامات التجارية/المنتجات، ولكن يمكنك الاعتراف بحيهم للسياق. 🚨 إجباري: بما أنك تعرف المدينة، استدعي فوراً get_brands_by_city_name('{city_context['city_name']}') لعرض العلامات التجارية المتاحة."
+                    else:
+                        found_where_ar = "الرسالة الحالية" if city_context['found_in'] == "current_message" else "تاريخ المحادثة"
+                        city_info = f"سياق مهم: العميل من {city_context['city_name']} ({city_context['city_name_en']}) - تم اكتشافها من {found_where_ar}. أنت تعرف مدينتهم بالفعل، لذا يمكنك عرض المنتجات والعلامات التجارية لهذه المدينة بدون السؤال مرة أخرى. 🚨 إجباري: بما أنك تعرف المدينة، استدعي فوراً get_brands_by_city_name('{city_context['city_name']}') لعرض العلامات التجارية المتاحة."
+                
+                if brand_context:
+                    found_where_ar = "الرسالة الحالية" if brand_context['found_in'] == "current_message" else "تاريخ المحادثة"
+                    
+                    brand_info = f"سياق العلامة التجارية: العميل ذكر '{brand_context['brand_title']}' - تم اكتشافها من {found_where_ar}. 🔍 نوع الاستخراج: عام (من قاعدة بيانات جميع العلامات التجارية - ليس خاص بمدينة). ⚠️ تحقق إجباري: هذه العلامة التجارية قد تكون متوفرة أو غير متوفرة في المدينة المستهدفة. يجب أولاً استدعاء get_brands_by_city_name('اسم_المدينة') للتحقق من وجود '{brand_context['brand_title']}' في قائمة علامات تلك المدينة، ثم عرض المنتجات فقط إذا تم تأكيد التوفر."
+            
+            prompt.add_dynamic("city_context", city_info)
+            prompt.add_dynamic("brand_context", brand_info)
             
-            # Add current user message
-            messages.append({"role": "user", "content": user_message})
+            # Last 7 history messages, trimmed oldest-first if the prompt exceeds its token budget
+            prompt.set_history((conversation_history or [])[-7:])
+            messages = prompt.build(user_message)
+            if conversation_history:
+                print(f"📚 Added {len(prompt.history)} messages from conversation history")
             
-            # Main function calling loop
-            while function_call_count < max_function_calls:
+            # Main tool calling loop - one LLM round-trip can request several tools at once
+            while round_trips < self.max_tool_round_trips:
                 try:
-                    # Make request to OpenAI with function calling
+                    # Make request to OpenAI with tool calling
                     api_start_time = time.time()
                     
                     # Log the LLM request
                     if LOGGING_AVAILABLE and journey_id:
-                        prompt_text = "\n".join([f"{msg['role']}: {msg.get('content', 'Function call')}" for msg in messages[-5:]])  # Last 5 messages for context
-                        
+                        prompt_text = "\n".join([f"{msg['role']}: {msg.get('content') or 'Tool call'}" for msg in messages[-5:]])  # Last 5 messages for context
+                    
+                    prompt.fit(messages)
+                    self._log_prompt_tokens(prompt, messages, "query_agent" if round_trips == 0 else "query_agent_tool_followup", journey_id)
                     response = await self._call_openai_with_retry(
                         model="gpt-4o-mini",
                         messages=messages,
-                        functions=self.function_definitions,
-                        function_call="auto",
+                        tools=self.tool_definitions,
+                        tool_choice="auto",
+                        parallel_tool_calls=True,
                         temperature=0.3,
                         max_tokens=800
                     )
+                    round_trips += 1
                     
                     api_duration = int((time.time() - api_start_time) * 1000)
                     message = response.choices[0].message
+                    tool_calls = message.tool_calls or []
                     
                     # Log the LLM response
                     if LOGGING_AVAILABLE and journey_id:
-                        function_calls_info = None
-                        if message.function_call:
-                            function_calls_info = [{
-                                "function_name": message.function_call.name,
-                                "arguments": message.function_call.arguments
-                            }]
+                        function_calls_info = [{
+                            "function_name": tool_call.function.name,
+                            "arguments": tool_call.function.arguments
+                        } for tool_call in tool_calls] or None
                         
                         message_journey_logger.log_llm_interaction(
                             journey_id=journey_id,
                             llm_type="openai",
                             prompt=prompt_text,
-                            response=message.content or f"Function call: {message.function_call.name}" if message.function_call else "",
+                            response=message.content or ("Tool calls: " + ", ".join(tool_call.function.name for tool_call in tool_calls) if tool_calls else ""),
                             model="gpt-4o-mini",
                             function_calls=function_calls_info,
                             duration_ms=api_duration,
                             tokens_used={"total_tokens": response.usage.total_tokens if response.usage else None}
                         )
                     
-                    # Check if model wants to call a function
-                    if message.function_call:
-                        function_call_count += 1
-                        function_name = message.function_call.name
-                        
-                        try:
-                            function_args = json.loads(message.function_call.arguments)
-                        except json.JSONDecodeError:
-                            logger.error(f"Invalid function arguments: {message.function_call.arguments}")
-                            error_msg = "عذراً، حدث خطأ في معالجة طلبك. الرجاء إعادة صياغة السؤال." if user_language == 'ar' else "Sorry, there was an error processing your request. Please rephrase your question."
-                            return (error_msg, city_context, brand_context)
-                        
-                        logger.info(f"Calling function #{function_call_count}: {function_name} with args: {function_args}")
-                        print(f"⚙️ Function Call #{function_call_count}: {function_name}({function_args})")
-                        
-                        # Call the requested function
-                        if function_name in self.available_functions:
+                    # Check if model wants to call tools
+                    if tool_calls:
+                        parsed_calls = []
+                        for tool_call in tool_calls:
+                            function_name = tool_call.function.name
                             try:
-                                # Record function call start time for duration measurement
-                                func_start_time = time.time()
-                                
-                                # Automatically add user_language parameter for language-aware functions
-                                if function_name in ["get_brands_by_city_name", "get_products_by_brand_and_city_name", "get_all_cities"]:
-                                    function_args["user_language"] = user_language
-                                    logger.info(f"Added user_language='{user_language}' to {function_name}")
-                                
-                                function_result = self.available_functions[function_name](**function_args)
-                                
-                                # Calculate function execution duration
-                                func_duration = int((time.time() - func_start_time) * 1000)
-                                
-                                # Log the function call and response in detail
-                                if LOGGING_AVAILABLE and journey_id:
-                                    message_journey_logger.log_function_call(
-                                        journey_id=journey_id,
-                                        function_name=function_name,
-                                        function_args=function_args,
-                                        function_result=function_result,
-                                        duration_ms=func_duration,
-                                        status="completed"
-                                    )
-                                
-                                # Add function call and result to conversation
-                                messages.append({
-                                    "role": "assistant",
-                                    "content": None,
-                                    "function_call": {
-                                        "name": function_name,
-                                        "arguments": message.function_call.arguments
-                                    }
-                                })
-                                messages.append({
-                                    "role": "function",
-                                    "name": function_name,
-                                    "content": json.dumps(function_result, ensure_ascii=False)
-                                })
-                                
-                                logger.info(f"Function {function_name} completed successfully")
-                                print(f"✅ Function Response: {function_name} → {type(function_result).__name__} (success: {function_result.get('success', 'N/A') if isinstance(function_result, dict) else 'N/A'})")
-                                
-                            except Exception as func_error:
-                                # Calculate function execution duration even for errors
-                                func_duration = int((time.time() - func_start_time) * 1000) if 'func_start_time' in locals() else None
-                                
-                                logger.error(f"Function {function_name} failed: {str(func_error)}")
+                                function_args = json.loads(tool_call.function.arguments or "{}")
+                            except json.JSONDecodeError:
+                                logger.error(f"Invalid function arguments: {tool_call.function.arguments}")
+                                error_msg = "عذراً، حدث خطأ في معالجة طلبك. الرجاء إعادة صياغة السؤال." if user_language == 'ar' else "Sorry, there was an error processing your request. Please rephrase your question."
+                                return (error_msg, city_context, brand_context)
+                            
+                            if function_name not in self.available_functions:
+                                logger.error(f"Unknown function: {function_name}")
                                 
-                                # Log the function error in detail
+                                # Log the unknown function call
                                 if LOGGING_AVAILABLE and journey_id:
                                     message_journey_logger.log_function_call(
                                         journey_id=journey_id,
                                         function_name=function_name,
                                         function_args=function_args,
                                         function_result=None,
-                                        duration_ms=func_duration,
                                         status="failed",
-                                        error=str(func_error)
+                                        error=f"Unknown function: {function_name}"
                                     )
                                 
-                                # Add error result to conversation
-                                error_result = {"error": f"Function failed: {str(func_error)}"}
-                                messages.append({
-                                    "role": "function",
-                                    "name": function_name,
-                                    "content": json.dumps(error_result, ensure_ascii=False)
-                                })
-                        else:
-                            logger.error(f"Unknown function: {function_name}")
+                                error_msg = f"خطأ: الوظيفة '{function_name}' غير متاحة." if user_language == 'ar' else f"Error: Function '{function_name}' is not available."
+                                return (error_msg, city_context, brand_context)
                             
-                            # Log the unknown function call
-                            if LOGGING_AVAILABLE and journey_id:
-                                message_journey_logger.log_function_call(
-                                    journey_id=journey_id,
-                                    function_name=function_name,
-                                    function_args=function_args,
-                                    function_result=None,
-                                    status="failed",
-                                    error=f"Unknown function: {function_name}"
-                                )
+                            # Automatically add user_language parameter for language-aware functions
+                            if function_name in ["get_brands_by_city_name", "get_products_by_brand_and_city_name", "get_all_cities"]:
+                                function_args["user_language"] = user_language
                             
-                            error_msg = f"خطأ: الوظيفة '{function_name}' غير متاحة." if user_language == 'ar' else f"Error: Function '{function_name}' is not available."
-                            return (error_msg, city_context, brand_context)
+                            parsed_calls.append((tool_call, function_name, function_args))
+                        
+                        function_call_count += len(parsed_calls)
+                        print(f"⚙️ Round-trip #{round_trips}: {len(parsed_calls)} tool call(s) - " + ", ".join(
+                            f"{function_name}({function_args})" for _, function_name, function_args in parsed_calls
+                        ))
+                        
+                        # Independent tools run concurrently; repeats within this turn reuse the first result
+                        contents = await asyncio.gather(*[
+                            self._execute_tool_call(tool_call.id, function_name, function_args, turn_tool_results, journey_id)
+                            for tool_call, function_name, function_args in parsed_calls
+                        ])
+                        
+                        # Add the tool calls and their results to the conversation
+                        messages.append({
+                            "role": "assistant",
+                            "content": message.content,
+                            "tool_calls": [{
+                                "id": tool_call.id,
+                                "type": "function",
+                                "function": {
+                                    "name": tool_call.function.name,
+                                    "arguments": tool_call.function.arguments
+                                }
+                            } for tool_call, _, _ in parsed_calls]
+                        })
+                        for (tool_call, function_name, _), content in zip(parsed_calls, contents):
+                            messages.append(prompt.tool_message(tool_call.id, content))
+                            reply_info.setdefault("tools", []).append(function_name)
+                            if tool_result_serializer.is_failure(content):
+                                reply_info["tool_failures"] = reply_info.get("tool_failures", 0) + 1
                     else:
-                        # No function call, return the response
+                        # No tool call, return the response
                         final_response = message.content
                         if final_response:
-                            logger.info(f"Query completed after {function_call_count} function calls")
+                            logger.info(f"Query completed after {round_trips} round-trips and {function_call_count} function calls")
+                            chatbot_metrics.observe_query_round_trips(round_trips, "success")
+                            reply_info["source"] = "tool_grounded" if reply_info.get("tools") else "llm_freeform"
                             
                             # Log successful query completion
                             if LOGGING_AVAILABLE and journey_id:
                                 message_journey_logger.add_step(
                                     journey_id=journey_id,
                                     step_type="query_completion",
-                                    description=f"Query completed successfully with {function_call_count} function calls",
+                                    description=f"Query completed successfully with {function_call_count} function calls in {round_trips} round-trips",
                                     data={
                                         "total_function_calls": function_call_count,
+                                        "round_trips": round_trips,
                                         "final_response_length": len(final_response),
                                         "completion_status": "success",
                                         "completion_method": "natural_completion"
@@ -3268,6 +3615,7 @@ Output in JSON format only:
                             return (final_response, city_context, brand_context)
                         else:
                             error_msg = "عذراً، لم أتمكن من معالجة طلبك. الرجاء المحاولة مرة أخرى." if user_language == 'ar' else "Sorry, I couldn't process your request. Please try again."
+                            chatbot_metrics.observe_query_round_trips(round_trips, "empty_response")
                             
                             # Log empty response error
                             if LOGGING_AVAILABLE and journey_id:
@@ -3277,6 +3625,7 @@ Output in JSON format only:
                                     description="Query failed - empty response from LLM",
                                     data={
                                         "total_function_calls": function_call_count,
+                                        "round_trips": round_trips,
                                         "completion_status": "failed",
                                         "error": "Empty response from LLM"
                                     },
@@ -3287,22 +3636,27 @@ Output in JSON format only:
                 
                 except Exception as api_error:
                     logger.error(f"OpenAI API error: {str(api_error)}")
+                    chatbot_metrics.observe_query_round_trips(round_trips, "error")
                     # Return error message instead of fallback
                     error_msg = "عذراً، حدث خطأ في الخدمة. الرجاء المحاولة مرة أخرى." if user_language == 'ar' else "Sorry, there was a service error. Please try again."
                     return (error_msg, city_context, brand_context)
             
-            # If we reached max function calls, get final response
+            # If we reached max round-trips, get final response
             try:
                 final_api_start_time = time.time()
                 
+                final_messages = self._tool_messages_as_text(prompt.fit(messages))
+                self._log_prompt_tokens(prompt, messages, "query_agent_final", journey_id)
                 final_response = await self._call_langchain_llm(
-                    messages=messages,
+                    messages=final_messages,
                     temperature=0.3,
                     max_tokens=400
                 )
+                round_trips += 1
                 
                 final_api_duration = int((time.time() - final_api_start_time) * 1000)
                 response_text = final_response["content"]
+                chatbot_metrics.observe_query_round_trips(round_trips, "max_round_trips")
                 
                 # Log final response generation
                 if LOGGING_AVAILABLE and journey_id:
@@ -3318,6 +3672,7 @@ Output in JSON format only:
                 
                 if response_text:
                     logger.info(f"Final response generated after {function_call_count} function calls")
+                    reply_info["source"] = "max_round_trips"
                     
                     # Log query completion summary
                     if LOGGING_AVAILABLE and journey_id:
@@ -3327,6 +3682,7 @@ Output in JSON format only:
                             description=f"Query completed with {function_call_count} function calls",
                             data={
                                 "total_function_calls": function_call_count,
+                                "round_trips": round_trips,
                                 "final_response_length": len(response_text),
                                 "completion_status": "success"
                             }
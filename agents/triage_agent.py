@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import time
+import logging
+from typing import Dict, Any, List, Optional
+from langchain_openai import ChatOpenAI
+from langchain_core.messages import SystemMessage, HumanMessage
+from database.db_models import MessageType
+from utils.language_utils import language_handler
+from utils.llm_backend import llm_backend
+from services.llm_cache import llm_decision_cache
+
+logger = logging.getLogger(__name__)
+
+# Import message journey logger for detailed logging
+try:
+    from utils.message_logger import message_journey_logger
+    LOGGING_AVAILABLE = True
+except ImportError:
+    LOGGING_AVAILABLE = False
+
+# Bump when the triage prompt changes - cached triage results of the old prompt stop matching
+TRIAGE_PROMPT_VERSION = "1"
+
+KB_ACTIONS = ("reply", "skip", "continue")
+
+TRIAGE_SYSTEM_PROMPT = """أنت مساعد فرز (triage) لرسائل عملاء شركة أبار لتوصيل المياه في السعودية عبر الواتس اب.
+مهمتك اتخاذ كل قرارات الفرز لرسالة العميل الحالية دفعة واحدة، مع مراعاة سياق المحادثة.
+
+1) message_type - نوع الرسالة (اختر واحداً فقط):
+- SERVICE_REQUEST: طلبات توصيل مياه أو طلبات جديدة
+- INQUIRY: أسئلة عن المدن، الأسعار، العلامات التجارية، المنتجات، الأحجام، التوفر، التوصيل لمدينة معينة، تبديل أو استبدال الجوالين
+- COMPLAINT: مشاكل في الخدمة، تأخير التوصيل، جودة المياه
+- SUGGESTION: اقتراحات للتحسين، ملاحظات، آراء
+- GREETING: تحية مباشرة واضحة فقط (السلام عليكم، مرحبا، هلا، صباح الخير)
+- THANKING: شكر أو رضا بسيط (شكراً، مشكور، يعطيك العافية، ممتاز)
+- OTHERS: رسائل عامة أو غير محددة أو خارج نطاق العمل
+🚨 أي ذكر لعلامة تجارية أو مدينة أو منتج = INQUIRY. إذا سأل البوت عن المدينة أو الماركة ورد العميل باسم فقط = INQUIRY.
+🚨 "المدينة" تعني المدينة المنورة، و"الخميس" تعني خميس مشيط.
+
+2) is_relevant - هل الرسالة متعلقة بخدمات توصيل المياه (المدن، العلامات، المنتجات، الأسعار، الطلبات، متابعة محادثة عن المياه)؟
+الرسائل التي تحتوي روابط، أو مواضيع لا علاقة لها بالمياه = false.
+
+3) language - لغة رسالة العميل: "ar" أو "en".
+
+4) city_mentions و brand_mentions - المدن/الأحياء والعلامات التجارية التي ذكرها العميل نفسه بوضوح أو أكد عليها تحديداً (في رسالته الحالية أو رسائله السابقة)، بنفس كتابة العميل.
+- لا تضف ما ذكره المساعد فقط في قائمة خيارات، ولا الردود الغامضة مثل "نعم" أو "أي واحدة"
+- "صفا مكة" أو "صفا مكه" علامة تجارية للمياه وليست مدينة مكة
+- أسماء علامات شائعة: نستله، أكوافينا، العين، القصيم، المراعي، نوفا، نقي، تانيا، صافية، بنما، أروى، مساء، سدير، صحتك، صحتين، وي، المنهل، حلوة، هنا، صفا مكة، أوسكا
+
+5) kb_action - فقط إذا أُعطيت إجابة محفوظة من قاعدة المعرفة (وإلا "continue"):
+- "reply": فقط إذا كان لرسالة العميل والسؤال المحفوظ نفس المعنى والقصد تماماً ولم نرسل نفس الرد مؤخراً، أو كانت الرسالة تحية أو شكراً بسيطاً فقط
+- "skip": رسائل لا تحتاج رداً مثل (تمام، طيب، أوك، خلاص)
+- "continue": أي شيء آخر، أو إذا ذكر العميل علامة تجارية أو مدينة أو سعراً أو منتجاً
+⚠️ تشابه الكلمات ≠ نفس المعنى. كن متحفظاً جداً في اختيار "reply".
+
+أجب بصيغة JSON فقط بدون أي نص آخر:
+{"message_type": "INQUIRY", "is_relevant": true, "language": "ar", "city_mentions": [], "brand_mentions": [], "kb_action": "continue"}"""
+
+
+class TriageAgent:
+    """
+    Optional single-call front door (MESSAGE_TRIAGE_MODE=single).
+
+    Replaces the separate knowledge-base answer evaluation, message type classification
+    and relevance calls with one structured JSON call that also reports the language and
+    the cities/brands the customer mentioned. process_message_async feeds the result to
+    every downstream branch; when the call fails it returns None and the per-agent
+    calls run as before.
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("MESSAGE_TRIAGE_MODE", "off").lower()
+        self.llm = ChatOpenAI(
+            model=os.getenv("MESSAGE_TRIAGE_MODEL", "gpt-4o-mini"),
+            temperature=0.1,
+            api_key=os.getenv("OPENAI_API_KEY"),
+            tags=["triage-agent", "abar-chatbot"]
+        )
+        self.stats = {"triaged": 0, "failed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode == "single"
+
+    async def triage(self, user_message: str, conversation_history: List[Dict] = None,
+                     kb_match: Optional[Dict[str, Any]] = None, journey_id: str = None) -> Optional[Dict[str, Any]]:
+        """
+        Make every pre-response decision about a message in one LLM call
+
+        Args:
+            kb_match: 'needs_evaluation' result of embedding_agent.process_message(evaluate=False), if any
+
+        Returns:
+            Dict with message_type (MessageType), is_relevant, language, city_mentions,
+            brand_mentions and kb_action - or None if the call failed (caller falls back)
+        """
+        recent_messages = (conversation_history or [])[-7:]
+        context = ""
+        if recent_messages:
+            context_lines = []
+            for msg in recent_messages:
+                role = "العميل" if msg.get('role') == 'user' else "المساعد"
+                context_lines.append(f"{role}: {msg.get('content', '')}")
+            context = "تاريخ المحادثة الحديث:\n" + "\n".join(context_lines) + "\n\n"
+
+        kb_section = "لا توجد إجابة محفوظة مطابقة من قاعدة المعرفة (kb_action = continue)."
+        if kb_match:
+            kb_section = f"""إجابة محفوظة من قاعدة المعرفة:
+- السؤال المشابه: "{kb_match['matched_question']}"
+- الرد المحفوظ: "{kb_match['matched_answer']}\""""
+
+        triage_prompt = f"""{context}الرسالة الحالية للعميل: "{user_message}"
+
+{kb_section}"""
+
+        langchain_messages = [
+            SystemMessage(content=TRIAGE_SYSTEM_PROMPT),
+            HumanMessage(content=triage_prompt)
+        ]
+        temp_llm = self.llm.bind(max_tokens=150, temperature=0.1)
+
+        async def _triage_call():
+            response = await llm_backend.chat_text(
+                lambda: temp_llm.ainvoke(langchain_messages),
+                langchain_messages,
+                model=self.llm.model_name,
+                max_tokens=150,
+                temperature=0.1
+            )
+            return response.content
+
+        start_time = time.time()
+        try:
+            raw_response = await llm_decision_cache.get_or_compute(
+                "triage",
+                TRIAGE_PROMPT_VERSION,
+                user_message,
+                _triage_call,
+                history=recent_messages,
+                extra=[kb_match['matched_question'], kb_match['matched_answer']] if kb_match else None
+            )
+            result = self._parse(raw_response, user_message, has_kb_match=bool(kb_match))
+        except Exception as e:
+            self.stats["failed"] += 1
+            logger.error(f"Triage failed, falling back to per-agent calls: {str(e)}")
+            if LOGGING_AVAILABLE and journey_id:
+                message_journey_logger.add_step(
+                    journey_id=journey_id,
+                    step_type="triage",
+                    description=f"Triage failed - falling back to separate agent calls: {str(e)}",
+                    status="failed",
+                    duration_ms=int((time.time() - start_time) * 1000)
+                )
+            return None
+
+        self.stats["triaged"] += 1
+        print(f"🧭 Triage: {result['message_type'].name}, relevant={result['is_relevant']}, "
+              f"kb={result['kb_action']}, cities={result['city_mentions']}, brands={result['brand_mentions']}")
+
+        if LOGGING_AVAILABLE and journey_id:
+            message_journey_logger.add_step(
+                journey_id=journey_id,
+                step_type="triage",
+                description=f"Triage: {result['message_type'].name} / kb {result['kb_action']}",
+                data={
+                    **result,
+                    "message_type": result['message_type'].name,
+                    "raw_response": raw_response,
+                    "had_kb_match": bool(kb_match)
+                },
+                duration_ms=int((time.time() - start_time) * 1000)
+            )
+        return result
+
+    @staticmethod
+    def _parse(raw_response: str, user_message: str, has_kb_match: bool) -> Dict[str, Any]:
+        """Validate the triage JSON - raises on anything unusable (unknown type, bad JSON)"""
+        content = (raw_response or "").strip()
+        json_match = re.search(r'\{.*\}', content, re.DOTALL)
+        parsed = json.loads(json_match.group(0) if json_match else content)
+
+        message_type = MessageType[str(parsed["message_type"]).strip().upper()]
+
+        language = str(parsed.get("language", "")).strip().lower()
+        if language not in language_handler.supported_languages:
+            language = language_handler.detect_language(user_message)
+
+        kb_action = str(parsed.get("kb_action", "continue")).strip().lower()
+        if not has_kb_match or kb_action not in KB_ACTIONS:
+            kb_action = "continue"
+
+        def _names(key):
+            values = parsed.get(key) or []
+            if isinstance(values, str):
+                values = [values]
+            return [str(value).strip() for value in values if str(value).strip()]
+
+        return {
+            "message_type": message_type,
+            "is_relevant": bool(parsed.get("is_relevant", True)),
+            "language": language,
+            "city_mentions": _names("city_mentions"),
+            "brand_mentions": _names("brand_mentions"),
+            "kb_action": kb_action
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, **self.stats}
+
+
+# Singleton instance
+triage_agent = TriageAgent()
@@ -11,6 +11,7 @@ from dotenv import load_dotenv
 import json
 
 from database.db_utils import DatabaseManager
+from utils.llm_scheduler import llm_scheduler
 from vectorstore.chroma_db import chroma_manager
 
 # Ensure environment variables are loaded
@@ -175,7 +176,7 @@ class WhatsAppAgent:
                     context["chat_history"] = DatabaseManager.get_user_message_history(db, user.id)
                     
                     # Generate response
-                    response = await self.chain.ainvoke(context)
+                    response = await self._invoke_chain(context)
                     
                     # Save the response
                     DatabaseManager.save_bot_reply(db, user_message.id, response)
@@ -183,12 +184,20 @@ class WhatsAppAgent:
                     return response
             
             # If no database or user, just process the message
-            return await self.chain.ainvoke(context)
+            return await self._invoke_chain(context)
             
         except Exception as e:
             print(f"[Error processing message] {str(e)}")
             return "عذراً، حدث خطأ أثناء معالجة رسالتك. الرجاء المحاولة مرة أخرى."
     
+    async def _invoke_chain(self, context: Dict[str, Any]) -> str:
+        """Run the chain through the shared LLM scheduler"""
+        return await llm_scheduler.run(
+            self.chat_model.model_name,
+            llm_scheduler.estimate_tokens([{"content": json.dumps(context, ensure_ascii=False, default=str)}], None),
+            lambda: self.chain.ainvoke(context)
+        )
+    
     def send_whatsapp_message(self, to_number: str, message: str) -> Dict[str, Any]:
         """Send a message via Wati API"""
         # Ensure there's no trailing slash in the API URL and correct the path format
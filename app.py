@@ -10,7 +10,7 @@ os.environ["LANGCHAIN_PROJECT"] = "abar-chatbot"
 import openai
 import os
 from fastapi import FastAPI, Request, Depends, HTTPException, Header, Query
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from starlette.middleware.sessions import SessionMiddleware
@@ -69,7 +69,7 @@ def is_access_restricted():
     """Check if access is currently restricted"""
     return load_access_control_config()
 import threading
-from collections import defaultdict
+from collections import defaultdict, deque
 from typing import Dict, List, Any
 
 
@@ -86,20 +86,33 @@ load_dotenv(dotenv_path=env_path)
 
 from database.db_utils import get_db, DatabaseManager
 from database.db_models import MessageType, UserSession, BotReply
+from database.district_utils import DistrictLookup
 from agents.embedding_agent import embedding_agent
 from agents.message_classifier import message_classifier
 from agents.query_agent import query_agent
 from agents.service_request import service_request_agent
+from agents.triage_agent import triage_agent
+from agents.fast_path_router import fast_path_router
+from utils.validation_policy import validation_policy
+from utils.tool_result_serializer import tool_result_serializer
 from utils.language_utils import language_handler
 from services.data_api import data_api
 from services.data_scraper import data_scraper
 from services.scheduler import scheduler
+from services.ingest_queue import ingest_queue
+from services.coordination import get_coordination_backend, WORKER_ID
+from services.message_dedup import message_deduplicator
+from services.llm_cache import llm_decision_cache
+from services.gazetteer import entity_gazetteer
+from services.whatsapp_sender import whatsapp_sender
 
 # Import knowledge_manager
 from utils.knowledge_manager import knowledge_manager
 
 # Import message journey logger
 from utils.message_logger import message_journey_logger
+from utils.metrics import chatbot_metrics
+from utils.llm_scheduler import llm_scheduler, llm_priority
 
 app = FastAPI(
     title="Abar Chatbot API",
@@ -138,6 +151,14 @@ async def add_utf8_headers(request: Request, call_next):
         response.headers["content-type"] = "application/json; charset=utf-8"
     return response
 
+# Customer messages are processed by the ingest workers; LLM calls made while serving
+# admin/debug requests queue behind them in the shared LLM scheduler
+@app.middleware("http")
+async def set_llm_priority(request: Request, call_next):
+    if not request.url.path.startswith("/webhook"):
+        llm_priority.set("admin")
+    return await call_next(request)
+
 # Add session middleware for login functionality
 app.add_middleware(SessionMiddleware, secret_key="abar-secret-key-2024")
 
@@ -221,7 +242,11 @@ async def verify_webhook(
 
 # Async processing function to handle webhook data in background
 async def process_webhook_async(data: dict, db):
-    """Process webhook data asynchronously after immediate response to Wati"""
+    """Process webhook data asynchronously after immediate response to Wati
+    
+    Returns True when the message was handed to the batcher, which acks its ingest queue row
+    once the batch has been processed; errors propagate so the queue can retry the message.
+    """
     journey_id = None
     webhook_start_time = time.time()
     
@@ -371,37 +396,6 @@ async def process_webhook_async(data: dict, db):
                 # Empty template reply skipped
                 return
         
-        # Early duplicate check with existing session
-        if wati_message_id and DatabaseManager.check_message_already_processed(db, wati_message_id):
-            message_journey_logger.add_step(
-                journey_id=journey_id,
-                step_type="duplicate_check",
-                description=f"Duplicate message detected: {wati_message_id}",
-                data={"wati_message_id": wati_message_id},
-                status="skipped"
-            )
-            message_journey_logger.complete_journey(journey_id, status="skipped_duplicate")
-            # Duplicate message skipped
-            return
-        
-        # Additional check: Skip if the same message was processed recently (time-based)
-        if wati_message_id:
-            current_time = time.time()
-            if wati_message_id in processed_messages:
-                last_processed_time = processed_messages[wati_message_id]
-                if current_time - last_processed_time < 30:  # 30 seconds cooldown
-                    # Recent message skipped
-                    return
-            
-            # Track this message
-            processed_messages[wati_message_id] = current_time
-            
-            # Clean up old entries (keep only last 1000 messages)
-            if len(processed_messages) > 1000:
-                old_messages = sorted(processed_messages.items(), key=lambda x: x[1])
-                for msg_id, _ in old_messages[:500]:  # Remove oldest 500
-                    del processed_messages[msg_id]
-        
         # Log the incoming message for debugging
         # Processing message
         
@@ -419,6 +413,7 @@ async def process_webhook_async(data: dict, db):
         
         # Add message to batch for processing
         await add_message_to_batch(phone_number, data)
+        return True
         
     except Exception as e:
         # Log error in journey if journey_id exists
@@ -432,14 +427,15 @@ async def process_webhook_async(data: dict, db):
             )
             message_journey_logger.complete_journey(journey_id, status="failed")
         
-        pass  # Async processing error
         import traceback
         traceback.print_exc()
+        # Let the ingest queue retry the message (or park it as failed)
+        raise
 
 
 # Main webhook endpoint to receive WhatsApp messages from Wati
 @app.post("/webhook")
-async def webhook(request: Request, db=Depends(get_db)):
+async def webhook(request: Request):
     """Handle incoming WhatsApp messages from Wati webhook"""
     # Start timing the webhook processing
     webhook_start_time = time.time()
@@ -477,8 +473,23 @@ async def webhook(request: Request, db=Depends(get_db)):
         # 🚀 IMMEDIATE RESPONSE: Respond to Wati immediately to prevent timeouts
         # Immediate response sent
         
-        # Schedule async processing in background and return immediately
-        asyncio.create_task(process_webhook_async(data, db))
+        # Webhook retries of a message we already claimed - skip without touching the database
+        if message_deduplicator.seen_recently(wati_message_id):
+            return {"status": "success", "message": "Duplicate message ignored"}
+        
+        # Persist to the ingest queue - the worker pool runs process_webhook_async with its own session.
+        # The dedup claim is written in the same transaction, so retried or recovered rows are never
+        # rejected as duplicates of their own claim
+        queue_item_id = await ingest_queue.enqueue(data)
+        if queue_item_id == ingest_queue.DUPLICATE:
+            return {"status": "success", "message": "Duplicate message ignored"}
+        if queue_item_id is None:
+            # Backpressure: queue is full (or could not be written) - ask Wati to retry later
+            return JSONResponse(
+                status_code=503,
+                content={"status": "error", "message": "Server busy - please retry"},
+                headers={"Retry-After": str(ingest_queue.retry_after_seconds)}
+            )
         
         return {"status": "success", "message": "Message received - processing in background"}
 
@@ -496,11 +507,35 @@ async def webhook(request: Request, db=Depends(get_db)):
 
 # Replace the global dictionaries with thread-safe alternatives
 class ThreadSafeMessageBatcher:
+    # Messages that look complete on their own - no point waiting for a follow-up
+    FLUSH_KEYWORDS = [
+        'كم سعر', 'بكم', 'الاسعار', 'اسعار', 'توصلون', 'هل توصلون', 'ابي اطلب', 'ابغى اطلب', 'ابغا اطلب',
+        'how much', 'price', 'prices', 'do you deliver'
+    ]
+    
     def __init__(self):
         self._batches: Dict[str, List[Dict]] = {}
         self._timers: Dict[str, asyncio.Task] = {}
         self._locks: Dict[str, asyncio.Lock] = {}  # Changed from defaultdict to regular dict
+        # Held while a phone's batch runs the agents - separate from _locks so adding a message
+        # (the ingest worker) never waits for the agents
+        self._processing_locks: Dict[str, asyncio.Lock] = {}
         self._last_cleanup = time.time()
+        
+        # Adaptive debounce configuration (seconds)
+        self.default_window = float(os.getenv("BATCH_DEFAULT_WINDOW", "3.0"))  # Users we know nothing about yet
+        self.min_window = float(os.getenv("BATCH_MIN_WINDOW", "1.5"))
+        self.max_window = float(os.getenv("BATCH_MAX_WINDOW", "6.0"))
+        self.max_wait = float(os.getenv("BATCH_MAX_WAIT", "12.0"))  # Hard cap from the first message of a batch
+        
+        # Per-user typing cadence
+        self._last_message_time: Dict[str, float] = {}
+        self._message_gaps: Dict[str, deque] = {}
+        self._flush_reasons: Dict[str, str] = {}
+        
+        # Batching delay stats (time between first message of a batch and processing start)
+        self._batch_delays = deque(maxlen=1000)
+        self._flush_reason_counts: Dict[str, int] = defaultdict(int)
     
     def _get_lock(self, phone_number: str) -> asyncio.Lock:
         """Get or create a lock for the given phone number"""
@@ -508,6 +543,12 @@ class ThreadSafeMessageBatcher:
             self._locks[phone_number] = asyncio.Lock()
         return self._locks[phone_number]
     
+    def _get_processing_lock(self, phone_number: str) -> asyncio.Lock:
+        """Get or create the lock that keeps one phone's batches processing in order"""
+        if phone_number not in self._processing_locks:
+            self._processing_locks[phone_number] = asyncio.Lock()
+        return self._processing_locks[phone_number]
+    
     async def _cleanup_old_data(self):
         """Clean up old locks and empty batches to prevent memory leaks"""
         current_time = time.time()
@@ -533,6 +574,78 @@ class ThreadSafeMessageBatcher:
                 if phone_number in self._locks:
                     del self._locks[phone_number]
                     # Old lock cleaned
+                processing_lock = self._processing_locks.get(phone_number)
+                if processing_lock and not processing_lock.locked():
+                    del self._processing_locks[phone_number]
+        
+        # Forget cadence of users that have been silent for an hour
+        for phone_number, last_time in list(self._last_message_time.items()):
+            if current_time - last_time > 3600:
+                self._last_message_time.pop(phone_number, None)
+                self._message_gaps.pop(phone_number, None)
+    
+    def _record_cadence(self, phone_number: str, current_time: float):
+        """Track the gaps between consecutive messages of the same burst"""
+        last_time = self._last_message_time.get(phone_number)
+        self._last_message_time[phone_number] = current_time
+        
+        if last_time is None:
+            return
+        
+        gap = current_time - last_time
+        # Gaps longer than the hard cap belong to a new conversation turn, not to typing cadence
+        if gap <= self.max_wait:
+            self._message_gaps.setdefault(phone_number, deque(maxlen=20)).append(gap)
+    
+    def _get_quiet_window(self, phone_number: str) -> float:
+        """Quiet window for this user based on how fast they usually send follow-ups"""
+        gaps = self._message_gaps.get(phone_number)
+        if not gaps:
+            return self.default_window
+        
+        ordered = sorted(gaps)
+        typical_gap = ordered[min(len(ordered) - 1, int(len(ordered) * 0.75))]
+        # Wait a bit longer than the user's usual gap so we catch the follow-up
+        return min(self.max_window, max(self.min_window, typical_gap * 1.5))
+    
+    def _get_flush_signal(self, message_data: dict) -> Optional[str]:
+        """Return the reason to flush immediately, or None when we should keep waiting"""
+        if (message_data.get("buttonReply") or message_data.get("listReply") or
+                message_data.get("interactiveButtonReply") or
+                message_data.get("original_message_type") == "button"):
+            return "button_reply"
+        
+        text = (message_data.get("text") or "").strip()
+        if not text:
+            return None
+        
+        if text.endswith("?") or text.endswith("؟"):
+            return "question_mark"
+        
+        text_lower = text.lower()
+        if any(keyword in text_lower for keyword in self.FLUSH_KEYWORDS):
+            return "intent_keyword"
+        
+        return None
+    
+    def _get_batch_delay(self, phone_number: str, message_data: dict, current_time: float):
+        """Work out how long to wait before processing the user's batch
+        
+        Returns:
+            (delay_seconds, flush_reason)
+        """
+        flush_signal = self._get_flush_signal(message_data)
+        if flush_signal:
+            return 0.0, flush_signal
+        
+        quiet_window = self._get_quiet_window(phone_number)
+        batch = self._batches.get(phone_number) or []
+        batch_started = batch[0]['timestamp'] if batch else current_time
+        remaining = self.max_wait - (current_time - batch_started)
+        
+        if remaining <= quiet_window:
+            return max(0.0, remaining), "max_wait"
+        return quiet_window, "quiet_window"
     
     async def add_message_to_batch(self, phone_number: str, message_data: dict):
         """Add a message to user's batch with proper locking"""
@@ -547,11 +660,13 @@ class ThreadSafeMessageBatcher:
                 self._batches[phone_number] = []
             
             # Add message to batch
+            self._record_cadence(phone_number, current_time)
             self._batches[phone_number].append({
                 'data': message_data,
                 'timestamp': current_time,
                 'text': message_data.get('text', '')
             })
+            delay, flush_reason = self._get_batch_delay(phone_number, message_data, current_time)
             
             # Cancel existing timer if any
             existing_timer = self._timers.get(phone_number)
@@ -565,10 +680,11 @@ class ThreadSafeMessageBatcher:
                     # Timer cleanup error
                     pass
             
-            # Set new timer to process batch after 5 seconds of inactivity
+            # Set new timer to process batch after the user's quiet window (0 = flush now)
             try:
+                self._flush_reasons[phone_number] = flush_reason
                 self._timers[phone_number] = asyncio.create_task(
-                    self._process_batch_delayed(phone_number)
+                    self._process_batch_delayed(phone_number, delay)
                 )
                 # Message added to batch
             except Exception as e:
@@ -576,10 +692,10 @@ class ThreadSafeMessageBatcher:
                 # If timer creation fails, process immediately to prevent message loss
                 await self.process_user_batch(phone_number)
     
-    async def _process_batch_delayed(self, phone_number: str):
+    async def _process_batch_delayed(self, phone_number: str, delay: float):
         """Process batch after delay"""
         try:
-            await asyncio.sleep(5)  # Wait 5 seconds for more messages
+            await asyncio.sleep(delay)  # Wait for more messages
             await self.process_user_batch(phone_number)
         except asyncio.CancelledError:
             # Batch timer cancelled
@@ -596,6 +712,7 @@ class ThreadSafeMessageBatcher:
     
     async def process_user_batch(self, phone_number: str):
         """Process all messages in user's batch as one conversation"""
+        # Take the batch under the batch lock, then release it before running the agents
         async with self._get_lock(phone_number):
             if phone_number not in self._batches or not self._batches[phone_number]:
                 return
@@ -603,10 +720,17 @@ class ThreadSafeMessageBatcher:
             batch = self._batches[phone_number]
             print(f"🔄 Processing batch of {len(batch)} messages for {phone_number}")
             
+            # Record how long batching held these messages back
+            self._batch_delays.append(time.time() - batch[0]['timestamp'])
+            self._flush_reason_counts[self._flush_reasons.pop(phone_number, "manual")] += 1
+            
             # Clear the batch and timer first to prevent race conditions
             self._batches[phone_number] = []
             timer_task = self._timers.get(phone_number)
-            if timer_task:
+            if timer_task is asyncio.current_task():
+                # Called from the timer itself - never cancel the task doing the processing
+                del self._timers[phone_number]
+            elif timer_task:
                 timer_task.cancel()
                 # Properly handle the cancelled timer to prevent CancelledError from propagating
                 try:
@@ -618,66 +742,104 @@ class ThreadSafeMessageBatcher:
                     print(f"⚠️ Unexpected error while cancelling timer for {phone_number}: {e}")
                 del self._timers[phone_number]
             
-            # Combine all messages into one conversation
-            combined_messages = []
-            wati_message_ids = []
-            
-            for msg_item in batch:
-                combined_messages.append(msg_item['text'])
-                if msg_item['data'].get('id'):
-                    wati_message_ids.append(msg_item['data']['id'])
-            
-            # Create combined message text
-            if len(combined_messages) == 1:
-                combined_text = combined_messages[0]
-            else:
-                combined_text = "\n".join([f"رسالة {i+1}: {msg}" for i, msg in enumerate(combined_messages)])
-            
-            # Use the first message data as base
-            first_message_data = batch[0]['data'].copy()  # Create a copy to avoid mutations
-            first_message_data['text'] = combined_text
-            first_message_data['is_batch'] = True
-            first_message_data['batch_size'] = len(batch)
-            first_message_data['batch_message_ids'] = wati_message_ids
-            
-            # Process the combined message with timeout - INSIDE the lock context
-            try:
-                await asyncio.wait_for(
-                    process_message_async(
-                        first_message_data, 
-                        phone_number, 
-                        first_message_data.get('type', 'text'),
-                        f"batch_{phone_number}_{int(time.time())}"
-                    ),
-                    timeout=120  # 2 minutes timeout
-                )
-                print(f"✅ Successfully processed batch of {len(batch)} messages for {phone_number}")
-            except asyncio.TimeoutError:
-                print(f"⏰ Batch processing timed out for {phone_number} (batch size: {len(batch)})")
-            except Exception as e:
-                print(f"❌ Error processing batch for {phone_number} (batch size: {len(batch)}): {str(e)}")
-                import traceback
-                traceback.print_exc()
+        # Combine all messages into one conversation
+        combined_messages = []
+        wati_message_ids = []
+        queue_item_ids = []
+        
+        for msg_item in batch:
+            combined_messages.append(msg_item['text'])
+            if msg_item['data'].get('id'):
+                wati_message_ids.append(msg_item['data']['id'])
+            if msg_item['data'].get('queue_item_id'):
+                queue_item_ids.append(msg_item['data']['queue_item_id'])
+        
+        # Create combined message text
+        if len(combined_messages) == 1:
+            combined_text = combined_messages[0]
+        else:
+            combined_text = "\n".join([f"رسالة {i+1}: {msg}" for i, msg in enumerate(combined_messages)])
+        
+        # Use the first message data as base
+        first_message_data = batch[0]['data'].copy()  # Create a copy to avoid mutations
+        first_message_data['text'] = combined_text
+        first_message_data['is_batch'] = True
+        first_message_data['batch_size'] = len(batch)
+        first_message_data['batch_message_ids'] = wati_message_ids
+        
+        # Process the combined message with timeout - one batch per phone at a time, in order
+        # (asyncio.Lock is FIFO), and at most INGEST_WORKER_COUNT batches running the agents.
+        # Failed batches are retried here, still holding the phone's lock, so a newer batch of
+        # the same phone can't overtake them.
+        async with self._get_processing_lock(phone_number):
+            attempts = 0
+            while True:
+                attempts += 1
+                try:
+                    async with ingest_queue.processing_slot():
+                        await asyncio.wait_for(
+                            process_message_async(
+                                first_message_data, 
+                                phone_number, 
+                                first_message_data.get('type', 'text'),
+                                f"batch_{phone_number}_{int(time.time())}"
+                            ),
+                            timeout=120  # 2 minutes timeout
+                        )
+                    print(f"✅ Successfully processed batch of {len(batch)} messages for {phone_number}")
+                    break
+                except asyncio.TimeoutError as e:
+                    print(f"⏰ Batch processing timed out for {phone_number} (batch size: {len(batch)})")
+                    error = e
+                except Exception as e:
+                    print(f"❌ Error processing batch for {phone_number} (batch size: {len(batch)}): {str(e)}")
+                    import traceback
+                    traceback.print_exc()
+                    error = e
+                
+                if not await ingest_queue.retry(queue_item_ids, error, attempts):
+                    await ingest_queue.fail(queue_item_ids, error)
+                    return
+                await asyncio.sleep(ingest_queue.retry_delay(attempts))
+        
+        # Only now are the messages done - remove them from the ingest queue
+        await ingest_queue.complete(queue_item_ids)
 
-    async def get_stats(self) -> Dict[str, int]:
+    async def get_stats(self) -> Dict[str, Any]:
         """Get statistics about the current batching state"""
         active_batches = len([batch for batch in self._batches.values() if batch])
         active_timers = len([timer for timer in self._timers.values() if not timer.done()])
         total_locks = len(self._locks)
         
+        delays = sorted(self._batch_delays)
+        def percentile(p):
+            if not delays:
+                return 0.0
+            return round(delays[min(len(delays) - 1, int(len(delays) * p))], 3)
+        
         return {
             "active_batches": active_batches,
             "active_timers": active_timers,
             "total_locks": total_locks,
-            "total_users": len(self._batches)
+            "total_users": len(self._batches),
+            "batch_delay_seconds": {
+                "p50": percentile(0.50),
+                "p95": percentile(0.95),
+                "samples": len(delays)
+            },
+            "flush_reasons": dict(self._flush_reason_counts),
+            "tracked_cadences": len(self._message_gaps),
+            "config": {
+                "default_window": self.default_window,
+                "min_window": self.min_window,
+                "max_window": self.max_window,
+                "max_wait": self.max_wait
+            }
         }
 
 # Create thread-safe instance
 message_batcher = ThreadSafeMessageBatcher()
 
-# Initialize message tracking to prevent infinite loops
-processed_messages = {}
-
 # Remove the old global dictionaries
 # user_message_batches = {}  # REMOVED
 # batch_timers = {}  # REMOVED
@@ -806,6 +968,9 @@ async def process_message_async(data, phone_number, message_type, wati_message_i
             message_type=message_type,
             webhook_data=data
         )
+    else:
+        # Attribute LLM calls made from this task to the journey (per-message /metrics)
+        message_journey_logger.bind_journey(journey_id)
     
     # Start timing the async processing
     async_start_time = time.time()
@@ -1012,29 +1177,75 @@ async def process_message_async(data, phone_number, message_type, wati_message_i
         # Quick language detection for embedding agent
         temp_language = language_handler.detect_language(message_text)
         
-        embedding_start_time = time.time()
-        embedding_result = await embedding_agent.process_message(
-            user_message=message_text,
-            conversation_history=conversation_history,
-            user_language=temp_language,
-            journey_id=journey_id
-        )
+        # Template inquiries ("وش الماركات في جدة") are answered from the catalog without any LLM call
+        fast_path_result = None
+        if not (is_access_restricted() and not is_allowed_user):
+            fast_path_result = await fast_path_router.route(message_text, journey_id)
+        
+        triage_result = None
+        if fast_path_result is None:
+            embedding_start_time = time.time()
+            if triage_agent.enabled:
+                # One structured call decides KB answer, message type, relevance, language and mentions
+                embedding_result = await embedding_agent.process_message(
+                    user_message=message_text,
+                    conversation_history=conversation_history,
+                    user_language=temp_language,
+                    journey_id=journey_id,
+                    evaluate=False
+                )
+                if embedding_result['action'] in ('needs_evaluation', 'continue_to_classification'):
+                    triage_result = await triage_agent.triage(
+                        message_text,
+                        conversation_history,
+                        kb_match=embedding_result if embedding_result['action'] == 'needs_evaluation' else None,
+                        journey_id=journey_id
+                    )
+                if embedding_result['action'] == 'needs_evaluation':
+                    # Without a triage result this falls back to the ChatGPT evaluation
+                    embedding_result = await embedding_agent.evaluate_match(
+                        message_text,
+                        embedding_result,
+                        conversation_history,
+                        journey_id,
+                        action=triage_result['kb_action'] if triage_result else None
+                    )
+            else:
+                embedding_result = await embedding_agent.process_message(
+                    user_message=message_text,
+                    conversation_history=conversation_history,
+                    user_language=temp_language,
+                    journey_id=journey_id
+                )
         
-        # Log embedding agent processing
-        message_journey_logger.log_embedding_agent(
-            journey_id=journey_id,
-            user_message=message_text,
-            action=embedding_result['action'],
-            confidence=embedding_result['confidence'],
-            matched_question=embedding_result.get('matched_question'),
-            response=embedding_result.get('response'),
-            duration_ms=int((time.time() - embedding_start_time) * 1000)
-        )
+            # Log embedding agent processing
+            message_journey_logger.log_embedding_agent(
+                journey_id=journey_id,
+                user_message=message_text,
+                action=embedding_result['action'],
+                confidence=embedding_result['confidence'],
+                matched_question=embedding_result.get('matched_question'),
+                response=embedding_result.get('response'),
+                duration_ms=int((time.time() - embedding_start_time) * 1000)
+            )
         
-        print(f"🎯 Embedding agent result: {embedding_result['action']} (confidence: {embedding_result['confidence']:.3f})")
-        print(f"🔍 Full embedding result: {embedding_result}")
+            print(f"🎯 Embedding agent result: {embedding_result['action']} (confidence: {embedding_result['confidence']:.3f})")
+            print(f"🔍 Full embedding result: {embedding_result}")
         
-        if embedding_result['action'] == 'reply':
+        if fast_path_result:
+            response_text = fast_path_result['response']
+            detected_language = fast_path_result['language']
+            classified_message_type, detected_language = message_classifier.record_classification(
+                message_text, db, user_message, MessageType.INQUIRY, detected_language
+            )
+            
+            # Store the detected language in session context
+            context = json.loads(session.context) if session.context else {}
+            context['language'] = detected_language
+            session.context = json.dumps(context)
+            db.commit()
+            
+        elif embedding_result['action'] == 'reply':
             # Found a good match in knowledge base - use it directly
             response_text = embedding_result['response']
             detected_language = temp_language
@@ -1082,9 +1293,14 @@ async def process_message_async(data, phone_number, message_type, wati_message_i
             
             # Classify message and detect language WITH conversation history
             classification_start_time = time.time()
-            classified_message_type, detected_language = await message_classifier.classify_message(
-                message_text, db, user_message, conversation_history
-            )
+            if triage_result:
+                classified_message_type, detected_language = message_classifier.record_classification(
+                    message_text, db, user_message, triage_result['message_type'], triage_result['language']
+                )
+            else:
+                classified_message_type, detected_language = await message_classifier.classify_message(
+                    message_text, db, user_message, conversation_history
+                )
             
             # Log message classification
             message_journey_logger.log_classification(
@@ -1235,9 +1451,15 @@ Important notes:
                     user_message=message_text,
                     conversation_history=conversation_history,
                     user_language=detected_language,
-                    journey_id=journey_id
+                    journey_id=journey_id,
+                    triage=triage_result,
+                    session_context=context
                 )
                 
+                # Keep the resolved city/brand for the next turn (also when no reply is sent)
+                session.context = json.dumps(context, ensure_ascii=False)
+                db.commit()
+                
                 message_journey_logger.log_agent_processing(
                     journey_id=journey_id,
                     agent_name="query_agent",
@@ -1275,9 +1497,15 @@ Important notes:
                     user_message=message_text,
                     conversation_history=conversation_history,
                     user_language=detected_language,
-                    journey_id=journey_id
+                    journey_id=journey_id,
+                    triage=triage_result,
+                    session_context=context
                 )
                 
+                # Keep the resolved city/brand for the next turn (also when no reply is sent)
+                session.context = json.dumps(context, ensure_ascii=False)
+                db.commit()
+                
                 message_journey_logger.log_agent_processing(
                     journey_id=journey_id,
                     agent_name="query_agent",
@@ -1427,95 +1655,9 @@ Important notes:
         print(f"🔄 Async processing completed for message {wati_message_id}")
 
 async def send_whatsapp_message(phone_number: str, message: str):
-    
-    """Send message through Wati API"""
-    wati_api_key = os.getenv("WATI_API_KEY")
-    
-    # Check for both possible environment variable names
-    wati_api_url = os.getenv("WATI_API_URL") or os.getenv("WATI_INSTANCE_ID")
-    
-    # If neither is set, use the user's default URL
-    if not wati_api_url:
-        wati_api_url = "https://live-mt-server.wati.io/301269/api/v1"
-        print(f"💡 Using default Wati URL: {wati_api_url}")
-    
-    # Check if Wati configuration is complete
-    if not wati_api_key:
-        error_msg = "WATI_API_KEY environment variable is not set"
-        print(f"❌ [Wati Config Error] {error_msg}")
-        return {"error": error_msg}
-    
-    # Clean up the URL if it doesn't end with /api/v1
-    if not wati_api_url.endswith('/api/v1'):
-        if wati_api_url.endswith('/'):
-            wati_api_url = wati_api_url + 'api/v1'
-        else:
-            wati_api_url = wati_api_url + '/api/v1'
-    
-    try:
-        print(f"📤 Sending WhatsApp message to {phone_number}")
-        print(f"🔗 Using Wati API URL: {wati_api_url}")
-        print(f"🔤 Original message: {message}")
-        
-        # URL encode the message to handle special characters, including Arabic
-        encoded_message = urllib.parse.quote(message, safe='', encoding='utf-8')
-        
-        # Use sendSessionMessage endpoint as shown in working examples
-        send_url = f"{wati_api_url}/sendSessionMessage/{phone_number}?messageText={encoded_message}"
-        
-        print(f"📡 Request URL: {send_url[:80]}...")  # Show partial URL for debugging
-        
-        # Headers based on working examples with proper UTF-8 support
-        headers = {
-            "Authorization": f"Bearer {wati_api_key}",
-            "Content-Type": "application/json; charset=utf-8",
-            "accept": "*/*",
-            "accept-language": "ar,en-GB;q=0.9,en;q=0.8,ar-EG;q=0.7,en-US;q=0.6",
-            "accept-charset": "utf-8",
-            "origin": "https://live.wati.io",
-            "referer": "https://live.wati.io/",
-            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"
-        }
-        
-        # Empty payload as message is in URL (as per working examples)
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-            async with session.post(
-                send_url,
-                headers=headers,
-                data={}  # Empty payload
-            ) as response:
-                if response.status == 200:
-                    print(f"✅ Message sent successfully to {phone_number}")
-                    # Try to parse JSON response, but handle if it's not JSON
-                    try:
-                        result = await response.json()
-                    except:
-                        result = {"status": "success", "text": await response.text()}
-                else:
-                    print(f"⚠️ Wati API returned status {response.status}")
-                    response_text = await response.text()
-                    print(f"Response: {response_text}")
-                    
-                    # Try alternative endpoints if primary fails
-                    print("🔄 Trying alternative endpoint...")
-                    alt_url = f"{wati_api_url}/sendMessage?whatsappNumber={phone_number}&messageText={encoded_message}"
-                    async with session.post(alt_url, headers=headers, data={}) as alt_response:
-                        if alt_response.status == 200:
-                            print(f"✅ Alternative endpoint successful!")
-                            try:
-                                result = await alt_response.json()
-                            except:
-                                result = {"status": "success", "text": await alt_response.text()}
-                        else:
-                            print(f"❌ Alternative endpoint also failed: {alt_response.status}")
-                            result = {"error": f"HTTP {response.status}", "response": response_text}
-                
-                return result
-                
-    except Exception as e:
-        error_msg = f"Failed to send WhatsApp message: {str(e)}"
-        print(f"❌ [Wati API Error] {error_msg}")
-        return {"error": error_msg}
+    """Send message through Wati API (pooled, rate-limited, ordered per phone number)"""
+    print(f"📤 Sending WhatsApp message to {phone_number}")
+    return await whatsapp_sender.send(phone_number, message)
 
 # Direct client message endpoint
 @app.post("/send-message")
@@ -2444,6 +2586,106 @@ async def update_user_conclusion(request: Request, db=Depends(get_db)):
         print(f"[Update User ERROR] {str(e)}")
         return {"status": "error", "message": str(e)}
 
+@app.get("/debug/ingest-queue")
+async def debug_ingest_queue(include_failed: bool = False):
+    """Webhook ingest queue depth, lag and worker metrics"""
+    stats = ingest_queue.get_stats()
+    stats["dedup"] = message_deduplicator.get_stats()
+    if include_failed:
+        stats["failed_items"] = ingest_queue.get_failed_items()
+    return {"status": "success", "data": stats}
+
+@app.get("/debug/message-batcher")
+async def debug_message_batcher():
+    """Message batching state and adaptive debounce delay stats"""
+    return {"status": "success", "data": await message_batcher.get_stats()}
+
+@app.get("/debug/outbound-sender")
+async def debug_outbound_sender(include_dead_letters: bool = False):
+    """Outbound WhatsApp sender latency, retry and failure metrics"""
+    stats = whatsapp_sender.get_stats()
+    if include_dead_letters:
+        stats["dead_letters"] = whatsapp_sender.get_dead_letters()
+    return {"status": "success", "data": stats}
+
+@app.get("/debug/journeys")
+async def debug_journeys(journey_id: Optional[str] = None, phone_number: Optional[str] = None, limit: int = 20):
+    """Look up message journeys by ID or phone number (ring buffer + persisted journey store)"""
+    if journey_id:
+        journey = message_journey_logger.get_journey_summary(journey_id)
+        if journey is None:
+            raise HTTPException(status_code=404, detail="Journey not found")
+        return {"status": "success", "data": journey}
+    if phone_number:
+        return {"status": "success", "data": message_journey_logger.get_journeys_by_phone(phone_number, limit)}
+    return {"status": "success", "data": message_journey_logger.get_stats()}
+
+@app.get("/debug/llm-scheduler")
+async def debug_llm_scheduler():
+    """Shared LLM scheduler: in-flight calls, queued calls per priority lane, per-model budgets"""
+    return {"status": "success", "data": llm_scheduler.get_stats()}
+
+@app.get("/debug/validation-policy")
+async def debug_validation_policy():
+    """Response validation policy: validated/skipped replies by reason, audit refusals and estimated time saved"""
+    return {"status": "success", "data": validation_policy.get_stats()}
+
+@app.get("/debug/tool-results")
+async def debug_tool_results():
+    """Compact tool-result serializer: tokens sent vs the JSON dumps they replaced, rows cut by the row cap"""
+    return {"status": "success", "data": tool_result_serializer.get_stats()}
+
+@app.get("/debug/fast-path")
+async def debug_fast_path():
+    """Deterministic fast-path router: hit rate, answered intents and fallback reasons"""
+    return {"status": "success", "data": fast_path_router.get_stats()}
+
+@app.get("/debug/gazetteer")
+async def debug_gazetteer(text: Optional[str] = None):
+    """City/brand/district mention automaton: size, build stats and (with ?text=) the exact and fuzzy mentions it finds"""
+    data = entity_gazetteer.get_stats()
+    if text:
+        normalized = DistrictLookup.normalize_city_name(text)
+        data["text_normalized"] = normalized
+        data["mentions"] = [
+            {
+                "kind": match["kind"],
+                "name": match["item"].get("name") or match["item"].get("title"),
+                "field": match["field"],
+                "span": [match["start"], match["end"]]
+            }
+            for match in entity_gazetteer.find(normalized)
+        ]
+        data["fuzzy"] = {
+            kind: [
+                {"name": match["item"].get("name") or match["item"].get("title"), "phrase": match["phrase"], "score": match["score"]}
+                for match in entity_gazetteer.fuzzy_mentions(kind, normalized)
+            ]
+            for kind in entity_gazetteer.KINDS
+        }
+    return {"status": "success", "data": data}
+
+@app.get("/debug/triage")
+async def debug_triage():
+    """Single-call triage mode (MESSAGE_TRIAGE_MODE) and how often it fell back to the per-agent calls"""
+    return {"status": "success", "data": triage_agent.get_stats()}
+
+@app.get("/debug/llm-cache")
+async def debug_llm_cache():
+    """Memoized LLM sub-decisions: hit rate overall and per decision type"""
+    return {"status": "success", "data": llm_decision_cache.get_stats()}
+
+@app.delete("/debug/llm-cache")
+async def clear_llm_cache(namespace: Optional[str] = None):
+    """Drop cached LLM decisions, e.g. after editing a prompt without bumping its version"""
+    deleted = llm_decision_cache.clear(namespace)
+    return {"status": "success", "data": {"deleted": deleted, "namespace": namespace}}
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus scrape endpoint - stage, LLM and per-message histograms from the message journeys"""
+    return Response(content=chatbot_metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/debug/knowledge-structure")
 async def debug_knowledge_structure():
     """Debug endpoint to test knowledge base structure"""
@@ -2677,21 +2919,58 @@ async def trigger_initial_sync(db=Depends(get_db)):
         print(f"❌ Initial sync failed: {str(e)}")
         return {"status": "error", "message": str(e)}
 
+async def scheduler_leader_loop():
+    """Hold the scheduler lease and run the daily sync scheduler while we hold it"""
+    coordinator = get_coordination_backend()
+    while True:
+        try:
+            if coordinator.acquire("data_sync_scheduler", WORKER_ID, 120):
+                if not scheduler.is_running:
+                    scheduler.start_scheduler("02:00")  # Start daily sync at 2 AM
+                    print(f"Data sync scheduler initialized successfully (worker {WORKER_ID})")
+            elif scheduler.is_running:
+                # Another worker took over the lease
+                scheduler.stop_scheduler()
+        except Exception as e:
+            print(f"Failed to initialize scheduler: {str(e)}")
+        
+        if coordinator.is_local:
+            return
+        await asyncio.sleep(30)
+
 @app.on_event("startup")
 async def startup_event():
     """Run on application startup"""
     print("Starting Abar Chatbot API...")
     
-    # Initialize the data sync scheduler
+    # Initialize the data sync scheduler - only one worker runs it in multi-worker mode
+    asyncio.create_task(scheduler_leader_loop())
+    
+    # Build the entity gazetteer before any message is handled; later refreshes run in the background
     try:
-        scheduler.start_scheduler("02:00")  # Start daily sync at 2 AM
-        print("Data sync scheduler initialized successfully")
+        await asyncio.to_thread(entity_gazetteer.rebuild)
+        print("Entity gazetteer built successfully")
     except Exception as e:
-        print(f"Failed to initialize scheduler: {str(e)}")
+        print(f"Failed to build entity gazetteer: {str(e)}")
+    
+    # Start the webhook ingest workers (also re-dispatches messages left over from a restart)
+    try:
+        await ingest_queue.start(process_webhook_async)
+        print("Webhook ingest queue started successfully")
+    except Exception as e:
+        print(f"Failed to start webhook ingest queue: {str(e)}")
     
     # You can uncomment this to populate the knowledge base on startup
     # knowledge_manager.populate_abar_knowledge()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Run on application shutdown"""
+    # Unfinished queue rows stay in SQLite and are recovered on the next startup
+    await ingest_queue.stop()
+    await whatsapp_sender.close()
+    message_journey_logger.shutdown()
+
 if __name__ == "__main__":
     print("Starting Abar Chatbot API...")
     uvicorn.run("app:app", host="0.0.0.0", port=8000, reload=False)
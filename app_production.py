@@ -7,6 +7,15 @@ from dotenv import load_dotenv
 # Load environment variables
 load_dotenv()
 
+# Number of uvicorn worker processes. With more than one worker, per-phone batching,
+# dedup and the scheduler are coordinated through COORDINATION_BACKEND
+# ('sqlite' by default, or a redis:// URL for multi-host setups)
+APP_WORKERS = int(os.getenv("APP_WORKERS", "1"))
+
+if APP_WORKERS > 1:
+    # Set before the workers start so every process picks the same shared backend
+    os.environ.setdefault("COORDINATION_BACKEND", "sqlite")
+
 # Import the main app
 from app import app
 
@@ -18,5 +27,6 @@ if __name__ == "__main__":
         "app:app", 
         host="0.0.0.0", 
         port=8000, 
-        reload=False  # Disable auto-reload
+        reload=False,  # Disable auto-reload
+        workers=APP_WORKERS
     ) 
\ No newline at end of file
@@ -1,9 +1,11 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, create_engine, Enum, Float, Table, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, DateTime, create_engine, Enum, Float, Table, UniqueConstraint, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 import datetime
 import enum
 
+from utils.arabic_normalizer import normalize_search
+
 Base = declarative_base()
 
 # Many-to-many association table between cities and brands
@@ -47,7 +49,7 @@ class UserMessage(Base):
     timestamp = Column(DateTime, default=datetime.datetime.utcnow)
     message_type = Column(Enum(MessageType), nullable=True)
     language = Column(String(2), default='ar')  # 'ar' for Arabic, 'en' for English
-    wati_message_id = Column(String(255), nullable=True)  # Track Wati message ID to prevent duplicates
+    wati_message_id = Column(String(255), nullable=True, index=True)  # Track Wati message ID to prevent duplicates
     
     # Relationships
     user = relationship("User", back_populates="messages")
@@ -114,6 +116,9 @@ class City(Base):
     name = Column(String(200), nullable=False)  # Arabic name
     name_en = Column(String(200), nullable=True)  # English name
     title = Column(String(200), nullable=True)  # Alternative name field from API
+    name_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(name)
+    name_en_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(name_en)
+    title_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(title)
     lat = Column(Float, nullable=True)  # Latitude
     lng = Column(Float, nullable=True)  # Longitude
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
@@ -129,6 +134,8 @@ class Brand(Base):
     external_id = Column(Integer, unique=True, nullable=False)  # contract_id from external API
     title = Column(String(200), nullable=False)  # Arabic title
     title_en = Column(String(200), nullable=True)  # English title
+    title_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(title)
+    title_en_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(title_en)
     image_url = Column(Text, nullable=True)
     mounting_rate_image = Column(Text, nullable=True)
     meta_keywords = Column(Text, nullable=True)
@@ -148,6 +155,8 @@ class Product(Base):
     brand_id = Column(Integer, ForeignKey("brands.id"), nullable=False)
     title = Column(String(200), nullable=False)
     title_en = Column(String(200), nullable=True)
+    title_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(title)
+    title_en_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(title_en)
     packing = Column(String(200), nullable=True)
     market_price = Column(Float, nullable=True)
     contract_price = Column(Float, nullable=True)  # Added contract_price field
@@ -174,12 +183,36 @@ class District(Base):
     id = Column(Integer, primary_key=True, autoincrement=True)
     name = Column(String(200), nullable=False, index=True)  # District name in Arabic (حي)
     city_name = Column(String(200), nullable=False, index=True)  # City name in Arabic (المدينة)
+    name_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(name)
+    city_name_normalized = Column(String(200), nullable=True, index=True)  # normalize_search(city_name)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
     
     # Add unique constraint to prevent duplicate district-city combinations
     __table_args__ = (UniqueConstraint('name', 'city_name', name='uq_district_city'),)
 
+# Normalized search keys: (source column, key column) per catalog model. Name lookups compare
+# normalize_search(query) against the indexed key columns (exact match / prefix range) instead of
+# ILIKE '%x%' scans; the keys are refreshed on every ORM insert/update, including the data sync.
+SEARCH_KEY_COLUMNS = {
+    City: (("name", "name_normalized"), ("name_en", "name_en_normalized"), ("title", "title_normalized")),
+    Brand: (("title", "title_normalized"), ("title_en", "title_en_normalized")),
+    Product: (("title", "title_normalized"), ("title_en", "title_en_normalized")),
+    District: (("name", "name_normalized"), ("city_name", "city_name_normalized")),
+}
+
+def set_search_keys(target):
+    """Fill the *_normalized columns of a City, Brand, Product or District from its names"""
+    for source, key in SEARCH_KEY_COLUMNS[type(target)]:
+        setattr(target, key, normalize_search(getattr(target, source)) or None)
+
+def _set_search_keys_listener(mapper, connection, target):
+    set_search_keys(target)
+
+for _model in SEARCH_KEY_COLUMNS:
+    event.listen(_model, "before_insert", _set_search_keys_listener)
+    event.listen(_model, "before_update", _set_search_keys_listener)
+
 # Sync log to track data updates
 class ConversationPause(Base):
     __tablename__ = "conversation_pauses"
@@ -205,4 +238,48 @@ class DataSyncLog(Base):
     records_processed = Column(Integer, default=0)
     error_message = Column(Text, nullable=True)
     started_at = Column(DateTime, default=datetime.datetime.utcnow)
-    completed_at = Column(DateTime, nullable=True) 
\ No newline at end of file
+    completed_at = Column(DateTime, nullable=True) 
+
+class WebhookQueueItem(Base):
+    __tablename__ = "webhook_ingest_queue"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    phone_number = Column(String(20), nullable=False, index=True)
+    partition = Column(Integer, nullable=False, default=0, index=True)  # crc32(phone) % partitions - owned by exactly one worker
+    wati_message_id = Column(String(255), nullable=True)
+    payload = Column(Text, nullable=False)  # Raw webhook JSON
+    status = Column(String(20), nullable=False, default="pending", index=True)  # 'pending', 'processing', 'failed'
+    attempts = Column(Integer, default=0)
+    error_message = Column(Text, nullable=True)
+    enqueued_at = Column(DateTime, default=datetime.datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+
+class ProcessedWebhookMessage(Base):
+    __tablename__ = "processed_webhook_messages"
+    
+    # Primary key doubles as the unique index - a second insert of the same ID fails instantly
+    wati_message_id = Column(String(255), primary_key=True)
+    phone_number = Column(String(20), nullable=True)
+    queue_item_id = Column(Integer, nullable=True)  # webhook_ingest_queue row claimed together with this ID
+    processed_at = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+
+class OutboundDeadLetter(Base):
+    __tablename__ = "outbound_dead_letters"
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    phone_number = Column(String(20), nullable=False, index=True)
+    message = Column(Text, nullable=False)
+    attempts = Column(Integer, default=0)
+    last_status = Column(Integer, nullable=True)  # Last HTTP status from Wati (NULL for network errors)
+    error_message = Column(Text, nullable=True)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+class LLMDecisionCacheEntry(Base):
+    __tablename__ = "llm_decision_cache"
+    
+    # sha256 of namespace + prompt version + normalized text + history window hash
+    cache_key = Column(String(64), primary_key=True)
+    namespace = Column(String(50), nullable=False, index=True)
+    value = Column(Text, nullable=False)  # JSON-encoded LLM result
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
@@ -10,8 +10,8 @@ from database.db_models import Base, User, UserMessage, BotReply, City, Brand, P
 # Create database directory if it doesn't exist
 os.makedirs("database/data", exist_ok=True)
 
-# Database connection
-DATABASE_URL = "sqlite:///database/data/chatbot.sqlite?charset=utf8"
+# Database connection (DATABASE_URL points tools such as the load test at a scratch copy)
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///database/data/chatbot.sqlite?charset=utf8")
 
 # Configure SQLite for better concurrency
 engine = create_engine(
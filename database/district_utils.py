@@ -1,8 +1,11 @@
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterable, Callable
+from array import array
+from bisect import bisect_left, bisect_right
 from sqlalchemy.orm import Session
 from database.db_models import District
 from database.db_utils import SessionLocal
 import re
+from utils.arabic_normalizer import normalize_search
 
 class DistrictLookup:
     """Utility class for looking up cities by district names"""
@@ -13,36 +16,8 @@ class DistrictLookup:
         Comprehensive Arabic text normalization for better city extraction
         Removes hamza and normalizes common Arabic character variations
         """
-        if not city_name:
-            return city_name
-            
-        normalized = city_name.strip().lower()
-        
-        # Comprehensive Arabic character normalization
-        normalizations = {
-            # Remove standalone hamza
-            'ء': '',
-            # Alif variations
-            'أ': 'ا',  # alif with hamza above -> alif
-            'إ': 'ا',  # alif with hamza below -> alif
-            'آ': 'ا',  # alif with madda -> alif
-            # Yeh variations  
-            'ى': 'ي',  # alif maksura -> yeh
-            'ئ': 'ي',  # yeh with hamza -> yeh
-            # Waw variations
-            'ؤ': 'و',  # waw with hamza -> waw
-            # Teh marbuta
-            'ة': 'ه',  # teh marbuta -> heh
-        }
-        
-        # Apply all normalizations
-        for original, replacement in normalizations.items():
-            normalized = normalized.replace(original, replacement)
-        
-        # Remove extra whitespace
-        normalized = ' '.join(normalized.split())
-                
-        return normalized
+        # Guarded str.replace folding + LRU memo (utils.arabic_normalizer, "search" profile)
+        return normalize_search(city_name)
     
     @staticmethod
     def get_city_by_district(district_name: str, session: Optional[Session] = None) -> Optional[str]:
@@ -51,43 +26,44 @@ class DistrictLookup:
         
         Args:
             district_name: The district name to search for
-            session: Optional database session, if not provided a new one will be created
+            session: Unused - lookups are served from the in-memory district index
             
         Returns:
             The city name if found, None otherwise
         """
-        should_close_session = False
-        if session is None:
-            session = SessionLocal()
-            should_close_session = True
-        
         try:
+            # Import here to avoid circular imports
+            from services.gazetteer import entity_gazetteer
+            index = entity_gazetteer.district_index()
+            
             # Clean the district name
             clean_district = district_name.strip()
             
             # Direct match first
-            district = session.query(District).filter_by(name=clean_district).first()
-            
-            if district:
-                # Normalize the city name to handle spelling variations
-                return DistrictLookup.normalize_city_name(district.city_name)
-            
-            # If no direct match, try partial matching (case-insensitive)
-            district = session.query(District).filter(
-                District.name.like(f'%{clean_district}%')
-            ).first()
-            
-            if district:
-                return DistrictLookup.normalize_city_name(district.city_name)
+            position = index.exact(clean_district)
+            
+            # If no direct match, try partial matching: names starting with it, having it as a
+            # whole word, then containing it
+            if position is None:
+                normalized_district = DistrictLookup.normalize_city_name(clean_district)
+                matches = (index.with_prefix(normalized_district) or index.with_token(normalized_district)
+                           or index.containing(normalized_district))
+                position = matches[0] if matches else None
+            
+            if position is not None:
+                # City name is stored normalized to handle spelling variations
+                return index.city(position)
+            
+            # Last resort: closest district name within a few typos
+            fuzzy_districts = entity_gazetteer.fuzzy("district", DistrictLookup.normalize_city_name(clean_district), limit=1)
+            if fuzzy_districts:
+                return DistrictLookup.normalize_city_name(fuzzy_districts[0]["item"]["city_name"])
                 
             return None
             
         except Exception as e:
             print(f"❌ Error looking up district '{district_name}': {str(e)}")
             return None
-        finally:
-            if should_close_session:
-                session.close()
     
     @staticmethod
     def get_all_districts_for_city(city_name: str, session: Optional[Session] = None) -> List[str]:
@@ -96,26 +72,18 @@ class DistrictLookup:
         
         Args:
             city_name: The city name to search for
-            session: Optional database session, if not provided a new one will be created
+            session: Unused - lookups are served from the in-memory district index
             
         Returns:
             List of district names for the city
         """
-        should_close_session = False
-        if session is None:
-            session = SessionLocal()
-            should_close_session = True
-        
         try:
-            districts = session.query(District).filter_by(city_name=city_name.strip()).all()
-            return [district.name for district in districts]
+            from services.gazetteer import entity_gazetteer
+            return entity_gazetteer.district_index().districts_of_city(city_name)
             
         except Exception as e:
             print(f"❌ Error getting districts for city '{city_name}': {str(e)}")
             return []
-        finally:
-            if should_close_session:
-                session.close()
     
     @staticmethod
     def find_district_in_message(message: str, session: Optional[Session] = None) -> Optional[Dict[str, str]]:
@@ -125,22 +93,15 @@ class DistrictLookup:
         
         Args:
             message: The user message to search
-            session: Optional database session
+            session: Unused - lookups are served from the in-memory district index
             
         Returns:
             Dict with 'district' and 'city' keys if found, None otherwise
         """
-        should_close_session = False
-        if session is None:
-            session = SessionLocal()
-            should_close_session = True
-        
         try:
-            # Get all districts from database
-            all_districts = session.query(District).all()
-            
-            # Sort by length (longest first) for better exact matching
-            districts_sorted = sorted(all_districts, key=lambda d: len(d.name), reverse=True)
+            # Import here to avoid circular imports
+            from services.gazetteer import entity_gazetteer
+            index = entity_gazetteer.district_index()
             
             message_lower = message.lower()
             
@@ -148,20 +109,17 @@ class DistrictLookup:
             normalized_message = DistrictLookup.normalize_city_name(message)
             
             # PHASE 1: Look for exact district name matches first
-            for district in districts_sorted:
-                district_name = district.name.strip()
-                # Normalize district name for comparison
-                normalized_district_name = DistrictLookup.normalize_city_name(district_name)
-                
-                if normalized_district_name.lower() in normalized_message.lower():
-                    print(f"🎯 District match found:")
-                    print(f"   Original district: '{district_name}'")
-                    print(f"   Normalized district: '{normalized_district_name}'")
-                    print(f"   User message normalized: '{normalized_message}'")
-                    return {
-                        'district': district_name,
-                        'city': DistrictLookup.normalize_city_name(district.city_name)
-                    }
+            # One automaton pass; matches come longest district name first
+            district_matches = index.within(normalized_message)
+            if district_matches:
+                position = district_matches[0]
+                print(f"🎯 District match found:")
+                print(f"   Original district: '{index.names[position]}'")
+                print(f"   User message normalized: '{normalized_message}'")
+                return {
+                    'district': index.names[position],
+                    'city': index.city(position)
+                }
             
             # PHASE 2: Look for partial district name matches
             # Extract potential district names after keywords
@@ -182,33 +140,40 @@ class DistrictLookup:
                         # Normalize potential district for better matching
                         normalized_potential_district = DistrictLookup.normalize_city_name(potential_district_clean)
                         
-                        # Look for partial matches with normalization
-                        for district in all_districts:
-                            district_name = district.name.strip()
-                            normalized_district_name = DistrictLookup.normalize_city_name(district_name).lower()
-                            
-                            # Check if the potential district is a substring of the actual district
-                            # or vice versa (handles "الحمراء" matching "الحمراء الأول")
-                            if (normalized_potential_district in normalized_district_name or 
-                                normalized_district_name in normalized_potential_district or
-                                any(word in normalized_district_name for word in normalized_potential_district.split() if len(word) > 2)):
-                                
-                                print(f"🔍 Partial match with normalization:")
-                                print(f"   Original potential: '{potential_district_clean}' -> Normalized: '{normalized_potential_district}'")
-                                print(f"   Original district: '{district_name}' -> Normalized: '{normalized_district_name}'")
-                                return {
-                                    'district': district.name.strip(),
-                                    'city': DistrictLookup.normalize_city_name(district.city_name)
-                                }
+                        # Partial matches with normalization: the potential district is a substring of
+                        # the actual district or vice versa (handles "الحمراء" matching "الحمراء الأول"),
+                        # or one of its words (longer than 2 letters) is
+                        candidates = set(index.containing(normalized_potential_district))
+                        candidates.update(index.within(normalized_potential_district))
+                        for word in normalized_potential_district.split():
+                            if len(word) > 2:
+                                candidates.update(index.containing(word))
+                        
+                        if candidates:
+                            position = min(candidates, key=lambda candidate: index.ids[candidate])
+                            print(f"🔍 Partial match with normalization:")
+                            print(f"   Original potential: '{potential_district_clean}' -> Normalized: '{normalized_potential_district}'")
+                            print(f"   Original district: '{index.names[position]}' -> Normalized: '{index.normalized[position]}'")
+                            return {
+                                'district': index.names[position],
+                                'city': index.city(position)
+                            }
+                        
+                        # PHASE 3: Misspelled district name after the keyword
+                        fuzzy_districts = entity_gazetteer.fuzzy_mentions("district", normalized_potential_district)
+                        if fuzzy_districts:
+                            district = fuzzy_districts[0]["item"]
+                            print(f"🔤 Fuzzy district match: '{fuzzy_districts[0]['phrase']}' -> '{district['name']}' (score {fuzzy_districts[0]['score']})")
+                            return {
+                                'district': district['name'],
+                                'city': DistrictLookup.normalize_city_name(district['city_name'])
+                            }
             
             return None
             
         except Exception as e:
             print(f"❌ Error finding district in message: {str(e)}")
             return None
-        finally:
-            if should_close_session:
-                session.close()
     
     @staticmethod
     def is_city_serviced(city_name: str, session: Optional[Session] = None) -> Dict[str, Any]:
@@ -389,5 +354,118 @@ class DistrictLookup:
             if should_close_session:
                 session.close()
 
+class DistrictIndex:
+    """
+    Read-only in-memory index over the District table, built together with the entity
+    gazetteer (services/gazetteer.py) and swapped with it after a sync, so district lookups
+    never query SQLite.
+
+    Positions follow the district list it is built from (longest name first); "first" match
+    means lowest district id, like the old unordered queries. Storage is array-backed:
+        names / normalized      district name as stored and normalized
+        ids, city_of            array of district ids and of indexes into cities
+        cities                  normalized city names (district -> city map)
+        postings                normalized token -> array of positions
+        sorted_names            normalized names in sort order (prefix lookups with bisect)
+        haystack                all normalized names joined by newlines (substring lookups
+                                with str.find, mapped back to positions by offset)
+    Names occurring inside a text are found by the gazetteer's automaton (matcher).
+    """
+
+    def __init__(self, districts: List[Dict[str, Any]], matcher: Optional[Callable[[str], Iterable[int]]] = None):
+        self.matcher = matcher
+        self.names: List[str] = [district["name"] for district in districts]
+        self.normalized: List[str] = [DistrictLookup.normalize_city_name(name) for name in self.names]
+        self.ids = array('l', (district["id"] for district in districts))
+
+        self.cities: List[str] = []
+        self.raw_cities: List[str] = []
+        city_positions: Dict[str, int] = {}
+        self.city_of = array('l')
+        for district in districts:
+            raw_city = (district["city_name"] or "").strip()
+            if raw_city not in city_positions:
+                city_positions[raw_city] = len(self.raw_cities)
+                self.raw_cities.append(raw_city)
+                self.cities.append(DistrictLookup.normalize_city_name(raw_city))
+            self.city_of.append(city_positions[raw_city])
+
+        self.by_city: Dict[str, array] = {}
+        self.by_name: Dict[str, int] = {}
+        self.by_normalized: Dict[str, int] = {}
+        self.postings: Dict[str, array] = {}
+        for position in self._by_id(range(len(self.names))):
+            self.by_city.setdefault(self.raw_cities[self.city_of[position]], array('l')).append(position)
+            self.by_name.setdefault(self.names[position], position)
+            self.by_normalized.setdefault(self.normalized[position], position)
+            for token in set(self.normalized[position].split()):
+                self.postings.setdefault(token, array('l')).append(position)
+
+        order = sorted(range(len(self.normalized)), key=lambda position: self.normalized[position])
+        self.sorted_names = [self.normalized[position] for position in order]
+        self.sorted_positions = array('l', order)
+
+        self.haystack = "\n".join(self.normalized)
+        self.offsets = array('l')
+        offset = 0
+        for name in self.normalized:
+            self.offsets.append(offset)
+            offset += len(name) + 1
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def _by_id(self, positions: Iterable[int]) -> List[int]:
+        return sorted(set(positions), key=lambda position: self.ids[position])
+
+    def city(self, position: int) -> str:
+        """Normalized city name of a district"""
+        return self.cities[self.city_of[position]]
+
+    def exact(self, name: str) -> Optional[int]:
+        """Position of a district by stored name, then by normalized name"""
+        position = self.by_name.get(name)
+        if position is None:
+            position = self.by_normalized.get(DistrictLookup.normalize_city_name(name))
+        return position
+
+    def with_token(self, token: str) -> List[int]:
+        """Districts whose normalized name has the (normalized) token as a whole word, by id"""
+        return list(self.postings.get(token, ()))
+
+    def with_prefix(self, prefix: str) -> List[int]:
+        """Districts whose normalized name starts with prefix, by id"""
+        if not prefix:
+            return []
+        start = bisect_left(self.sorted_names, prefix)
+        end = bisect_right(self.sorted_names, prefix + "\uffff")
+        return self._by_id(self.sorted_positions[start:end])
+
+    def containing(self, text: str) -> List[int]:
+        """Districts whose normalized name contains text, by id"""
+        if not text or "\n" in text:
+            return []
+        positions = []
+        found = self.haystack.find(text)
+        while found != -1:
+            position = bisect_right(self.offsets, found) - 1
+            positions.append(position)
+            # Continue after this name - one hit per district is enough
+            next_start = self.offsets[position + 1] if position + 1 < len(self.offsets) else len(self.haystack)
+            found = self.haystack.find(text, next_start)
+        return self._by_id(positions)
+
+    def within(self, normalized_text: str) -> List[int]:
+        """Districts whose normalized name occurs in the text, longest name first"""
+        if not normalized_text:
+            return []
+        if self.matcher is not None:
+            return sorted(set(self.matcher(normalized_text)))
+        return [position for position, name in enumerate(self.normalized) if name and name in normalized_text]
+
+    def districts_of_city(self, city_name: str) -> List[str]:
+        return [self.names[position] for position in self.by_city.get(city_name.strip(), ())]
+
+
 # Create a global instance for easy access
 district_lookup = DistrictLookup() 
\ No newline at end of file
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Database migration script for the shared message dedup index
+- Adds an index on user_messages.wati_message_id (duplicate checks no longer scan the table)
+- Creates processed_webhook_messages and backfills it from existing user messages
+"""
+
+import os
+from sqlalchemy import create_engine, text
+
+# Create database directory if it doesn't exist
+os.makedirs("database/data", exist_ok=True)
+
+# Database connection
+DATABASE_URL = "sqlite:///database/data/chatbot.sqlite"
+engine = create_engine(DATABASE_URL)
+
+def migrate_add_dedup_index():
+    """Add wati_message_id index and processed_webhook_messages table"""
+    try:
+        with engine.connect() as connection:
+            # Index on user_messages.wati_message_id
+            result = connection.execute(text("PRAGMA index_list(user_messages)"))
+            indexes = [row[1] for row in result.fetchall()]
+
+            if 'ix_user_messages_wati_message_id' not in indexes:
+                print("Adding index on user_messages.wati_message_id...")
+                connection.execute(text(
+                    "CREATE INDEX ix_user_messages_wati_message_id ON user_messages (wati_message_id)"
+                ))
+                print("✅ Successfully added wati_message_id index")
+            else:
+                print("ℹ️  wati_message_id index already exists")
+
+            # Persistent dedup table - primary key is the unique index
+            connection.execute(text("""
+                CREATE TABLE IF NOT EXISTS processed_webhook_messages (
+                    wati_message_id VARCHAR(255) NOT NULL PRIMARY KEY,
+                    phone_number VARCHAR(20),
+                    queue_item_id INTEGER,
+                    processed_at DATETIME
+                )
+            """))
+
+            # Claims are now taken together with the ingest queue row
+            result = connection.execute(text("PRAGMA table_info(processed_webhook_messages)"))
+            columns = [row[1] for row in result.fetchall()]
+            if 'queue_item_id' not in columns:
+                print("Adding queue_item_id column to processed_webhook_messages table...")
+                connection.execute(text(
+                    "ALTER TABLE processed_webhook_messages ADD COLUMN queue_item_id INTEGER"
+                ))
+                print("✅ Successfully added queue_item_id column")
+            connection.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_processed_webhook_messages_processed_at "
+                "ON processed_webhook_messages (processed_at)"
+            ))
+
+            # Backfill with messages that were already processed
+            result = connection.execute(text("""
+                INSERT OR IGNORE INTO processed_webhook_messages (wati_message_id, phone_number, processed_at)
+                SELECT um.wati_message_id, u.phone_number, MAX(um.timestamp)
+                FROM user_messages um
+                JOIN users u ON u.id = um.user_id
+                WHERE um.wati_message_id IS NOT NULL AND um.wati_message_id NOT LIKE 'batch_%'
+                GROUP BY um.wati_message_id, u.phone_number
+            """))
+            connection.commit()
+            print(f"✅ Backfilled {result.rowcount} processed message IDs")
+
+    except Exception as e:
+        print(f"❌ Error during migration: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    print("🔄 Starting database migration...")
+    migrate_add_dedup_index()
+    print("✅ Migration completed successfully!")
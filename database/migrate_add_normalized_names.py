@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Database migration script for the normalized search key columns
+- Adds the *_normalized columns to cities, brands, products and districts
+- Indexes them (name lookups become an index seek instead of an ILIKE '%x%' scan)
+- Backfills them with utils.arabic_normalizer.normalize_search
+New and updated rows get their keys from the ORM listeners in db_models.
+"""
+
+import os
+import sys
+from sqlalchemy import create_engine, text
+
+# Add parent directory to Python path for imports
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.arabic_normalizer import normalize_search
+
+# Create database directory if it doesn't exist
+os.makedirs("database/data", exist_ok=True)
+
+# Database connection
+DATABASE_URL = "sqlite:///database/data/chatbot.sqlite"
+engine = create_engine(DATABASE_URL)
+
+# table -> ((source column, key column), ...) - same pairs as db_models.SEARCH_KEY_COLUMNS
+NORMALIZED_COLUMNS = {
+    "cities": (("name", "name_normalized"), ("name_en", "name_en_normalized"), ("title", "title_normalized")),
+    "brands": (("title", "title_normalized"), ("title_en", "title_en_normalized")),
+    "products": (("title", "title_normalized"), ("title_en", "title_en_normalized")),
+    "districts": (("name", "name_normalized"), ("city_name", "city_name_normalized")),
+}
+
+def migrate_add_normalized_names():
+    """Add, index and backfill the normalized name columns"""
+    try:
+        with engine.connect() as connection:
+            for table, pairs in NORMALIZED_COLUMNS.items():
+                result = connection.execute(text(f"PRAGMA table_info({table})"))
+                columns = [row[1] for row in result.fetchall()]
+                if not columns:
+                    print(f"ℹ️  {table} table does not exist yet, skipping")
+                    continue
+
+                for _, key in pairs:
+                    if key not in columns:
+                        print(f"Adding {key} column to {table} table...")
+                        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {key} VARCHAR(200)"))
+                        print(f"✅ Successfully added {table}.{key}")
+                    else:
+                        print(f"ℹ️  {table}.{key} column already exists")
+
+                    connection.execute(text(
+                        f"CREATE INDEX IF NOT EXISTS ix_{table}_{key} ON {table} ({key})"
+                    ))
+
+                # Backfill every row (re-running refreshes keys after a normalizer change)
+                sources = ", ".join(source for source, _ in pairs)
+                assignments = ", ".join(f"{key} = :{key}" for _, key in pairs)
+                rows = connection.execute(text(f"SELECT id, {sources} FROM {table}")).fetchall()
+                for row in rows:
+                    values = {key: normalize_search(row[position + 1]) or None for position, (_, key) in enumerate(pairs)}
+                    connection.execute(text(f"UPDATE {table} SET {assignments} WHERE id = :id"), {"id": row[0], **values})
+                print(f"✅ Backfilled normalized names for {len(rows)} {table}")
+
+            connection.commit()
+
+    except Exception as e:
+        print(f"❌ Error during migration: {str(e)}")
+        raise
+
+if __name__ == "__main__":
+    print("🔄 Starting database migration...")
+    migrate_add_normalized_names()
+    print("✅ Migration completed successfully!")
@@ -81,6 +81,8 @@ print_success "Dependencies updated"
 # Run database migrations
 print_status "Running database migrations..."
 python database/migrate_add_columns.py
+python database/migrate_add_dedup_index.py
+python database/migrate_add_normalized_names.py
 print_success "Database migrations completed"
 
 # Check if systemd service exists and restart it
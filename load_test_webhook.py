@@ -0,0 +1,429 @@
+#!/usr/bin/env python3
+"""
+Webhook Replay Load Test
+Replays recorded (or synthetic) Wati webhook payloads against the FastAPI app in-process:
+/webhook -> ingest queue -> ThreadSafeMessageBatcher -> process_message_async -> agents
+
+The LLM and the Wati sender are stubbed locally, so no network calls and no spend.
+Reports end-to-end and per-stage p50/p95/p99, throughput, event loop lag and DB lock waits.
+
+Runs against a scratch copy of the chatbot database (DATABASE_URL) with the persistent LLM
+decision cache off and journeys in a scratch directory - nothing is written to production data.
+
+Usage:
+    python load_test_webhook.py --synthetic 200 --rate 20 --concurrency 50
+    python load_test_webhook.py --payloads recorded_webhooks.jsonl --rate 50 --llm-latency-ms 300-1200
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import sqlite3
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+from typing import Dict, List, Any, Optional
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+# Agents need an API key at import time - the stubs make sure it is never used
+os.environ.setdefault("OPENAI_API_KEY", "sk-load-test")
+os.environ.setdefault("WATI_API_KEY", "load-test")
+os.environ.setdefault("LANGCHAIN_TRACING_V2", "false")
+
+SYNTHETIC_MESSAGES = [
+    "السلام عليكم",
+    "كم سعر مياه نوفا في الرياض؟",
+    "ابي اطلب مياه",
+    "الرياض",
+    "نستله",
+    "هل توصلون جدة؟",
+    "ايش الماركات المتوفرة عندكم في الدمام",
+    "ارخص كرتون مياه في مكة",
+    "شكرا",
+    "How much is Aquafina in Riyadh?",
+]
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))], 2)
+
+
+def summarize(samples: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(samples),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": round(max(samples), 2) if samples else 0.0
+    }
+
+
+class LoadTestStats:
+    """Everything measured during a run"""
+
+    def __init__(self):
+        self.webhook_latencies: List[float] = []
+        self.webhook_statuses: Dict[int, int] = defaultdict(int)
+        self.e2e_latencies: List[float] = []
+        self.stage_durations: Dict[str, List[float]] = defaultdict(list)
+        self.loop_lag: List[float] = []
+        self.db_query_times: List[float] = []
+        self.db_lock_waits: List[float] = []
+        self.db_lock_errors = 0
+        self.replies_sent = 0
+        self.llm_calls: Dict[str, int] = defaultdict(int)
+        self.pending_by_phone: Dict[str, List[float]] = defaultdict(list)
+        self.sent = 0
+
+
+def isolate_storage(args) -> str:
+    """Point the app at a scratch copy of the database before anything imports it
+
+    Stubbed LLM verdicts must never reach the shared llm_decision_cache, and test users,
+    ingest rows, dedup claims and journeys must not land in the production database.
+    """
+    if "database.db_utils" in sys.modules:
+        raise RuntimeError("isolate_storage() must run before the app/database modules are imported")
+
+    workdir = tempfile.mkdtemp(prefix="abar_load_test_")
+    database_path = os.path.join(workdir, "chatbot.sqlite")
+    if os.path.exists(args.source_database):
+        # Online backup - consistent snapshot even while the bot is writing (WAL)
+        source = sqlite3.connect(args.source_database)
+        target = sqlite3.connect(database_path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+        print(f"🗄️ Using a copy of {args.source_database} in {workdir}")
+    else:
+        print(f"🗄️ {args.source_database} not found - using an empty database in {workdir}")
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{database_path}?charset=utf8"
+    os.environ["LLM_CACHE_PERSISTENT"] = "false"
+    os.environ["JOURNEY_STORE_DIR"] = os.path.join(workdir, "journeys")
+    return workdir
+
+
+def stub_llm_responder(kind: str, messages: List, params: Dict[str, Any]):
+    """Plausible answers for every prompt in the pipeline so all branches keep flowing"""
+    def content_of(message):
+        return message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+
+    text = "\n".join(str(content_of(message) or "") for message in messages)
+
+    if kind == "chat_completion":
+        # First round: two DB-backed tools in parallel, second round: answer
+        if params.get("tools") and not any(
+            isinstance(message, dict) and message.get("role") == "tool" for message in messages
+        ):
+            return {
+                "choices": [{"index": 0, "finish_reason": "tool_calls", "message": {
+                    "role": "assistant", "content": None, "function_call": None,
+                    "tool_calls": [
+                        {"id": "call_cities", "type": "function",
+                         "function": {"name": "get_all_cities", "arguments": "{}"}},
+                        {"id": "call_brands", "type": "function",
+                         "function": {"name": "get_brands_by_city_name", "arguments": "{\"city_name\": \"الرياض\"}"}}
+                    ]
+                }}],
+                "usage": {"prompt_tokens": 1500, "completion_tokens": 40, "total_tokens": 1540}
+            }
+        return {
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {
+                "role": "assistant", "content": "متوفر لدينا عدة ماركات، في أي مدينة أنت؟",
+                "function_call": None, "tool_calls": None
+            }}],
+            "usage": {"prompt_tokens": 1800, "completion_tokens": 30, "total_tokens": 1830}
+        }
+
+    if '"kb_action"' in text:
+        return json.dumps({
+            "message_type": "INQUIRY", "is_relevant": True, "language": "ar",
+            "city_mentions": ["الرياض"], "brand_mentions": ["نستله"], "kb_action": "continue"
+        }, ensure_ascii=False)
+    if '"verdicts"' in text:
+        return json.dumps({"verdicts": [{"index": index, "correct": True, "confidence": 0.9} for index in range(1, 11)]})
+    if '"is_appropriate"' in text:
+        return json.dumps({"is_appropriate": True, "reason": "load test", "confidence": 0.9})
+    if "not_relevant" in text:
+        return "relevant"
+    if "صحيح" in text and "خطأ" in text:
+        return "صحيح"
+    if "`reply`" in text and "`continue`" in text:
+        return "continue"
+    if "استفسار" in text and "تحية" in text:
+        return "استفسار"
+    return "أهلاً وسهلاً، كيف نقدر نخدمك؟"
+
+
+def install_stubs(args, stats: LoadTestStats):
+    """Stub the LLM backend, the Wati sender and instrument the journey logger / DB engine"""
+    from sqlalchemy import event
+    from database.db_utils import engine
+    from utils.llm_backend import llm_backend
+    from utils.message_logger import message_journey_logger
+    from services.whatsapp_sender import whatsapp_sender
+
+    def counting_responder(kind, messages, params):
+        stats.llm_calls[kind] += 1
+        return stub_llm_responder(kind, messages, params)
+
+    llm_backend.install_stub(counting_responder, latency_ms=args.llm_latency_ms)
+
+    async def stub_post_once(phone_number: str, message: str, alternate: bool = False):
+        if args.sender_latency_ms > 0:
+            await asyncio.sleep(args.sender_latency_ms / 1000)
+        now = time.perf_counter()
+        for posted_at in stats.pending_by_phone.pop(phone_number, []):
+            stats.e2e_latencies.append((now - posted_at) * 1000)
+        stats.replies_sent += 1
+        return 200, {"result": True, "load_test": True}, None
+
+    whatsapp_sender._post_once = stub_post_once
+    whatsapp_sender.bucket.rate = max(whatsapp_sender.bucket.rate, 1000)
+    whatsapp_sender.bucket.capacity = max(whatsapp_sender.bucket.capacity, 1000)
+
+    # Per-stage timings straight from the journey steps
+    original_add_step = message_journey_logger.add_step
+
+    def recording_add_step(journey_id, step_type, description, data=None, status="completed", duration_ms=None):
+        if duration_ms is not None:
+            stats.stage_durations[step_type].append(duration_ms)
+        return original_add_step(journey_id, step_type, description, data, status, duration_ms)
+
+    message_journey_logger.add_step = recording_add_step
+    if not args.verbose:
+        message_journey_logger.logger.disabled = True
+
+    # DB statement timings - on SQLite, slow statements are (almost always) lock waits
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("load_test_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["load_test_start"].pop()) * 1000
+        stats.db_query_times.append(elapsed_ms)
+        if elapsed_ms >= args.lock_threshold_ms:
+            stats.db_lock_waits.append(elapsed_ms)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        if "locked" in str(context.original_exception).lower():
+            stats.db_lock_errors += 1
+
+
+def load_payloads(args) -> List[Dict[str, Any]]:
+    """Recorded payloads (JSON lines) or synthetic text messages"""
+    payloads = []
+    if args.payloads:
+        with open(args.payloads, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    payloads.append(json.loads(line))
+    else:
+        for i in range(args.synthetic):
+            payloads.append({
+                "eventType": "message",
+                "type": "text",
+                "text": random.choice(SYNTHETIC_MESSAGES),
+                "waId": f"{args.phone_prefix}{i % args.users:06d}",
+                "senderName": "Load Test",
+            })
+    return payloads
+
+
+def prepare_payload(payload: Dict[str, Any], index: int, args) -> Dict[str, Any]:
+    """Fresh message ID every time (dedup would drop replays) and test-only phone numbers"""
+    data = dict(payload)
+    data["id"] = f"loadtest_{uuid.uuid4().hex}"
+    if args.payloads and not args.keep_phone_numbers:
+        original = str(data.get("waId") or index)
+        data["waId"] = f"{args.phone_prefix}{abs(hash(original)) % args.users:06d}"
+    data.setdefault("conversationId", f"loadtest_conv_{data['waId']}")
+    return data
+
+
+async def monitor_event_loop_lag(stats: LoadTestStats, interval: float = 0.05):
+    """Scheduling delay of a periodic timer = how long the loop was blocked"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        stats.loop_lag.append(max(0.0, (time.perf_counter() - start - interval) * 1000))
+
+
+def pipeline_idle() -> bool:
+    from app import message_batcher
+    from services.ingest_queue import ingest_queue
+
+    if ingest_queue.depth > 0:
+        return False
+    if any(batch for batch in message_batcher._batches.values()):
+        return False
+    if any(not timer.done() for timer in message_batcher._timers.values()):
+        return False
+    return not any(lock.locked() for lock in message_batcher._locks.values())
+
+
+async def run_load_test(args) -> Dict[str, Any]:
+    stats = LoadTestStats()
+    install_stubs(args, stats)
+
+    import httpx
+    from app import app
+
+    payloads = load_payloads(args)
+    if args.loop:
+        payloads = (payloads * (args.loop // max(1, len(payloads)) + 1))[:args.loop]
+    print(f"📦 {len(payloads)} webhook payloads, rate {args.rate}/s, concurrency {args.concurrency}")
+
+    await app.router.startup()
+    lag_task = asyncio.create_task(monitor_event_loop_lag(stats))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    tasks = []
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test", timeout=60) as client:
+
+        async def post_one(index: int, payload: Dict[str, Any]):
+            async with semaphore:
+                data = prepare_payload(payload, index, args)
+                posted_at = time.perf_counter()
+                stats.pending_by_phone[data["waId"]].append(posted_at)
+                try:
+                    response = await client.post("/webhook", json=data)
+                    stats.webhook_statuses[response.status_code] += 1
+                except Exception as e:
+                    stats.webhook_statuses[-1] += 1
+                    print(f"❌ Webhook request failed: {e}")
+                stats.webhook_latencies.append((time.perf_counter() - posted_at) * 1000)
+                stats.sent += 1
+
+        run_start = time.perf_counter()
+        for index, payload in enumerate(payloads):
+            # Open-loop arrivals at the target rate
+            target = run_start + index / args.rate
+            delay = target - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post_one(index, payload)))
+
+        await asyncio.gather(*tasks)
+        send_duration = time.perf_counter() - run_start
+        print(f"📤 All webhooks posted in {send_duration:.1f}s - draining pipeline...")
+
+        # Let batching and processing finish
+        drain_deadline = time.perf_counter() + args.drain_timeout
+        await asyncio.sleep(1)
+        while time.perf_counter() < drain_deadline and not pipeline_idle():
+            await asyncio.sleep(0.25)
+        total_duration = time.perf_counter() - run_start
+
+    lag_task.cancel()
+    await app.router.shutdown()
+
+    unreplied = sum(len(items) for items in stats.pending_by_phone.values())
+    report = {
+        "payloads": len(payloads),
+        "duration_seconds": round(total_duration, 2),
+        "throughput": {
+            "webhooks_per_second": round(stats.sent / send_duration, 2) if send_duration else 0.0,
+            "replies_per_second": round(stats.replies_sent / total_duration, 2) if total_duration else 0.0,
+            "replies_sent": stats.replies_sent,
+            "messages_without_reply": unreplied
+        },
+        "webhook_status_codes": dict(stats.webhook_statuses),
+        "webhook_latency_ms": summarize(stats.webhook_latencies),
+        "end_to_end_latency_ms": summarize(stats.e2e_latencies),
+        "stages_ms": {stage: summarize(samples) for stage, samples in sorted(stats.stage_durations.items())},
+        "event_loop_lag_ms": summarize(stats.loop_lag),
+        "db": {
+            "statements": summarize(stats.db_query_times),
+            "lock_waits": summarize(stats.db_lock_waits),
+            "lock_wait_threshold_ms": args.lock_threshold_ms,
+            "lock_errors": stats.db_lock_errors
+        },
+        "stub_llm_calls": dict(stats.llm_calls)
+    }
+    return report
+
+
+def print_report(report: Dict[str, Any]):
+    def line(name: str, summary: Dict[str, Any]):
+        print(f"   {name:<40} n={summary['count']:<6} p50={summary['p50']:<9} p95={summary['p95']:<9} p99={summary['p99']:<9} max={summary['max']}")
+
+    print(f"\n{'='*60}")
+    print("📊 LOAD TEST REPORT")
+    print(f"{'='*60}")
+    print(f"⏱️  Duration: {report['duration_seconds']}s for {report['payloads']} payloads")
+    throughput = report["throughput"]
+    print(f"🚀 Throughput: {throughput['webhooks_per_second']} webhooks/s, {throughput['replies_per_second']} replies/s")
+    print(f"💬 Replies sent: {throughput['replies_sent']} | Messages without reply: {throughput['messages_without_reply']}")
+    print(f"🌐 Webhook status codes: {report['webhook_status_codes']}")
+
+    print(f"\n{'─'*40}\n📋 Latency (ms)\n{'─'*40}")
+    line("webhook response", report["webhook_latency_ms"])
+    line("end-to-end (webhook -> reply sent)", report["end_to_end_latency_ms"])
+    line("event loop lag", report["event_loop_lag_ms"])
+
+    print(f"\n{'─'*40}\n📋 Stages (ms)\n{'─'*40}")
+    for stage, summary in report["stages_ms"].items():
+        line(stage, summary)
+
+    print(f"\n{'─'*40}\n📋 Database\n{'─'*40}")
+    line("statements", report["db"]["statements"])
+    line(f"lock waits (>= {report['db']['lock_wait_threshold_ms']}ms)", report["db"]["lock_waits"])
+    print(f"   'database is locked' errors: {report['db']['lock_errors']}")
+    print(f"\n🤖 Stub LLM calls: {report['stub_llm_calls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay Wati webhooks against the app with stubbed LLM and sender")
+    parser.add_argument("--payloads", help="JSON lines file with recorded webhook payloads")
+    parser.add_argument("--synthetic", type=int, default=100, help="Number of synthetic messages when no payload file is given")
+    parser.add_argument("--loop", type=int, default=0, help="Replay the payload file until this many webhooks were sent")
+    parser.add_argument("--users", type=int, default=50, help="Distinct test phone numbers")
+    parser.add_argument("--phone-prefix", default="999", help="Prefix for test phone numbers")
+    parser.add_argument("--keep-phone-numbers", action="store_true", help="Do not remap phone numbers of recorded payloads")
+    parser.add_argument("--rate", type=float, default=10.0, help="Webhooks per second")
+    parser.add_argument("--concurrency", type=int, default=50, help="Max in-flight webhook requests")
+    parser.add_argument("--llm-latency-ms", default="300-1200", help="Stub LLM latency: fixed '500' or range '300-1200'")
+    parser.add_argument("--sender-latency-ms", type=float, default=150, help="Stub Wati send latency")
+    parser.add_argument("--lock-threshold-ms", type=float, default=50, help="DB statements slower than this count as lock waits")
+    parser.add_argument("--drain-timeout", type=float, default=180, help="Seconds to wait for the pipeline to finish")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    parser.add_argument("--source-database", default="database/data/chatbot.sqlite", help="Database copied for the run (catalog, districts)")
+    parser.add_argument("--keep-database", action="store_true", help="Keep the scratch database and journeys for inspection")
+    parser.add_argument("--verbose", action="store_true", help="Keep journey logging on the console")
+    args = parser.parse_args()
+
+    workdir = isolate_storage(args)
+    try:
+        report = asyncio.run(run_load_test(args))
+        print_report(report)
+
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\n💾 Report written to {args.output}")
+    finally:
+        if args.keep_database:
+            print(f"\n🗄️ Scratch database kept in {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,18 @@ This module contains:
 - DataScraperService: Scrapes data from external APIs
 - DataAPIService: Internal APIs to serve scraped data
 - DataSyncScheduler: Automated scheduling for data sync
+- WebhookIngestQueue: Durable queue + worker pool behind the Wati webhook
+- MessageDeduplicator: Shared duplicate-message index for webhook retries
+- LLMDecisionCache: Memoized deterministic LLM sub-decisions
+- EntityGazetteer: Aho-Corasick matcher for city, brand and district mentions
 """
 
 from .data_scraper import data_scraper
 from .data_api import data_api
 from .scheduler import scheduler
+from .ingest_queue import ingest_queue
+from .message_dedup import message_deduplicator
+from .llm_cache import llm_decision_cache
+from .gazetteer import entity_gazetteer
 
-__all__ = ['data_scraper', 'data_api', 'scheduler'] 
\ No newline at end of file
+__all__ = ['data_scraper', 'data_api', 'scheduler', 'ingest_queue', 'message_deduplicator', 'llm_decision_cache', 'entity_gazetteer'] 
\ No newline at end of file
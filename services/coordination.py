@@ -0,0 +1,236 @@
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import text
+
+from database.db_utils import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+
+class CoordinationBackend:
+    """
+    Lease store shared by all worker processes.
+
+    A lease is a key owned by one worker until it expires. Workers renew the leases
+    they hold; a lease left by a dead worker expires and can be taken over.
+    """
+
+    is_local = False
+    name = "base"
+
+    def acquire(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        """Take or renew a lease. Returns True if `owner` holds it afterwards"""
+        raise NotImplementedError
+
+    def release(self, key: str, owner: str):
+        """Drop a lease, only if `owner` still holds it"""
+        raise NotImplementedError
+
+    def count_active(self, prefix: str) -> int:
+        """Number of unexpired leases whose key starts with `prefix`"""
+        raise NotImplementedError
+
+
+class LocalCoordinationBackend(CoordinationBackend):
+    """In-process leases - single worker deployments (the default)"""
+
+    is_local = True
+    name = "local"
+
+    def __init__(self):
+        self._leases: Dict[str, tuple] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        with self._lock:
+            current = self._leases.get(key)
+            if current and current[0] != owner and current[1] > now:
+                return False
+            self._leases[key] = (owner, now + ttl_seconds)
+            return True
+
+    def release(self, key: str, owner: str):
+        with self._lock:
+            current = self._leases.get(key)
+            if current and current[0] == owner:
+                del self._leases[key]
+
+    def count_active(self, prefix: str) -> int:
+        now = time.time()
+        with self._lock:
+            return len([key for key, (_, expires_at) in self._leases.items()
+                        if key.startswith(prefix) and expires_at > now])
+
+
+class SQLiteCoordinationBackend(CoordinationBackend):
+    """Leases stored in the shared chatbot SQLite database (multi-worker on one host)"""
+
+    name = "sqlite"
+
+    def __init__(self):
+        db = SessionLocal()
+        try:
+            db.execute(text("""
+                CREATE TABLE IF NOT EXISTS coordination_leases (
+                    lease_key VARCHAR(255) NOT NULL PRIMARY KEY,
+                    owner VARCHAR(255) NOT NULL,
+                    expires_at FLOAT NOT NULL
+                )
+            """))
+            db.commit()
+        finally:
+            db.close()
+
+    def acquire(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        now = time.time()
+        db = SessionLocal()
+        try:
+            # Single atomic upsert: only overwrite our own or an expired lease
+            db.execute(text("""
+                INSERT INTO coordination_leases (lease_key, owner, expires_at)
+                VALUES (:key, :owner, :expires_at)
+                ON CONFLICT(lease_key) DO UPDATE SET
+                    owner = excluded.owner,
+                    expires_at = excluded.expires_at
+                WHERE coordination_leases.owner = excluded.owner
+                   OR coordination_leases.expires_at < :now
+            """), {"key": key, "owner": owner, "expires_at": now + ttl_seconds, "now": now})
+            db.commit()
+
+            current_owner = db.execute(
+                text("SELECT owner FROM coordination_leases WHERE lease_key = :key"),
+                {"key": key}
+            ).scalar()
+            return current_owner == owner
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Lease acquire failed for {key}: {str(e)}")
+            return False
+        finally:
+            db.close()
+
+    def release(self, key: str, owner: str):
+        db = SessionLocal()
+        try:
+            db.execute(
+                text("DELETE FROM coordination_leases WHERE lease_key = :key AND owner = :owner"),
+                {"key": key, "owner": owner}
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Lease release failed for {key}: {str(e)}")
+        finally:
+            db.close()
+
+    def count_active(self, prefix: str) -> int:
+        db = SessionLocal()
+        try:
+            return db.execute(
+                text("SELECT COUNT(*) FROM coordination_leases WHERE lease_key LIKE :prefix AND expires_at > :now"),
+                {"prefix": f"{prefix}%", "now": time.time()}
+            ).scalar() or 0
+        finally:
+            db.close()
+
+
+class RedisCoordinationBackend(CoordinationBackend):
+    """Leases in any Redis-protocol server (Redis, KeyDB, Valkey...) - multi-host deployments"""
+
+    name = "redis"
+
+    _ACQUIRE_SCRIPT = """
+    local current = redis.call('GET', KEYS[1])
+    if (not current) or current == ARGV[1] then
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+        return 1
+    end
+    return 0
+    """
+
+    _RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+
+    def __init__(self, url: str, key_prefix: str = "abar:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("COORDINATION_BACKEND is a redis:// URL but the 'redis' package is not installed")
+
+        self.client = redis.Redis.from_url(url, decode_responses=True)
+        self.key_prefix = key_prefix
+        self._acquire = self.client.register_script(self._ACQUIRE_SCRIPT)
+        self._release = self.client.register_script(self._RELEASE_SCRIPT)
+
+    def acquire(self, key: str, owner: str, ttl_seconds: float) -> bool:
+        try:
+            return bool(self._acquire(keys=[self.key_prefix + key], args=[owner, int(ttl_seconds * 1000)]))
+        except Exception as e:
+            logger.error(f"Lease acquire failed for {key}: {str(e)}")
+            return False
+
+    def release(self, key: str, owner: str):
+        try:
+            self._release(keys=[self.key_prefix + key], args=[owner])
+        except Exception as e:
+            logger.error(f"Lease release failed for {key}: {str(e)}")
+
+    def count_active(self, prefix: str) -> int:
+        # Redis expires keys itself - every key that still exists is active
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.key_prefix}{prefix}*"))
+
+
+# Backends selectable through COORDINATION_BACKEND, by name or URL scheme
+BACKENDS = {
+    "local": lambda url: LocalCoordinationBackend(),
+    "sqlite": lambda url: SQLiteCoordinationBackend(),
+    "redis": lambda url: RedisCoordinationBackend(url),
+    "rediss": lambda url: RedisCoordinationBackend(url),
+}
+
+
+def register_backend(scheme: str, factory):
+    """Plug in another backend - factory receives the full COORDINATION_BACKEND value"""
+    BACKENDS[scheme] = factory
+
+
+def create_coordination_backend(setting: Optional[str] = None) -> CoordinationBackend:
+    """Build the backend from COORDINATION_BACKEND ('local', 'sqlite' or 'redis://host:6379/0')"""
+    setting = setting or os.getenv("COORDINATION_BACKEND")
+    if not setting:
+        # Several uvicorn workers need a shared backend
+        setting = "sqlite" if int(os.getenv("APP_WORKERS", "1")) > 1 else "local"
+
+    scheme = setting.split("://", 1)[0].lower()
+    factory = BACKENDS.get(scheme)
+    if factory is None:
+        raise ValueError(f"Unknown coordination backend: {setting}")
+
+    backend = factory(setting)
+    logger.info(f"Using '{backend.name}' coordination backend")
+    return backend
+
+
+# Identifies this worker process in leases
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+_backend: Optional[CoordinationBackend] = None
+
+
+def get_coordination_backend() -> CoordinationBackend:
+    """Process-wide backend, created on first use"""
+    global _backend
+    if _backend is None:
+        _backend = create_coordination_backend()
+    return _backend
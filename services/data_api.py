@@ -1,14 +1,62 @@
 from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
-from sqlalchemy import or_
+from sqlalchemy import or_, and_
 
 from database.db_utils import DatabaseManager
 from database.db_models import City, Brand, Product
+from utils.arabic_normalizer import normalize_search
+
+def _prefix_range(column, prefix: str):
+    """column LIKE 'prefix%' written as a range, so SQLite seeks the column's index (LIKE can't)"""
+    return and_(column >= prefix, column < prefix[:-1] + chr(ord(prefix[-1]) + 1))
 
 class DataAPIService:
     """Internal API service to fetch data from the database with unified ID structure"""
     
+    @staticmethod
+    def _city_key_columns(user_language: str = 'ar'):
+        """Normalized city name columns, the conversation language's column first"""
+        if user_language == 'en':
+            return (City.name_en_normalized, City.name_normalized, City.title_normalized)
+        return (City.name_normalized, City.name_en_normalized, City.title_normalized)
+    
+    @staticmethod
+    def _find_cities_by_name(db: Session, city_name: str, user_language: str = 'ar') -> List[City]:
+        """
+        Cities matching a name, most relevant first:
+        1. Exact normalized name (index seek)
+        2. Normalized name starting with the query (index range)
+        3. Substring of the raw names (ILIKE scan - rows without keys and mid-name matches)
+        Within a level, a match on the conversation language's column ranks first.
+        """
+        key = normalize_search(city_name)
+        if not key:
+            return []
+        columns = DataAPIService._city_key_columns(user_language)
+        
+        for condition, matches in (
+            (lambda column: column == key, lambda value: value == key),
+            (lambda column: _prefix_range(column, key), lambda value: value.startswith(key)),
+        ):
+            cities = db.query(City).filter(or_(*[condition(column) for column in columns])).all()
+            if cities:
+                def priority(city):
+                    return next(
+                        (position for position, column in enumerate(columns)
+                         if getattr(city, column.key) and matches(getattr(city, column.key))),
+                        len(columns)
+                    )
+                return sorted(cities, key=lambda city: (priority(city), city.id))
+        
+        return db.query(City).filter(
+            or_(
+                City.name.ilike(f"%{city_name}%"),
+                City.name_en.ilike(f"%{city_name}%"),
+                City.title.ilike(f"%{city_name}%")
+            )
+        ).all()
+    
     @staticmethod
     def get_all_cities(db: Session) -> List[Dict[str, Any]]:
         """Get all cities from database - simplified response"""
@@ -41,20 +89,8 @@ class DataAPIService:
     def get_city_id_by_name(db: Session, city_name: str, user_language: str = 'ar') -> Optional[int]:
         """Get city ID by name - language-aware search"""
         # LANGUAGE-AWARE CITY SEARCH: Search appropriate language column first
-        if user_language == 'en':
-            # For English conversations, prioritize English city names
-            city = db.query(City).filter(
-                (City.name_en.ilike(f"%{city_name}%")) |
-                (City.name.ilike(f"%{city_name}%")) | 
-                (City.title.ilike(f"%{city_name}%"))
-            ).first()
-        else:
-            # For Arabic conversations, prioritize Arabic city names  
-            city = db.query(City).filter(
-                (City.name.ilike(f"%{city_name}%")) | 
-                (City.name_en.ilike(f"%{city_name}%")) |
-                (City.title.ilike(f"%{city_name}%"))
-            ).first()
+        cities = DataAPIService._find_cities_by_name(db, city_name, user_language)
+        city = cities[0] if cities else None
         
         if city:
             return city.id  # Now this is the same as external_id
@@ -76,67 +112,59 @@ class DataAPIService:
         if not query or not query.strip():
             return []
         
-        query_normalized = query.strip().lower()
-        
-        # Get all cities for filtering
-        cities = db.query(City).all()
+        query_normalized = normalize_search(query)
+        columns = DataAPIService._city_key_columns(user_language)[:2]  # name and name_en
         
-        exact_matches = []
-        partial_matches = []
+        # Exact matches are an index seek on the normalized names; partial (substring) matches are
+        # filtered in SQL on the same stored keys instead of normalizing every city in Python
+        exact_cities = db.query(City).filter(
+            or_(*[column == query_normalized for column in columns])
+        ).all()
+        exact_ids = [city.id for city in exact_cities]
+        partial_cities = db.query(City).filter(
+            or_(*[column.contains(query_normalized, autoescape=True) for column in columns]),
+            ~City.id.in_(exact_ids)
+        ).all()
         
-        for city in cities:
-            city_name_lower = city.name.lower() if city.name else ""
-            city_name_en_lower = city.name_en.lower() if city.name_en else ""
-            
-            # Use language-appropriate names
-            if user_language == 'en':
-                city_name_result = city.name_en or city.name
-            else:
-                city_name_result = city.name
-            
-            city_data = {
+        def city_data(city, match_type):
+            return {
                 "id": city.id,
                 "external_id": city.external_id,
-                "name": city_name_result,        # Language-appropriate city name
-                "name_en": city.name_en or ""    # Keep original English for reference
+                # Use language-appropriate names
+                "name": (city.name_en or city.name) if user_language == 'en' else city.name,
+                "name_en": city.name_en or "",    # Keep original English for reference
+                "match_type": match_type
             }
+        
+        # LANGUAGE-AWARE SEARCH PRIORITY: cities matched on the conversation language's column first,
+        # names starting with the query before names that only contain it
+        def priority(city):
+            keys = [getattr(city, column.key) or "" for column in columns]
+            language = next((position for position, key in enumerate(keys) if query_normalized in key), len(keys))
+            prefix = not any(key.startswith(query_normalized) for key in keys)
+            return (prefix, language, city.id)
+        
+        exact_matches = [city_data(city, "exact") for city in sorted(
+            exact_cities,
+            key=lambda city: (next(position for position, column in enumerate(columns)
+                                   if getattr(city, column.key) == query_normalized), city.id)
+        )]
+        partial_matches = [city_data(city, "partial") for city in sorted(partial_cities, key=priority)]
+        
+        # Nothing matched: fall back to misspelled names ("الرياظ", "jedda")
+        if not exact_matches and not partial_matches:
+            from services.gazetteer import entity_gazetteer
             
-            # LANGUAGE-AWARE SEARCH PRIORITY: Check appropriate language first
-            exact_match = False
-            
-            if user_language == 'en':
-                # For English conversations, prioritize English city names
-                if query_normalized == city_name_en_lower:
-                    city_data["match_type"] = "exact"
-                    exact_matches.append(city_data)
-                    exact_match = True
-                elif query_normalized == city_name_lower:
-                    city_data["match_type"] = "exact"
-                    exact_matches.append(city_data)
-                    exact_match = True
-                elif query_normalized in city_name_en_lower:
-                    city_data["match_type"] = "partial"
-                    partial_matches.append(city_data)
-                elif query_normalized in city_name_lower:
-                    city_data["match_type"] = "partial"
-                    partial_matches.append(city_data)
-            else:
-                # For Arabic conversations, prioritize Arabic city names
-                if query_normalized == city_name_lower:
-                    city_data["match_type"] = "exact"
-                    exact_matches.append(city_data)
-                    exact_match = True
-                elif query_normalized == city_name_en_lower:
-                    city_data["match_type"] = "exact"
-                    exact_matches.append(city_data)
-                    exact_match = True
-                elif query_normalized in city_name_lower:
-                    city_data["match_type"] = "partial"
-                    partial_matches.append(city_data)
-                elif query_normalized in city_name_en_lower:
-                    city_data["match_type"] = "partial"
-                    partial_matches.append(city_data)
-            # If no match at all, don't include this city
+            for match in entity_gazetteer.fuzzy("city", query_normalized):
+                city = match["item"]
+                partial_matches.append({
+                    "id": city["id"],
+                    "external_id": city["external_id"],
+                    "name": (city["name_en"] or city["name"]) if user_language == 'en' else city["name"],
+                    "name_en": city["name_en"] or "",
+                    "match_type": "fuzzy",
+                    "score": match["score"]
+                })
         
         # Return exact matches first, then partial matches
         return exact_matches + partial_matches
@@ -162,13 +190,8 @@ class DataAPIService:
     def get_brands_by_city_name(db: Session, city_name: str, user_language: str = 'ar') -> List[Dict[str, Any]]:
         """Get all brands for a specific city using city name with fuzzy matching"""
         # First try to find the city by name
-        city = db.query(City).filter(
-            or_(
-                City.name.ilike(f"%{city_name}%"),
-                City.name_en.ilike(f"%{city_name}%"),
-                City.title.ilike(f"%{city_name}%")
-            )
-        ).first()
+        cities = DataAPIService._find_cities_by_name(db, city_name, user_language)
+        city = cities[0] if cities else None
         
         if not city:
             return []
@@ -203,34 +226,20 @@ class DataAPIService:
         """Search brands by name within a specific city only (not global search)
         Prioritizes exact matches first, then partial matches
         """
-        from database.district_utils import DistrictLookup
-        
         # Normalize inputs for better matching
-        normalized_brand_name = DistrictLookup.normalize_city_name(brand_name).lower()
-        normalized_city_name = DistrictLookup.normalize_city_name(city_name).lower()
+        normalized_brand_name = normalize_search(brand_name)
+        normalized_city_name = normalize_search(city_name)
         
-        # Find the city first - prioritize exact matches
-        city = None
+        # Find the city first - exact normalized name, then prefix, then partial match
+        cities = DataAPIService._find_cities_by_name(db, city_name, user_language)
+        city = cities[0] if cities else None
         
-        # Try exact match first (normalized)
-        for city_candidate in db.query(City).all():
-            city_ar_normalized = DistrictLookup.normalize_city_name(city_candidate.name).lower()
-            city_en_normalized = city_candidate.name_en.lower() if city_candidate.name_en else ""
-            
-            if (city_ar_normalized == normalized_city_name or 
-                city_en_normalized == normalized_city_name):
-                city = city_candidate
-                break
-        
-        # If no exact match, try partial match
+        # Still nothing: closest city name within a few typos
         if not city:
-            city = db.query(City).filter(
-                or_(
-                    City.name.ilike(f"%{city_name}%"),
-                    City.name_en.ilike(f"%{city_name}%"),
-                    City.title.ilike(f"%{city_name}%")
-                )
-            ).first()
+            from services.gazetteer import entity_gazetteer
+            fuzzy_cities = entity_gazetteer.fuzzy("city", normalized_city_name, limit=1)
+            if fuzzy_cities:
+                city = db.query(City).filter(City.id == fuzzy_cities[0]["item"]["id"]).first()
         
         if not city:
             return []
@@ -243,9 +252,9 @@ class DataAPIService:
             if not brand.title:
                 continue
                 
-            # Normalize brand title for comparison
-            normalized_brand_title = DistrictLookup.normalize_city_name(brand.title).lower()
-            normalized_brand_title_en = brand.title_en.lower() if brand.title_en else ""
+            # Stored normalized titles (normalized here only for rows the migration hasn't backfilled)
+            normalized_brand_title = brand.title_normalized or normalize_search(brand.title)
+            normalized_brand_title_en = brand.title_en_normalized or normalize_search(brand.title_en) or ""
             
             # Use language-appropriate names
             if user_language == 'en':
@@ -301,12 +310,36 @@ class DataAPIService:
                     partial_matches.append(brand_info)
                     partial_match = True
         
+        # No exact or partial match: misspelled brand names ("نستلي") among this city's brands
+        fuzzy_matches = []
+        if not exact_matches and not partial_matches:
+            from services.gazetteer import entity_gazetteer
+            from utils.arabic_normalizer import normalize_brand
+            city_brands = {brand.id: brand for brand in city.brands if brand.title}
+            for match in entity_gazetteer.fuzzy("brand", normalize_brand(brand_name), limit=10):
+                brand = city_brands.get(match["item"]["id"])
+                if brand is None:
+                    continue
+                fuzzy_matches.append({
+                    "id": brand.id,
+                    "external_id": brand.external_id,
+                    "title": (brand.title_en or brand.title) if user_language == 'en' else brand.title,
+                    "title_en": brand.title_en,
+                    "image_url": brand.image_url,
+                    "city_id": city.id,
+                    "city_name": (city.name_en or city.name) if user_language == 'en' else city.name,
+                    "city_name_en": city.name_en,
+                    "match_score": match["score"]
+                })
+        
         print(f"🔍 Brand search results for '{brand_name}' in '{city_name}':")
         print(f"   ✅ Exact matches: {len(exact_matches)}")
         print(f"   🔍 Partial matches: {len(partial_matches)}")
+        if fuzzy_matches:
+            print(f"   🔤 Fuzzy matches: {len(fuzzy_matches)}")
         
-        # Return exact matches first, then partial matches
-        return exact_matches + partial_matches
+        # Return exact matches first, then partial matches, then fuzzy ones
+        return exact_matches + partial_matches + fuzzy_matches
     
     @staticmethod 
     def get_products_by_brand_and_city_name(db: Session, brand_name: str, city_name: str, user_language: str = 'ar') -> List[Dict[str, Any]]:
@@ -317,38 +350,25 @@ class DataAPIService:
         3. Partial city + exact brand
         4. Partial city + partial brand (lowest priority)
         """
-        from database.district_utils import DistrictLookup
-        
         # Normalize inputs for matching
-        normalized_brand_name = DistrictLookup.normalize_city_name(brand_name).lower()
-        normalized_city_name = DistrictLookup.normalize_city_name(city_name).lower()
+        normalized_brand_name = normalize_search(brand_name)
+        normalized_city_name = normalize_search(city_name)
         
         print(f"🔍 Cascading search for products: brand='{brand_name}' city='{city_name}'")
         print(f"   Normalized: brand='{normalized_brand_name}' city='{normalized_city_name}'")
         
         # Helper function to find exact city match (LANGUAGE-AWARE)
         def find_exact_city(city_name_to_search: str):
-            normalized_search = DistrictLookup.normalize_city_name(city_name_to_search).lower()
+            normalized_search = normalize_search(city_name_to_search)
+            if not normalized_search:
+                return None
             
-            for city_candidate in db.query(City).all():
-                city_ar_normalized = DistrictLookup.normalize_city_name(city_candidate.name).lower()
-                city_en_normalized = city_candidate.name_en.lower() if city_candidate.name_en else ""
-                
-                # LANGUAGE-AWARE PRIORITY: Search appropriate language column first
-                if user_language == 'en':
-                    # For English conversations, prioritize English names
-                    if city_en_normalized and city_en_normalized == normalized_search:
-                        return city_candidate
-                    # Fallback: Check Arabic name (for cases like "Kharj" → "الخرج")
-                    elif city_ar_normalized == normalized_search:
-                        return city_candidate
-                else:
-                    # For Arabic conversations, prioritize Arabic names
-                    if city_ar_normalized == normalized_search:
-                        return city_candidate
-                    # Fallback: Check English name
-                    elif city_en_normalized and city_en_normalized == normalized_search:
-                        return city_candidate
+            # LANGUAGE-AWARE PRIORITY: Search appropriate language column first
+            # (Arabic name as fallback for English cases like "Kharj" → "الخرج"; index seek per column)
+            for column in DataAPIService._city_key_columns(user_language)[:2]:
+                city_candidate = db.query(City).filter(column == normalized_search).order_by(City.id).first()
+                if city_candidate:
+                    return city_candidate
             return None
         
         # Helper function to find partial city matches (LANGUAGE-AWARE)
@@ -375,14 +395,14 @@ class DataAPIService:
         
         # Helper function to find exact brand in city (LANGUAGE-AWARE)
         def find_exact_brand_in_city(city, brand_name_to_search: str):
-            normalized_search = DistrictLookup.normalize_city_name(brand_name_to_search).lower()
+            normalized_search = normalize_search(brand_name_to_search)
             
             for brand in city.brands:
                 if not brand.title:
                     continue
                     
-                brand_ar_normalized = DistrictLookup.normalize_city_name(brand.title).lower()
-                brand_en_normalized = brand.title_en.lower() if brand.title_en else ""
+                brand_ar_normalized = brand.title_normalized or normalize_search(brand.title)
+                brand_en_normalized = brand.title_en_normalized or normalize_search(brand.title_en) or ""
                 
                 # LANGUAGE-AWARE PRIORITY: Search appropriate language column first
                 if user_language == 'en':
@@ -403,14 +423,14 @@ class DataAPIService:
         
         # Helper function to find partial brand in city (LANGUAGE-AWARE)
         def find_partial_brand_in_city(city, brand_name_to_search: str):
-            normalized_search = DistrictLookup.normalize_city_name(brand_name_to_search).lower()
+            normalized_search = normalize_search(brand_name_to_search)
             
             for brand in city.brands:
                 if not brand.title:
                     continue
                     
-                brand_ar_normalized = DistrictLookup.normalize_city_name(brand.title).lower()
-                brand_en_normalized = brand.title_en.lower() if brand.title_en else ""
+                brand_ar_normalized = brand.title_normalized or normalize_search(brand.title)
+                brand_en_normalized = brand.title_en_normalized or normalize_search(brand.title_en) or ""
                 
                 # LANGUAGE-AWARE PRIORITY: Search appropriate language column first
                 if user_language == 'en':
@@ -735,24 +755,8 @@ class DataAPIService:
     def get_cheapest_products_by_city_name(db: Session, city_name: str, user_language: str = 'ar') -> Dict[str, Any]:
         """Get cheapest products in each size for a specific city"""
         # Find the city first (LANGUAGE-AWARE PRIORITY)
-        if user_language == 'en':
-            # For English conversations, prioritize English city names
-            city = db.query(City).filter(
-                or_(
-                    City.name_en.ilike(f"%{city_name}%"),
-                    City.name.ilike(f"%{city_name}%"),
-                    City.title.ilike(f"%{city_name}%")
-                )
-            ).first()
-        else:
-            # For Arabic conversations, prioritize Arabic city names
-            city = db.query(City).filter(
-                or_(
-                    City.name.ilike(f"%{city_name}%"),
-                    City.name_en.ilike(f"%{city_name}%"),
-                    City.title.ilike(f"%{city_name}%")
-                )
-            ).first()
+        cities = DataAPIService._find_cities_by_name(db, city_name, user_language)
+        city = cities[0] if cities else None
         
         if not city:
             if user_language == 'ar':
@@ -10,6 +10,7 @@ from sqlalchemy import text
 
 from database.db_utils import DatabaseManager, get_db
 from database.db_models import City, Brand, Product, DataSyncLog
+from services.gazetteer import entity_gazetteer
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -844,6 +845,9 @@ class DataScraperService:
             logger.info(f"   📦 Products: {results['products']}")
             logger.info("="*60)
             
+            # Swap in mention matching built from the fresh catalog (off the event loop)
+            await asyncio.to_thread(entity_gazetteer.rebuild)
+            
             return results
             
         except Exception as e:
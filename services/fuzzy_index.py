@@ -0,0 +1,177 @@
+import os
+from array import array
+from typing import Dict, List, Tuple, Iterable, Set
+
+# Edits tolerated by key length: short names ("جده", "ابها") must match exactly, otherwise
+# common words one letter away ("جدا") would resolve to them
+FUZZY_MIN_LENGTH_ONE_EDIT = int(os.getenv("FUZZY_MIN_LENGTH_ONE_EDIT", "5"))
+FUZZY_MIN_LENGTH_TWO_EDITS = int(os.getenv("FUZZY_MIN_LENGTH_TWO_EDITS", "9"))
+MAX_EDIT_DISTANCE = 2
+
+
+def allowed_distance(length: int) -> int:
+    if length >= FUZZY_MIN_LENGTH_TWO_EDITS:
+        return 2
+    if length >= FUZZY_MIN_LENGTH_ONE_EDIT:
+        return 1
+    return 0
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Optimal-string-alignment distance (Levenshtein plus adjacent transpositions), or
+    max_distance + 1 as soon as it is known to exceed max_distance
+
+    Only the diagonal band |i - j| <= max_distance is filled: cells outside it are more than
+    max_distance edits away anyway, so a check costs O(len(a) * (2 * max_distance + 1)).
+    """
+    if a == b:
+        return 0
+    len_a, len_b = len(a), len(b)
+    if abs(len_a - len_b) > max_distance:
+        return max_distance + 1
+    too_far = max_distance + 1
+    previous_previous = None
+    previous = [j if j <= max_distance else too_far for j in range(len_b + 1)]
+    for i in range(1, len_a + 1):
+        current = [too_far] * (len_b + 1)
+        if i <= max_distance:
+            current[0] = i
+        row_min = current[0]
+        char_a = a[i - 1]
+        for j in range(max(1, i - max_distance), min(len_b, i + max_distance) + 1):
+            value = previous[j - 1] if char_a == b[j - 1] else previous[j - 1] + 1
+            if previous[j] + 1 < value:
+                value = previous[j] + 1
+            if current[j - 1] + 1 < value:
+                value = current[j - 1] + 1
+            if (previous_previous is not None and j > 1 and char_a == b[j - 2]
+                    and a[i - 2] == b[j - 1] and previous_previous[j - 2] + 1 < value):
+                value = previous_previous[j - 2] + 1
+            if value > too_far:
+                value = too_far
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return too_far
+        previous_previous, previous = previous, current
+    return previous[len_b]
+
+
+def _deletes(text: str, distance: int) -> Set[str]:
+    variants = {text}
+    frontier = {text}
+    for _ in range(distance):
+        frontier = {word[:i] + word[i + 1:] for word in frontier for i in range(len(word))}
+        variants |= frontier
+    return variants
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyIndex:
+    """
+    Typo-tolerant lookup over normalized names (SymSpell-style).
+
+    Every key is stored with all variants of its first PREFIX_LENGTH characters that have up
+    to two characters deleted; a query generates the same variants, and keys sharing one are
+    verified with an edit distance bounded by allowed_distance(len(key)). Queries whose typo
+    moves characters across the prefix window fall back to character-trigram candidates
+    (Dice overlap >= TRIGRAM_MIN_OVERLAP), verified the same way.
+
+    Keys starting with "ال" are also stored without it, so "رياض" finds "الرياض".
+    Score = 1 - distance / len(key). Keys map to ranks (positions in the caller's entity list).
+    """
+
+    PREFIX_LENGTH = 7
+    TRIGRAM_MIN_OVERLAP = 0.5
+
+    def __init__(self, entries: Iterable[Tuple[str, int]]):
+        self.keys: List[str] = []
+        self.ranks = array('l')
+        seen: Dict[Tuple[str, int], bool] = {}
+        for key, rank in entries:
+            if not key:
+                continue
+            variants = [key]
+            if key.startswith("ال") and len(key) > 4:
+                variants.append(key[2:])
+            for variant in variants:
+                if (variant, rank) not in seen:
+                    seen[(variant, rank)] = True
+                    self.keys.append(variant)
+                    self.ranks.append(rank)
+
+        self.deletes: Dict[str, array] = {}
+        self.trigrams: Dict[str, array] = {}
+        self.trigram_counts = array('l')
+        for key_index, key in enumerate(self.keys):
+            for variant in _deletes(key[:self.PREFIX_LENGTH], allowed_distance(len(key))):
+                self.deletes.setdefault(variant, array('l')).append(key_index)
+            key_trigrams = _trigrams(key)
+            self.trigram_counts.append(len(key_trigrams))
+            for trigram in key_trigrams:
+                self.trigrams.setdefault(trigram, array('l')).append(key_index)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, term: str, limit: int = 3, min_score: float = 0.0) -> List[Dict[str, object]]:
+        """
+        Best keys for a normalized term
+
+        Returns:
+            Up to limit dicts with rank, key, distance and score, best score first (one per rank)
+        """
+        if not term:
+            return []
+        candidates: Set[int] = set()
+        for variant in _deletes(term[:self.PREFIX_LENGTH], MAX_EDIT_DISTANCE):
+            candidates.update(self.deletes.get(variant, ()))
+
+        results = self._verify(term, candidates)
+        # Terms shorter than this are only ever an exact key, which the prefix step finds
+        if not results and len(term) >= FUZZY_MIN_LENGTH_ONE_EDIT - 1:
+            term_trigrams = _trigrams(term)
+            overlaps: Dict[int, int] = {}
+            for trigram in term_trigrams:
+                for key_index in self.trigrams.get(trigram, ()):
+                    overlaps[key_index] = overlaps.get(key_index, 0) + 1
+            candidates = {
+                key_index for key_index, shared in overlaps.items()
+                if 2 * shared / (len(term_trigrams) + self.trigram_counts[key_index]) >= self.TRIGRAM_MIN_OVERLAP
+                and abs(len(self.keys[key_index]) - len(term)) <= MAX_EDIT_DISTANCE
+            }
+            results = self._verify(term, candidates)
+
+        best: Dict[int, Dict[str, object]] = {}
+        for result in results:
+            if result["score"] < min_score:
+                continue
+            current = best.get(result["rank"])
+            if current is None or result["score"] > current["score"]:
+                best[result["rank"]] = result
+        return sorted(best.values(), key=lambda result: (-result["score"], result["rank"]))[:limit]
+
+    def _verify(self, term: str, candidates: Iterable[int]) -> List[Dict[str, object]]:
+        results = []
+        # The same name is often stored for several ranks - check each string once
+        distances: Dict[str, int] = {}
+        for key_index in candidates:
+            key = self.keys[key_index]
+            max_distance = allowed_distance(len(key))
+            distance = distances.get(key)
+            if distance is None:
+                distance = distances[key] = edit_distance(term, key, max_distance)
+            if distance <= max_distance:
+                results.append({
+                    "rank": self.ranks[key_index],
+                    "key": key,
+                    "distance": distance,
+                    "score": round(1 - distance / len(key), 3)
+                })
+        return results
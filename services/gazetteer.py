@@ -0,0 +1,377 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from typing import Dict, Any, List, Optional, Tuple, Iterable
+
+from database.db_utils import SessionLocal
+from database.db_models import District
+from database.district_utils import DistrictLookup, DistrictIndex
+from services.data_api import data_api
+from services.fuzzy_index import FuzzyIndex
+from utils.arabic_normalizer import normalize_brand
+
+logger = logging.getLogger(__name__)
+
+class _Automaton:
+    """
+    Aho-Corasick automaton over a fixed set of patterns. Built once and never mutated, so a
+    reader holding a reference keeps a consistent view while a new one is being built.
+    """
+
+    def __init__(self, patterns: List[Tuple[str, Any]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # Per node: (pattern length, payload) of every pattern ending here, incl. via fail links
+        self.out: List[List[Tuple[int, Any]]] = [[]]
+
+        for text, payload in patterns:
+            if not text:
+                continue
+            node = 0
+            for char in text:
+                next_node = self.goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self.goto)
+                    self.goto[node][char] = next_node
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                node = next_node
+            self.out[node].append((len(text), payload))
+
+        # Breadth-first: a node's fail target is always finished before the node itself
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def iter_matches(self, text: str) -> Iterable[Tuple[int, int, Any]]:
+        """(start, end, payload) of every pattern occurrence, overlapping ones included"""
+        node = 0
+        for position, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, payload in self.out[node]:
+                yield position + 1 - length, position + 1, payload
+
+    @property
+    def size(self) -> int:
+        return len(self.goto)
+
+
+class _Snapshot:
+    """Everything built from one catalog/district load - swapped in as a whole"""
+
+    def __init__(self, entities: Dict[str, List[Dict[str, Any]]], patterns: List[Tuple[str, Any]],
+                 brand_titles: List[Tuple[str, int]], fuzzy_entries: Dict[str, List[Tuple[str, int]]],
+                 version: int):
+        self.entities = entities
+        self.automaton = _Automaton(patterns)
+        self.pattern_count = len(patterns)
+        # Cleaned brand title -> ranks, for exact matches and the "message inside a title" fallback
+        self.brand_titles = brand_titles
+        self.brands_by_title: Dict[str, List[int]] = {}
+        for title, rank in brand_titles:
+            self.brands_by_title.setdefault(title, []).append(rank)
+        self.max_brand_title_length = max((len(title) for title, _ in brand_titles), default=0)
+        self.district_index = DistrictIndex(entities["district"], self._district_ranks)
+        # Typo-tolerant lookups over the automaton's names
+        self.fuzzy = {kind: FuzzyIndex(fuzzy_entries.get(kind, [])) for kind in entities}
+        self.version = version
+        self.built_at = time.time()
+
+    def _district_ranks(self, text: str) -> Iterable[int]:
+        for _, _, (kind, rank, _) in self.automaton.iter_matches(text):
+            if kind == "district":
+                yield rank
+
+
+class EntityGazetteer:
+    """
+    Finds city, brand and district mentions in a message with one pass of an Aho-Corasick
+    automaton instead of a substring test per catalog row. Each snapshot also carries the
+    DistrictIndex used by DistrictLookup and a FuzzyIndex per kind for misspelled names
+    (fuzzy(), fuzzy_mentions(); matches below FUZZY_MIN_SCORE are dropped).
+
+    Patterns are normalized once per build:
+        city:     DistrictLookup.normalize_city_name of the Arabic and English name
+        brand:    normalize_brand of the Arabic and English title (water prefixes removed)
+        district: DistrictLookup.normalize_city_name of the district name
+    so callers pass text normalized the same way. Each match carries the entity's rank - its
+    position in the catalog (cities, brands) or in the longest-name-first district order - so
+    callers can keep the priority order of the old per-row loops.
+
+    rebuild() builds a complete new snapshot and swaps it in with a single assignment; lookups
+    running meanwhile keep using the previous one. It runs at startup and after every catalog
+    sync in this process (both off the event loop). GAZETTEER_TTL_SECONDS bounds how stale other
+    workers (or a district import run as a script) can be: a lookup on a stale snapshot starts a
+    rebuild in a background thread and is answered from the old snapshot.
+    """
+
+    KINDS = ("city", "brand", "district")
+
+    def __init__(self):
+        self.ttl_seconds = int(os.getenv("GAZETTEER_TTL_SECONDS", "600"))
+        self.fuzzy_min_score = float(os.getenv("FUZZY_MIN_SCORE", "0.8"))
+        self._snapshot: Optional[_Snapshot] = None
+        self._build_lock = threading.Lock()
+        self._version = 0
+        self.stats = {"builds": 0, "build_failures": 0, "last_build_ms": 0, "lookups": 0, "matches": 0,
+                      "fuzzy_lookups": 0, "fuzzy_hits": 0, "fuzzy_ms": 0.0}
+
+    @property
+    def version(self) -> int:
+        """Increments on every rebuild - dependent caches compare it to know when to refresh"""
+        return self._snapshot.version if self._snapshot else 0
+
+    def invalidate(self):
+        """Rebuild on next use"""
+        snapshot = self._snapshot
+        if snapshot:
+            snapshot.built_at = 0.0
+
+    def rebuild(self) -> bool:
+        """Load cities, brands and districts and swap in a new automaton"""
+        with self._build_lock:
+            return self._build()
+
+    def ensure_built(self) -> _Snapshot:
+        """Current snapshot; a stale one keeps being served while a background thread rebuilds it"""
+        snapshot = self._snapshot
+        if snapshot is None:
+            # Cold start (scripts, or a request before startup finished) - nothing to serve yet
+            with self._build_lock:
+                if self._snapshot is None and not self._build():
+                    raise RuntimeError("Entity gazetteer is not available")
+                return self._snapshot
+        if time.time() - snapshot.built_at >= self.ttl_seconds:
+            self._refresh_in_background()
+        return snapshot
+
+    def _refresh_in_background(self):
+        if not self._build_lock.acquire(blocking=False):
+            return  # a build is already running
+        threading.Thread(target=self._refresh, name="gazetteer-refresh", daemon=True).start()
+
+    def _refresh(self):
+        try:
+            if not self._build() and self._snapshot:
+                # Keep serving the previous snapshot; retry after another TTL
+                self._snapshot.built_at = time.time()
+        finally:
+            self._build_lock.release()
+
+    def _build(self) -> bool:
+        start_time = time.time()
+        try:
+            db = SessionLocal()
+            try:
+                cities = data_api.get_all_cities(db)
+                brands = data_api.get_all_brands(db)
+                districts = db.query(District).all()
+                # Same priority as the old scan: longest district name first
+                districts = sorted(districts, key=lambda d: len(d.name), reverse=True)
+                districts = [
+                    {"id": d.id, "name": d.name.strip(), "city_name": d.city_name}
+                    for d in districts
+                ]
+            finally:
+                db.close()
+
+            self._version += 1
+            snapshot = self._snapshot_of(cities, brands, districts, self._version)
+            self._snapshot = snapshot
+
+            duration_ms = int((time.time() - start_time) * 1000)
+            self.stats["builds"] += 1
+            self.stats["last_build_ms"] = duration_ms
+            print(f"🧭 Entity gazetteer built: {len(cities)} cities, {len(brands)} brands, "
+                  f"{len(districts)} districts ({snapshot.automaton.size} states, {duration_ms}ms)")
+            return True
+        except Exception as e:
+            self.stats["build_failures"] += 1
+            logger.error(f"Entity gazetteer build failed: {str(e)}")
+            return False
+
+    @staticmethod
+    def _snapshot_of(cities: List[Dict[str, Any]], brands: List[Dict[str, Any]],
+                     districts: List[Dict[str, Any]], version: int) -> _Snapshot:
+        """Normalize the catalog into patterns and build a snapshot (no DB access)"""
+        patterns: List[Tuple[str, Any]] = []
+        for rank, city in enumerate(cities):
+            patterns.append((DistrictLookup.normalize_city_name(city.get("name") or ""), ("city", rank, "ar")))
+            patterns.append((DistrictLookup.normalize_city_name(city.get("name_en") or ""), ("city", rank, "en")))
+        brand_titles = []
+        for rank, brand in enumerate(brands):
+            title = normalize_brand(brand.get("title") or "")
+            if title:
+                patterns.append((title, ("brand", rank, "ar")))
+                brand_titles.append((title, rank))
+            patterns.append((normalize_brand(brand.get("title_en") or ""), ("brand", rank, "en")))
+        for rank, district in enumerate(districts):
+            patterns.append((DistrictLookup.normalize_city_name(district["name"]), ("district", rank, "ar")))
+
+        patterns = [(text, payload) for text, payload in patterns if text]
+        fuzzy_entries: Dict[str, List[Tuple[str, int]]] = {}
+        for text, (kind, rank, _) in patterns:
+            fuzzy_entries.setdefault(kind, []).append((text, rank))
+
+        return _Snapshot(
+            {"city": cities, "brand": brands, "district": districts},
+            patterns,
+            brand_titles,
+            fuzzy_entries,
+            version
+        )
+
+    def find(self, text: str, kinds: Iterable[str] = KINDS) -> List[Dict[str, Any]]:
+        """
+        All mentions in already-normalized text
+
+        Returns:
+            List of dicts with kind, rank, field ("ar"/"en"), start, end (span in text) and
+            item (the city/brand/district dict), in order of appearance
+        """
+        if not text:
+            return []
+        return self._find(self.ensure_built(), text, kinds)
+
+    def _find(self, snapshot: _Snapshot, text: str, kinds: Iterable[str]) -> List[Dict[str, Any]]:
+        kinds = set(kinds)
+        matches = [
+            {
+                "kind": kind,
+                "rank": rank,
+                "field": field,
+                "start": start,
+                "end": end,
+                "item": snapshot.entities[kind][rank]
+            }
+            for start, end, (kind, rank, field) in snapshot.automaton.iter_matches(text)
+            if kind in kinds
+        ]
+        self.stats["lookups"] += 1
+        self.stats["matches"] += len(matches)
+        return matches
+
+    def entities_in(self, text: str, kind: str) -> List[Tuple[Dict[str, Any], set]]:
+        """(item, matched fields) per entity of one kind found in text, in rank order"""
+        fields: Dict[int, set] = {}
+        items: Dict[int, Dict[str, Any]] = {}
+        for match in self.find(text, (kind,)):
+            fields.setdefault(match["rank"], set()).add(match["field"])
+            items[match["rank"]] = match["item"]
+        return [(items[rank], fields[rank]) for rank in sorted(fields)]
+
+    def brands_titled(self, cleaned_text: str) -> List[Dict[str, Any]]:
+        """Brands whose cleaned title equals the cleaned text"""
+        if not cleaned_text:
+            return []
+        snapshot = self.ensure_built()
+        return [snapshot.entities["brand"][rank] for rank in snapshot.brands_by_title.get(cleaned_text, [])]
+
+    def brands_partial(self, cleaned_text: str) -> List[Dict[str, Any]]:
+        """
+        Brands whose cleaned title is inside the cleaned text (automaton pass) or contains it
+        (short messages like "نق" - only tried when the text is not longer than a title), in
+        catalog order
+        """
+        if not cleaned_text:
+            return []
+        snapshot = self.ensure_built()
+        ranks = {match["rank"] for match in self._find(snapshot, cleaned_text, ("brand",))}
+        if len(cleaned_text) <= snapshot.max_brand_title_length:
+            ranks.update(rank for title, rank in snapshot.brand_titles if cleaned_text in title)
+        return [snapshot.entities["brand"][rank] for rank in sorted(ranks)]
+
+    def fuzzy(self, kind: str, text: str, limit: int = 3) -> List[Dict[str, Any]]:
+        """
+        Entities of one kind whose name is within a few typos of the whole normalized text
+        ("نستلي" -> نستله, "رياض" -> الرياض, "jedda" -> Jeddah)
+
+        Returns:
+            Up to limit dicts with item, rank, matched (the normalized name), distance and
+            score (1 - distance / name length), best first
+        """
+        if not text:
+            return []
+        snapshot = self.ensure_built()
+        return self._fuzzy(snapshot, kind, text, limit)
+
+    def _fuzzy(self, snapshot: _Snapshot, kind: str, text: str, limit: int) -> List[Dict[str, Any]]:
+        start_time = time.perf_counter()
+        results = snapshot.fuzzy[kind].lookup(text, limit, self.fuzzy_min_score)
+        self.stats["fuzzy_lookups"] += 1
+        self.stats["fuzzy_ms"] += (time.perf_counter() - start_time) * 1000
+        if results:
+            self.stats["fuzzy_hits"] += 1
+        return [
+            {
+                "item": snapshot.entities[kind][result["rank"]],
+                "rank": result["rank"],
+                "matched": result["key"],
+                "distance": result["distance"],
+                "score": result["score"]
+            }
+            for result in results
+        ]
+
+    def fuzzy_mentions(self, kind: str, text: str, max_words: int = 3) -> List[Dict[str, Any]]:
+        """
+        Fuzzy matches of every 1..max_words word window of a normalized message - for messages
+        the automaton found nothing in. Best match per entity, best score first, with the
+        matching window as "phrase".
+        """
+        words = (text or "").split()
+        if not words:
+            return []
+        snapshot = self.ensure_built()
+        best: Dict[int, Dict[str, Any]] = {}
+        for start in range(len(words)):
+            for length in range(1, min(max_words, len(words) - start) + 1):
+                phrase = " ".join(words[start:start + length])
+                # Shorter names only ever match exactly - the automaton already covered them
+                if len(phrase) < 4:
+                    continue
+                for match in self._fuzzy(snapshot, kind, phrase, 1):
+                    current = best.get(match["rank"])
+                    if current is None or match["score"] > current["score"]:
+                        best[match["rank"]] = {**match, "phrase": phrase}
+        return sorted(best.values(), key=lambda match: (-match["score"], match["rank"]))
+
+    def entities(self, kind: str) -> List[Dict[str, Any]]:
+        return self.ensure_built().entities[kind]
+
+    def district_index(self) -> DistrictIndex:
+        """District lookups of the current snapshot (names, postings, district -> city)"""
+        return self.ensure_built().district_index
+
+    def get_stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            "version": self.version,
+            "ttl_seconds": self.ttl_seconds,
+            "entities": {kind: len(items) for kind, items in snapshot.entities.items()} if snapshot else {},
+            "patterns": snapshot.pattern_count if snapshot else 0,
+            "states": snapshot.automaton.size if snapshot else 0,
+            "district_tokens": len(snapshot.district_index.postings) if snapshot else 0,
+            "fuzzy_keys": {kind: len(index) for kind, index in snapshot.fuzzy.items()} if snapshot else {},
+            "fuzzy_min_score": self.fuzzy_min_score,
+            "fuzzy_avg_ms": round(self.stats["fuzzy_ms"] / self.stats["fuzzy_lookups"], 4) if self.stats["fuzzy_lookups"] else 0.0,
+            "age_seconds": int(time.time() - snapshot.built_at) if snapshot and snapshot.built_at else None,
+            **self.stats
+        }
+
+
+# Singleton instance
+entity_gazetteer = EntityGazetteer()
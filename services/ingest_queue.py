@@ -0,0 +1,632 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import time
+import zlib
+import datetime
+from collections import deque, defaultdict
+from contextlib import asynccontextmanager
+from typing import Dict, Any, Optional, List, Callable, Awaitable, Set
+
+from sqlalchemy import text
+from sqlalchemy.exc import IntegrityError
+
+from database.db_utils import SessionLocal
+from database.db_models import WebhookQueueItem
+from services.coordination import get_coordination_backend, WORKER_ID
+from services.message_dedup import message_deduplicator
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookIngestQueue:
+    """
+    Durable queue between POST /webhook and the message pipeline.
+
+    Every webhook payload is written to SQLite before we answer Wati, then drained
+    by a fixed pool of async workers. Phone numbers are hashed into partitions and
+    each partition is owned by exactly one worker process at a time (a lease in the
+    coordination backend), so all messages of one phone are batched and handled by a
+    single worker, in arrival order - also when running several uvicorn workers.
+    Rows left behind by a crash or restart are picked up again when their partition
+    is (re)acquired.
+
+    A handler may hand its message on to a later stage (the message batcher) by
+    returning True; the row then stays 'processing' until that stage calls complete()
+    or fail() for it, so a restart during the debounce window or the agents still
+    recovers the message. processing_slot() bounds how many of those later-stage runs
+    happen at once (INGEST_WORKER_COUNT), and depth counts a message until it is acked.
+    Failures are retried in place - by the worker, or by the later stage through
+    retry() - so a newer message of the same phone never overtakes a retried one.
+    All row updates run in a thread, off the event loop.
+    """
+
+    # enqueue() result for a Wati message ID that was already claimed
+    DUPLICATE = -1
+
+    def __init__(self):
+        self.worker_count = max(1, int(os.getenv("INGEST_WORKER_COUNT", "4")))
+        self.max_depth = max(1, int(os.getenv("INGEST_QUEUE_MAX_DEPTH", "2000")))
+        self.max_attempts = max(1, int(os.getenv("INGEST_MAX_ATTEMPTS", "3")))
+        self.retry_after_seconds = int(os.getenv("INGEST_RETRY_AFTER_SECONDS", "5"))
+        self.partition_count = max(1, int(os.getenv("INGEST_PARTITIONS", "16")))
+        self.poll_interval = float(os.getenv("INGEST_POLL_INTERVAL", "0.5"))
+        self.lease_ttl = float(os.getenv("INGEST_LEASE_TTL", "15"))
+
+        self._handler: Optional[Callable[[dict, Any], Awaitable[Any]]] = None
+        self._queues: List[asyncio.Queue] = []
+        self._workers: List[asyncio.Task] = []
+        self._coordination_task: Optional[asyncio.Task] = None
+        self._coordinator = None
+        self._owned_partitions: Set[int] = set()
+        self._enqueued_at: Dict[int, float] = {}           # Locally dispatched, unfinished (not yet acked) items
+        self._started_at: Dict[int, float] = {}            # First worker pickup per unfinished item
+        self._item_partition: Dict[int, int] = {}
+        self._dispatched_per_partition: Dict[int, int] = defaultdict(int)  # Waiting for / inside a local worker
+        self._handed_off: Set[int] = set()                                   # Debouncing or processing in the batcher
+        self._handed_off_per_partition: Dict[int, int] = defaultdict(int)
+        self._global_depth = 0
+        self._in_flight = 0
+        self._processing = 0
+        self._processing_slots = asyncio.Semaphore(self.worker_count)
+        self.is_running = False
+
+        # Metrics
+        self._lag_samples = deque(maxlen=1000)         # enqueue -> worker pickup (ms)
+        self._processing_samples = deque(maxlen=1000)  # handler duration (ms)
+        self.stats = {
+            "enqueued": 0,
+            "processed": 0,
+            "failed": 0,
+            "retried": 0,
+            "rejected": 0,
+            "recovered": 0
+        }
+
+    def _partition(self, phone_number: str) -> int:
+        """Stable phone -> partition mapping (hash() is randomized per process)"""
+        return zlib.crc32((phone_number or "").encode("utf-8")) % self.partition_count
+
+    @property
+    def depth(self) -> int:
+        """Messages accepted but not yet finished"""
+        return max(len(self._enqueued_at), self._global_depth)
+
+    @property
+    def is_distributed(self) -> bool:
+        return self._coordinator is not None and not self._coordinator.is_local
+
+    async def start(self, handler: Callable[[dict, Any], Awaitable[Any]]):
+        """Claim partitions, recover their unfinished rows and start the worker pool
+
+        Args:
+            handler: Coroutine called as handler(payload, db) for every queued message
+        """
+        if self.is_running:
+            logger.warning("Ingest queue is already running")
+            return
+
+        self._handler = handler
+        self._coordinator = get_coordination_backend()
+        self._queues = [asyncio.Queue() for _ in range(self.worker_count)]
+
+        self._workers = [
+            asyncio.create_task(self._worker(index))
+            for index in range(self.worker_count)
+        ]
+        self.is_running = True
+        self._rebalance_partitions()
+
+        if self.is_distributed:
+            self._coordination_task = asyncio.create_task(self._coordination_loop())
+
+        logger.info(
+            f"Ingest queue started with {self.worker_count} workers, "
+            f"{len(self._owned_partitions)}/{self.partition_count} partitions (max depth {self.max_depth})"
+        )
+
+    async def stop(self):
+        """Stop the workers - unfinished rows stay in the table and are recovered on next start"""
+        tasks = list(self._workers)
+        if self._coordination_task:
+            tasks.append(self._coordination_task)
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        for partition in list(self._owned_partitions):
+            self._coordinator.release(f"ingest_partition:{partition}", WORKER_ID)
+        if self._coordinator:
+            self._coordinator.release(f"worker:{WORKER_ID}", WORKER_ID)
+
+        self._owned_partitions.clear()
+        self._workers = []
+        self._coordination_task = None
+        self.is_running = False
+        logger.info("Ingest queue stopped")
+
+    async def _coordination_loop(self):
+        """Multi-worker mode: keep leases fresh and pull rows enqueued by other workers"""
+        while True:
+            try:
+                await asyncio.sleep(self.poll_interval)
+                self._rebalance_partitions()
+                self._dispatch_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingest coordination error: {str(e)}")
+
+    def _rebalance_partitions(self):
+        """Renew owned partitions and take/give partitions to reach a fair share"""
+        coordinator = self._coordinator
+
+        if coordinator.is_local:
+            # Single worker - own everything
+            newly_owned = set(range(self.partition_count)) - self._owned_partitions
+            self._owned_partitions |= newly_owned
+            for partition in sorted(newly_owned):
+                self._recover_partition(partition)
+            return
+
+        coordinator.acquire(f"worker:{WORKER_ID}", WORKER_ID, self.lease_ttl)
+        live_workers = max(1, coordinator.count_active("worker:"))
+        fair_share = math.ceil(self.partition_count / live_workers)
+
+        # Renew what we hold - a failed renewal means someone else took it over
+        for partition in list(self._owned_partitions):
+            if not coordinator.acquire(f"ingest_partition:{partition}", WORKER_ID, self.lease_ttl):
+                logger.warning(f"Lost ingest partition {partition}")
+                self._owned_partitions.discard(partition)
+
+        # Hand back extras once they have drained locally, so the new owner keeps ordering
+        if len(self._owned_partitions) > fair_share:
+            for partition in sorted(self._owned_partitions, reverse=True):
+                if len(self._owned_partitions) <= fair_share:
+                    break
+                if self._partition_idle(partition):
+                    coordinator.release(f"ingest_partition:{partition}", WORKER_ID)
+                    self._owned_partitions.discard(partition)
+
+        # Pick up free or expired partitions
+        if len(self._owned_partitions) < fair_share:
+            for partition in range(self.partition_count):
+                if len(self._owned_partitions) >= fair_share:
+                    break
+                if partition in self._owned_partitions:
+                    continue
+                if coordinator.acquire(f"ingest_partition:{partition}", WORKER_ID, self.lease_ttl):
+                    self._owned_partitions.add(partition)
+                    self._recover_partition(partition)
+
+    def _recover_partition(self, partition: int):
+        """Reset rows interrupted mid-processing by the previous owner of a partition"""
+        db = SessionLocal()
+        try:
+            interrupted = db.query(WebhookQueueItem).filter(
+                WebhookQueueItem.partition == partition,
+                WebhookQueueItem.status == "processing"
+            ).all()
+            for item in interrupted:
+                if (item.attempts or 0) >= self.max_attempts:
+                    # Message crashed a worker repeatedly - park it instead of looping forever
+                    item.status = "failed"
+                    item.error_message = "Exceeded max attempts during crash recovery"
+                else:
+                    item.status = "pending"
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Ingest queue recovery failed for partition {partition}: {str(e)}")
+        finally:
+            db.close()
+
+        recovered = self._dispatch_pending([partition])
+        self.stats["recovered"] += recovered
+        if recovered:
+            logger.info(f"Recovered {recovered} unfinished webhook messages in partition {partition}")
+
+    def _dispatch_pending(self, partitions: Optional[List[int]] = None) -> int:
+        """Hand pending rows of owned partitions to the local workers"""
+        partitions = list(partitions if partitions is not None else self._owned_partitions)
+        if not partitions:
+            return 0
+
+        db = SessionLocal()
+        try:
+            if self.is_distributed:
+                self._global_depth = db.query(WebhookQueueItem).filter(
+                    WebhookQueueItem.status.in_(["pending", "processing"])
+                ).count()
+
+            pending = db.query(WebhookQueueItem).filter(
+                WebhookQueueItem.status == "pending",
+                WebhookQueueItem.partition.in_(partitions)
+            ).order_by(WebhookQueueItem.id).limit(500).all()
+
+            dispatched = 0
+            for item in pending:
+                if item.id in self._enqueued_at:
+                    continue
+                enqueued_at = item.enqueued_at or datetime.datetime.utcnow()
+                self._dispatch(item.id, item.partition, enqueued_at.replace(tzinfo=datetime.timezone.utc).timestamp())
+                dispatched += 1
+            return dispatched
+        except Exception as e:
+            logger.error(f"Failed to dispatch pending webhook messages: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def _partition_idle(self, partition: int) -> bool:
+        """No local work left for the partition - queued, in a worker, or pending/running in the batcher"""
+        return (self._dispatched_per_partition.get(partition, 0) == 0
+                and self._handed_off_per_partition.get(partition, 0) == 0)
+
+    def _end_handoff(self, item_id: int):
+        if item_id in self._handed_off:
+            self._handed_off.discard(item_id)
+            partition = self._item_partition.get(item_id)
+            if partition is not None:
+                self._handed_off_per_partition[partition] -= 1
+
+    def _dispatch(self, item_id: int, partition: int, enqueued_at: float):
+        self._enqueued_at[item_id] = enqueued_at
+        self._item_partition[item_id] = partition
+        self._dispatched_per_partition[partition] += 1
+        # Same partition -> same local worker, which keeps per-phone ordering
+        self._queues[partition % self.worker_count].put_nowait(item_id)
+
+    def _forget(self, item_id: int):
+        """Drop local bookkeeping of a finished (deleted or parked) item"""
+        self._enqueued_at.pop(item_id, None)
+        self._item_partition.pop(item_id, None)
+        started_at = self._started_at.pop(item_id, None)
+        if started_at is not None:
+            self._processing_samples.append((time.time() - started_at) * 1000)
+
+    async def enqueue(self, data: dict) -> Optional[int]:
+        """Persist a webhook payload and hand it to its worker
+
+        Returns:
+            The queue item ID, DUPLICATE when the Wati message ID was already claimed, or
+            None when the queue is full or could not be written (the caller should ask
+            Wati to retry later)
+        """
+        if self.depth >= self.max_depth:
+            self.stats["rejected"] += 1
+            logger.warning(f"Ingest queue full ({self.depth}/{self.max_depth}) - rejecting webhook")
+            return None
+
+        phone_number = data.get("waId") or ""
+        partition = self._partition(phone_number)
+        # SQLite insert + commit off the event loop
+        item_id = await asyncio.to_thread(self._persist, data, phone_number, partition)
+        if item_id is None:
+            self.stats["rejected"] += 1
+            return None
+        if item_id == self.DUPLICATE:
+            return self.DUPLICATE
+
+        self.stats["enqueued"] += 1
+
+        if self.is_running and partition in self._owned_partitions:
+            self._dispatch(item_id, partition, time.time())
+        # Otherwise the owning worker picks the row up on its next poll (or on start())
+
+        return item_id
+
+    def _persist(self, data: dict, phone_number: str, partition: int) -> Optional[int]:
+        """Insert the queue row and the dedup claim of its message ID in one transaction"""
+        wati_message_id = data.get("id")
+        db = SessionLocal()
+        try:
+            # The engine runs SQLite in autocommit mode - open the transaction explicitly so the
+            # row and the claim are written (or rejected) together
+            if db.get_bind().dialect.name == "sqlite":
+                db.execute(text("BEGIN IMMEDIATE"))
+            item = WebhookQueueItem(
+                phone_number=phone_number,
+                partition=partition,
+                wati_message_id=wati_message_id,
+                payload=json.dumps(data, ensure_ascii=False),
+                status="pending"
+            )
+            db.add(item)
+            db.flush()
+            message_deduplicator.add_claim(db, wati_message_id, phone_number, queue_item_id=item.id)
+            db.commit()
+            message_deduplicator.record_claim(wati_message_id, duplicate=False)
+            return item.id
+        except IntegrityError:
+            # Message ID already claimed by an earlier delivery - nothing is queued
+            db.rollback()
+            message_deduplicator.record_claim(wati_message_id, duplicate=True)
+            return self.DUPLICATE
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to persist webhook payload: {str(e)}")
+            return None
+        finally:
+            db.close()
+
+    async def _worker(self, index: int):
+        """Drain one worker queue sequentially (keeps per-phone ordering)"""
+        queue = self._queues[index]
+        while True:
+            item_id = await queue.get()
+            try:
+                await self._process_item(item_id)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingest worker {index} error on item {item_id}: {str(e)}")
+            finally:
+                queue.task_done()
+
+    async def _process_item(self, item_id: int):
+        """Run the handler for one queued message, retrying in place on failure"""
+        enqueued_at = self._enqueued_at.get(item_id, time.time())
+        self._lag_samples.append((time.time() - enqueued_at) * 1000)
+        self._started_at.setdefault(item_id, time.time())
+
+        handed_off = False
+        try:
+            while True:
+                claimed = await asyncio.to_thread(self._claim_item, item_id)
+                if claimed is None:
+                    return
+                payload, attempts = claimed
+                data = json.loads(payload)
+                # Lets a later stage ack the row through complete()/fail()
+                data["queue_item_id"] = item_id
+
+                self._in_flight += 1
+                try:
+                    # The handler gets its own session
+                    handler_db = SessionLocal()
+                    try:
+                        handed_off = bool(await self._handler(data, handler_db))
+                    finally:
+                        handler_db.close()
+                    error = None
+                except asyncio.CancelledError:
+                    # Shutting down - leave the row as 'processing' so recovery retries it
+                    raise
+                except Exception as e:
+                    error = e
+                finally:
+                    self._in_flight -= 1
+
+                if error is None:
+                    if not handed_off:
+                        # Done - the row is no longer needed
+                        await asyncio.to_thread(self._delete_items, [item_id])
+                        self.stats["processed"] += 1
+                    # Handed off: the row stays 'processing' until complete()/fail()
+                    break
+
+                if attempts >= self.max_attempts:
+                    await asyncio.to_thread(self._set_status, [item_id], "failed", str(error))
+                    self.stats["failed"] += 1
+                    logger.error(f"Webhook item {item_id} failed after {attempts} attempts: {str(error)}")
+                    break
+
+                self.stats["retried"] += 1
+                await asyncio.to_thread(self._set_status, [item_id], "pending", str(error))
+                await asyncio.sleep(self.retry_delay(attempts))
+        finally:
+            partition = self._item_partition.get(item_id)
+            if handed_off and partition is not None:
+                # Counted before the worker lets go, so the partition never looks idle in between
+                self._handed_off.add(item_id)
+                self._handed_off_per_partition[partition] += 1
+            if partition is not None:
+                self._dispatched_per_partition[partition] -= 1
+            if not handed_off:
+                self._forget(item_id)
+
+    @staticmethod
+    def retry_delay(attempts: int) -> float:
+        """Backoff before the next attempt of a message that failed `attempts` times"""
+        return min(2 ** attempts, 30)
+
+    def _claim_item(self, item_id: int):
+        """Atomically move a pending row to 'processing' - protects against a second worker that
+        took over the partition. Returns (payload, attempts), or None when the row is gone or taken"""
+        db = SessionLocal()
+        try:
+            claimed = db.query(WebhookQueueItem).filter(
+                WebhookQueueItem.id == item_id,
+                WebhookQueueItem.status == "pending"
+            ).update({
+                "status": "processing",
+                "attempts": WebhookQueueItem.attempts + 1,
+                "started_at": datetime.datetime.utcnow()
+            }, synchronize_session=False)
+            db.commit()
+            if not claimed:
+                return None
+            item = db.query(WebhookQueueItem).filter(WebhookQueueItem.id == item_id).first()
+            return item.payload, item.attempts or 0
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @asynccontextmanager
+    async def processing_slot(self):
+        """Bounds the handed-off processing (batches running the agents) to worker_count at a time"""
+        async with self._processing_slots:
+            self._processing += 1
+            try:
+                yield
+            finally:
+                self._processing -= 1
+
+    async def complete(self, item_ids: List[int]):
+        """Ack handed-off messages after their processing finished - deletes their rows"""
+        item_ids = [item_id for item_id in item_ids if item_id]
+        if not item_ids:
+            return
+        try:
+            await asyncio.to_thread(self._delete_items, item_ids)
+        except Exception as e:
+            # Rows stay 'processing' and are retried on the next recovery of their partition
+            logger.error(f"Failed to ack webhook items {item_ids}: {str(e)}")
+        for item_id in item_ids:
+            self._end_handoff(item_id)
+            self.stats["processed"] += 1
+            self._forget(item_id)
+
+    async def retry(self, item_ids: List[int], error: Exception, attempts: int) -> bool:
+        """Handed-off processing failed on its `attempts`-th try; count another attempt on the rows
+
+        Returns:
+            True when the caller should run the messages again (after retry_delay(attempts),
+            still in order with the phone's newer messages), False when retries are exhausted
+            and it should call fail()
+        """
+        item_ids = [item_id for item_id in item_ids if item_id]
+        if attempts >= self.max_attempts:
+            return False
+        if item_ids:
+            try:
+                row_attempts = await asyncio.to_thread(self._count_attempt, item_ids, str(error))
+            except Exception as e:
+                logger.error(f"Failed to record retry of webhook items {item_ids}: {str(e)}")
+                row_attempts = attempts
+            if row_attempts > self.max_attempts:
+                return False
+        self.stats["retried"] += 1
+        return True
+
+    async def fail(self, item_ids: List[int], error: Exception):
+        """Handed-off processing failed for good - park the messages as failed"""
+        item_ids = [item_id for item_id in item_ids if item_id]
+        if not item_ids:
+            return
+        try:
+            await asyncio.to_thread(self._set_status, item_ids, "failed", str(error))
+        except Exception as e:
+            # Rows stay 'processing' and are retried on the next recovery of their partition
+            logger.error(f"Failed to park webhook items {item_ids}: {str(e)}")
+        for item_id in item_ids:
+            self._end_handoff(item_id)
+            self.stats["failed"] += 1
+            logger.error(f"Webhook item {item_id} failed: {str(error)}")
+            self._forget(item_id)
+
+    def _delete_items(self, item_ids: List[int]):
+        db = SessionLocal()
+        try:
+            db.query(WebhookQueueItem).filter(
+                WebhookQueueItem.id.in_(item_ids)
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _set_status(self, item_ids: List[int], status: str, error_message: str):
+        db = SessionLocal()
+        try:
+            db.query(WebhookQueueItem).filter(
+                WebhookQueueItem.id.in_(item_ids)
+            ).update({"status": status, "error_message": error_message}, synchronize_session=False)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _count_attempt(self, item_ids: List[int], error_message: str) -> int:
+        """Add an attempt to rows that stay 'processing' for an in-place retry; returns the highest count"""
+        db = SessionLocal()
+        try:
+            db.query(WebhookQueueItem).filter(
+                WebhookQueueItem.id.in_(item_ids)
+            ).update({
+                "attempts": WebhookQueueItem.attempts + 1,
+                "error_message": error_message
+            }, synchronize_session=False)
+            db.commit()
+            attempts = db.query(WebhookQueueItem.attempts).filter(WebhookQueueItem.id.in_(item_ids)).all()
+            return max((row[0] or 0 for row in attempts), default=0)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    @staticmethod
+    def _percentile(samples, percentile: float) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(percentile / 100 * (len(ordered) - 1))))
+        return round(ordered[index], 2)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Queue depth, lag and throughput metrics"""
+        now = time.time()
+        oldest = min(self._enqueued_at.values()) if self._enqueued_at else None
+
+        return {
+            "is_running": self.is_running,
+            "worker_id": WORKER_ID,
+            "coordination_backend": self._coordinator.name if self._coordinator else None,
+            "owned_partitions": sorted(self._owned_partitions),
+            "partition_count": self.partition_count,
+            "worker_count": self.worker_count,
+            "max_depth": self.max_depth,
+            "depth": self.depth,
+            "local_depth": len(self._enqueued_at),
+            "in_flight": self._in_flight,
+            "handed_off": len(self._handed_off),
+            "processing": self._processing,
+            "worker_queue_sizes": [queue.qsize() for queue in self._queues],
+            "oldest_message_age_seconds": round(now - oldest, 2) if oldest else 0.0,
+            "lag_ms": {
+                "p50": self._percentile(self._lag_samples, 50),
+                "p95": self._percentile(self._lag_samples, 95),
+                "max": round(max(self._lag_samples), 2) if self._lag_samples else 0.0
+            },
+            "processing_ms": {
+                "p50": self._percentile(self._processing_samples, 50),
+                "p95": self._percentile(self._processing_samples, 95)
+            },
+            **self.stats
+        }
+
+    def get_failed_items(self, limit: int = 50) -> List[Dict[str, Any]]:
+        """Messages parked after exhausting their retries"""
+        db = SessionLocal()
+        try:
+            items = db.query(WebhookQueueItem).filter(
+                WebhookQueueItem.status == "failed"
+            ).order_by(WebhookQueueItem.id.desc()).limit(limit).all()
+            return [
+                {
+                    "id": item.id,
+                    "phone_number": item.phone_number,
+                    "wati_message_id": item.wati_message_id,
+                    "attempts": item.attempts,
+                    "error_message": item.error_message,
+                    "enqueued_at": item.enqueued_at.isoformat() if item.enqueued_at else None
+                }
+                for item in items
+            ]
+        finally:
+            db.close()
+
+
+# Singleton instance
+ingest_queue = WebhookIngestQueue()
@@ -0,0 +1,251 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import datetime
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+
+from database.db_utils import SessionLocal
+from database.db_models import LLMDecisionCacheEntry
+from utils.arabic_normalizer import normalize_embedding
+
+logger = logging.getLogger(__name__)
+
+
+class LLMDecisionCache:
+    """
+    Memoizes deterministic LLM sub-decisions (relevance, entity verification, message type,
+    KB answer acceptance) - the same message in the same conversation state always gets the
+    same low-temperature answer, so it is only paid for once.
+
+    Keys combine the decision namespace, its prompt version, the normalized message text,
+    a hash of the history window the prompt actually sees and any extra prompt inputs.
+    Bumping a prompt version orphans its old entries. Lookups hit an in-memory TTL/LRU map
+    first, then the llm_decision_cache table (shared by every worker and kept across
+    restarts). Concurrent identical requests share one in-flight LLM call.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_CACHE_ENABLED", "true").lower() == "true"
+        self.ttl_seconds = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(24 * 3600)))
+        self.max_entries = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "5000"))
+        self.persistent = os.getenv("LLM_CACHE_PERSISTENT", "true").lower() == "true"
+
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._stores_since_prune = 0
+        self.stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "shared_in_flight": 0,
+            "misses": 0,
+            "errors": 0
+        }
+        self.namespace_stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def make_key(namespace: str, prompt_version: str, text: str,
+                 history: Optional[List[Dict]] = None, extra: Any = None) -> str:
+        """Stable key for a decision - only the history window passed in is hashed"""
+        history_window = [
+            (msg.get("role", ""), normalize_embedding(str(msg.get("content") or "")).lower())
+            for msg in (history or [])
+        ]
+        history_hash = hashlib.sha256(
+            json.dumps(history_window, ensure_ascii=False).encode("utf-8")
+        ).hexdigest()
+        raw = json.dumps(
+            [namespace, prompt_version, normalize_embedding(str(text or "")).lower(), history_hash, extra],
+            ensure_ascii=False, sort_keys=True, default=str
+        )
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, namespace: str, outcome: str):
+        self.stats[outcome] += 1
+        counters = self.namespace_stats.setdefault(namespace, {"hits": 0, "misses": 0})
+        counters["misses" if outcome == "misses" else "hits"] += 1
+
+    def _remember(self, key: str, value: Any, expires_at: float):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _memory_get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if time.time() > expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _load_persistent(self, key: str) -> Optional[tuple]:
+        db = SessionLocal()
+        try:
+            row = db.query(LLMDecisionCacheEntry).filter(
+                LLMDecisionCacheEntry.cache_key == key,
+                LLMDecisionCacheEntry.expires_at > datetime.datetime.utcnow()
+            ).first()
+            if row is None:
+                return None
+            expires_at = row.expires_at.replace(tzinfo=datetime.timezone.utc).timestamp()
+            return expires_at, json.loads(row.value)
+        finally:
+            db.close()
+
+    def _store_persistent(self, key: str, namespace: str, value: Any):
+        db = SessionLocal()
+        try:
+            db.merge(LLMDecisionCacheEntry(
+                cache_key=key,
+                namespace=namespace,
+                value=json.dumps(value, ensure_ascii=False),
+                created_at=datetime.datetime.utcnow(),
+                expires_at=datetime.datetime.utcnow() + datetime.timedelta(seconds=self.ttl_seconds)
+            ))
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+        self._stores_since_prune += 1
+        if self._stores_since_prune >= 500:
+            self._stores_since_prune = 0
+            self.prune_persistent()
+
+    async def get_or_compute(self, namespace: str, prompt_version: str, text: str,
+                             compute: Callable[[], Awaitable[Any]],
+                             history: Optional[List[Dict]] = None, extra: Any = None):
+        """Return the cached decision or run `compute` once and cache its (JSON-serializable) result
+
+        Args:
+            namespace: Decision name, e.g. "relevance" or "city_verification"
+            prompt_version: Version of the prompt behind the decision
+            text: The user message being decided on
+            compute: Coroutine factory making the LLM call - exceptions and None are not cached
+            history: The conversation window the prompt includes (already sliced)
+            extra: Any other prompt input that changes the answer (language, candidates...)
+        """
+        if not self.enabled:
+            return await compute()
+
+        key = self.make_key(namespace, prompt_version, text, history, extra)
+
+        entry = self._memory_get(key)
+        if entry is not None:
+            self._count(namespace, "memory_hits")
+            return entry[1]
+
+        pending = self._in_flight.get(key)
+        if pending is not None:
+            self._count(namespace, "shared_in_flight")
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The task that owned the call was cancelled - make our own
+                return await compute()
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            if self.persistent:
+                try:
+                    entry = await asyncio.to_thread(self._load_persistent, key)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"LLM cache lookup failed: {str(e)}")
+                    entry = None
+                if entry is not None:
+                    self._count(namespace, "persistent_hits")
+                    self._remember(key, entry[1], entry[0])
+                    future.set_result(entry[1])
+                    return entry[1]
+
+            self._count(namespace, "misses")
+            value = await compute()
+            future.set_result(value)
+            if value is None:
+                # Callers that swallow provider errors return None - don't pin the failure
+                return value
+            self._remember(key, value, time.time() + self.ttl_seconds)
+
+            if self.persistent:
+                try:
+                    await asyncio.to_thread(self._store_persistent, key, namespace, value)
+                except Exception as e:
+                    self.stats["errors"] += 1
+                    logger.error(f"LLM cache store failed: {str(e)}")
+            return value
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            if not future.done():
+                # Waiters get the same error - a failed call is never cached
+                future.set_exception(e)
+                future.exception()
+            raise
+        finally:
+            self._in_flight.pop(key, None)
+
+    def prune_persistent(self) -> int:
+        """Delete expired cache rows"""
+        db = SessionLocal()
+        try:
+            deleted = db.query(LLMDecisionCacheEntry).filter(
+                LLMDecisionCacheEntry.expires_at < datetime.datetime.utcnow()
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to prune LLM decision cache: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def clear(self, namespace: Optional[str] = None) -> int:
+        """Drop cached decisions (all, or one namespace) from memory and the table"""
+        # Memory keys don't carry the namespace - clearing one namespace empties the whole front
+        self._entries.clear()
+        db = SessionLocal()
+        try:
+            query = db.query(LLMDecisionCacheEntry)
+            if namespace is not None:
+                query = query.filter(LLMDecisionCacheEntry.namespace == namespace)
+            deleted = query.delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to clear LLM decision cache: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = sum(self.stats[name] for name in ("memory_hits", "persistent_hits", "shared_in_flight", "misses"))
+        hits = lookups - self.stats["misses"]
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self._entries),
+            "memory_max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+            "namespaces": self.namespace_stats,
+            **self.stats
+        }
+
+
+# Singleton instance
+llm_decision_cache = LLMDecisionCache()
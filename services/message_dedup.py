@@ -0,0 +1,155 @@
+import logging
+import os
+import time
+import datetime
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+from sqlalchemy.exc import IntegrityError
+
+from database.db_utils import SessionLocal
+from database.db_models import ProcessedWebhookMessage
+
+logger = logging.getLogger(__name__)
+
+
+class MessageDeduplicator:
+    """
+    Single place that decides whether a Wati message ID was already handled.
+
+    Lookups go to an in-memory TTL/LRU map first (O(1), no I/O). On a miss the ID is
+    claimed in the processed_webhook_messages table, whose primary key is the message
+    ID - so a duplicate insert fails on the unique index instead of scanning
+    user_messages, and the claim is shared by every worker/process using the database.
+
+    The webhook takes the claim in the same transaction as its ingest queue row
+    (add_claim + record_claim), so retries and crash recovery of that row never see
+    their own claim as a duplicate.
+    """
+
+    def __init__(self):
+        self.ttl_seconds = int(os.getenv("DEDUP_MEMORY_TTL_SECONDS", str(24 * 3600)))
+        self.max_entries = int(os.getenv("DEDUP_MEMORY_MAX_ENTRIES", "50000"))
+        self.retention_days = int(os.getenv("DEDUP_RETENTION_DAYS", "7"))
+
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._claims_since_prune = 0
+        self.stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "claimed": 0,
+            "errors": 0
+        }
+
+    def _remember(self, wati_message_id: str, now: float):
+        self._seen[wati_message_id] = now
+        self._seen.move_to_end(wati_message_id)
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+
+    def seen_recently(self, wati_message_id: Optional[str]) -> bool:
+        """Memory-only check - cheap enough to run inside the webhook request"""
+        if not wati_message_id:
+            return False
+
+        seen_at = self._seen.get(wati_message_id)
+        if seen_at is None:
+            return False
+
+        if time.time() - seen_at > self.ttl_seconds:
+            del self._seen[wati_message_id]
+            return False
+
+        self._seen.move_to_end(wati_message_id)
+        return True
+
+    def add_claim(self, db, wati_message_id: Optional[str], phone_number: Optional[str] = None,
+                  queue_item_id: Optional[int] = None):
+        """Add the claim for a message ID to the caller's transaction
+
+        The caller's commit decides: an IntegrityError means the ID was already claimed.
+        """
+        if wati_message_id:
+            db.add(ProcessedWebhookMessage(
+                wati_message_id=wati_message_id,
+                phone_number=phone_number,
+                queue_item_id=queue_item_id
+            ))
+
+    def record_claim(self, wati_message_id: Optional[str], duplicate: bool):
+        """Remember the outcome of a claim committed (or rejected) by the caller"""
+        if not wati_message_id:
+            return
+
+        self.stats["persistent_hits" if duplicate else "claimed"] += 1
+        self._remember(wati_message_id, time.time())
+
+        if not duplicate:
+            self._claims_since_prune += 1
+            if self._claims_since_prune >= 1000:
+                self._claims_since_prune = 0
+                self.prune_persistent()
+
+    def is_duplicate(self, wati_message_id: Optional[str], phone_number: Optional[str] = None) -> bool:
+        """Check a message ID and claim it if it is new
+
+        Returns:
+            True if the message was already seen (by this or any other worker), False if
+            this call claimed it and the caller should process it
+        """
+        if not wati_message_id:
+            return False
+
+        if self.seen_recently(wati_message_id):
+            self.stats["memory_hits"] += 1
+            return True
+
+        db = SessionLocal()
+        try:
+            self.add_claim(db, wati_message_id, phone_number)
+            db.commit()
+            duplicate = False
+        except IntegrityError:
+            db.rollback()
+            duplicate = True
+        except Exception as e:
+            # Fail open - better to risk a duplicate reply than to drop a message
+            db.rollback()
+            self.stats["errors"] += 1
+            logger.error(f"Dedup backstop error for {wati_message_id}: {str(e)}")
+            self._remember(wati_message_id, time.time())
+            return False
+        finally:
+            db.close()
+
+        self.record_claim(wati_message_id, duplicate)
+        return duplicate
+
+    def prune_persistent(self) -> int:
+        """Delete backstop rows older than the retention period"""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(days=self.retention_days)
+        db = SessionLocal()
+        try:
+            deleted = db.query(ProcessedWebhookMessage).filter(
+                ProcessedWebhookMessage.processed_at < cutoff
+            ).delete(synchronize_session=False)
+            db.commit()
+            return deleted
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to prune processed webhook messages: {str(e)}")
+            return 0
+        finally:
+            db.close()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "memory_entries": len(self._seen),
+            "memory_max_entries": self.max_entries,
+            "memory_ttl_seconds": self.ttl_seconds,
+            **self.stats
+        }
+
+
+# Singleton instance
+message_deduplicator = MessageDeduplicator()
@@ -0,0 +1,353 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Dict, Any, Optional, List
+
+import aiohttp
+
+from database.db_utils import SessionLocal
+from database.db_models import OutboundDeadLetter
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Async token bucket - `rate` sends per second with bursts up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class WatiSenderService:
+    """
+    Long-lived outbound sender for Wati session messages.
+
+    - one keep-alive aiohttp session shared by all sends
+    - a FIFO lane per phone number so replies arrive in order
+    - a global token bucket matching Wati's send limits
+    - retries with exponential backoff inside the lane, then a dead-letter table; a failed
+      sendSessionMessage is retried on the sendMessage endpoint as its own attempt
+    - no retry when the outcome is unknown (timeout, dropped connection): the message may
+      already be on the customer's phone, so it is dead-lettered for review instead
+    """
+
+    def __init__(self):
+        self.api_key = os.getenv("WATI_API_KEY")
+        self.api_url = self._normalize_url(
+            os.getenv("WATI_API_URL") or os.getenv("WATI_INSTANCE_ID") or "https://live-mt-server.wati.io/301269/api/v1"
+        )
+
+        # Wati limit is per account - split it across uvicorn workers
+        workers = max(1, int(os.getenv("APP_WORKERS", "1")))
+        rate = float(os.getenv("WATI_SEND_RATE_PER_SECOND", "10")) / workers
+        self.bucket = TokenBucket(rate=rate, capacity=max(1.0, float(os.getenv("WATI_SEND_BURST", "20")) / workers))
+
+        self.max_attempts = int(os.getenv("WATI_SEND_MAX_ATTEMPTS", "4"))
+        self.base_delay = float(os.getenv("WATI_SEND_BASE_DELAY", "1.0"))
+        self.request_timeout = float(os.getenv("WATI_SEND_TIMEOUT", "20"))
+        self.pool_size = int(os.getenv("WATI_SEND_POOL_SIZE", "20"))
+
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lanes: Dict[str, asyncio.Queue] = {}
+        self._lane_tasks: Dict[str, asyncio.Task] = {}
+        # Job each lane is delivering right now - failed by close() along with the queued ones
+        self._in_flight: Dict[str, Dict[str, Any]] = {}
+
+        # Metrics
+        self._latency_samples = deque(maxlen=1000)     # single HTTP call (ms)
+        self._delivery_samples = deque(maxlen=1000)    # enqueue -> delivered (ms)
+        self.stats = {
+            "sent": 0,
+            "alternate_endpoint_used": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "delivery_unknown": 0,
+            "dead_lettered": 0
+        }
+
+    @staticmethod
+    def _normalize_url(url: str) -> str:
+        """Make sure the base URL ends with /api/v1"""
+        url = url.rstrip('/')
+        if not url.endswith('/api/v1'):
+            url = url + '/api/v1'
+        return url
+
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json; charset=utf-8",
+            "accept": "*/*",
+            "accept-language": "ar,en-GB;q=0.9,en;q=0.8,ar-EG;q=0.7,en-US;q=0.6",
+            "accept-charset": "utf-8",
+            "origin": "https://live.wati.io",
+            "referer": "https://live.wati.io/",
+            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/136.0.0.0 Safari/537.36"
+        }
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """Shared keep-alive session (created lazily inside the running event loop)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                headers=self._headers(),
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+            )
+        return self._session
+
+    async def close(self):
+        """Cancel the lanes, fail their undelivered messages and close the connection pool"""
+        lanes = dict(self._lanes)
+        in_flight = dict(self._in_flight)
+        for task in self._lane_tasks.values():
+            task.cancel()
+        if self._lane_tasks:
+            await asyncio.gather(*self._lane_tasks.values(), return_exceptions=True)
+        self._lane_tasks.clear()
+        self._lanes.clear()
+        self._in_flight.clear()
+
+        # Callers of send() are waiting on these futures - resolve them and keep the messages
+        for phone_number, job in in_flight.items():
+            await self._abandon(phone_number, job, "Sender closed during delivery - outcome unknown")
+        for phone_number, lane in lanes.items():
+            while not lane.empty():
+                await self._abandon(phone_number, lane.get_nowait(), "Sender closed before delivery")
+
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+    async def send(self, phone_number: str, message: str) -> Dict[str, Any]:
+        """Queue a message on the phone's lane and wait for the delivery result"""
+        if not self.api_key:
+            error_msg = "WATI_API_KEY environment variable is not set"
+            print(f"❌ [Wati Config Error] {error_msg}")
+            return {"error": error_msg}
+
+        future = asyncio.get_running_loop().create_future()
+        lane = self._lanes.get(phone_number)
+        if lane is None:
+            lane = asyncio.Queue()
+            self._lanes[phone_number] = lane
+            self._lane_tasks[phone_number] = asyncio.create_task(self._drain_lane(phone_number, lane))
+
+        lane.put_nowait({
+            "message": message,
+            "future": future,
+            "enqueued_at": time.time()
+        })
+        # shield: a caller timeout must not cancel the delivery itself
+        return await asyncio.shield(future)
+
+    async def _drain_lane(self, phone_number: str, lane: asyncio.Queue):
+        """Deliver one phone's messages strictly in order, then retire the lane when idle"""
+        try:
+            while True:
+                try:
+                    job = await asyncio.wait_for(lane.get(), timeout=30)
+                except asyncio.TimeoutError:
+                    if lane.empty():
+                        break
+                    continue
+
+                self._in_flight[phone_number] = job
+                result = await self._deliver(phone_number, job["message"])
+                self._in_flight.pop(phone_number, None)
+                if "error" not in result:
+                    self._delivery_samples.append((time.time() - job["enqueued_at"]) * 1000)
+                if not job["future"].done():
+                    job["future"].set_result(result)
+        finally:
+            if self._lanes.get(phone_number) is lane:
+                del self._lanes[phone_number]
+                self._lane_tasks.pop(phone_number, None)
+
+    async def _deliver(self, phone_number: str, message: str) -> Dict[str, Any]:
+        """Send with retries/backoff; dead-letter the message when all attempts fail"""
+        last_status = None
+        last_error = None
+        attempts = 0
+        alternate = False
+        tried_alternate = False
+
+        for attempt in range(self.max_attempts):
+            attempts = attempt + 1
+            if attempt > 0:
+                self.stats["retries"] += 1
+
+            await self.bucket.acquire()
+            status, result, retry_after = await self._post_once(phone_number, message, alternate=alternate)
+
+            if status == 200:
+                if alternate:
+                    self.stats["alternate_endpoint_used"] += 1
+                self.stats["sent"] += 1
+                print(f"✅ Message sent successfully to {phone_number}")
+                return result
+
+            last_status = status
+            last_error = result.get("error")
+
+            if status == 429:
+                self.stats["rate_limited"] += 1
+            elif status is not None:
+                # Client errors (bad number, expired session...) won't fix themselves - but the
+                # other endpoint may accept the message, so give it one attempt first
+                if 400 <= status < 500 and tried_alternate:
+                    break
+                alternate = not alternate
+                tried_alternate = tried_alternate or alternate
+            elif result.get("delivery_unknown"):
+                # The request may have reached Wati - a retry could send the reply twice
+                self.stats["delivery_unknown"] += 1
+                last_error = f"Delivery unknown, not retried: {last_error}"
+                break
+
+            if attempts >= self.max_attempts:
+                break
+
+            delay = retry_after if retry_after else self.base_delay * (2 ** attempt) + random.uniform(0, 0.5)
+            endpoint = "sendMessage" if alternate else "sendSessionMessage"
+            print(f"🔄 Wati send to {phone_number} failed ({status or last_error}) - retrying on {endpoint} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+        await asyncio.to_thread(self._dead_letter, phone_number, message, attempts, last_status, last_error)
+        return {"error": f"HTTP {last_status}" if last_status else last_error, "dead_lettered": True}
+
+    async def _abandon(self, phone_number: str, job: Dict[str, Any], error: str):
+        """Dead-letter a message the sender will not deliver and fail its caller"""
+        await asyncio.to_thread(self._dead_letter, phone_number, job["message"], 0, None, error)
+        if not job["future"].done():
+            job["future"].set_result({"error": error, "dead_lettered": True})
+
+    async def _post_once(self, phone_number: str, message: str, alternate: bool = False):
+        """One HTTP call: sendSessionMessage, or the sendMessage endpoint when alternate is set
+
+        Returns:
+            (status, result_dict, retry_after_seconds)
+        """
+        session = self._get_session()
+        start_time = time.time()
+        if alternate:
+            url = f"{self.api_url}/sendMessage"
+            params = {"whatsappNumber": phone_number, "messageText": message}
+        else:
+            url = f"{self.api_url}/sendSessionMessage/{phone_number}"
+            params = {"messageText": message}
+        try:
+            # aiohttp encodes params (including Arabic) - Wati expects messageText as a query parameter
+            async with session.post(url, params=params) as response:
+                status = response.status
+                retry_after = response.headers.get("Retry-After")
+                text = await response.text()
+
+            self._latency_samples.append((time.time() - start_time) * 1000)
+
+            if status == 200:
+                try:
+                    return status, json.loads(text), None
+                except ValueError:
+                    return status, {"status": "success", "text": text}, None
+
+            try:
+                retry_after = float(retry_after) if retry_after else None
+            except ValueError:
+                retry_after = None
+            return status, {"error": f"HTTP {status}", "response": text}, retry_after
+
+        except Exception as e:
+            self._latency_samples.append((time.time() - start_time) * 1000)
+            # Only a failed connect proves nothing was sent; timeouts and dropped connections don't
+            return None, {
+                "error": f"Failed to send WhatsApp message: {str(e)}",
+                "delivery_unknown": not isinstance(e, aiohttp.ClientConnectorError)
+            }, None
+
+    def _dead_letter(self, phone_number: str, message: str, attempts: int, status: Optional[int], error: Optional[str]):
+        self.stats["dead_lettered"] += 1
+        print(f"❌ [Wati API Error] Giving up on message to {phone_number} after {attempts} attempts")
+        db = SessionLocal()
+        try:
+            db.add(OutboundDeadLetter(
+                phone_number=phone_number,
+                message=message,
+                attempts=attempts,
+                last_status=status,
+                error_message=error
+            ))
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            logger.error(f"Failed to store dead letter for {phone_number}: {str(e)}")
+        finally:
+            db.close()
+
+    def get_dead_letters(self, limit: int = 50) -> List[Dict[str, Any]]:
+        db = SessionLocal()
+        try:
+            items = db.query(OutboundDeadLetter).order_by(OutboundDeadLetter.id.desc()).limit(limit).all()
+            return [
+                {
+                    "id": item.id,
+                    "phone_number": item.phone_number,
+                    "message": item.message,
+                    "attempts": item.attempts,
+                    "last_status": item.last_status,
+                    "error_message": item.error_message,
+                    "created_at": item.created_at.isoformat() if item.created_at else None
+                }
+                for item in items
+            ]
+        finally:
+            db.close()
+
+    @staticmethod
+    def _percentile(samples, percentile: float) -> float:
+        if not samples:
+            return 0.0
+        ordered = sorted(samples)
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))], 2)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "active_lanes": len(self._lanes),
+            "queued_messages": sum(lane.qsize() for lane in self._lanes.values()),
+            "rate_per_second": self.bucket.rate,
+            "available_tokens": round(self.bucket.tokens, 2),
+            "send_latency_ms": {
+                "p50": self._percentile(self._latency_samples, 50),
+                "p95": self._percentile(self._latency_samples, 95)
+            },
+            "delivery_latency_ms": {
+                "p50": self._percentile(self._delivery_samples, 50),
+                "p95": self._percentile(self._delivery_samples, 95)
+            },
+            **self.stats
+        }
+
+
+# Singleton instance
+whatsapp_sender = WatiSenderService()
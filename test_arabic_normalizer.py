@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Arabic Normalizer Test Script
+Checks that utils.arabic_normalizer returns exactly what the old per-call normalizers returned
+and measures the speedup on the nested-loop pattern of the extractors
+(every catalog name normalized again for every message).
+"""
+
+import os
+import re
+import sys
+import time
+import random
+import unicodedata
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.arabic_normalizer import normalize_search, normalize_brand, normalize_embedding, clear_cache, cache_info
+
+
+# ─── Previous implementations (reference output) ───────────────────────────────
+
+def legacy_normalize_city_name(city_name):
+    """DistrictLookup.normalize_city_name before utils.arabic_normalizer"""
+    if not city_name:
+        return city_name
+    normalized = city_name.strip().lower()
+    normalizations = {
+        'ء': '', 'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ى': 'ي', 'ئ': 'ي', 'ؤ': 'و', 'ة': 'ه',
+    }
+    for original, replacement in normalizations.items():
+        normalized = normalized.replace(original, replacement)
+    normalized = ' '.join(normalized.split())
+    return normalized
+
+
+def legacy_clean_brand_name(brand_text):
+    """QueryAgent._clean_brand_name before utils.arabic_normalizer"""
+    water_prefixes = ["مياه", "موية", "مياة", "ميه", "water"]
+    cleaned_text = brand_text.strip()
+    for prefix in water_prefixes:
+        if cleaned_text.lower().startswith(prefix.lower() + " "):
+            cleaned_text = cleaned_text[len(prefix):].strip()
+            break
+        elif cleaned_text.lower().startswith(prefix.lower()) and len(cleaned_text) > len(prefix):
+            cleaned_text = cleaned_text[len(prefix):].strip()
+            break
+    cleaned_text = cleaned_text.replace("ايڤال", "ايفال")
+    return legacy_normalize_city_name(cleaned_text)
+
+
+def legacy_normalize_arabic_text(text):
+    """ArabicTextProcessor.normalize_arabic_text before utils.arabic_normalizer"""
+    if not text:
+        return ""
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    text = re.sub(r'[\u064B-\u065F\u0670\u06D6-\u06ED]', '', text)
+    text = text.replace('أ', 'ا').replace('إ', 'ا').replace('آ', 'ا')
+    text = text.replace('ة', 'ه')
+    text = text.replace('ى', 'ي')
+    text = re.sub(r'\s+', ' ', text).strip()
+    text = unicodedata.normalize('NFKC', text)
+    return text
+
+
+# ─── Corpus ───────────────────────────────────────────────────────────────────
+
+SAMPLES = [
+    "", " ", "الرياض", "جدة", "مكة المكرمة", "الأحساء", "أبها", "الخُبَر", "  الدمام  ",
+    "Riyadh", "JEDDAH", "Al Kharj", "مياه نستلة", "مياه نستله", "موية نقي", "ميه هنا", "مياة أكوافينا",
+    "مياه", "water Nova", "WATER nova", "Waterfall", "ايڤال", "مياه ايڤال", "صفا مكة", "مياهالعين",
+    "حي الحمراء الأول", "ساكن في حي النزهة، الرياض؟", "شُكْرًا جَزِيلًا", "سؤال عن التوصيل لمؤسسة",
+    "ﻻ", "ﷲ", "ﹰ", "ﺍﻟﺮﻳﺎﺽ", "١٢٣ ريال", "tab\there", "new\nline", "nbsp space", "İstanbul",
+    "ؤئءآإأىة", "ـــ كشيدة", "٪ ٫ ؛", "emoji 🚚 توصيل",
+]
+
+ALPHABET = (
+    "ابتثجحخدذرزسشصضطظعغفقكلمنهوي" "ءأإآؤئىة" "ڤپچگ" "ًٌٍَُِّْٰۖ"
+    "ﻻﺍﻟﺮﹰ" "abcXYZ" "0123٠١٢" " \t\n " "،؟!."
+)
+
+
+def build_corpus(size=5000, seed=7):
+    rng = random.Random(seed)
+    corpus = list(SAMPLES)
+    prefixes = ["", "", "مياه ", "موية", "ميه ", "water ", "  "]
+    for _ in range(size):
+        word = "".join(rng.choice(ALPHABET) for _ in range(rng.randint(1, 24)))
+        corpus.append(rng.choice(prefixes) + word)
+    return corpus
+
+
+# ─── Checks ───────────────────────────────────────────────────────────────────
+
+def check_equivalence(corpus):
+    print("\n🧪 Equivalence with the previous normalizers")
+    pairs = [
+        ("search    (normalize_city_name)", legacy_normalize_city_name, normalize_search),
+        ("brand     (_clean_brand_name)", legacy_clean_brand_name, normalize_brand),
+        ("embedding (normalize_arabic_text)", legacy_normalize_arabic_text, normalize_embedding),
+    ]
+    failures = 0
+    for name, legacy, current in pairs:
+        mismatches = [text for text in corpus if legacy(text) != current(text)]
+        # Second pass answers from the LRU memo and must agree too
+        mismatches += [text for text in corpus if legacy(text) != current(text)]
+        status = "✅" if not mismatches else "❌"
+        print(f"   {status} {name}: {len(corpus)} strings, {len(mismatches)} mismatches")
+        for text in mismatches[:5]:
+            print(f"      {text!r}: {legacy(text)!r} != {current(text)!r}")
+        failures += len(mismatches)
+
+    assert normalize_search(None) is None and legacy_normalize_city_name(None) is None
+    assert normalize_embedding("مَرْحَبًا".encode('utf-8')) == legacy_normalize_arabic_text("مَرْحَبًا".encode('utf-8'))
+    return failures == 0
+
+
+def benchmark(names, messages, repeat=5):
+    print("\n⏱️ Benchmark: normalize every catalog name for every message")
+
+    def run(normalize_name, normalize_message):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for message in messages:
+                normalize_message(message)
+                for name in names:
+                    normalize_name(name)
+        return (time.perf_counter() - start) * 1000
+
+    clear_cache()
+    legacy_ms = run(legacy_normalize_city_name, legacy_normalize_city_name)
+    current_ms = run(normalize_search, normalize_search)
+    print(f"   search:    {legacy_ms:8.1f} ms -> {current_ms:8.1f} ms  ({legacy_ms / current_ms:.1f}x)")
+
+    legacy_ms = run(legacy_clean_brand_name, legacy_clean_brand_name)
+    current_ms = run(normalize_brand, normalize_brand)
+    print(f"   brand:     {legacy_ms:8.1f} ms -> {current_ms:8.1f} ms  ({legacy_ms / current_ms:.1f}x)")
+
+    legacy_ms = run(legacy_normalize_arabic_text, legacy_normalize_arabic_text)
+    current_ms = run(normalize_embedding, normalize_embedding)
+    print(f"   embedding: {legacy_ms:8.1f} ms -> {current_ms:8.1f} ms  ({legacy_ms / current_ms:.1f}x)")
+
+    # Cold cache: unique strings only (every call misses the memo)
+    clear_cache()
+    unique = build_corpus(20000, seed=11)
+    start = time.perf_counter()
+    for text in unique:
+        legacy_normalize_city_name(text)
+    legacy_ms = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    for text in unique:
+        normalize_search(text)
+    current_ms = (time.perf_counter() - start) * 1000
+    print(f"   search, cold cache ({len(unique)} unique strings): {legacy_ms:.1f} ms -> {current_ms:.1f} ms  ({legacy_ms / current_ms:.1f}x)")
+    print(f"   cache: {cache_info()['search']}")
+
+
+def main():
+    corpus = build_corpus()
+    ok = check_equivalence(corpus)
+
+    names = build_corpus(400, seed=3)[len(SAMPLES):]
+    messages = build_corpus(50, seed=5)[len(SAMPLES):]
+    benchmark(names, messages)
+
+    if ok:
+        print("\n🎉 Normalizer output identical to the previous implementations")
+    else:
+        print("\n❌ Normalizer output differs from the previous implementations")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
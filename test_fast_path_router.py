@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Fast Path Router Test Script
+Seeds a scratch SQLite database (never the real one) with a small catalog, builds the entity
+gazetteer from it and checks agents.fast_path_router:
+- template inquiries are answered with the right intent, city, brand and reply
+- glued prefixes ("للرياض") and English names are recognized
+- ambiguous, low-confidence, over-long and mixed questions fall back to the LLM path (None)
+"""
+
+import os
+import sys
+import shutil
+import asyncio
+import tempfile
+
+# Scratch database - set before anything imports database.db_utils
+SCRATCH_DIR = tempfile.mkdtemp(prefix="fast_path_test_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(SCRATCH_DIR, 'chatbot.sqlite')}"
+os.environ["FAST_PATH_ENABLED"] = "true"
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database.db_utils import SessionLocal
+from database.db_models import City, Brand, Product
+from services.gazetteer import entity_gazetteer
+from agents.fast_path_router import FastPathRouter
+
+
+def seed():
+    db = SessionLocal()
+    try:
+        jeddah = City(external_id=1, name="جدة", name_en="Jeddah")
+        riyadh = City(external_id=2, name="الرياض", name_en="Riyadh")
+        tabuk = City(external_id=3, name="تبوك", name_en="Tabuk")
+        nestle = Brand(external_id=10, title="نستله", title_en="Nestle")
+        nova = Brand(external_id=11, title="نوفا", title_en="Nova")
+        # A brand named after a city - "ماركات تبوك" must not be guessed
+        tabuk_water = Brand(external_id=12, title="تبوك", title_en="Tabuk Water")
+        jeddah.brands = [nestle, nova]
+        riyadh.brands = [nestle]
+        tabuk.brands = [tabuk_water]
+        db.add_all([jeddah, riyadh, tabuk])
+        db.flush()
+        db.add(Product(external_id=100, brand_id=nestle.id, title="نستله 330 مل", packing="40 عبوة", contract_price=18.0))
+        db.add(Product(external_id=101, brand_id=nestle.id, title="نستله 600 مل", packing="30 عبوة", contract_price=21.5))
+        db.commit()
+    finally:
+        db.close()
+
+
+def check(result, intent, city=None, brand=None, contains=()):
+    if result is None:
+        return False
+    return (result["intent"] == intent and result["city"] == city and result["brand"] == brand
+            and all(text in result["response"] for text in contains))
+
+
+async def run():
+    router = FastPathRouter()
+    answered = [
+        ("وش الماركات في جدة", "brands_in_city", "جدة", None, ("نستله", "نوفا")),
+        ("اسعار نستله الرياض", "brand_prices_in_city", "الرياض", "نستله", ("18.0", "21.5", "ريال")),
+        ("فيه توصيل للرياض", "delivery_to_city", "الرياض", None, ("نعم، نوصل إلى الرياض",)),
+        ("brands in Jeddah", "brands_in_city", "جدة", None, ("These are the brands available in Jeddah",)),
+    ]
+    fallbacks = [
+        ("ماركات تبوك", "ambiguous_entity"),
+        ("الماركات في جدة غالية مره", "low_confidence"),
+        ("ماركات نستله جدة", "no_intent"),
+        ("وش الماركات في جدة والرياض", "entities"),
+        ("اسعار نوفا جدة", "no_data"),
+        ("ابي اعرف وش الماركات المتوفره عندكم في جدة لو سمحت", "length"),
+    ]
+
+    ok = True
+    print("\n🧪 Template inquiries are answered without the LLM")
+    for message, intent, city, brand, contains in answered:
+        result = await router.route(message)
+        passed = check(result, intent, city, brand, contains)
+        ok &= passed
+        summary = f"{result['intent']} (city={result['city']}, brand={result['brand']}, confidence={result['confidence']})" if result else "None"
+        print(f"   {'✅' if passed else '❌'} {message!r} -> {summary}")
+
+    print("\n🧪 Everything else falls back to the LLM path")
+    for message, reason in fallbacks:
+        before = router.stats["fallbacks"].get(reason, 0)
+        result = await router.route(message)
+        passed = result is None and router.stats["fallbacks"].get(reason, 0) == before + 1
+        ok &= passed
+        print(f"   {'✅' if passed else '❌'} {message!r} -> {'None' if result is None else result['intent']} ({reason})")
+
+    stats = router.get_stats()
+    print(f"\n📊 {stats['hits']}/{stats['attempts']} answered, fallbacks {stats['fallbacks']}")
+    return ok
+
+
+def main():
+    print(f"📂 Scratch database: {os.environ['DATABASE_URL']}")
+    try:
+        seed()
+        if not entity_gazetteer.rebuild():
+            print("❌ Entity gazetteer could not be built")
+            sys.exit(1)
+        ok = asyncio.run(run())
+    finally:
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+    if ok:
+        print("\n🎉 Fast path router checks passed")
+    else:
+        print("\n❌ Fast path router checks failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Entity Gazetteer Test Script
+Checks the indexes behind services.gazetteer against brute force on a sample catalog:
+- the Aho-Corasick automaton against str.find for every pattern
+- FuzzyIndex against the edit distance to every key
+- DistrictIndex against list scans over the district names
+and measures the speedup over the brute-force scans. No database is needed.
+"""
+
+import os
+import sys
+import time
+import random
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database.district_utils import DistrictLookup
+from services.fuzzy_index import allowed_distance
+from services.gazetteer import EntityGazetteer
+from utils.arabic_normalizer import normalize_brand
+
+
+# ─── Sample catalog ───────────────────────────────────────────────────────────
+
+CITIES = [
+    ("الرياض", "Riyadh"), ("جدة", "Jeddah"), ("مكة", "Makkah"), ("المدينة المنورة", "Madinah"),
+    ("الدمام", "Dammam"), ("الخبر", "Khobar"), ("الظهران", "Dhahran"), ("الأحساء", "Al Ahsa"),
+    ("الطائف", "Taif"), ("أبها", "Abha"), ("خميس مشيط", "Khamis Mushait"), ("تبوك", "Tabuk"),
+    ("بريدة", "Buraydah"), ("عنيزة", "Unaizah"), ("حائل", "Hail"), ("الخرج", "Al Kharj"),
+    ("حفر الباطن", "Hafar Al-Batin"), ("الجبيل", "Jubail"), ("ينبع", "Yanbu"), ("بلجرشي", "Baljurashi"),
+    ("نجران", "Najran"), ("جازان", "Jazan"), ("القطيف", "Qatif"), ("صفا مكة", "Safa Makkah"),
+]
+
+BRANDS = [
+    ("مياه نستلة", "Nestle"), ("أكوافينا", "Aquafina"), ("مياه العين", "Al Ain"), ("القصيم", "Qassim"),
+    ("مياه نوفا", "Nova"), ("موية هنا", "Hana"), ("ايڤال", "Evian"), ("مياه بيرين", "Berain"),
+    ("تانيا", "Tania"), ("مياه صافية", "Safia"), ("أروى", "Arwa"), ("نقي", "Naqi"), ("مياه مكة", "Makkah Water"),
+]
+
+DISTRICT_WORDS = [
+    "النرجس", "الياسمين", "الملقا", "العليا", "الروضة", "الحمراء", "النزهة", "الربوة", "السلامة",
+    "الصفا", "المروة", "الشاطئ", "الفيصلية", "العزيزية", "الخالدية", "الشرفية", "النسيم", "الفيحاء",
+]
+DISTRICT_SUFFIXES = ["", "", " الأول", " الثاني", " الشرقي", " الغربي", " الجديدة"]
+
+
+def build_catalog(seed=13):
+    rng = random.Random(seed)
+    cities = [{"id": index + 1, "name": name, "name_en": name_en} for index, (name, name_en) in enumerate(CITIES)]
+    brands = [{"id": index + 1, "title": title, "title_en": title_en} for index, (title, title_en) in enumerate(BRANDS)]
+
+    names = set()
+    for word in DISTRICT_WORDS:
+        for suffix in DISTRICT_SUFFIXES:
+            names.add(word + suffix)
+    districts = []
+    for name in sorted(names):
+        for city in rng.sample(CITIES, rng.randint(1, 3)):
+            districts.append({"id": rng.randint(1, 10 ** 6), "name": name, "city_name": city[0]})
+    # Same order as EntityGazetteer._build: longest district name first
+    districts.sort(key=lambda district: len(district["name"]), reverse=True)
+    return cities, brands, districts
+
+
+# ─── Brute-force references ───────────────────────────────────────────────────
+
+def reference_patterns(cities, brands, districts):
+    """Pattern list the automaton should hold (normalization documented on EntityGazetteer)"""
+    patterns = []
+    for rank, city in enumerate(cities):
+        patterns.append((DistrictLookup.normalize_city_name(city["name"]), ("city", rank, "ar")))
+        patterns.append((DistrictLookup.normalize_city_name(city["name_en"]), ("city", rank, "en")))
+    for rank, brand in enumerate(brands):
+        patterns.append((normalize_brand(brand["title"]), ("brand", rank, "ar")))
+        patterns.append((normalize_brand(brand["title_en"]), ("brand", rank, "en")))
+    for rank, district in enumerate(districts):
+        patterns.append((DistrictLookup.normalize_city_name(district["name"]), ("district", rank, "ar")))
+    return [(text, payload) for text, payload in patterns if text]
+
+
+def brute_matches(patterns, text):
+    """Every (start, end, payload) occurrence of every pattern, overlaps included"""
+    found = set()
+    for pattern, payload in patterns:
+        start = text.find(pattern)
+        while start != -1:
+            found.add((start, start + len(pattern), payload))
+            start = text.find(pattern, start + 1)
+    return found
+
+
+def brute_distance(a, b):
+    """Optimal-string-alignment distance with the full table (no cut-off)"""
+    table = [[0] * (len(b) + 1) for _ in range(len(a) + 1)]
+    for i in range(len(a) + 1):
+        table[i][0] = i
+    for j in range(len(b) + 1):
+        table[0][j] = j
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            table[i][j] = min(table[i - 1][j] + 1, table[i][j - 1] + 1, table[i - 1][j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                table[i][j] = min(table[i][j], table[i - 2][j - 2] + 1)
+    return table[len(a)][len(b)]
+
+
+def brute_fuzzy(entries, term):
+    """rank -> smallest distance to any of its keys (and "ال"-less variants) within the allowed distance"""
+    best = {}
+    for key, rank in entries:
+        variants = [key] + ([key[2:]] if key.startswith("ال") and len(key) > 4 else [])
+        for variant in variants:
+            distance = brute_distance(term, variant)
+            if distance <= allowed_distance(len(variant)) and distance < best.get(rank, distance + 1):
+                best[rank] = distance
+    return best
+
+
+# ─── Generated inputs ─────────────────────────────────────────────────────────
+
+FILLER = ["وش", "الماركات", "في", "توصيل", "اسعار", "ابي", "كرتون", "حي", "مياه", "please", "to", "عندكم"]
+
+
+def build_messages(patterns, count, seed):
+    rng = random.Random(seed)
+    texts = [text for text, _ in patterns]
+    messages = []
+    for _ in range(count):
+        words = []
+        for _ in range(rng.randint(1, 8)):
+            choice = rng.random()
+            if choice < 0.4:
+                words.append(rng.choice(texts))
+            elif choice < 0.5:
+                # Glued prefix or a cut-off name
+                text = rng.choice(texts)
+                words.append(rng.choice("وبل") + text if rng.random() < 0.5 else text[:rng.randint(1, len(text))])
+            else:
+                words.append(rng.choice(FILLER))
+        messages.append(" ".join(words))
+    return messages
+
+
+def typo(text, edits, rng):
+    alphabet = "ابتجحدرزسشصطعفقكلمنهوي" if any("؀" <= char <= "ۿ" for char in text) else "abcdeilmnorstu"
+    for _ in range(edits):
+        if len(text) < 2:
+            break
+        position = rng.randrange(len(text))
+        operation = rng.choice(("substitute", "insert", "delete", "transpose"))
+        if operation == "substitute":
+            text = text[:position] + rng.choice(alphabet) + text[position + 1:]
+        elif operation == "insert":
+            text = text[:position] + rng.choice(alphabet) + text[position:]
+        elif operation == "delete":
+            text = text[:position] + text[position + 1:]
+        elif position + 1 < len(text):
+            text = text[:position] + text[position + 1] + text[position] + text[position + 2:]
+    return text
+
+
+def build_queries(entries, count, seed):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        key, _ = rng.choice(entries)
+        queries.append(typo(key, rng.choice((0, 1, 1, 2)), rng))
+    return queries
+
+
+# ─── Checks ───────────────────────────────────────────────────────────────────
+
+def report(name, checked, failures):
+    status = "✅" if not failures else "❌"
+    print(f"   {status} {name}: {checked} checked, {len(failures)} mismatches")
+    for failure in failures[:5]:
+        print(f"      {failure}")
+    return not failures
+
+
+def check_automaton(snapshot, patterns, messages):
+    print("\n🧪 Automaton vs str.find per pattern")
+    failures = []
+    for message in messages:
+        text = DistrictLookup.normalize_city_name(message)
+        expected = brute_matches(patterns, text)
+        actual = set(snapshot.automaton.iter_matches(text))
+        if actual != expected:
+            failures.append(f"{text!r}: missing {sorted(expected - actual)[:3]}, extra {sorted(actual - expected)[:3]}")
+    return report("iter_matches", len(messages), failures)
+
+
+def check_fuzzy(snapshot, fuzzy_entries, queries_by_kind):
+    print("\n🧪 FuzzyIndex vs edit distance to every key")
+    ok = True
+    for kind, queries in queries_by_kind.items():
+        index = snapshot.fuzzy[kind]
+        entries = fuzzy_entries[kind]
+        wrong, missed = [], []
+        for query in queries:
+            expected = brute_fuzzy(entries, query)
+            results = index.lookup(query, limit=len(entries))
+            for result in results:
+                # Every hit is a real match with the right distance and score
+                distance = brute_distance(query, result["key"])
+                if (distance != result["distance"] or distance > allowed_distance(len(result["key"]))
+                        or result["score"] != round(1 - distance / len(result["key"]), 3)):
+                    wrong.append(f"{query!r} -> {result}")
+            # The best brute-force match is always found
+            if expected:
+                best = min(expected.values())
+                if not results or results[0]["distance"] > best:
+                    missed.append(f"{query!r}: expected distance {best} ({sorted(r for r, d in expected.items() if d == best)}), got {results[:1]}")
+        ok = report(f"{kind:<8} hits correct", len(queries), wrong) and ok
+        ok = report(f"{kind:<8} best match found", len(queries), missed) and ok
+    return ok
+
+
+def check_district_index(snapshot, districts, messages):
+    print("\n🧪 DistrictIndex vs list scans")
+    index = snapshot.district_index
+    normalized = [DistrictLookup.normalize_city_name(district["name"]) for district in districts]
+
+    def by_id(positions):
+        return sorted(set(positions), key=lambda position: districts[position]["id"])
+
+    tokens = sorted({token for name in normalized for token in name.split()})
+    prefixes = sorted({name[:length] for name in normalized for length in (1, 2, 3, 5)})
+    fragments = sorted({name[start:start + 3] for name in normalized for start in range(0, len(name) - 2, 2)})
+    ok = True
+
+    failures = []
+    for name in {district["name"] for district in districts}:
+        first = by_id(position for position, district in enumerate(districts) if district["name"] == name)[0]
+        if index.exact(name) != first:
+            failures.append(f"exact({name!r}) = {index.exact(name)}, expected {first}")
+    ok = report("exact", len(districts), failures) and ok
+
+    failures = []
+    for token in tokens:
+        expected = by_id(position for position, name in enumerate(normalized) if token in name.split())
+        if index.with_token(token) != expected:
+            failures.append(f"with_token({token!r})")
+    ok = report("with_token", len(tokens), failures) and ok
+
+    failures = []
+    for prefix in prefixes:
+        expected = by_id(position for position, name in enumerate(normalized) if name.startswith(prefix))
+        if index.with_prefix(prefix) != expected:
+            failures.append(f"with_prefix({prefix!r})")
+    ok = report("with_prefix", len(prefixes), failures) and ok
+
+    failures = []
+    for fragment in fragments:
+        expected = by_id(position for position, name in enumerate(normalized) if fragment in name)
+        if index.containing(fragment) != expected:
+            failures.append(f"containing({fragment!r})")
+    ok = report("containing", len(fragments), failures) and ok
+
+    failures = []
+    for message in messages:
+        text = DistrictLookup.normalize_city_name(message)
+        expected = [position for position, name in enumerate(normalized) if name and name in text]
+        if index.within(text) != expected:
+            failures.append(f"within({text!r}): {index.within(text)} != {expected}")
+    ok = report("within (automaton)", len(messages), failures) and ok
+
+    return ok
+
+
+def benchmark(snapshot, patterns, fuzzy_entries, messages, queries):
+    print("\n⏱️ Benchmark: indexes vs brute-force scans")
+
+    def timed(function, items):
+        start = time.perf_counter()
+        for item in items:
+            function(item)
+        return (time.perf_counter() - start) * 1000
+
+    texts = [DistrictLookup.normalize_city_name(message) for message in messages]
+    brute_ms = timed(lambda text: brute_matches(patterns, text), texts)
+    index_ms = timed(lambda text: list(snapshot.automaton.iter_matches(text)), texts)
+    print(f"   mentions ({len(texts)} messages, {len(patterns)} patterns): {brute_ms:8.1f} ms -> {index_ms:6.1f} ms  ({brute_ms / index_ms:.1f}x)")
+
+    entries = fuzzy_entries["district"]
+    brute_ms = timed(lambda query: brute_fuzzy(entries, query), queries)
+    index_ms = timed(lambda query: snapshot.fuzzy["district"].lookup(query), queries)
+    print(f"   fuzzy    ({len(queries)} queries, {len(entries)} keys):      {brute_ms:8.1f} ms -> {index_ms:6.1f} ms  ({brute_ms / index_ms:.1f}x)")
+
+
+def main():
+    cities, brands, districts = build_catalog()
+    snapshot = EntityGazetteer._snapshot_of(cities, brands, districts, version=1)
+    patterns = reference_patterns(cities, brands, districts)
+    assert snapshot.pattern_count == len(patterns)
+    fuzzy_entries = {}
+    for text, (kind, rank, _) in patterns:
+        fuzzy_entries.setdefault(kind, []).append((text, rank))
+    print(f"📚 Sample catalog: {len(cities)} cities, {len(brands)} brands, {len(districts)} districts, "
+          f"{len(patterns)} patterns ({snapshot.automaton.size} automaton states)")
+
+    messages = build_messages(patterns, 1500, seed=5)
+    queries_by_kind = {
+        kind: build_queries(fuzzy_entries[kind], 400, seed=index)
+        for index, kind in enumerate(EntityGazetteer.KINDS)
+    }
+
+    ok = check_automaton(snapshot, patterns, messages)
+    ok = check_fuzzy(snapshot, fuzzy_entries, queries_by_kind) and ok
+    ok = check_district_index(snapshot, districts, messages) and ok
+    benchmark(snapshot, patterns, fuzzy_entries, messages[:300], queries_by_kind["district"][:200])
+
+    if ok:
+        print("\n🎉 Gazetteer indexes agree with brute force")
+    else:
+        print("\n❌ Gazetteer indexes differ from brute force")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
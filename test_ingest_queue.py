@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Ingest Queue Test Script
+Runs services.ingest_queue against a scratch SQLite database (never the real one) and checks:
+- rows are deleted only after their message is processed (direct and handed-off)
+- failures are retried in place, before newer messages of the same phone
+- handed-off retries (retry()) stop at INGEST_MAX_ATTEMPTS and park the rows (fail())
+- rows left 'processing' by a crash are recovered on start, or parked after max attempts
+- a redelivered Wati message ID is rejected as DUPLICATE
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import tempfile
+
+# Scratch database and fast retries - set before anything imports database.db_utils
+SCRATCH_DIR = tempfile.mkdtemp(prefix="ingest_queue_test_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(SCRATCH_DIR, 'chatbot.sqlite')}"
+os.environ["INGEST_MAX_ATTEMPTS"] = "3"
+os.environ["INGEST_WORKER_COUNT"] = "2"
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from database.db_utils import SessionLocal
+from database.db_models import WebhookQueueItem
+from services.ingest_queue import WebhookIngestQueue
+
+
+def rows(status=None):
+    db = SessionLocal()
+    try:
+        query = db.query(WebhookQueueItem)
+        if status:
+            query = query.filter(WebhookQueueItem.status == status)
+        return query.order_by(WebhookQueueItem.id).all()
+    finally:
+        db.close()
+
+
+def clear_rows():
+    db = SessionLocal()
+    try:
+        db.query(WebhookQueueItem).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+def payload(phone_number, text, message_id=None):
+    return {"waId": phone_number, "text": text, "id": message_id or f"{phone_number}-{text}-{time.time_ns()}"}
+
+
+async def drain(queue, timeout=10.0):
+    """Wait until nothing is left locally - queued, in a worker or handed off"""
+    deadline = time.time() + timeout
+    while queue.depth and time.time() < deadline:
+        await asyncio.sleep(0.02)
+    return queue.depth == 0
+
+
+def fast_retries(queue):
+    queue.retry_delay = lambda attempts: 0.01
+
+
+# ─── Checks ───────────────────────────────────────────────────────────────────
+
+async def check_ack_after_processing():
+    print("\n🧪 Rows are deleted only after processing")
+    queue = WebhookIngestQueue()
+    seen_rows = []
+
+    async def handler(data, db):
+        # While the handler runs, the row is still there and marked 'processing'
+        seen_rows.append([item.status for item in rows() if item.id == data["queue_item_id"]])
+
+    await queue.start(handler)
+    for index in range(5):
+        await queue.enqueue(payload("966500000001", f"m{index}"))
+    drained = await drain(queue)
+    await queue.stop()
+
+    ok = drained and seen_rows == [["processing"]] * 5 and not rows()
+    print(f"   {'✅' if ok else '❌'} 5 messages processed, statuses during handler {seen_rows}, {len(rows())} rows left")
+    return ok
+
+
+async def check_in_place_retry_keeps_order():
+    print("\n🧪 Failed messages are retried before newer messages of the same phone")
+    queue = WebhookIngestQueue()
+    fast_retries(queue)
+    order = []
+    failures = {"m0": 2}
+
+    async def handler(data, db):
+        if failures.get(data["text"], 0) > 0:
+            failures[data["text"]] -= 1
+            raise RuntimeError("temporary failure")
+        order.append(data["text"])
+
+    await queue.start(handler)
+    for index in range(4):
+        await queue.enqueue(payload("966500000002", f"m{index}"))
+    drained = await drain(queue)
+    await queue.stop()
+
+    ok = drained and order == ["m0", "m1", "m2", "m3"] and queue.stats["retried"] == 2 and not rows()
+    print(f"   {'✅' if ok else '❌'} order {order}, retried {queue.stats['retried']}")
+    return ok
+
+
+async def check_handoff_ack_and_retry():
+    print("\n🧪 Handed-off messages: complete(), retry() and fail()")
+    queue = WebhookIngestQueue()
+    handed_off = []
+
+    async def handler(data, db):
+        handed_off.append(data["queue_item_id"])
+        return True
+
+    await queue.start(handler)
+    for index in range(3):
+        await queue.enqueue(payload("966500000003", f"m{index}"))
+    await asyncio.sleep(0.2)
+    ok = True
+
+    # Handed off: rows stay 'processing' and the partition is not idle
+    partition = queue._partition("966500000003")
+    still_processing = [item.id for item in rows("processing")] == handed_off
+    busy = not queue._partition_idle(partition) and queue.depth == 3
+    ok &= still_processing and busy
+    print(f"   {'✅' if still_processing and busy else '❌'} handed off {len(handed_off)}: rows processing, depth {queue.depth}")
+
+    # Success acks (deletes) the first row
+    await queue.complete(handed_off[:1])
+    acked = [item.id for item in rows()] == handed_off[1:]
+    ok &= acked
+    print(f"   {'✅' if acked else '❌'} complete() deleted the processed row")
+
+    # Retries count attempts on the rows and stop at max_attempts
+    error = RuntimeError("agent failure")
+    decisions = []
+    for attempts in range(1, 4):
+        decisions.append(await queue.retry(handed_off[1:], error, attempts))
+    counted = {item.attempts for item in rows()} == {3}
+    retried = decisions == [True, True, False] and counted
+    ok &= retried
+    print(f"   {'✅' if retried else '❌'} retry() decisions {decisions}, row attempts {[item.attempts for item in rows()]}")
+
+    await queue.fail(handed_off[1:], error)
+    parked = [item.id for item in rows("failed")] == handed_off[1:] and queue._partition_idle(partition) and queue.depth == 0
+    ok &= parked
+    print(f"   {'✅' if parked else '❌'} fail() parked {len(rows('failed'))} rows, partition idle, depth {queue.depth}")
+
+    await queue.stop()
+    clear_rows()
+    return ok
+
+
+async def check_recovery():
+    print("\n🧪 Rows interrupted by a crash are recovered on start")
+    db = SessionLocal()
+    try:
+        for text, attempts in (("r0", 1), ("r1", 1), ("r2", 3)):
+            data = payload("966500000004", text)
+            db.add(WebhookQueueItem(phone_number="966500000004", partition=WebhookIngestQueue()._partition("966500000004"),
+                                    wati_message_id=data["id"], payload=json.dumps(data),
+                                    status="processing", attempts=attempts))
+        db.commit()
+    finally:
+        db.close()
+
+    queue = WebhookIngestQueue()
+    order = []
+
+    async def handler(data, db):
+        order.append(data["text"])
+
+    await queue.start(handler)
+    drained = await drain(queue)
+    await queue.stop()
+
+    failed = [item.error_message for item in rows("failed")]
+    ok = drained and order == ["r0", "r1"] and queue.stats["recovered"] == 2 and len(failed) == 1
+    print(f"   {'✅' if ok else '❌'} recovered {order}, parked {len(failed)} ({failed})")
+    clear_rows()
+    return ok
+
+
+async def check_duplicates():
+    print("\n🧪 Redelivered Wati message IDs are rejected")
+    queue = WebhookIngestQueue()
+    first = await queue.enqueue(payload("966500000005", "d0", message_id="wamid.duplicate-test"))
+    second = await queue.enqueue(payload("966500000005", "d0", message_id="wamid.duplicate-test"))
+    ok = first not in (None, queue.DUPLICATE) and second == queue.DUPLICATE and len(rows()) == 1
+    print(f"   {'✅' if ok else '❌'} first {first}, second {second}, {len(rows())} row queued")
+    clear_rows()
+    return ok
+
+
+async def check_many_phones():
+    print("\n🧪 Per-phone order with many phones and two workers")
+    queue = WebhookIngestQueue()
+    received = {}
+
+    async def handler(data, db):
+        await asyncio.sleep(0.001)
+        received.setdefault(data["waId"], []).append(int(data["text"]))
+
+    await queue.start(handler)
+    phones = [f"9665100000{index:02d}" for index in range(20)]
+    for sequence in range(10):
+        for phone_number in phones:
+            await queue.enqueue(payload(phone_number, str(sequence)))
+    drained = await drain(queue, timeout=30)
+    await queue.stop()
+
+    in_order = all(received.get(phone_number) == list(range(10)) for phone_number in phones)
+    ok = drained and in_order and not rows()
+    print(f"   {'✅' if ok else '❌'} {sum(len(values) for values in received.values())} messages, "
+          f"per-phone order {'kept' if in_order else 'broken'}, lag p95 {queue.get_stats()['lag_ms']['p95']} ms")
+    return ok
+
+
+async def run():
+    ok = await check_ack_after_processing()
+    ok = await check_in_place_retry_keeps_order() and ok
+    ok = await check_handoff_ack_and_retry() and ok
+    ok = await check_recovery() and ok
+    ok = await check_duplicates() and ok
+    ok = await check_many_phones() and ok
+    return ok
+
+
+def main():
+    print(f"📂 Scratch database: {os.environ['DATABASE_URL']}")
+    try:
+        ok = asyncio.run(run())
+    finally:
+        shutil.rmtree(SCRATCH_DIR, ignore_errors=True)
+
+    if ok:
+        print("\n🎉 Ingest queue checks passed")
+    else:
+        print("\n❌ Ingest queue checks failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+LLM Scheduler Test Script
+Runs utils.llm_scheduler.LLMScheduler with fake provider calls (no OpenAI requests) and checks:
+- queued calls are granted customer lane first, then background, then admin
+- a 429 pauses the model for Retry-After and the call is retried by the scheduler
+- the retries stop at LLM_SCHEDULER_MAX_RETRIES and the 429 reaches the caller
+- a paused or out-of-budget model does not hold back calls for other models
+- concurrency never exceeds LLM_MAX_CONCURRENCY
+"""
+
+import os
+import sys
+import time
+import asyncio
+
+# Small, fast limits - set before the scheduler reads them
+os.environ["LLM_MAX_CONCURRENCY"] = "2"
+os.environ["LLM_SCHEDULER_MAX_RETRIES"] = "2"
+os.environ["LLM_SCHEDULER_BASE_DELAY"] = "0.05"
+
+# Add project root to path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from utils.llm_scheduler import LLMScheduler, llm_priority
+
+
+class FakeRateLimitError(Exception):
+    """Shaped like openai.RateLimitError: status_code plus a response with headers"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Error code: 429 - rate limit exceeded")
+        self.status_code = 429
+        self.response = type("Response", (), {"headers": {"retry-after-ms": str(retry_after * 1000)}})()
+
+
+async def in_lane(priority, coroutine):
+    """Run a coroutine from a task in the given priority lane"""
+    llm_priority.set(priority)
+    return await coroutine
+
+
+# ─── Checks ───────────────────────────────────────────────────────────────────
+
+async def check_priority_lanes():
+    print("\n🧪 Queued calls are granted by priority lane")
+    scheduler = LLMScheduler()
+    order = []
+    release = asyncio.Event()
+
+    async def blocking_call():
+        await release.wait()
+
+    def recording_call(name):
+        async def call():
+            order.append(name)
+        return call
+
+    # Fill both slots so everything after them has to queue
+    blockers = [asyncio.create_task(scheduler.run("gpt-4o-mini", 10, blocking_call)) for _ in range(2)]
+    await asyncio.sleep(0.01)
+    queued = [
+        asyncio.create_task(in_lane(lane, scheduler.run("gpt-4o-mini", 10, recording_call(name))))
+        for lane, name in (("admin", "admin"), ("background", "background"), ("customer", "customer-1"), ("customer", "customer-2"))
+    ]
+    await asyncio.sleep(0.01)
+    waiting = scheduler.get_stats()["queued"]
+    release.set()
+    await asyncio.gather(*blockers, *queued)
+
+    ok = order == ["customer-1", "customer-2", "background", "admin"] and waiting == {"customer": 2, "background": 1, "admin": 1}
+    print(f"   {'✅' if ok else '❌'} queued {waiting}, granted {order}")
+    return ok
+
+
+async def check_rate_limit_pause_and_retry():
+    print("\n🧪 A 429 pauses the model and is retried by the scheduler")
+    scheduler = LLMScheduler()
+    attempts = []
+
+    async def call():
+        attempts.append(time.monotonic())
+        if len(attempts) == 1:
+            raise FakeRateLimitError(retry_after=0.2)
+        return "ok"
+
+    result = await scheduler.run("gpt-4o-mini", 10, call)
+    waited = attempts[1] - attempts[0]
+    ok = result == "ok" and len(attempts) == 2 and waited >= 0.19 and scheduler.stats["rate_limited"] == 1
+    print(f"   {'✅' if ok else '❌'} result {result!r} after {len(attempts)} attempts, paused {waited * 1000:.0f} ms")
+    return ok
+
+
+async def check_retries_give_up():
+    print("\n🧪 Rate limit retries stop at LLM_SCHEDULER_MAX_RETRIES")
+    scheduler = LLMScheduler()
+    attempts = []
+
+    async def call():
+        attempts.append(time.monotonic())
+        raise FakeRateLimitError(retry_after=0.01)
+
+    try:
+        await scheduler.run("gpt-4o-mini", 10, call)
+        raised = False
+    except FakeRateLimitError:
+        raised = True
+
+    ok = raised and len(attempts) == scheduler.max_retries + 1
+    print(f"   {'✅' if ok else '❌'} {len(attempts)} attempts, 429 raised to the caller: {raised}")
+    return ok
+
+
+async def check_blocked_model_does_not_block_others():
+    print("\n🧪 A paused model does not hold back other models")
+    scheduler = LLMScheduler()
+    finished = {}
+    started_at = time.monotonic()
+    scheduler._paused_until["gpt-4o"] = started_at + 0.3
+
+    def recording_call(name):
+        async def call():
+            finished[name] = time.monotonic() - started_at
+        return call
+
+    # The paused model's call is queued first and has the higher priority
+    await asyncio.gather(
+        in_lane("customer", scheduler.run("gpt-4o", 10, recording_call("gpt-4o"))),
+        in_lane("background", scheduler.run("gpt-4o-mini", 10, recording_call("gpt-4o-mini")))
+    )
+
+    ok = finished["gpt-4o-mini"] < 0.05 and finished["gpt-4o"] >= 0.29
+    print(f"   {'✅' if ok else '❌'} gpt-4o-mini done after {finished['gpt-4o-mini'] * 1000:.0f} ms, "
+          f"paused gpt-4o after {finished['gpt-4o'] * 1000:.0f} ms")
+
+    # Same with an exhausted request budget instead of a 429 pause
+    scheduler = LLMScheduler()
+    request_bucket, _ = scheduler._buckets("gpt-4o")
+    request_bucket.consume(request_bucket.tokens)
+    finished.clear()
+    started_at = time.monotonic()
+    other = asyncio.create_task(scheduler.run("gpt-4o-mini", 10, recording_call("gpt-4o-mini")))
+    starved = asyncio.create_task(scheduler.run("gpt-4o", 10, recording_call("gpt-4o")))
+    await other
+    budget_ok = "gpt-4o-mini" in finished and "gpt-4o" not in finished
+    starved.cancel()
+    await asyncio.gather(starved, return_exceptions=True)
+    ok &= budget_ok and scheduler._active == 0
+    print(f"   {'✅' if budget_ok else '❌'} out-of-budget gpt-4o still queued while gpt-4o-mini ran")
+    return ok
+
+
+async def check_concurrency_limit():
+    print("\n🧪 In-flight calls never exceed LLM_MAX_CONCURRENCY")
+    scheduler = LLMScheduler()
+    in_flight = 0
+    peak = 0
+
+    async def call():
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+
+    await asyncio.gather(*(scheduler.run(model, 10, call) for model in ("gpt-4o-mini", "gpt-4o") * 10))
+    ok = peak == scheduler.max_concurrency and scheduler._active == 0 and not scheduler._waiters
+    print(f"   {'✅' if ok else '❌'} 20 calls, peak {peak} in flight (limit {scheduler.max_concurrency})")
+    return ok
+
+
+async def run():
+    ok = await check_priority_lanes()
+    ok = await check_rate_limit_pause_and_retry() and ok
+    ok = await check_retries_give_up() and ok
+    ok = await check_blocked_model_does_not_block_others() and ok
+    ok = await check_concurrency_limit() and ok
+    return ok
+
+
+def main():
+    if asyncio.run(run()):
+        print("\n🎉 LLM scheduler checks passed")
+    else:
+        print("\n❌ LLM scheduler checks failed")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
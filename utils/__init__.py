@@ -1,3 +1,10 @@
-from utils.knowledge_manager import knowledge_manager
+__all__ = ['knowledge_manager']
 
-__all__ = ['knowledge_manager'] 
\ No newline at end of file
+
+def __getattr__(name):
+    # Loaded on first use so that light helpers (utils.arabic_normalizer, utils.metrics, ...)
+    # can be imported by database/services code without starting the vector store
+    if name == 'knowledge_manager':
+        from utils.knowledge_manager import knowledge_manager
+        return knowledge_manager
+    raise AttributeError(f"module 'utils' has no attribute '{name}'")
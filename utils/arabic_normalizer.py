@@ -0,0 +1,117 @@
+"""
+Arabic text normalization shared by matching, search and embeddings.
+
+Each profile is a precompiled set of folding pairs/patterns plus whitespace collapsing,
+memoized with an LRU cache because the same catalog names are normalized over and over:
+
+    search     DistrictLookup.normalize_city_name - lower-case, hamza/alif/yeh/waw/teh
+               marbuta folding, collapsed whitespace
+    brand      search, after removing a leading water word (مياه, موية, ...) and ايڤال -> ايفال
+    embedding  ArabicTextProcessor.normalize_arabic_text - diacritics removed, alif/teh
+               marbuta/alif maksura folding, collapsed whitespace, then NFKC
+
+Output is identical to the per-call .replace()/regex implementations these replace
+(test_arabic_normalizer.py checks that and measures the speedup).
+"""
+import os
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Optional
+
+NORMALIZER_CACHE_SIZE = int(os.getenv("NORMALIZER_CACHE_SIZE", "50000"))
+
+# Character folding as (character, replacement) pairs; a pair is only applied when its character
+# occurs. For these short strings CPython's str.replace beats str.translate by 3-4x.
+SEARCH_FOLDING = (
+    ('ء', ''),   # standalone hamza
+    ('أ', 'ا'),  # alif with hamza above -> alif
+    ('إ', 'ا'),  # alif with hamza below -> alif
+    ('آ', 'ا'),  # alif with madda -> alif
+    ('ى', 'ي'),  # alif maksura -> yeh
+    ('ئ', 'ي'),  # yeh with hamza -> yeh
+    ('ؤ', 'و'),  # waw with hamza -> waw
+    ('ة', 'ه'),  # teh marbuta -> heh
+)
+EMBEDDING_FOLDING = (('أ', 'ا'), ('إ', 'ا'), ('آ', 'ا'), ('ة', 'ه'), ('ى', 'ي'))
+
+# Diacritics (تشكيل)
+DIACRITICS_PATTERN = re.compile(r'[\u064B-\u065F\u0670\u06D6-\u06ED]')
+
+# Water words written in front of brand names: "مياه نقي", "موية هنا"
+WATER_PREFIXES = ("مياه", "موية", "مياة", "ميه", "water")
+
+
+def _fold(text: str, folding) -> str:
+    for character, replacement in folding:
+        if character in text:
+            text = text.replace(character, replacement)
+    return text
+
+
+@lru_cache(maxsize=NORMALIZER_CACHE_SIZE)
+def _search(text: str) -> str:
+    return ' '.join(_fold(text.strip().lower(), SEARCH_FOLDING).split())
+
+
+@lru_cache(maxsize=NORMALIZER_CACHE_SIZE)
+def _brand(text: str) -> str:
+    cleaned_text = text.strip()
+    lowered = cleaned_text.lower()
+
+    # Remove a water prefix from the beginning (with or without a space after it)
+    for prefix in WATER_PREFIXES:
+        if lowered.startswith(prefix + " ") or (lowered.startswith(prefix) and len(cleaned_text) > len(prefix)):
+            cleaned_text = cleaned_text[len(prefix):].strip()
+            break
+
+    # Apply brand-specific replacements
+    if 'ڤ' in cleaned_text:
+        cleaned_text = cleaned_text.replace("ايڤال", "ايفال")
+
+    return _search(cleaned_text) if cleaned_text else cleaned_text
+
+
+@lru_cache(maxsize=NORMALIZER_CACHE_SIZE)
+def _embedding(text: str) -> str:
+    text = ' '.join(_fold(DIACRITICS_PATTERN.sub('', text), EMBEDDING_FOLDING).split())
+    if text.isascii() or unicodedata.is_normalized('NFKC', text):
+        return text
+    return unicodedata.normalize('NFKC', text)
+
+
+_PROFILES = {"search": _search, "brand": _brand, "embedding": _embedding}
+
+
+def normalize(text: Optional[str], profile: str = "search") -> Optional[str]:
+    """Normalize text with a named profile (search, brand or embedding)"""
+    return _PROFILES[profile](text) if text else text
+
+
+def normalize_search(text: Optional[str]) -> Optional[str]:
+    """Matching form of city, district and message text ('أبها' -> 'ابها', 'جدة' -> 'جده')"""
+    return _search(text) if text else text
+
+
+def normalize_brand(text: Optional[str]) -> str:
+    """Matching form of a brand name or message: 'مياه نستلة' -> 'نستله'"""
+    return _brand(text) if text else ""
+
+
+def normalize_embedding(text) -> str:
+    """Embedding/vector-store form of a text (accepts UTF-8 bytes)"""
+    if not text:
+        return ""
+    if isinstance(text, bytes):
+        text = text.decode('utf-8')
+    return _embedding(text)
+
+
+def cache_info():
+    """LRU statistics per profile"""
+    return {name: function.cache_info()._asdict() for name, function in _PROFILES.items()}
+
+
+def clear_cache():
+    for function in _PROFILES.values():
+        function.cache_clear()
@@ -0,0 +1,233 @@
+import os
+import json
+import queue
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, Any, Optional, List
+
+logger = logging.getLogger(__name__)
+
+
+class JourneyStore:
+    """
+    Append-only store for completed message journeys.
+
+    Journeys are written as JSON lines into size-rolled segment files, and a small SQLite
+    index maps journey_id / phone number to (segment, offset, length). All file and index
+    I/O happens on a background writer thread - callers only hand over the serialized record.
+
+    Changes after a journey was written (late steps, completion of an evicted journey) are
+    appended as small delta records ({"steps": [...], "status": ...}) indexed in
+    journey_deltas; get() applies them to the base record in order.
+    """
+
+    def __init__(self):
+        self.directory = Path(os.getenv("JOURNEY_STORE_DIR", "logs/journeys"))
+        self.segment_max_bytes = int(os.getenv("JOURNEY_SEGMENT_MAX_BYTES", str(16 * 1024 * 1024)))
+        self.segment_retention = int(os.getenv("JOURNEY_SEGMENT_RETENTION", "50"))
+        self.index_path = self.directory / "index.sqlite"
+
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue(maxsize=int(os.getenv("JOURNEY_STORE_QUEUE_SIZE", "10000")))
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {"written": 0, "dropped": 0, "segments_removed": 0}
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.directory / f"segment_{segment:06d}.jsonl"
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.index_path), timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS journeys (
+                journey_id TEXT PRIMARY KEY,
+                phone_number TEXT,
+                status TEXT,
+                started_at TEXT,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_journeys_phone ON journeys (phone_number, started_at)")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS journey_deltas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                journey_id TEXT NOT NULL,
+                segment INTEGER NOT NULL,
+                offset INTEGER NOT NULL,
+                length INTEGER NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_journey_deltas_journey ON journey_deltas (journey_id, id)")
+        return conn
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self.directory.mkdir(parents=True, exist_ok=True)
+                self._thread = threading.Thread(target=self._writer_loop, name="journey-store", daemon=True)
+                self._thread.start()
+
+    def append(self, journey: Dict[str, Any]):
+        """Queue a full journey for persistence (never blocks the caller) - replaces earlier records"""
+        self._put("journey", journey.get("journey_id"), journey, journey.get("phone_number"),
+                  journey.get("status"), journey.get("started_at"))
+
+    def append_delta(self, journey_id: str, delta: Dict[str, Any]):
+        """Queue a change to an already written journey: "steps" are appended, other keys replaced"""
+        self._put("delta", journey_id, {"journey_id": journey_id, "delta": delta}, status=delta.get("status"))
+
+    def _put(self, kind: str, journey_id: Optional[str], payload: Dict[str, Any], phone_number: Optional[str] = None,
+             status: Optional[str] = None, started_at: Optional[str] = None):
+        try:
+            record = json.dumps(payload, ensure_ascii=False, default=str)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Journey {journey_id} is not serializable: {str(e)}")
+            return
+
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((kind, journey_id, phone_number, status, started_at, record))
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _writer_loop(self):
+        conn = self._connect()
+        segments = sorted(int(path.stem.split("_")[1]) for path in self.directory.glob("segment_*.jsonl"))
+        segment = segments[-1] if segments else 1
+        handle = open(self._segment_path(segment), "ab")
+
+        stopping = False
+        try:
+            while not stopping:
+                item = self._queue.get()
+                if item is None:
+                    break
+
+                batch = [item]
+                # Group whatever else is already queued into one index transaction
+                while len(batch) < 200:
+                    try:
+                        next_item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if next_item is None:
+                        stopping = True
+                        break
+                    batch.append(next_item)
+
+                try:
+                    for kind, journey_id, phone_number, status, started_at, record in batch:
+                        if handle.tell() >= self.segment_max_bytes:
+                            handle.close()
+                            segment += 1
+                            handle = open(self._segment_path(segment), "ab")
+                            self._apply_retention(conn, segment)
+
+                        data = (record + "\n").encode("utf-8")
+                        offset = handle.tell()
+                        handle.write(data)
+                        if kind == "journey":
+                            # A full record supersedes earlier deltas
+                            conn.execute("DELETE FROM journey_deltas WHERE journey_id = ?", (journey_id,))
+                            conn.execute(
+                                "INSERT OR REPLACE INTO journeys (journey_id, phone_number, status, started_at, segment, offset, length) "
+                                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                (journey_id, phone_number, status, started_at, segment, offset, len(data))
+                            )
+                        else:
+                            conn.execute(
+                                "INSERT INTO journey_deltas (journey_id, segment, offset, length) VALUES (?, ?, ?, ?)",
+                                (journey_id, segment, offset, len(data))
+                            )
+                            if status:
+                                conn.execute("UPDATE journeys SET status = ? WHERE journey_id = ?", (status, journey_id))
+
+                    handle.flush()
+                    conn.commit()
+                    self.stats["written"] += len(batch)
+                except Exception as e:
+                    logger.error(f"Failed to persist {len(batch)} journeys: {str(e)}")
+        finally:
+            handle.close()
+            conn.close()
+
+    def _apply_retention(self, conn: sqlite3.Connection, current_segment: int):
+        """Drop the oldest segments (and their index rows) beyond the retention count"""
+        oldest_kept = current_segment - self.segment_retention + 1
+        for path in self.directory.glob("segment_*.jsonl"):
+            segment = int(path.stem.split("_")[1])
+            if segment < oldest_kept:
+                conn.execute("DELETE FROM journeys WHERE segment = ?", (segment,))
+                conn.execute("DELETE FROM journey_deltas WHERE segment = ?", (segment,))
+                path.unlink(missing_ok=True)
+                self.stats["segments_removed"] += 1
+        conn.commit()
+
+    def _read(self, segment: int, offset: int, length: int) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._segment_path(segment), "rb") as f:
+                f.seek(offset)
+                return json.loads(f.read(length).decode("utf-8"))
+        except (OSError, ValueError):
+            return None
+
+    def _load(self, conn: sqlite3.Connection, journey_id: str, row) -> Optional[Dict[str, Any]]:
+        """Base record with its deltas applied"""
+        journey = self._read(*row)
+        if journey is None:
+            return None
+        deltas = conn.execute(
+            "SELECT segment, offset, length FROM journey_deltas WHERE journey_id = ? ORDER BY id", (journey_id,)
+        ).fetchall()
+        for delta_row in deltas:
+            record = self._read(*delta_row)
+            if not record:
+                continue
+            delta = dict(record.get("delta") or {})
+            journey.setdefault("steps", []).extend(delta.pop("steps", []))
+            journey.update(delta)
+        return journey
+
+    def get(self, journey_id: str) -> Optional[Dict[str, Any]]:
+        """Load a persisted journey by ID"""
+        if not self.index_path.exists():
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT segment, offset, length FROM journeys WHERE journey_id = ?", (journey_id,)
+            ).fetchone()
+            return self._load(conn, journey_id, row) if row else None
+        finally:
+            conn.close()
+
+    def find_by_phone(self, phone_number: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most recent persisted journeys of a phone number"""
+        if not self.index_path.exists():
+            return []
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT journey_id, segment, offset, length FROM journeys WHERE phone_number = ? "
+                "ORDER BY started_at DESC LIMIT ?",
+                (phone_number, limit)
+            ).fetchall()
+            journeys = [self._load(conn, row[0], row[1:]) for row in rows]
+        finally:
+            conn.close()
+        return [journey for journey in journeys if journey]
+
+    def close(self, timeout: float = 5.0):
+        """Flush queued journeys and stop the writer thread"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"queued": self._queue.qsize(), "directory": str(self.directory), **self.stats}
@@ -4,6 +4,7 @@ import re
 import os
 from langchain_openai import ChatOpenAI
 from langchain_core.messages import SystemMessage, HumanMessage
+from utils.llm_backend import llm_backend
 
 class LanguageHandler:
     def __init__(self):
@@ -115,7 +116,12 @@ class LanguageHandler:
             ]
 
             # Call LangChain (this will be traced in LangSmith)
-            response = await self.llm.ainvoke(messages)
+            response = await llm_backend.chat_text(
+                lambda: self.llm.ainvoke(messages),
+                messages,
+                model=self.llm.model_name,
+                temperature=self.llm.temperature
+            )
             
             # Check if response and content exist before calling strip()
             if response and hasattr(response, 'content') and response.content:
@@ -0,0 +1,260 @@
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+from types import SimpleNamespace
+from typing import Dict, Any, List, Optional, Callable, Awaitable, Tuple
+
+from utils.metrics import chatbot_metrics
+from utils.llm_scheduler import llm_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def _to_namespace(value):
+    """Turn a recorded JSON response back into an object with attribute access
+    (response.choices[0].message.tool_calls[0].function.name works like the OpenAI SDK)"""
+    if isinstance(value, dict):
+        return SimpleNamespace(**{key: _to_namespace(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return [_to_namespace(item) for item in value]
+    return value
+
+
+def _to_jsonable(response) -> Dict[str, Any]:
+    """Serialize an OpenAI SDK response (pydantic model) for the cassette"""
+    if hasattr(response, "model_dump"):
+        return response.model_dump(mode="json")
+    if isinstance(response, dict):
+        return response
+    return json.loads(json.dumps(response, default=lambda o: getattr(o, "__dict__", str(o))))
+
+
+def _token_usage(response) -> Tuple[int, int]:
+    """(prompt, completion) tokens from an OpenAI response or a LangChain AIMessage"""
+    usage = getattr(response, "usage", None)
+    if usage is not None:
+        return getattr(usage, "prompt_tokens", 0) or 0, getattr(usage, "completion_tokens", 0) or 0
+    usage = getattr(response, "usage_metadata", None)
+    if isinstance(usage, dict):
+        return usage.get("input_tokens", 0) or 0, usage.get("output_tokens", 0) or 0
+    return 0, 0
+
+
+def _message_to_dict(message) -> Dict[str, Any]:
+    """Normalize OpenAI dict messages and LangChain message objects for hashing"""
+    if isinstance(message, dict):
+        return message
+    return {"role": getattr(message, "type", "unknown"), "content": getattr(message, "content", "")}
+
+
+class LLMBackend:
+    """
+    Pluggable layer in front of every LLM call (OpenAI SDK and LangChain).
+
+    Modes (LLM_BACKEND_MODE):
+    - live:   call the provider (default)
+    - record: call the provider and store request/response cassettes in LLM_CASSETTE_DIR
+    - replay: serve cassettes locally, no network - with LLM_REPLAY_LATENCY_MS of simulated
+              latency ("300", "100-800" for a uniform range, or "recorded")
+    - stub:   answer from a Python responder installed with install_stub() (load tests)
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("LLM_BACKEND_MODE", "live").lower()
+        self.cassette_dir = os.getenv("LLM_CASSETTE_DIR", "llm_cassettes")
+        self.replay_latency = os.getenv("LLM_REPLAY_LATENCY_MS", "0")
+        # Text returned for prompts that were never recorded (unset = raise)
+        self.replay_default_response = os.getenv("LLM_REPLAY_DEFAULT_RESPONSE")
+        self.stub_responder: Optional[Callable[[str, List, Dict[str, Any]], Any]] = None
+
+        if self.mode not in ("live", "record", "replay"):
+            logger.warning(f"Unknown LLM_BACKEND_MODE '{self.mode}' - falling back to live")
+            self.mode = "live"
+
+        if self.mode != "live":
+            os.makedirs(self.cassette_dir, exist_ok=True)
+            print(f"🎞️ LLM backend in {self.mode} mode (cassettes: {self.cassette_dir})")
+
+        self.stats = {"live_calls": 0, "recorded": 0, "replayed": 0, "replay_misses": 0, "stubbed": 0}
+
+    def install_stub(self, responder: Callable[[str, List, Dict[str, Any]], Any], latency_ms: str = "0"):
+        """Serve every call from `responder(kind, messages, params)` instead of the provider
+
+        The responder returns the response text (or a full response dict shaped like a
+        recorded cassette, e.g. with choices[0].message.tool_calls for chat_completion)
+        """
+        self.stub_responder = responder
+        self.replay_latency = latency_ms
+        self.mode = "stub"
+
+    @staticmethod
+    def make_key(kind: str, messages: List, params: Dict[str, Any]) -> str:
+        """Stable cassette key for a request"""
+        payload = {
+            "kind": kind,
+            "messages": [_message_to_dict(message) for message in messages],
+            "params": params
+        }
+        raw = json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _cassette_path(self, key: str) -> str:
+        return os.path.join(self.cassette_dir, f"{key}.json")
+
+    def _save_cassette(self, key: str, kind: str, messages: List, params: Dict[str, Any],
+                       response: Any, duration_ms: int):
+        cassette = {
+            "kind": kind,
+            "request": {
+                "messages": [_message_to_dict(message) for message in messages],
+                "params": params
+            },
+            "response": response,
+            "duration_ms": duration_ms,
+            "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S")
+        }
+        tmp_path = self._cassette_path(key) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cassette, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp_path, self._cassette_path(key))
+        self.stats["recorded"] += 1
+
+    def _load_cassette(self, key: str) -> Optional[Dict[str, Any]]:
+        path = self._cassette_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    async def _simulate_latency(self, cassette: Optional[Dict[str, Any]]):
+        setting = (self.replay_latency or "0").strip()
+        if setting == "recorded":
+            delay_ms = (cassette or {}).get("duration_ms") or 0
+        elif "-" in setting:
+            low, high = setting.split("-", 1)
+            delay_ms = random.uniform(float(low), float(high))
+        else:
+            delay_ms = float(setting)
+        if delay_ms > 0:
+            await asyncio.sleep(delay_ms / 1000)
+
+    def _replay_miss(self, kind: str, key: str):
+        self.stats["replay_misses"] += 1
+        if self.replay_default_response is None:
+            raise LookupError(f"No LLM cassette for {kind} request {key[:12]} (LLM_BACKEND_MODE=replay)")
+        logger.warning(f"No LLM cassette for {kind} request {key[:12]} - using default response")
+
+    async def chat_completion(self, live_call: Callable[[], Awaitable[Any]], **kwargs):
+        """OpenAI chat.completions.create - supports function/tool calls in the response
+
+        Args:
+            live_call: Coroutine factory making the real API call
+            kwargs: The create() arguments (used for the cassette key)
+        """
+        messages = kwargs.get("messages", [])
+        params = {key: value for key, value in kwargs.items() if key != "messages"}
+        return await self._run("chat_completion", messages, params, live_call)
+
+    async def chat_text(self, live_call: Callable[[], Awaitable[Any]], messages: List, **params):
+        """LangChain ainvoke - the response only needs `.content`"""
+        return await self._run("chat_text", messages, params, live_call)
+
+    async def _run(self, kind: str, messages: List, params: Dict[str, Any], live_call):
+        """Serve the call according to the mode and record latency/tokens for /metrics"""
+        start_time = time.time()
+        try:
+            response = await self._dispatch(kind, messages, params, live_call)
+        except Exception:
+            chatbot_metrics.observe_llm_call(params.get("model"), kind, "error", time.time() - start_time)
+            raise
+        prompt_tokens, completion_tokens = _token_usage(response)
+        chatbot_metrics.observe_llm_call(
+            params.get("model"), kind, "success", time.time() - start_time, prompt_tokens, completion_tokens
+        )
+        return response
+
+    async def _dispatch(self, kind: str, messages: List, params: Dict[str, Any], live_call):
+        if self.mode == "live":
+            self.stats["live_calls"] += 1
+            return await self._call_provider(messages, params, live_call)
+
+        if self.mode == "stub":
+            # Stubs stand in for the provider, so they go through the scheduler too (load tests)
+            return await self._call_provider(messages, params, lambda: self._stub_call(kind, messages, params))
+
+        key = self.make_key(kind, messages, params)
+
+        if self.mode == "replay":
+            cassette = self._load_cassette(key)
+            await self._simulate_latency(cassette)
+            if cassette is None:
+                self._replay_miss(kind, key)
+                response = self._text_response(kind, self.replay_default_response)
+            else:
+                self.stats["replayed"] += 1
+                response = cassette["response"]
+            return _to_namespace(response)
+
+        # record
+        self.stats["live_calls"] += 1
+        start_time = time.time()
+        result = await self._call_provider(messages, params, live_call)
+        duration_ms = int((time.time() - start_time) * 1000)
+
+        if kind == "chat_text":
+            recorded = {"content": getattr(result, "content", "")}
+        else:
+            recorded = _to_jsonable(result)
+
+        try:
+            self._save_cassette(key, kind, messages, params, recorded, duration_ms)
+        except Exception as e:
+            logger.error(f"Failed to record LLM cassette: {str(e)}")
+        return result
+
+    async def _call_provider(self, messages: List, params: Dict[str, Any], live_call):
+        """Provider request governed by the shared LLM scheduler (budgets, concurrency, 429 backoff)"""
+        return await llm_scheduler.run(
+            params.get("model"),
+            llm_scheduler.estimate_tokens(messages, params.get("max_tokens")),
+            live_call,
+            usage_of=lambda response: sum(_token_usage(response))
+        )
+
+    async def _stub_call(self, kind: str, messages: List, params: Dict[str, Any]):
+        await self._simulate_latency(None)
+        self.stats["stubbed"] += 1
+        response = self.stub_responder(kind, messages, params)
+        if isinstance(response, str) or response is None:
+            response = self._text_response(kind, response)
+        return _to_namespace(response)
+
+    @staticmethod
+    def _text_response(kind: str, content: Optional[str]) -> Dict[str, Any]:
+        """Plain text answer shaped like a recorded response of the given kind"""
+        if kind == "chat_text":
+            return {"content": content}
+        return {
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {
+                    "role": "assistant",
+                    "content": content,
+                    "function_call": None,
+                    "tool_calls": None
+                }
+            }],
+            "usage": None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"mode": self.mode, "cassette_dir": self.cassette_dir, **self.stats}
+
+
+# Singleton instance
+llm_backend = LLMBackend()
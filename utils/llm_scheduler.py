@@ -0,0 +1,263 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Callable, Awaitable, List
+
+logger = logging.getLogger(__name__)
+
+# Priority lane of LLM calls made from the current task (lower value is served first)
+PRIORITY_LANES = {"customer": 0, "background": 1, "admin": 2}
+llm_priority: ContextVar[str] = ContextVar("llm_priority", default="customer")
+
+
+def _parse_limits(value: str) -> Dict[str, float]:
+    """"gpt-4o-mini=5000,gpt-4o=500" -> {"gpt-4o-mini": 5000.0, "gpt-4o": 500.0}"""
+    limits = {}
+    for item in (value or "").split(","):
+        if "=" in item:
+            model, limit = item.split("=", 1)
+            limits[model.strip()] = float(limit)
+    return limits
+
+
+class RateBucket:
+    """Per-minute token bucket that reports how long to wait instead of sleeping"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.tokens = per_minute
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` is available (0 = available now)"""
+        self._refill()
+        # Requests bigger than the whole bucket only wait for a full bucket
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float):
+        self._refill()
+        self.tokens -= amount
+
+    def refund(self, amount: float):
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class LLMScheduler:
+    """
+    Process-wide governor for outbound LLM requests.
+
+    - requests-per-minute and tokens-per-minute buckets per model (LLM_RPM_LIMITS / LLM_TPM_LIMITS)
+    - at most LLM_MAX_CONCURRENCY requests in flight
+    - priority lanes: customer replies are dispatched before background and admin/debug calls
+    - 429 responses pause the model for Retry-After (or exponential backoff) and are retried here
+    """
+
+    def __init__(self):
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+        self.default_rpm = float(os.getenv("LLM_DEFAULT_RPM", "500"))
+        self.default_tpm = float(os.getenv("LLM_DEFAULT_TPM", "200000"))
+        self.rpm_limits = _parse_limits(os.getenv("LLM_RPM_LIMITS", ""))
+        self.tpm_limits = _parse_limits(os.getenv("LLM_TPM_LIMITS", ""))
+        self.max_retries = int(os.getenv("LLM_SCHEDULER_MAX_RETRIES", "3"))
+        self.base_delay = float(os.getenv("LLM_SCHEDULER_BASE_DELAY", "1.0"))
+
+        # Budgets are per OpenAI account - split across uvicorn workers
+        workers = max(1, int(os.getenv("APP_WORKERS", "1")))
+        self._worker_share = 1.0 / workers
+
+        self._request_buckets: Dict[str, RateBucket] = {}
+        self._token_buckets: Dict[str, RateBucket] = {}
+        self._paused_until: Dict[str, float] = {}
+        self._waiters: List = []  # heap of (priority, seq, model, tokens, future)
+        self._sequence = itertools.count()
+        self._active = 0
+        self._wakeup: Optional[asyncio.TimerHandle] = None
+
+        self.stats = {
+            "requests": 0,
+            "rate_limited": 0,
+            "retries": 0,
+            "throttled": 0,
+            "queue_wait_ms_total": 0.0
+        }
+
+    def _buckets(self, model: str):
+        if model not in self._request_buckets:
+            rpm = self.rpm_limits.get(model, self.default_rpm) * self._worker_share
+            tpm = self.tpm_limits.get(model, self.default_tpm) * self._worker_share
+            self._request_buckets[model] = RateBucket(rpm)
+            self._token_buckets[model] = RateBucket(tpm)
+        return self._request_buckets[model], self._token_buckets[model]
+
+    @staticmethod
+    def estimate_tokens(messages: List, max_tokens: Optional[int]) -> int:
+        """Rough prompt + completion estimate used for the TPM budget (corrected after the call)"""
+        chars = 0
+        for message in messages:
+            content = message.get("content") if isinstance(message, dict) else getattr(message, "content", "")
+            chars += len(str(content or ""))
+        # Arabic text tokenizes at roughly 3 characters per token
+        return chars // 3 + (max_tokens or 500)
+
+    def _pump(self):
+        """Grant slots to waiters in priority order while concurrency and budgets allow
+
+        A model that is out of budget (or paused after a 429) only holds back its own
+        waiters - calls for other models behind it are still dispatched.
+        """
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+
+        blocked: Dict[str, float] = {}  # model -> seconds until its first waiter fits
+        for priority, seq, model, tokens, future in sorted(self._waiters):
+            if self._active >= self.max_concurrency:
+                break
+            if future.done() or model in blocked:
+                # Later waiters of a blocked model stay behind its first one
+                continue
+
+            request_bucket, token_bucket = self._buckets(model)
+            wait = max(
+                self._paused_until.get(model, 0.0) - time.monotonic(),
+                request_bucket.wait_time(1),
+                token_bucket.wait_time(tokens)
+            )
+            if wait > 0:
+                self.stats["throttled"] += 1
+                blocked[model] = wait
+                continue
+
+            request_bucket.consume(1)
+            token_bucket.consume(tokens)
+            self._active += 1
+            future.set_result(None)
+
+        # Drop granted and cancelled waiters
+        self._waiters = [waiter for waiter in self._waiters if not waiter[4].done()]
+        heapq.heapify(self._waiters)
+
+        if blocked and self._active < self.max_concurrency:
+            self._wakeup = asyncio.get_running_loop().call_later(min(blocked.values()), self._pump)
+
+    async def _acquire(self, model: str, tokens: int, priority: str):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITY_LANES.get(priority, 0), next(self._sequence), model, tokens, future))
+        self._pump()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Slot was granted right as we were cancelled - hand it back
+                self._release()
+            raise
+
+    def _release(self):
+        self._active -= 1
+        self._pump()
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except (TypeError, ValueError):
+            pass
+        return None
+
+    @staticmethod
+    def is_rate_limit(error: Exception) -> bool:
+        if getattr(error, "status_code", None) == 429:
+            return True
+        message = str(error).lower()
+        return "429" in message or "rate limit" in message
+
+    async def run(self, model: Optional[str], estimated_tokens: int,
+                  call: Callable[[], Awaitable[Any]],
+                  usage_of: Optional[Callable[[Any], int]] = None):
+        """Run `call` once a slot and budget are available, retrying 429s
+
+        Args:
+            model: Model name (selects the RPM/TPM budget)
+            estimated_tokens: Prompt + completion estimate charged up front
+            call: Coroutine factory making the provider request
+            usage_of: Returns the actual total tokens of a response, to correct the TPM charge
+        """
+        model = model or "default"
+        priority = llm_priority.get()
+
+        for attempt in range(self.max_retries + 1):
+            queued_at = time.monotonic()
+            await self._acquire(model, estimated_tokens, priority)
+            self.stats["queue_wait_ms_total"] += (time.monotonic() - queued_at) * 1000
+            self.stats["requests"] += 1
+            try:
+                result = await call()
+            except Exception as e:
+                if not self.is_rate_limit(e) or attempt >= self.max_retries:
+                    raise
+                self.stats["rate_limited"] += 1
+                self.stats["retries"] += 1
+                delay = self._retry_after(e) or self.base_delay * (2 ** attempt) + random.uniform(0, 0.5)
+                # Pause the whole model so the other queued calls don't walk into the same 429
+                self._paused_until[model] = max(self._paused_until.get(model, 0.0), time.monotonic() + delay)
+                logger.warning(f"LLM rate limit on {model} - pausing {delay:.1f}s (attempt {attempt + 1}/{self.max_retries + 1})")
+                continue
+            finally:
+                self._release()
+
+            if usage_of is not None:
+                actual = usage_of(result)
+                if actual:
+                    _, token_bucket = self._buckets(model)
+                    if actual < estimated_tokens:
+                        token_bucket.refund(estimated_tokens - actual)
+                    else:
+                        token_bucket.consume(actual - estimated_tokens)
+            return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        queued = {lane: 0 for lane in PRIORITY_LANES}
+        lane_names = {value: name for name, value in PRIORITY_LANES.items()}
+        for priority, _, _, _, future in self._waiters:
+            if not future.done():
+                queued[lane_names.get(priority, "customer")] += 1
+        now = time.monotonic()
+        return {
+            "active": self._active,
+            "max_concurrency": self.max_concurrency,
+            "queued": queued,
+            "models": {
+                model: {
+                    "requests_available": round(self._request_buckets[model].tokens, 1),
+                    "tokens_available": round(self._token_buckets[model].tokens),
+                    "paused_for_seconds": round(max(0.0, self._paused_until.get(model, 0.0) - now), 1)
+                }
+                for model in self._request_buckets
+            },
+            **self.stats,
+            "queue_wait_ms_total": round(self.stats["queue_wait_ms_total"], 1)
+        }
+
+
+# Singleton instance
+llm_scheduler = LLMScheduler()
@@ -1,22 +1,58 @@
 import logging
+import logging.handlers
+import atexit
 import json
 import os
+import queue
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 from typing import Dict, Any, Optional, List, Union
 from pathlib import Path
 import traceback
 
+from utils.metrics import chatbot_metrics, current_journey_id
+from utils.journey_store import JourneyStore
+
+# Statuses that mean the journey is still being processed
+IN_FLIGHT_STATUSES = ("started", "active")
+
+# What is kept in memory about a journey after it left the ring buffer
+STUB_FIELDS = ("journey_id", "phone_number", "started_at", "status", "message_type", "classified_type")
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the listener falls behind"""
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
 
 class MessageJourneyLogger:
     """
     Comprehensive logging system for tracking message journey through the chatbot.
     Logs the complete lifecycle from incoming message to final response.
+
+    Only the most recent JOURNEY_BUFFER_SIZE journeys are kept in memory; completed
+    journeys are persisted to the JourneyStore (segment files indexed by journey_id and phone).
+    A journey pushed out of the buffer is written to the store and leaves a small stub behind
+    (JOURNEY_STUB_SIZE of them), so later steps and its completion are appended to the stored
+    record as deltas. Log records go through a queue so file/console writes never block the
+    event loop.
     """
     
     def __init__(self):
         self.setup_logging()
-        self.active_journeys: Dict[str, Dict[str, Any]] = {}
+        self.max_journeys = int(os.getenv("JOURNEY_BUFFER_SIZE", "500"))
+        self.active_journeys: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.max_stubs = int(os.getenv("JOURNEY_STUB_SIZE", "10000"))
+        self.persisted_stubs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.store = JourneyStore()
+        self.evicted_in_flight = 0
+        atexit.register(self.shutdown)
     
     def setup_logging(self):
         """Setup logging configuration with file rotation"""
@@ -53,8 +89,14 @@ class MessageJourneyLogger:
         file_handler.setFormatter(formatter)
         console_handler.setFormatter(formatter)
         
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        # The handlers run on the listener thread - the caller only enqueues the record
+        self._log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=10000)
+        self._queue_listener = logging.handlers.QueueListener(
+            self._log_queue, file_handler, console_handler, respect_handler_level=True
+        )
+        self._queue_listener.start()
+        self._listener_running = True
+        self.logger.addHandler(_NonBlockingQueueHandler(self._log_queue))
         
         # Ensure the logger doesn't propagate to avoid duplicate logs
         self.logger.propagate = False
@@ -85,7 +127,8 @@ class MessageJourneyLogger:
             "webhook_data": webhook_data or {}
         }
         
-        self.active_journeys[journey_id] = journey_data
+        self._remember(journey_id, journey_data)
+        current_journey_id.set(journey_id)
         
         # Log the start of journey
         self.logger.info(f"📥 JOURNEY_START | ID: {journey_id} | Phone: {phone_number} | Type: {message_type}")
@@ -102,6 +145,10 @@ class MessageJourneyLogger:
             
         return journey_id
     
+    def bind_journey(self, journey_id: str):
+        """Mark journey_id as the journey the current task is processing"""
+        current_journey_id.set(journey_id)
+    
     def add_step(self,
                  journey_id: str,
                  step_type: str,
@@ -110,15 +157,6 @@ class MessageJourneyLogger:
                  status: str = "completed",
                  duration_ms: Optional[int] = None):
         """Add a processing step to the message journey"""
-        if journey_id not in self.active_journeys:
-            self.logger.warning(f"⚠️ Journey {journey_id} not found, creating minimal journey")
-            self.active_journeys[journey_id] = {
-                "journey_id": journey_id,
-                "started_at": datetime.now().isoformat(),
-                "steps": [],
-                "status": "active"
-            }
-        
         step = {
             "step_type": step_type,
             "description": description,
@@ -128,7 +166,27 @@ class MessageJourneyLogger:
             "duration_ms": duration_ms
         }
         
-        self.active_journeys[journey_id]["steps"].append(step)
+        stub = self.persisted_stubs.get(journey_id) if journey_id not in self.active_journeys else None
+        if stub is not None:
+            # Journey already left the buffer - append the step to its stored record
+            chatbot_metrics.observe_step(stub, step)
+            self.store.append_delta(journey_id, {"steps": [step]})
+        else:
+            if journey_id not in self.active_journeys:
+                self.logger.warning(f"⚠️ Journey {journey_id} not found, creating minimal journey")
+                self._remember(journey_id, {
+                    "journey_id": journey_id,
+                    "started_at": datetime.now().isoformat(),
+                    "steps": [],
+                    "status": "active"
+                })
+            
+            journey = self.active_journeys[journey_id]
+            journey["steps"].append(step)
+            chatbot_metrics.observe_step(journey, step)
+            if journey["status"] not in IN_FLIGHT_STATUSES:
+                # Late step after completion - the journey is already stored, append just the step
+                self.store.append_delta(journey_id, {"steps": [step]})
         
         # Format duration info
         duration_info = f" | Duration: {duration_ms}ms" if duration_ms else ""
@@ -314,46 +372,76 @@ class MessageJourneyLogger:
         
         if journey_id in self.active_journeys:
             self.active_journeys[journey_id]["status"] = "failed"
+        elif journey_id in self.persisted_stubs:
+            self.persisted_stubs[journey_id]["status"] = "failed"
     
     def complete_journey(self,
                         journey_id: str,
                         final_response: Optional[str] = None,
                         status: str = "completed"):
         """Mark journey as completed and log final summary"""
-        if journey_id not in self.active_journeys:
+        stub = self.persisted_stubs.get(journey_id) if journey_id not in self.active_journeys else None
+        if journey_id not in self.active_journeys and stub is None:
             self.logger.warning(f"⚠️ Journey {journey_id} not found for completion")
             return
         
-        journey = self.active_journeys[journey_id]
-        journey["status"] = status
-        journey["completed_at"] = datetime.now().isoformat()
+        journey = self.active_journeys[journey_id] if stub is None else stub
+        completion = {"status": status, "completed_at": datetime.now().isoformat()}
         
         if final_response:
-            journey["final_response"] = final_response
+            completion["final_response"] = final_response
         
         # Calculate total journey duration
         start_time = datetime.fromisoformat(journey["started_at"])
         end_time = datetime.now()
         total_duration = int((end_time - start_time).total_seconds() * 1000)
         
-        journey["total_duration_ms"] = total_duration
+        completion["total_duration_ms"] = total_duration
+        journey.update(completion)
+        chatbot_metrics.observe_journey(journey)
+        if current_journey_id.get() == journey_id:
+            current_journey_id.set(None)
+        if stub is None:
+            self.store.append(journey)
+        else:
+            # Evicted while in flight - its steps are already stored, add the completion
+            self.store.append_delta(journey_id, completion)
         
         # Log completion summary
-        self.logger.info(f"✅ JOURNEY_COMPLETE | ID: {journey_id} | Status: {status} | Duration: {total_duration}ms | Steps: {len(journey['steps'])}")
+        step_count = len(journey["steps"]) if stub is None else "stored"
+        self.logger.info(f"✅ JOURNEY_COMPLETE | ID: {journey_id} | Status: {status} | Duration: {total_duration}ms | Steps: {step_count}")
         
         if final_response:
             response_preview = final_response[:100] + "..." if len(final_response) > 100 else final_response
             self.logger.info(f"📤 FINAL_RESPONSE | ID: {journey_id} | Response: '{response_preview}'")
         
-        # Keep the journey data for a while for potential debugging
-        # In production, you might want to archive or clean old journeys
+        # The journey stays in the ring buffer for debugging until newer journeys push it out
+    
+    def _remember(self, journey_id: str, journey: Dict[str, Any]):
+        """Add a journey to the ring buffer, evicting the oldest ones beyond max_journeys"""
+        self.active_journeys[journey_id] = journey
+        while len(self.active_journeys) > self.max_journeys:
+            evicted_id, evicted = self.active_journeys.popitem(last=False)
+            self._evict(evicted_id, evicted)
+    
+    def _evict(self, journey_id: str, journey: Dict[str, Any]):
+        """Journey leaves memory - store it (if still in flight) and keep a stub for later steps"""
+        if journey.get("status") in IN_FLIGHT_STATUSES:
+            # Still processing - write what we have, later steps arrive as deltas
+            self.evicted_in_flight += 1
+            self.store.append(journey)
+        # Completed journeys are already stored
+        self.persisted_stubs[journey_id] = {field: journey.get(field) for field in STUB_FIELDS}
+        while len(self.persisted_stubs) > self.max_stubs:
+            self.persisted_stubs.popitem(last=False)
     
     def get_journey_summary(self, journey_id: str) -> Optional[Dict]:
-        """Get a summary of a specific journey"""
-        if journey_id not in self.active_journeys:
+        """Get a summary of a specific journey (from memory, or the journey store)"""
+        journey = self.active_journeys.get(journey_id) or self.store.get(journey_id)
+        if journey is None:
             return None
         
-        journey = self.active_journeys[journey_id].copy()
+        journey = journey.copy()
         
         # Add some computed statistics
         journey["total_steps"] = len(journey["steps"])
@@ -384,11 +472,44 @@ class MessageJourneyLogger:
                 to_remove.append(journey_id)
         
         for journey_id in to_remove:
-            del self.active_journeys[journey_id]
+            self._evict(journey_id, self.active_journeys.pop(journey_id))
         
         if to_remove:
             self.logger.info(f"🧹 Cleaned up {len(to_remove)} old journey records")
 
+    def get_journeys_by_phone(self, phone_number: str, limit: int = 20) -> List[Dict]:
+        """Recent journeys of a phone number - in-memory ones first, then the journey store"""
+        journeys = [
+            journey for journey in reversed(self.active_journeys.values())
+            if journey.get("phone_number") == phone_number
+        ][:limit]
+        seen = {journey["journey_id"] for journey in journeys}
+        if len(journeys) < limit:
+            for journey in self.store.find_by_phone(phone_number, limit):
+                if journey.get("journey_id") not in seen and len(journeys) < limit:
+                    journeys.append(journey)
+        return journeys
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Ring buffer, log queue and journey store metrics"""
+        in_flight = sum(1 for journey in self.active_journeys.values() if journey.get("status") in IN_FLIGHT_STATUSES)
+        return {
+            "buffered_journeys": len(self.active_journeys),
+            "in_flight_journeys": in_flight,
+            "max_journeys": self.max_journeys,
+            "evicted_in_flight": self.evicted_in_flight,
+            "persisted_stubs": len(self.persisted_stubs),
+            "log_queue_size": self._log_queue.qsize(),
+            "store": self.store.get_stats()
+        }
+    
+    def shutdown(self):
+        """Flush queued log records and persisted journeys"""
+        if self._listener_running:
+            self._listener_running = False
+            self._queue_listener.stop()
+        self.store.close()
+    
     def log_function_call(self,
                          journey_id: str,
                          function_name: str,
@@ -0,0 +1,280 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Any, Optional, Tuple, List
+
+# Journey the current task is working on - lets the LLM backend attribute calls/tokens to a message
+current_journey_id: ContextVar[Optional[str]] = ContextVar("current_journey_id", default=None)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+LLM_CALL_BUCKETS = (0, 1, 2, 3, 4, 5, 6, 8, 10, 15, 20)
+TOKEN_BUCKETS = (0, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000, 64000)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Counter:
+    """Monotonic counter with labels"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name) or "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_number(value)}")
+        return lines
+
+
+class Histogram:
+    """Cumulative histogram with labels (Prometheus _bucket/_sum/_count series)"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name) or "") for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._values[key] = series
+            series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                    cumulative += count
+                    le = f'le="{_format_number(bound)}"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {_format_number(round(series['sum'], 6))}")
+                lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class ChatbotMetrics:
+    """
+    In-process metrics aggregated from message journeys and LLM calls,
+    exposed in Prometheus text format on /metrics.
+    """
+
+    STAGE_LABELS = ("stage", "agent", "model", "message_type", "outcome")
+    MESSAGE_LABELS = ("message_type", "outcome")
+    LLM_LABELS = ("model", "kind", "outcome")
+
+    def __init__(self, max_tracked_journeys: int = 5000):
+        self.stage_duration = Histogram(
+            "chatbot_stage_duration_seconds",
+            "Duration of journey steps (embedding, classification, LLM, DB, function calls...)",
+            self.STAGE_LABELS
+        )
+        self.stage_total = Counter(
+            "chatbot_stage_total",
+            "Journey steps recorded, including steps without a duration",
+            self.STAGE_LABELS
+        )
+        self.message_duration = Histogram(
+            "chatbot_message_duration_seconds",
+            "End-to-end processing time of a message journey",
+            self.MESSAGE_LABELS
+        )
+        self.messages_total = Counter(
+            "chatbot_messages_total",
+            "Completed message journeys",
+            self.MESSAGE_LABELS
+        )
+        self.llm_calls_per_message = Histogram(
+            "chatbot_llm_calls_per_message",
+            "LLM requests made while processing one message",
+            self.MESSAGE_LABELS,
+            buckets=LLM_CALL_BUCKETS
+        )
+        self.llm_tokens_per_message = Histogram(
+            "chatbot_llm_tokens_per_message",
+            "LLM tokens (prompt + completion) spent on one message",
+            self.MESSAGE_LABELS,
+            buckets=TOKEN_BUCKETS
+        )
+        self.llm_request_duration = Histogram(
+            "chatbot_llm_request_duration_seconds",
+            "Latency of individual LLM requests",
+            self.LLM_LABELS
+        )
+        self.llm_tokens_total = Counter(
+            "chatbot_llm_tokens_total",
+            "LLM tokens by model and direction",
+            ("model", "kind", "direction")
+        )
+        self.query_round_trips = Histogram(
+            "chatbot_query_round_trips",
+            "LLM round-trips of the query agent tool loop per inquiry",
+            ("outcome",),
+            buckets=LLM_CALL_BUCKETS
+        )
+        self.tool_calls_total = Counter(
+            "chatbot_tool_calls_total",
+            "Query agent tool calls (deduplicated = repeat within a turn, served from the first call)",
+            ("tool", "outcome")
+        )
+        self.prompt_tokens = Histogram(
+            "chatbot_prompt_tokens",
+            "Estimated prompt tokens per LLM call stage (section=total or static prefix)",
+            ("stage", "section"),
+            buckets=TOKEN_BUCKETS
+        )
+        self.tool_result_tokens_total = Counter(
+            "chatbot_tool_result_tokens_total",
+            "Tokens of tool results sent to the query agent LLM, compact text vs the JSON it replaced",
+            ("tool", "format")
+        )
+        self.validation_decisions_total = Counter(
+            "chatbot_validation_decisions_total",
+            "Response validation policy decisions (validate/skip) by reason",
+            ("decision", "reason")
+        )
+        self._metrics = [
+            self.stage_duration, self.stage_total,
+            self.message_duration, self.messages_total,
+            self.llm_calls_per_message, self.llm_tokens_per_message,
+            self.llm_request_duration, self.llm_tokens_total,
+            self.query_round_trips, self.tool_calls_total,
+            self.prompt_tokens, self.tool_result_tokens_total,
+            self.validation_decisions_total
+        ]
+
+        # journey_id -> {"llm_calls": n, "tokens": n}, bounded so abandoned journeys can't leak
+        self._per_journey: "OrderedDict[str, Dict[str, int]]" = OrderedDict()
+        self._max_tracked_journeys = max_tracked_journeys
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _message_type(journey: Dict[str, Any]) -> str:
+        """Classified type once the classifier ran, the Wati message type before that"""
+        return journey.get("classified_type") or journey.get("message_type") or "unknown"
+
+    def observe_step(self, journey: Dict[str, Any], step: Dict[str, Any]):
+        """Called by MessageJourneyLogger.add_step"""
+        data = step.get("data") or {}
+        step_type = step.get("step_type") or "unknown"
+
+        if step_type == "message_classification" and data.get("classified_type"):
+            # "MessageType.INQUIRY" -> "inquiry"
+            journey["classified_type"] = str(data["classified_type"]).split(".")[-1].lower()
+
+        agent = data.get("agent") or (step_type if step_type.endswith("_agent") else "")
+        labels = {
+            "stage": step_type,
+            "agent": agent,
+            "model": data.get("model") or "",
+            "message_type": self._message_type(journey),
+            "outcome": step.get("status") or "completed"
+        }
+        self.stage_total.inc(**labels)
+        if step.get("duration_ms") is not None:
+            self.stage_duration.observe(step["duration_ms"] / 1000, **labels)
+
+    def observe_llm_call(self, model: Optional[str], kind: str, outcome: str, duration_seconds: float,
+                         prompt_tokens: int = 0, completion_tokens: int = 0):
+        """Called by the LLM backend for every request, attributed to the current journey"""
+        model = model or "unknown"
+        self.llm_request_duration.observe(duration_seconds, model=model, kind=kind, outcome=outcome)
+        if prompt_tokens:
+            self.llm_tokens_total.inc(prompt_tokens, model=model, kind=kind, direction="prompt")
+        if completion_tokens:
+            self.llm_tokens_total.inc(completion_tokens, model=model, kind=kind, direction="completion")
+
+        journey_id = current_journey_id.get()
+        if not journey_id:
+            return
+        with self._lock:
+            usage = self._per_journey.get(journey_id)
+            if usage is None:
+                usage = {"llm_calls": 0, "tokens": 0}
+                self._per_journey[journey_id] = usage
+                while len(self._per_journey) > self._max_tracked_journeys:
+                    self._per_journey.popitem(last=False)
+            usage["llm_calls"] += 1
+            usage["tokens"] += prompt_tokens + completion_tokens
+
+    def observe_query_round_trips(self, round_trips: int, outcome: str):
+        """Called by the query agent when its tool loop ends"""
+        self.query_round_trips.observe(round_trips, outcome=outcome)
+
+    def observe_tool_call(self, tool: str, outcome: str):
+        self.tool_calls_total.inc(tool=tool, outcome=outcome)
+
+    def observe_prompt_tokens(self, stage: str, total_tokens: int, static_tokens: int):
+        """Called by PromptBuilder for each assembled prompt"""
+        self.prompt_tokens.observe(total_tokens, stage=stage, section="total")
+        self.prompt_tokens.observe(static_tokens, stage=stage, section="static")
+
+    def observe_tool_result_tokens(self, tool: str, json_tokens: int, compact_tokens: int):
+        self.tool_result_tokens_total.inc(json_tokens, tool=tool, format="json")
+        self.tool_result_tokens_total.inc(compact_tokens, tool=tool, format="compact")
+
+    def observe_validation_decision(self, decision: str, reason: str):
+        self.validation_decisions_total.inc(decision=decision, reason=reason)
+
+    def observe_journey(self, journey: Dict[str, Any]):
+        """Called by MessageJourneyLogger.complete_journey"""
+        labels = {"message_type": self._message_type(journey), "outcome": journey.get("status") or "unknown"}
+        self.messages_total.inc(**labels)
+        if journey.get("total_duration_ms") is not None:
+            self.message_duration.observe(journey["total_duration_ms"] / 1000, **labels)
+
+        with self._lock:
+            usage = self._per_journey.pop(journey.get("journey_id"), None) or {"llm_calls": 0, "tokens": 0}
+        self.llm_calls_per_message.observe(usage["llm_calls"], **labels)
+        self.llm_tokens_per_message.observe(usage["tokens"], **labels)
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# Singleton instance
+chatbot_metrics = ChatbotMetrics()
@@ -0,0 +1,204 @@
+import json
+import math
+import logging
+from functools import lru_cache
+from typing import Dict, Any, List, Optional
+
+from utils.metrics import chatbot_metrics
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+# Per-message framing tokens of the chat format (role, separators)
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@lru_cache(maxsize=8)
+def _encoding_for(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def count_tokens(text: Optional[str], model: str = "gpt-4o-mini") -> int:
+    """Token count of a text - tiktoken when installed, otherwise ~3 characters per token"""
+    if not text:
+        return 0
+    if TIKTOKEN_AVAILABLE:
+        return len(_encoding_for(model).encode(text))
+    return math.ceil(len(text) / 3)
+
+
+def count_message_tokens(message: Dict[str, Any], model: str = "gpt-4o-mini") -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(message.get("content"), model)
+    for tool_call in message.get("tool_calls") or []:
+        tokens += count_tokens(tool_call["function"]["name"], model) + count_tokens(tool_call["function"]["arguments"], model)
+    return tokens
+
+
+def trim_tool_result(content: str, max_tokens: int, model: str = "gpt-4o-mini") -> str:
+    """
+    Shrink a tool result to max_tokens. JSON results lose items from the end of their "data"
+    list ("truncated_items" tells the model how many are missing); compact text results lose
+    whole lines from the end. Anything else is cut as text.
+    """
+    if count_tokens(content, model) <= max_tokens:
+        return content
+    try:
+        result = json.loads(content)
+    except (TypeError, ValueError):
+        result = None
+
+    if isinstance(result, dict) and isinstance(result.get("data"), list) and result["data"]:
+        items = result["data"]
+        total = len(items)
+
+        def with_items(keep: int) -> str:
+            return json.dumps({**result, "data": items[:keep], "truncated_items": total - keep}, ensure_ascii=False)
+
+        # Largest prefix of the list that fits (at least one item is always kept)
+        low, high = 1, total - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(with_items(middle), model) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        return with_items(max(low, 1))
+
+    lines = (content or "").split("\n")
+    if result is None and len(lines) > 1:
+        def with_lines(keep: int) -> str:
+            return "\n".join(lines[:keep] + [f"… {len(lines) - keep} more lines truncated"])
+
+        low, high = 1, len(lines) - 1
+        while low < high:
+            middle = (low + high + 1) // 2
+            if count_tokens(with_lines(middle), model) <= max_tokens:
+                low = middle
+            else:
+                high = middle - 1
+        trimmed = with_lines(low)
+        if count_tokens(trimmed, model) <= max_tokens:
+            return trimmed
+
+    # ~3 characters per token keeps the cut inside the budget for Arabic and English text
+    return content[:max_tokens * 3] + " …[truncated]"
+
+
+class PromptBuilder:
+    """
+    Assembles a chat prompt in a cache-friendly order with per-section token accounting:
+
+        system: static blocks (identical for every call with the same language/flags, so the
+                provider's prompt-prefix cache can reuse them)
+        conversation history (oldest first)
+        system: dynamic blocks (per-conversation context such as the extracted city/brand)
+        user:   the current message
+
+    fit() enforces the token budget on the assembled messages: the oldest history messages go
+    first, then the largest tool results are shrunk. Static blocks and the current message are
+    never trimmed.
+    """
+
+    def __init__(self, budget_tokens: int, model: str = "gpt-4o-mini", max_tool_result_tokens: int = 4000):
+        self.budget_tokens = budget_tokens
+        self.model = model
+        self.max_tool_result_tokens = max_tool_result_tokens
+        self.static_blocks: List[tuple] = []
+        self.dynamic_blocks: List[tuple] = []
+        self.history: List[Dict[str, Any]] = []
+        self.user_message = ""
+        self.trimmed_history = 0
+        self.trimmed_tool_results = 0
+
+    def add_static(self, name: str, text: Optional[str]):
+        if text:
+            self.static_blocks.append((name, text))
+
+    def add_dynamic(self, name: str, text: Optional[str]):
+        if text:
+            self.dynamic_blocks.append((name, text.strip()))
+
+    def set_history(self, conversation_history: List[Dict[str, Any]]):
+        # Only role/content go to the provider; empty messages are dropped
+        self.history = [
+            {"role": msg.get("role", "user"), "content": msg.get("content", "")}
+            for msg in conversation_history or []
+            if (msg.get("content") or "").strip()
+        ]
+
+    def build(self, user_message: str) -> List[Dict[str, Any]]:
+        self.user_message = user_message
+        messages = [{"role": "system", "content": "\n\n".join(text for _, text in self.static_blocks)}]
+        messages.extend(self.history)
+        if self.dynamic_blocks:
+            messages.append({"role": "system", "content": "\n\n".join(text for _, text in self.dynamic_blocks)})
+        messages.append({"role": "user", "content": user_message})
+        return self.fit(messages)
+
+    def tool_message(self, tool_call_id: str, content: str) -> Dict[str, Any]:
+        """Tool result message, capped at max_tool_result_tokens"""
+        trimmed = trim_tool_result(content, self.max_tool_result_tokens, self.model)
+        if trimmed is not content:
+            self.trimmed_tool_results += 1
+        return {"role": "tool", "tool_call_id": tool_call_id, "content": trimmed}
+
+    def fit(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Trim messages (in place) until they fit the budget"""
+        total = sum(count_message_tokens(msg, self.model) for msg in messages)
+
+        while total > self.budget_tokens and self.history:
+            oldest = self.history.pop(0)
+            messages[:] = [msg for msg in messages if msg is not oldest]
+            self.trimmed_history += 1
+            total -= count_message_tokens(oldest, self.model)
+
+        while total > self.budget_tokens:
+            tool_messages = [msg for msg in messages if msg.get("role") == "tool"]
+            if not tool_messages:
+                break
+            largest = max(tool_messages, key=lambda msg: count_tokens(msg["content"], self.model))
+            current = count_tokens(largest["content"], self.model)
+            if current <= 50:
+                break
+            trimmed = trim_tool_result(largest["content"], current // 2, self.model)
+            remaining = count_tokens(trimmed, self.model)
+            if remaining >= current:
+                break
+            largest["content"] = trimmed
+            self.trimmed_tool_results += 1
+            total -= current - remaining
+
+        if total > self.budget_tokens:
+            logger.warning(f"Prompt still {total} tokens after trimming (budget {self.budget_tokens})")
+        return messages
+
+    def report(self, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Token count per section of an assembled prompt"""
+        sections = {name: count_tokens(text, self.model) for name, text in self.static_blocks + self.dynamic_blocks}
+        history_ids = {id(msg) for msg in self.history}
+        sections["history"] = sum(count_message_tokens(msg, self.model) for msg in messages if id(msg) in history_ids)
+        sections["tool_results"] = sum(count_message_tokens(msg, self.model) for msg in messages if msg.get("role") == "tool")
+        sections["user_message"] = count_tokens(self.user_message, self.model)
+        return {
+            "total_tokens": sum(count_message_tokens(msg, self.model) for msg in messages),
+            "static_tokens": sum(sections[name] for name, _ in self.static_blocks),
+            "budget_tokens": self.budget_tokens,
+            "sections": sections,
+            "trimmed_history": self.trimmed_history,
+            "trimmed_tool_results": self.trimmed_tool_results,
+            "token_counter": "tiktoken" if TIKTOKEN_AVAILABLE else "estimate"
+        }
+
+    def observe(self, stage: str, messages: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Record the prompt size of one LLM call stage in the metrics and return the report"""
+        report = self.report(messages)
+        chatbot_metrics.observe_prompt_tokens(stage, report["total_tokens"], report["static_tokens"])
+        return report
@@ -0,0 +1,130 @@
+import os
+import json
+import logging
+from typing import Dict, Any
+
+from utils.metrics import chatbot_metrics
+from utils.prompt_builder import count_tokens
+
+logger = logging.getLogger(__name__)
+
+# Per tool: summary fields kept (in order) and the columns kept from each "data" row.
+# Rows that are plain strings are listed one per line; anything not listed here is dropped.
+TOOL_PROJECTIONS = {
+    "get_all_cities": {
+        "fields": ["success", "error", "response_message", "total_cities"],
+        "columns": None
+    },
+    "get_brands_by_city_name": {
+        "fields": ["success", "error", "city_found", "response_message", "total_brands"],
+        "columns": None
+    },
+    "get_products_by_brand_and_city_name": {
+        "fields": ["success", "error", "brand_found", "city_found", "response_message", "total_products"],
+        "columns": None
+    },
+    "search_brands_in_city": {
+        "fields": ["success", "error", "total_brands"],
+        "columns": ["title"]
+    },
+    "search_cities": {
+        "fields": ["success", "error", "message", "count"],
+        "columns": ["name", "name_en", "match_type"]
+    },
+    "get_cheapest_products_by_city_name": {
+        "fields": ["success", "error", "city_name", "message", "total_sizes"],
+        "columns": ["product_title", "product_packing", "product_contract_price", "brand_title"]
+    }
+}
+
+
+def _cell(value: Any) -> str:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value).replace("\n", " ").replace("|", "/").strip()
+
+
+class ToolResultSerializer:
+    """
+    Turns tool results into the compact text the query agent sends back to the model.
+
+    Only the fields in TOOL_PROJECTIONS survive (no image URLs, external IDs or duplicate
+    *_en fields). Summary fields become "name: value" lines and the "data" rows a pipe-separated
+    table with one header line, capped at TOOL_RESULT_MAX_ROWS rows plus a "more available"
+    marker. Tools without a projection keep the old JSON dump, and TOOL_RESULT_FORMAT=json
+    switches back to JSON everywhere. Tokens of the compact text are compared with the JSON
+    dump for every call.
+    """
+
+    def __init__(self):
+        self.format = os.getenv("TOOL_RESULT_FORMAT", "compact").lower()
+        self.max_rows = int(os.getenv("TOOL_RESULT_MAX_ROWS", "50"))
+        self.stats = {"serialized": 0, "json_tokens": 0, "compact_tokens": 0, "rows_dropped": 0}
+
+    def serialize(self, tool_name: str, result: Any) -> str:
+        json_content = json.dumps(result, ensure_ascii=False)
+        projection = TOOL_PROJECTIONS.get(tool_name)
+        if self.format != "compact" or projection is None or not isinstance(result, dict):
+            return json_content
+
+        try:
+            content = self._compact(result, projection)
+        except Exception as e:
+            logger.error(f"Compact serialization of {tool_name} failed, sending JSON: {str(e)}")
+            return json_content
+
+        json_tokens = count_tokens(json_content)
+        compact_tokens = count_tokens(content)
+        self.stats["serialized"] += 1
+        self.stats["json_tokens"] += json_tokens
+        self.stats["compact_tokens"] += compact_tokens
+        chatbot_metrics.observe_tool_result_tokens(tool_name, json_tokens, compact_tokens)
+        print(f"📦 {tool_name} result: {compact_tokens} tokens (JSON would be {json_tokens})")
+        return content
+
+    def _compact(self, result: Dict[str, Any], projection: Dict[str, Any]) -> str:
+        lines = [
+            f"{field}: {_cell(result[field])}"
+            for field in projection["fields"]
+            if field in result and result[field] not in (None, "")
+        ]
+
+        rows = result.get("data")
+        if isinstance(rows, list) and rows:
+            shown = rows[:self.max_rows]
+            columns = projection["columns"]
+            if columns and isinstance(shown[0], dict):
+                lines.append(f"data ({' | '.join(columns)}):")
+                lines.extend(" | ".join(_cell(row.get(column)) for column in columns) for row in shown)
+            else:
+                lines.append("data:")
+                lines.extend(_cell(row) for row in shown)
+            if len(rows) > len(shown):
+                self.stats["rows_dropped"] += len(rows) - len(shown)
+                lines.append(f"… {len(rows) - len(shown)} more available (not shown)")
+        return "\n".join(lines)
+
+    @staticmethod
+    def is_failure(content: str) -> bool:
+        """True for a serialized result reporting an error or success=False (JSON or compact)"""
+        try:
+            result = json.loads(content)
+        except (TypeError, ValueError):
+            return content.startswith("success: false") or content.startswith("error:") or "\nerror:" in content
+        return isinstance(result, dict) and ("error" in result or result.get("success") is False)
+
+    def get_stats(self) -> Dict[str, Any]:
+        saved = self.stats["json_tokens"] - self.stats["compact_tokens"]
+        return {
+            "format": self.format,
+            "max_rows": self.max_rows,
+            "tokens_saved": saved,
+            "saved_ratio": round(saved / self.stats["json_tokens"], 3) if self.stats["json_tokens"] else 0.0,
+            **self.stats
+        }
+
+
+# Singleton instance
+tool_result_serializer = ToolResultSerializer()
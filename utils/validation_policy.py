@@ -0,0 +1,125 @@
+import os
+import random
+import logging
+from typing import Dict, Any, List, Optional
+
+from utils.metrics import chatbot_metrics
+
+logger = logging.getLogger(__name__)
+
+# How a reply was produced (reported by the agent that generated it)
+REPLY_SOURCES = ("tool_grounded", "cache_hit", "template", "llm_freeform", "max_round_trips", "error")
+
+# Tools whose results a reply can be rendered from verbatim
+DEFAULT_GROUNDING_TOOLS = (
+    "get_brands_by_city_name,get_products_by_brand_and_city_name,"
+    "search_brands_in_city,get_cheapest_products_by_city_name,get_all_cities,search_cities"
+)
+
+
+def _parse_list(value: str) -> List[str]:
+    return [item.strip() for item in (value or "").split(",") if item.strip()]
+
+
+class ValidationPolicy:
+    """
+    Decides whether a generated reply goes through the response validation LLM call.
+
+    Replies rendered from successful catalog tool results (or served from a cache or a
+    template) are skipped when the relevance verdict behind them is confident enough; free
+    LLM text, max-round-trip fallbacks and error messages are always validated. A share of
+    skippable replies (VALIDATION_AUDIT_SAMPLE_RATE) is validated anyway so the skip rules can
+    be audited - audit refusals show up in get_stats().
+
+    Modes (VALIDATION_POLICY_MODE): "policy" (default), "always" (validate every reply) and
+    "off" (never validate).
+    """
+
+    def __init__(self):
+        self.mode = os.getenv("VALIDATION_POLICY_MODE", "policy").lower()
+        if self.mode not in ("policy", "always", "off"):
+            logger.warning(f"Unknown VALIDATION_POLICY_MODE '{self.mode}' - using policy")
+            self.mode = "policy"
+        self.skip_sources = set(_parse_list(os.getenv("VALIDATION_SKIP_SOURCES", "tool_grounded,cache_hit,template")))
+        self.grounding_tools = set(_parse_list(os.getenv("VALIDATION_GROUNDING_TOOLS", DEFAULT_GROUNDING_TOOLS)))
+        self.min_relevance_confidence = float(os.getenv("VALIDATION_MIN_RELEVANCE_CONFIDENCE", "0.8"))
+        self.audit_sample_rate = float(os.getenv("VALIDATION_AUDIT_SAMPLE_RATE", "0.05"))
+
+        self.stats = {
+            "decisions": 0,
+            "validated": 0,
+            "skipped": 0,
+            "audited": 0,
+            "audit_refusals": 0,
+            "reasons": {}
+        }
+        # Running average of real validation calls - used to estimate the time saved by skips
+        self._validation_ms_total = 0
+        self._validation_count = 0
+
+    def decide(self, source: str, relevance_confidence: float = 0.0,
+               tools: Optional[List[str]] = None, tool_failures: int = 0) -> Dict[str, Any]:
+        """
+        Args:
+            source: One of REPLY_SOURCES
+            relevance_confidence: 0-1 confidence that the message is a water-delivery inquiry
+            tools: Tools called while producing the reply
+            tool_failures: Tool calls that errored or reported success=False
+
+        Returns:
+            Dict with validate (bool), audit (bool) and reason
+        """
+        tools = tools or []
+        audit = False
+        if self.mode == "always":
+            validate, reason = True, "mode_always"
+        elif self.mode == "off":
+            validate, reason = False, "mode_off"
+        elif source not in self.skip_sources:
+            validate, reason = True, f"source_{source}"
+        elif source == "tool_grounded" and (not tools or tool_failures):
+            validate, reason = True, "tool_failure"
+        elif source == "tool_grounded" and not set(tools) <= self.grounding_tools:
+            validate, reason = True, "ungrounded_tool"
+        elif relevance_confidence < self.min_relevance_confidence:
+            validate, reason = True, "low_relevance_confidence"
+        elif random.random() < self.audit_sample_rate:
+            validate, reason, audit = True, "audit_sample", True
+        else:
+            validate, reason = False, f"skip_{source}"
+
+        self.stats["decisions"] += 1
+        self.stats["validated" if validate else "skipped"] += 1
+        if audit:
+            self.stats["audited"] += 1
+        self.stats["reasons"][reason] = self.stats["reasons"].get(reason, 0) + 1
+        chatbot_metrics.observe_validation_decision("validate" if validate else "skip", reason)
+
+        return {"validate": validate, "audit": audit, "reason": reason}
+
+    def record_validation(self, decision: Dict[str, Any], duration_ms: int, is_appropriate: bool):
+        """Feed back a validation call made on the policy's advice"""
+        self._validation_ms_total += duration_ms
+        self._validation_count += 1
+        if decision.get("audit") and not is_appropriate:
+            # A reply the policy would have sent unchecked was refused - the skip rules are too loose
+            self.stats["audit_refusals"] += 1
+            logger.warning(f"Validation audit refused a skippable reply ({decision.get('reason')})")
+
+    def average_validation_ms(self) -> int:
+        return int(self._validation_ms_total / self._validation_count) if self._validation_count else 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "skip_sources": sorted(self.skip_sources),
+            "min_relevance_confidence": self.min_relevance_confidence,
+            "audit_sample_rate": self.audit_sample_rate,
+            "average_validation_ms": self.average_validation_ms(),
+            "estimated_saved_ms": self.stats["skipped"] * self.average_validation_ms(),
+            **self.stats
+        }
+
+
+# Singleton instance
+validation_policy = ValidationPolicy()
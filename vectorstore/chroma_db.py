@@ -9,7 +9,7 @@ import asyncio
 import threading
 from contextlib import asynccontextmanager
 import re
-import unicodedata
+from utils.arabic_normalizer import normalize_embedding
 
 # Create vector store directory if it doesn't exist
 os.makedirs("vectorstore/data", exist_ok=True)
@@ -22,28 +22,9 @@ class ArabicTextProcessor:
         """
         Normalize Arabic text for better embedding
         """
-        if not text:
-            return ""
-        
-        # Ensure UTF-8 encoding
-        if isinstance(text, bytes):
-            text = text.decode('utf-8')
-        
-        # Remove diacritics (تشكيل)
-        text = re.sub(r'[\u064B-\u065F\u0670\u06D6-\u06ED]', '', text)
-        
-        # Normalize Arabic characters
-        text = text.replace('أ', 'ا').replace('إ', 'ا').replace('آ', 'ا')
-        text = text.replace('ة', 'ه')
-        text = text.replace('ى', 'ي')
-        
-        # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
-        
-        # Normalize Unicode
-        text = unicodedata.normalize('NFKC', text)
-        
-        return text
+        # Diacritics, character folding, whitespace and NFKC in one memoized pass
+        # ("embedding" profile of utils.arabic_normalizer)
+        return normalize_embedding(text)
     
     @staticmethod
     def is_arabic_text(text: str) -> bool: